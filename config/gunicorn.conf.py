@@ -0,0 +1,33 @@
+# config/gunicorn.conf.py
+# Modo producción: gunicorn -c config/gunicorn.conf.py config.wsgi
+# Cada parámetro se puede ajustar con su variable de entorno GUNICORN_*.
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+# Hilos por worker: las requests esperan sobre todo a Postgres
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+
+# Django y numpy se importan una sola vez en el maestro y los workers los heredan
+# (copy-on-write). pandas, openpyxl y qrcode no: cada worker los importa recién en la
+# primera carga de Excel o configuración de 2FA (ver core/carga_excel.py y medir_arranque)
+preload_app = True
+
+# Las cargas masivas y la DJ 1949 pueden tardar: más que el default de 30 s
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = 30
+keepalive = 5
+# Reciclar workers cada tanto acota el crecimiento de memoria (con jitter para no reiniciarlos juntos)
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '2000'))
+max_requests_jitter = 200
+
+accesslog = '-'
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    # Ninguna conexión abierta por el maestro durante la precarga se comparte entre workers
+    from django.db import connections
+    connections.close_all()
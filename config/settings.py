@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 import os
+import tempfile
 from dotenv import load_dotenv
 load_dotenv()
 from pathlib import Path
@@ -26,7 +27,8 @@ SECRET_KEY = os.getenv('SECRET_KEY')
 DEBUG = os.getenv('DEBUG', 'False') == 'True'
 # SECURITY WARNING: don't run with debug turned on in production!
 
-ALLOWED_HOSTS = []
+# Separados por coma (obligatorio con DEBUG=False, p. ej. en el modo producción de docker-compose)
+ALLOWED_HOSTS = [h.strip() for h in os.getenv('ALLOWED_HOSTS', '').split(',') if h.strip()]
 
 
 # Application definition
@@ -52,6 +54,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.PerfiladoMiddleware',  # Primero: mide a todos los demás (inactivo si PERFILADO = False)
+    'core.middleware.ReplicaMiddleware',  # Antes de la sesión: ya lee de la base (inactivo sin réplica)
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -69,7 +73,8 @@ ROOT_URLCONF = 'config.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # El backend de Django, con el tiempo de render medido por el perfilado
+        'BACKEND': 'core.perfilado.DjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -96,9 +101,31 @@ DATABASES = {
         'PASSWORD': os.getenv('DB_PASSWORD'),
         'HOST': os.getenv('DB_HOST'),
         'PORT': os.getenv('DB_PORT'),
+        # Conexiones persistentes: cada worker reutiliza su conexión entre requests (segundos;
+        # 0 = una conexión por request). La salud se verifica antes de reutilizarla.
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '60')),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Réplica de lectura opcional (p. ej. una réplica en streaming de PostgreSQL): con
+# DB_REPLICA_HOST, las vistas de consulta y los GET de la API leen de ella (ver
+# core/router.py). Tras una escritura, el navegador lee de la primaria durante
+# REPLICA_PEGAR_SEGUNDOS. En los tests la réplica es un espejo de la base de pruebas.
+REPLICA_LECTURA = 'replica' if os.getenv('DB_REPLICA_HOST') else None
+REPLICA_PEGAR_SEGUNDOS = int(os.getenv('REPLICA_PEGAR_SEGUNDOS', '15'))
+if REPLICA_LECTURA:
+    DATABASES[REPLICA_LECTURA] = {
+        **DATABASES['default'],
+        'NAME': os.getenv('DB_REPLICA_NAME', DATABASES['default']['NAME']),
+        'USER': os.getenv('DB_REPLICA_USER', DATABASES['default']['USER']),
+        'PASSWORD': os.getenv('DB_REPLICA_PASSWORD', DATABASES['default']['PASSWORD']),
+        'HOST': os.getenv('DB_REPLICA_HOST'),
+        'PORT': os.getenv('DB_REPLICA_PORT', DATABASES['default']['PORT']),
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_ROUTERS = ['core.router.ReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -135,6 +162,8 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/5.2/howto/static-files/
 
 STATIC_URL = 'static/'
+# Destino de collectstatic, para servir los estáticos (admin, DRF) detrás de gunicorn
+STATIC_ROOT = BASE_DIR / 'staticfiles'
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -164,4 +193,61 @@ SPECTACULAR_SETTINGS = {
     'SERVE_INCLUDE_SCHEMA': False,
 }
 
-OTP_TOTP_ISSUER = 'NUAM_Tributario'
\ No newline at end of file
+OTP_TOTP_ISSUER = 'NUAM_Tributario'
+
+# Historial: índice compuesto (history_date, id) en las tablas Historical*, para
+# reconstruir la grilla "al instante" recorriendo sólo un rango de fechas
+SIMPLE_HISTORY_DATE_INDEX = 'composite'
+
+# Cachés: 'grilla' guarda la grilla histórica (?al=) del mantenedor (en bloques) y de la
+# API, que se reconstruye una sola vez por instante y filtros (ver core/views.py). Local a cada
+# proceso; con un instante reciente, lo editado después se ve al vencer GRILLA_CACHE_SEGUNDOS.
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'grilla': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'grilla',
+        'TIMEOUT': int(os.getenv('GRILLA_CACHE_SEGUNDOS', '300')),
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+}
+
+# Perfilado por request: header Server-Timing (SQL, plantillas, serialización, total)
+# y log (logger 'core.perfilado') de las requests que superan PERFILADO_LENTO_MS
+PERFILADO = os.getenv('PERFILADO', 'False') == 'True'
+PERFILADO_LENTO_MS = int(os.getenv('PERFILADO_LENTO_MS', '1000'))
+PERFILADO_TOP_CONSULTAS = int(os.getenv('PERFILADO_TOP_CONSULTAS', '5'))
+
+# Métricas (/metrics): cada proceso vuelca sus valores a un archivo en METRICAS_DIR,
+# que debe ser el mismo para todos los workers del servidor
+METRICAS_DIR = os.getenv('METRICAS_DIR', os.path.join(tempfile.gettempdir(), 'nuam_metricas'))
+METRICAS_INTERVALO = float(os.getenv('METRICAS_INTERVALO', '1'))
+
+# Ejercicios cerrados (comando archivar_ejercicios, ver core/archivo.py): tablespace
+# opcional para las tablas de archivo (p. ej. en discos más baratos)
+ARCHIVO_TABLESPACE = os.getenv('ARCHIVO_TABLESPACE') or None
+
+# Avisos de cambios a sistemas externos (outbox, ver core/avisos.py): se registran en la
+# transacción del cambio si AVISOS_ACTIVOS, y el comando despachar_avisos los entrega
+AVISOS_DESTINOS = []
+if os.getenv('AVISOS_WEBHOOK_URL'):
+    AVISOS_DESTINOS.append({
+        'clase': 'core.avisos.Webhook',
+        'url': os.getenv('AVISOS_WEBHOOK_URL'),
+        'secreto': os.getenv('AVISOS_WEBHOOK_SECRETO') or None,
+    })
+if os.getenv('AVISOS_ARCHIVO'):
+    AVISOS_DESTINOS.append({'clase': 'core.avisos.Archivo', 'ruta': os.getenv('AVISOS_ARCHIVO')})
+AVISOS_ACTIVOS = os.getenv('AVISOS_ACTIVOS', str(bool(AVISOS_DESTINOS))) == 'True'
+AVISOS_MAX_INTENTOS = int(os.getenv('AVISOS_MAX_INTENTOS', '10'))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'core': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
@@ -1,12 +1,42 @@
 # core/admin.py
 
 from django.contrib import admin
+from django.contrib.contenttypes.prefetch import GenericPrefetch
+from django.core.exceptions import ValidationError
+from django.forms.models import BaseInlineFormSet
+from django_otp.plugins.otp_totp.models import TOTPDevice
 from simple_history.admin import SimpleHistoryAdmin
 from .models import Emisor, EventoCorporativo, CalificacionTributaria, ConceptoFactor, DetalleFactor, AuditLog
+from .validacion import validar_vector
+
+class DetalleFactorFormSet(BaseInlineFormSet):
+    """Aplica al vector completo de factores las mismas reglas que la interfaz y la carga masiva."""
+    def clean(self):
+        super().clean()
+        por_columna = {}
+        for form in self.forms:
+            if not hasattr(form, 'cleaned_data') or not form.cleaned_data or self._should_delete_form(form):
+                continue
+            concepto = form.cleaned_data.get('concepto')
+            if concepto is not None:
+                por_columna[concepto.columna_dj] = form
+        validacion = validar_vector(
+            {columna: form.cleaned_data.get('valor') for columna, form in por_columna.items()},
+            sorted(por_columna),
+        )
+        fila = []
+        for error in validacion.errores:
+            if error['columna'] is None:
+                fila.append(error['mensaje'])
+            else:
+                por_columna[error['columna']].add_error('valor', error['mensaje'])
+        if fila:
+            raise ValidationError(fila)
 
 # Configuración para ver los factores "dentro" de la calificación
 class DetalleFactorInline(admin.TabularInline):
     model = DetalleFactor
+    formset = DetalleFactorFormSet
     extra = 0 # No mostrar filas vacías extra
     autocomplete_fields = ['concepto']
 
@@ -48,6 +78,15 @@ class AuditLogAdmin(admin.ModelAdmin):
     
     # Campos de solo lectura
     readonly_fields = ('user', 'action', 'content_type', 'object_id', 'object_repr', 'changes', 'timestamp')
+    list_select_related = ('user', 'content_type')
+
+    def get_queryset(self, request):
+        # Objetos afectados en una consulta por tipo (no una por fila), con lo que necesita su __str__
+        return super().get_queryset(request).prefetch_related(GenericPrefetch('content_object', [
+            EventoCorporativo.objects.select_related('emisor'),
+            CalificacionTributaria.objects.select_related('evento__emisor'),
+            TOTPDevice.objects.select_related('user'),
+        ]))
 
     def has_add_permission(self, request):
         return False  # Nadie puede crear logs manualmente
@@ -0,0 +1,213 @@
+# core/anomalias.py
+# Detección de anomalías en los vectores de factores.
+# Se carga la matriz de factores de todos los ejercicios con UNA consulta
+# (un arreglo de columnas y otro de valores por calificación) y se analiza con
+# NumPy: cada ejercicio se compara contra la historia acumulada de los
+# ejercicios anteriores, por emisor y por columna, más reglas fijas.
+# Los hallazgos se guardan en AnomaliaCalificacion (reemplazando el análisis
+# anterior de cada ejercicio) para que el mantenedor pueda filtrar por ellos.
+from itertools import chain
+from decimal import Decimal
+import numpy as np
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.db import transaction
+from django.db.models import FloatField, OuterRef, Subquery
+from django.db.models.functions import Cast
+from .models import AnomaliaCalificacion, CalificacionTributaria, DetalleFactor
+from .validacion import COLUMNAS_CREDITO, TOPE_CREDITOS
+
+COLUMNAS = tuple(range(8, 38))
+# Calificaciones previas mínimas para comparar contra una historia
+MIN_HISTORIA = 3
+# Desviaciones estándar a partir de las cuales un valor se informa
+UMBRAL_Z = 4.0
+# Diferencias menores a esto no se informan aunque la historia sea constante
+DIFERENCIA_MINIMA = 0.01
+# Suma de créditos (8-19) desde la que se avisa que está cerca del tope
+SUMA_ALERTA = 0.98
+
+LOTE_BD = 1000
+_CREDITO = [i for i, c in enumerate(COLUMNAS) if COLUMNAS_CREDITO[0] <= c <= COLUMNAS_CREDITO[1]]
+
+
+class MatrizFactores:
+    """Factores de n calificaciones: ids, emisor y ejercicio por fila; valores n x 30 (0 = no informado)."""
+
+    def __init__(self, ids, emisores, ejercicios, valores, informados):
+        self.ids = ids
+        self.emisores = emisores
+        self.ejercicios = ejercicios
+        self.valores = valores
+        self.informados = informados
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def cargar_matriz(hasta=None):
+    """Matriz de factores de todas las calificaciones (hasta el ejercicio indicado), en una consulta."""
+    factores = DetalleFactor.objects.filter(
+        calificacion=OuterRef('pk'), concepto__columna_dj__in=COLUMNAS,
+    ).order_by().values('calificacion')
+    queryset = CalificacionTributaria.objects.all()
+    if hasta is not None:
+        queryset = queryset.filter(evento__ejercicio_comercial__lte=hasta)
+    filas = list(
+        queryset.order_by()
+        .annotate(
+            # Mismo orden en ambos arreglos: se emparejan por posición
+            columnas=Subquery(factores.annotate(
+                a=ArrayAgg('concepto__columna_dj', ordering='concepto__columna_dj')
+            ).values('a')),
+            # float8 desde la BD: la matriz no necesita Decimal (el detalle exacto se relee al guardar)
+            valores=Subquery(factores.annotate(
+                a=ArrayAgg(Cast('valor', FloatField()), ordering='concepto__columna_dj')
+            ).values('a')),
+        )
+        .values_list('id', 'evento__emisor_id', 'evento__ejercicio_comercial', 'columnas', 'valores')
+    )
+    n = len(filas)
+    ids = np.fromiter((f[0] for f in filas), dtype=np.int64, count=n)
+    emisores = np.fromiter((f[1] for f in filas), dtype=np.int64, count=n)
+    ejercicios = np.fromiter((f[2] for f in filas), dtype=np.int64, count=n)
+
+    # Arreglos de largo variable -> coordenadas planas (fila, columna) y un solo asignado
+    largos = np.fromiter((len(f[3] or ()) for f in filas), dtype=np.int64, count=n)
+    total = int(largos.sum())
+    columnas = np.fromiter(chain.from_iterable(f[3] or () for f in filas), dtype=np.int64, count=total)
+    datos = np.fromiter(chain.from_iterable(f[4] or () for f in filas), dtype=np.float64, count=total)
+    posiciones = np.repeat(np.arange(n), largos)
+
+    valores = np.zeros((n, len(COLUMNAS)))
+    informados = np.zeros((n, len(COLUMNAS)), dtype=bool)
+    valores[posiciones, columnas - COLUMNAS[0]] = datos
+    informados[posiciones, columnas - COLUMNAS[0]] = True
+    return MatrizFactores(ids, emisores, ejercicios, valores, informados)
+
+
+def _por_grupo(grupos, matriz, cantidad):
+    """Suma las filas de 'matriz' por grupo (bincount sobre el índice plano grupo x columna)."""
+    ancho = matriz.shape[1]
+    indices = (grupos[:, None] * ancho + np.arange(ancho)).ravel()
+    return np.bincount(indices, weights=matriz.ravel(), minlength=cantidad * ancho).reshape(cantidad, ancho)
+
+
+def _hallazgos(mascara, codigo, filas, valores=None, referencia=None, puntaje=None):
+    """Celdas marcadas -> tuplas (fila global, índice de columna | None, código, valor, referencia, puntaje)."""
+    if mascara.ndim == 1:
+        return [(int(filas[i]), None, codigo, None, None, None) for i in np.flatnonzero(mascara)]
+    i, j = np.nonzero(mascara)
+    return [
+        (int(filas[a]), int(b), codigo, float(valores[a, b]),
+         None if referencia is None else float(referencia[a, b]),
+         None if puntaje is None else float(puntaje[a, b]))
+        for a, b in zip(i, j)
+    ]
+
+
+def detectar(matriz, ejercicios=None):
+    """
+    Analiza los ejercicios indicados (None = todos los de la matriz) contra los anteriores.
+    Devuelve {ejercicio: [(fila, indice_columna, codigo, valor, referencia, puntaje)]}.
+    """
+    anios = np.unique(matriz.ejercicios)
+    objetivo = set(anios.tolist() if ejercicios is None else ejercicios)
+    emisores, grupo = np.unique(matriz.emisores, return_inverse=True)
+    ancho = len(COLUMNAS)
+
+    # Historia acumulada: por emisor (calificaciones, suma, suma de cuadrados, veces informada)
+    # y por columna para los emisores sin historia propia
+    cal_emisor = np.zeros(len(emisores))
+    suma_emisor = np.zeros((len(emisores), ancho))
+    cuad_emisor = np.zeros((len(emisores), ancho))
+    usos_emisor = np.zeros((len(emisores), ancho))
+    cal_columna, suma_columna, cuad_columna = 0, np.zeros(ancho), np.zeros(ancho)
+
+    resultado = {}
+    for anio in anios:
+        filas = np.flatnonzero(matriz.ejercicios == anio)
+        valores, informados, g = matriz.valores[filas], matriz.informados[filas], grupo[filas]
+
+        if anio in objetivo:
+            hallazgos = []
+            n_hist = cal_emisor[g][:, None]
+            con_historia = n_hist >= MIN_HISTORIA
+            with np.errstate(invalid='ignore', divide='ignore'):
+                media = suma_emisor[g] / n_hist
+                desvio = np.sqrt(np.maximum(cuad_emisor[g] / n_hist - media ** 2, 0))
+                media_col = suma_columna / cal_columna
+                desvio_col = np.sqrt(np.maximum(cuad_columna / cal_columna - media_col ** 2, 0))
+
+            # 1. Columna que el emisor nunca informó en su historia (p.ej. crédito en otra columna)
+            inusual = con_historia & informados & (valores != 0) & (usos_emisor[g] == 0)
+            hallazgos += _hallazgos(inusual, 'COLUMNA_INUSUAL', filas, valores)
+
+            # 2. Desvío contra la historia del emisor (lo no informado cuenta como 0)
+            diferencia = np.abs(valores - np.where(con_historia, media, 0))
+            z = diferencia / np.maximum(desvio, 1e-12)
+            lejos = con_historia & ~inusual & (diferencia > DIFERENCIA_MINIMA) & (z > UMBRAL_Z)
+            hallazgos += _hallazgos(lejos, 'DESVIO_EMISOR', filas, valores, media, np.minimum(z, 1e6))
+
+            # 3. Emisores sin historia propia: contra la historia de la columna (todos los emisores)
+            if cal_columna >= MIN_HISTORIA:
+                diferencia = np.abs(valores - media_col)
+                z = diferencia / np.maximum(desvio_col, 1e-12)
+                lejos = ~con_historia & informados & (diferencia > DIFERENCIA_MINIMA) & (z > UMBRAL_Z)
+                hallazgos += _hallazgos(
+                    lejos, 'DESVIO_COLUMNA', filas, valores,
+                    np.broadcast_to(media_col, valores.shape), np.minimum(z, 1e6),
+                )
+
+            # 4. Reglas por fila
+            creditos = valores[:, _CREDITO].sum(axis=1)
+            hallazgos += [
+                (f, None, 'SUMA_LIMITE', s, float(TOPE_CREDITOS), None)
+                for f, s in zip(filas[creditos >= SUMA_ALERTA].tolist(), creditos[creditos >= SUMA_ALERTA].tolist())
+            ]
+            hallazgos += _hallazgos(~informados.any(axis=1), 'SIN_FACTORES', filas)
+            resultado[int(anio)] = hallazgos
+
+        # El ejercicio pasa a ser historia de los siguientes
+        cal_emisor += np.bincount(g, minlength=len(emisores))
+        suma_emisor += _por_grupo(g, valores, len(emisores))
+        cuad_emisor += _por_grupo(g, valores ** 2, len(emisores))
+        usos_emisor += _por_grupo(g, informados.astype(np.float64), len(emisores))
+        cal_columna += len(filas)
+        suma_columna += valores.sum(axis=0)
+        cuad_columna += (valores ** 2).sum(axis=0)
+    return resultado
+
+
+def _decimal(valor):
+    return None if valor is None else Decimal(repr(valor)).quantize(Decimal('1E-8'))
+
+
+def guardar(matriz, resultado):
+    """Reemplaza las anomalías guardadas de cada ejercicio analizado. Devuelve {ejercicio: cantidad}."""
+    with transaction.atomic():
+        anteriores = AnomaliaCalificacion.objects.filter(ejercicio__in=list(resultado))
+        # _raw_delete: un solo DELETE, sin cargar objetos ni disparar auditoría por fila
+        anteriores._raw_delete(anteriores.db)
+        AnomaliaCalificacion.objects.bulk_create(
+            (
+                AnomaliaCalificacion(
+                    calificacion_id=int(matriz.ids[fila]),
+                    ejercicio=ejercicio,
+                    codigo=codigo,
+                    columna_dj=None if indice is None else COLUMNAS[indice],
+                    valor=_decimal(valor),
+                    referencia=_decimal(referencia),
+                    puntaje=puntaje,
+                )
+                for ejercicio, hallazgos in resultado.items()
+                for fila, indice, codigo, valor, referencia, puntaje in hallazgos
+            ),
+            batch_size=LOTE_BD,
+        )
+    return {ejercicio: len(hallazgos) for ejercicio, hallazgos in resultado.items()}
+
+
+def analizar(ejercicios=None):
+    """Carga, analiza y guarda. 'ejercicios' = None analiza toda la historia."""
+    matriz = cargar_matriz(hasta=max(ejercicios) if ejercicios else None)
+    return guardar(matriz, detectar(matriz, ejercicios))
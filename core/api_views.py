@@ -1,13 +1,125 @@
-from rest_framework import viewsets
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Prefetch, Sum
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import OpenApiParameter, extend_schema, extend_schema_view
+from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework import status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import OrderingFilter
+from rest_framework.parsers import JSONParser
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
-from .models import Emisor, EventoCorporativo, CalificacionTributaria
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from . import archivo, metricas, versiones
+from .bulk import MAX_ITEMS, procesar_lote
+from .cambios import calificaciones_vigentes, leer_cambios
+from .dj1949 import FORMATOS as FORMATOS_DJ1949, generar as generar_dj1949
+from .exporters import exportar_csv, exportar_ndjson
+from .filters import CalificacionFilter
+from .models import ConflictoVersion, Emisor, EventoCorporativo, CalificacionTributaria, ResumenEmisor, ResumenFactor
+from .parsers import NDJSONParser
+from .reconstruccion import estado_al, parsear_instante
+from .resumenes import por_columna
+from .transiciones import ARCHIVADA, origenes_permitidos, transicionar
 from .serializers import (
     EmisorSerializer, 
     EventoCorporativoSerializer, 
-    CalificacionTributariaSerializer
+    CalificacionTributariaSerializer,
+    CalificacionLecturaSerializer,
+    CalificacionBulkItemSerializer,
+    BulkResultadoSerializer,
+    CambiosResultadoSerializer,
+    TransicionSerializer,
+    TransicionResultadoSerializer,
+    ResumenEmisorSerializer,
+    ResumenTotalesSerializer,
 )
 
-class EmisorViewSet(viewsets.ReadOnlyModelViewSet):
+class MetricasMixin:
+    """Latencia de cada acción del viewset en el histograma api_request_duracion_segundos."""
+    def dispatch(self, request, *args, **kwargs):
+        inicio = time.perf_counter()
+        response = super().dispatch(request, *args, **kwargs)
+        metricas.API_DURACION.observar(
+            time.perf_counter() - inicio,
+            vista=self.basename, accion=self.action or request.method.lower(), estado=f'{response.status_code // 100}xx',
+        )
+        return response
+
+
+class ArchivoMixin:
+    """Los ejercicios archivados son de sólo lectura (ver core/archivo.py): 400 en vez de un error de la BD."""
+    def _verificar_ejercicios(self, *ejercicios):
+        cerrados = archivo.archivados(e for e in ejercicios if e is not None)
+        if cerrados:
+            raise ValidationError({'ejercicio_comercial': [archivo.mensaje(e) for e in sorted(cerrados)]})
+
+    @staticmethod
+    def _ejercicio(instancia):
+        return getattr(instancia, 'evento', instancia).ejercicio_comercial
+
+    def perform_create(self, serializer):
+        self._verificar_ejercicios(serializer.validated_data.get('ejercicio_comercial'))
+        super().perform_create(serializer)
+
+    def perform_update(self, serializer):
+        self._verificar_ejercicios(self._ejercicio(serializer.instance), serializer.validated_data.get('ejercicio_comercial'))
+        super().perform_update(serializer)
+
+    def perform_destroy(self, instance):
+        self._verificar_ejercicios(self._ejercicio(instance))
+        super().perform_destroy(instance)
+
+
+class VersionMixin:
+    """
+    Concurrencia optimista (ver core/versiones.py): el detalle lleva la versión en el ETag
+    y PUT / PATCH / DELETE aceptan If-Match con él. Si ya no es la vigente, 412 con lo
+    que cambió desde la versión enviada. Sin If-Match no se pisa lo guardado por otro
+    mientras dura la request.
+    """
+    def _verificar_version(self, instancia):
+        aceptadas = versiones.if_match(self.request.headers.get('If-Match'))
+        if aceptadas is not None and instancia.version not in aceptadas:
+            raise ConflictoVersion(instancia, max(aceptadas, default=None))
+
+    def perform_update(self, serializer):
+        self._verificar_version(serializer.instance)
+        # Si hay conflicto se revierte sólo este bloque: luego se lee lo que cambió
+        with transaction.atomic():
+            super().perform_update(serializer)
+
+    def perform_destroy(self, instance):
+        self._verificar_version(instance)
+        super().perform_destroy(instance)
+
+    def retrieve(self, request, *args, **kwargs):
+        response = super().retrieve(request, *args, **kwargs)
+        response['ETag'] = versiones.etag(response.data['version'])
+        return response
+
+    def update(self, request, *args, **kwargs):
+        response = super().update(request, *args, **kwargs)
+        response['ETag'] = versiones.etag(response.data['version'])
+        return response
+
+    def handle_exception(self, exc):
+        if isinstance(exc, ConflictoVersion):
+            return Response(versiones.conflicto(exc), status=status.HTTP_412_PRECONDITION_FAILED)
+        return super().handle_exception(exc)
+
+
+class EmisorViewSet(MetricasMixin, viewsets.ReadOnlyModelViewSet):
     """
     API para listar Emisores (Solo lectura)
     """
@@ -15,7 +127,7 @@ class EmisorViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = EmisorSerializer
     permission_classes = [IsAuthenticated]
 
-class EventoViewSet(viewsets.ModelViewSet):
+class EventoViewSet(MetricasMixin, ArchivoMixin, VersionMixin, viewsets.ModelViewSet):
     """
     API para Eventos Corporativos
     """
@@ -23,23 +135,285 @@ class EventoViewSet(viewsets.ModelViewSet):
     serializer_class = EventoCorporativoSerializer
     permission_classes = [IsAuthenticated]
 
-class CalificacionViewSet(viewsets.ModelViewSet):
+# Máximo de cambios por página del change feed
+LIMITE_CAMBIOS = 1000
+
+_VISTA = OpenApiParameter(
+    'vista', str, enum=['detalles'],
+    description="Use 'detalles' para recibir los factores como lista de objetos (formato anterior).",
+)
+_AL = OpenApiParameter(
+    'al', str,
+    description="Instante (AAAA-MM-DDTHH:MM[:SS][±zona] o AAAA-MM-DD = fin del día): lista las calificaciones, "
+                "eventos y factores tal como estaban en ese momento. Admite los mismos filtros salvo 'anomalia'; "
+                "se ignora 'ordering' (orden por fecha de pago descendente).",
+)
+
+_IF_MATCH = OpenApiParameter(
+    'If-Match', str, OpenApiParameter.HEADER,
+    description='ETag del detalle leído (p. ej. "3"). Si la calificación cambió desde entonces: 412 con lo que cambió.',
+)
+
+
+@extend_schema_view(
+    list=extend_schema(parameters=[_VISTA, _AL]),
+    retrieve=extend_schema(parameters=[_VISTA]),
+    update=extend_schema(parameters=[_IF_MATCH]),
+    partial_update=extend_schema(parameters=[_IF_MATCH]),
+    destroy=extend_schema(parameters=[_IF_MATCH]),
+)
+class CalificacionViewSet(MetricasMixin, ArchivoMixin, VersionMixin, viewsets.ModelViewSet):
     """
     API principal de Calificaciones Tributarias
     """
     queryset = CalificacionTributaria.objects.select_related('evento__emisor').prefetch_related('detalles__concepto').all().order_by('-evento__fecha_pago')
     serializer_class = CalificacionTributariaSerializer
     permission_classes = [IsAuthenticated]
+
+    def get_serializer_class(self):
+        # Lectura compilada (factores como arreglo) salvo que se pida la vista con 'detalles'
+        if self.action in ('list', 'retrieve') and self.request.query_params.get('vista') != 'detalles':
+            return CalificacionLecturaSerializer
+        return super().get_serializer_class()
     
-    # Filtros simples (opcional, si quisieras filtrar por URL)
+    filter_backends = [DjangoFilterBackend, OrderingFilter]
+    filterset_class = CalificacionFilter
+    ordering_fields = ['evento__fecha_pago', 'evento__ejercicio_comercial', 'ultima_modificacion', 'id']
+
     def get_queryset(self):
         queryset = super().get_queryset()
-        nemonico = self.request.query_params.get('nemonico')
-        year = self.request.query_params.get('year')
-        
-        if nemonico:
-            queryset = queryset.filter(evento__emisor__nemonico__icontains=nemonico)
-        if year:
-            queryset = queryset.filter(evento__ejercicio_comercial=year)
-            
-        return queryset
\ No newline at end of file
+        if self.get_serializer_class() is CalificacionLecturaSerializer:
+            # La lectura compilada sólo necesita concepto_id, no el objeto ConceptoFactor
+            queryset = queryset.prefetch_related(None).prefetch_related('detalles')
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        if 'al' not in request.query_params:
+            return super().list(request, *args, **kwargs)
+        try:
+            instante = parsear_instante(request.query_params['al'])
+        except ValueError as e:
+            return Response({'al': [str(e)]}, status=status.HTTP_400_BAD_REQUEST)
+        # Se validan los filtros con el mismo FilterSet y se aplican sobre la grilla reconstruida
+        filtros = CalificacionFilter(request.query_params, queryset=CalificacionTributaria.objects.none())
+        if not filtros.is_valid():
+            return Response(filtros.errors, status=status.HTTP_400_BAD_REQUEST)
+        datos = filtros.form.cleaned_data
+        ejercicio = datos.get('ejercicio') or datos.get('year')
+        opciones = {
+            'mercado': datos.get('mercado'),
+            'nemonico': datos.get('nemonico'),
+            'ejercicio': int(ejercicio) if ejercicio is not None else None,
+            'estado': datos.get('estado'),
+            'emisor': int(datos['emisor']) if datos.get('emisor') is not None else None,
+            'fecha_pago_desde': datos.get('fecha_pago_desde'),
+            'fecha_pago_hasta': datos.get('fecha_pago_hasta'),
+        }
+        # Se reconstruye una vez por (instante, filtros): las páginas siguientes salen de la caché 'grilla'
+        clave = 'api_historica:' + hashlib.sha1(
+            json.dumps([instante.isoformat(), opciones], sort_keys=True, cls=DjangoJSONEncoder).encode()
+        ).hexdigest()
+        cache = caches['grilla']
+        calificaciones = cache.get(clave)
+        if calificaciones is None:
+            calificaciones = estado_al(instante, **opciones)
+            cache.set(clave, calificaciones)
+        pagina = self.paginate_queryset(calificaciones)
+        if pagina is not None:
+            return self.get_paginated_response(self.get_serializer(pagina, many=True).data)
+        return Response(self.get_serializer(calificaciones, many=True).data)
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter('formato', str, enum=['ndjson', 'csv'], description='Formato de salida (por defecto ndjson).'),
+        ],
+        responses={(200, 'application/x-ndjson'): OpenApiTypes.STR, (200, 'text/csv'): OpenApiTypes.STR},
+        description="Exporta TODAS las calificaciones que cumplen los filtros en un único stream "
+                    "(NDJSON o CSV), sin paginación.",
+    )
+    @action(detail=False, methods=['get'], url_path='export')
+    def export(self, request):
+        formato = request.query_params.get('formato', 'ndjson')
+        if formato not in ('ndjson', 'csv'):
+            return Response({'detail': "Formato no soportado. Use 'ndjson' o 'csv'."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Queryset "limpio" (sin select/prefetch_related): la exportación arma las filas con values()
+        queryset = self.filter_queryset(CalificacionTributaria.objects.all())
+        if formato == 'csv':
+            response = StreamingHttpResponse(exportar_csv(queryset), content_type='text/csv; charset=utf-8')
+            response['Content-Disposition'] = 'attachment; filename="calificaciones.csv"'
+        else:
+            response = StreamingHttpResponse(exportar_ndjson(queryset), content_type='application/x-ndjson')
+        return response
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter('ejercicio', int, required=True, description='Ejercicio comercial.'),
+            OpenApiParameter('formato', str, enum=[*FORMATOS_DJ1949], description='txt (ancho fijo, por defecto) o csv.'),
+            OpenApiParameter('todas', bool, description='Incluir calificaciones no validadas.'),
+        ],
+        responses={(200, 'text/plain'): OpenApiTypes.BINARY, (200, 'text/csv'): OpenApiTypes.BINARY},
+        description="Descarga el archivo anual de la DJ 1949: un registro por evento con los factores 8 a 37 "
+                    "y un registro final de totales.",
+    )
+    @action(detail=False, methods=['get'], url_path='dj1949', filter_backends=[])
+    def dj1949(self, request):
+        formato = request.query_params.get('formato', 'txt')
+        try:
+            ejercicio = int(request.query_params['ejercicio'])
+        except (KeyError, ValueError):
+            return Response({'detail': "Indique un 'ejercicio' válido."}, status=status.HTTP_400_BAD_REQUEST)
+        if formato not in FORMATOS_DJ1949:
+            return Response({'detail': "Formato no soportado. Use 'txt' o 'csv'."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Se genera a disco y se entrega desde el archivo (no se arma en memoria).
+        # Siempre en un solo proceso: hacer fork desde un worker con hilos (gthread) puede
+        # bloquearse; la generación en paralelo queda para el comando generar_dj1949.
+        directorio = tempfile.mkdtemp(prefix='dj1949-')
+        ruta = os.path.join(directorio, f'DJ1949_{ejercicio}.{formato}')
+        try:
+            generar_dj1949(
+                ejercicio,
+                ruta,
+                formato=formato,
+                estados=None if request.query_params.get('todas') in ('1', 'true') else ('VALIDADO',),
+                procesos=1,
+            )
+            archivo = open(ruta, 'rb')
+        finally:
+            # En Linux el archivo abierto sigue legible tras borrarlo: no quedan residuos en /tmp
+            shutil.rmtree(directorio, ignore_errors=True)
+        content_type = 'text/csv; charset=utf-8' if formato == 'csv' else 'text/plain; charset=iso-8859-1'
+        return FileResponse(archivo, as_attachment=True, filename=os.path.basename(ruta), content_type=content_type)
+
+    @extend_schema(
+        request=CalificacionBulkItemSerializer(many=True),
+        responses={200: BulkResultadoSerializer, 207: BulkResultadoSerializer, 400: BulkResultadoSerializer},
+        description="Crea o actualiza miles de calificaciones (con sus factores) en una sola transacción. "
+                    "Acepta una lista JSON o NDJSON (application/x-ndjson) y devuelve el resultado por elemento.",
+    )
+    @action(detail=False, methods=['post'], url_path='bulk', parser_classes=[JSONParser, NDJSONParser], filter_backends=[])
+    def bulk(self, request):
+        items = request.data
+        if isinstance(items, dict):
+            items = items.get('items')
+        if not isinstance(items, list):
+            return Response({'detail': 'Se espera una lista de calificaciones (JSON o NDJSON).'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > MAX_ITEMS:
+            return Response({'detail': f'El lote excede el máximo de {MAX_ITEMS} elementos.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        with metricas.CARGA_DURACION.cronometro(origen='api'):
+            resultado = procesar_lote(items, user=request.user)
+        metricas.CARGA_FILAS.inc(resultado['creados'] + resultado['actualizados'], origen='api')
+        metricas.CARGA_ERRORES.inc(resultado['con_error'], origen='api')
+
+        if resultado['con_error'] == 0:
+            codigo = status.HTTP_200_OK
+        elif resultado['con_error'] < resultado['total']:
+            codigo = status.HTTP_207_MULTI_STATUS  # Éxito parcial
+        else:
+            codigo = status.HTTP_400_BAD_REQUEST
+        return Response(resultado, status=codigo)
+
+    @extend_schema(
+        request=TransicionSerializer,
+        responses=TransicionResultadoSerializer,
+        description="Cambia el estado de muchas calificaciones a la vez (por lista de ids o por los filtros "
+                    "de la URL). Sólo se aplican las transiciones permitidas por el flujo de revisión; "
+                    "el resto se informa en 'omitidas'.",
+    )
+    @action(detail=False, methods=['post'], url_path='transicion')
+    def transicion(self, request):
+        entrada = TransicionSerializer(data=request.data)
+        entrada.is_valid(raise_exception=True)
+        datos = entrada.validated_data
+
+        if 'ids' in datos:
+            queryset = CalificacionTributaria.objects.filter(pk__in=datos['ids'])
+        else:
+            # Sin ids se exige al menos un filtro: evita cambiar toda la tabla por accidente
+            if not set(request.query_params) & set(CalificacionFilter.base_filters):
+                return Response({'detail': 'Indique ids o al menos un filtro.'}, status=status.HTTP_400_BAD_REQUEST)
+            queryset = self.filter_queryset(CalificacionTributaria.objects.all())
+
+        resultado = transicionar(queryset, datos['estado'], user=request.user, motivo=datos['motivo'])
+        # 409 sólo si NADA se pudo aplicar por el flujo (las que ya estaban en el destino no cuentan)
+        bloqueantes = set(resultado['omitidas']) - {datos['estado']}
+        if not resultado['actualizadas'] and bloqueantes:
+            detalle = (
+                'Las calificaciones son de ejercicios archivados (sólo lectura).' if bloqueantes == {ARCHIVADA}
+                else f"Sólo se puede pasar a {datos['estado']} desde: {', '.join(origenes_permitidos(datos['estado']))}."
+            )
+            return Response({**resultado, 'detail': detalle}, status=status.HTTP_409_CONFLICT)
+        return Response(TransicionResultadoSerializer(resultado).data)
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter('desde', str, description="Token devuelto en 'siguiente' por la consulta anterior (vacío = desde el inicio)."),
+            OpenApiParameter('limite', int, description=f'Máximo de cambios por página (por defecto {LIMITE_CAMBIOS}).'),
+        ],
+        responses=CambiosResultadoSerializer,
+        description="Feed incremental: calificaciones creadas, actualizadas (con factores) o eliminadas "
+                    "(tombstone) desde el token indicado.",
+    )
+    @action(detail=False, methods=['get'], url_path='cambios', filter_backends=[])
+    def cambios(self, request):
+        desde = request.query_params.get('desde', '')
+        try:
+            limite = min(int(request.query_params.get('limite', LIMITE_CAMBIOS)), LIMITE_CAMBIOS)
+            filas, siguiente, hay_mas = leer_cambios(desde, max(limite, 1))
+        except ValueError:
+            return Response({'detail': 'Parámetros desde/limite inválidos.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        upserts = [f[2] for f in filas if f[3] == 'UPSERT']
+        vigentes = calificaciones_vigentes(upserts)
+        representar = CalificacionLecturaSerializer(context=self.get_serializer_context()).compilado()
+        estados = {c.pk: representar(c) for c in vigentes}
+
+        cambios = []
+        for cambio_id, _, calificacion_id, accion in filas:
+            estado = estados.get(calificacion_id)
+            if accion == 'UPSERT' and estado is not None:
+                cambios.append({'accion': 'upsert', 'id': calificacion_id, 'secuencia': cambio_id, 'calificacion': estado})
+            else:
+                # Eliminada (o borrada después de este cambio): tombstone
+                cambios.append({'accion': 'delete', 'id': calificacion_id, 'secuencia': cambio_id})
+
+        return Response({'desde': desde, 'siguiente': siguiente, 'hay_mas': hay_mas, 'cambios': cambios})
+
+
+class ResumenViewSet(MetricasMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Totales por (ejercicio, mercado, emisor) con el resumen de cada columna de factores.
+    Lee sólo las tablas pre-agregadas (ver core/resumenes.py).
+    """
+    queryset = ResumenEmisor.objects.select_related('emisor').prefetch_related(
+        Prefetch('factores', queryset=ResumenFactor.objects.select_related('concepto').order_by('concepto__columna_dj'))
+    ).order_by('-ejercicio', 'emisor__nemonico', 'mercado')
+    serializer_class = ResumenEmisorSerializer
+    permission_classes = [IsAuthenticated]
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = ['ejercicio', 'mercado', 'emisor']
+
+    @extend_schema(responses=ResumenTotalesSerializer,
+                   description='Totales combinados de los resúmenes que cumplen los filtros (sin paginar).')
+    @action(detail=False, methods=['get'], url_path='totales')
+    def totales(self, request):
+        resumenes = self.filter_queryset(ResumenEmisor.objects.all())
+        totales = resumenes.aggregate(eventos=Sum('eventos'), monto_total=Sum('monto_total'))
+        datos = {
+            'eventos': totales['eventos'] or 0,
+            'monto_total': totales['monto_total'] or 0,
+            'columnas': por_columna(resumenes),
+        }
+        return Response(ResumenTotalesSerializer(datos).data)
+
+
+@extend_schema(exclude=True)
+class MetricasView(APIView):
+    """Métricas de todos los procesos en formato de texto de Prometheus (sólo staff, p. ej. con token)."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return HttpResponse(metricas.exponer(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
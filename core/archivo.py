@@ -0,0 +1,184 @@
+# core/archivo.py
+# Separación caliente / frío por ejercicio. Los eventos, calificaciones y factores de
+# los ejercicios cerrados se mueven a tablas del esquema 'archivo' que HEREDAN de las
+# de la aplicación (herencia de tablas de PostgreSQL): toda consulta del ORM sobre
+# core_detallefactor recorre también archivo.core_detallefactor, sin cambiar nada en
+# el código. Las tablas calientes sólo guardan los ejercicios abiertos, así sus índices
+# y su VACUUM no crecen con la historia; las de archivo se congelan (VACUUM FREEZE,
+# sin autovacuum) y un trigger las deja de sólo lectura.
+#
+# Por qué herencia y no particionamiento declarativo: una tabla particionada exige la
+# columna de partición en la clave primaria y en cada FK que la referencia, y
+# DetalleFactor y CalificacionTributaria no tienen el ejercicio (está en el evento).
+from django.conf import settings
+from django.db import connection, transaction
+from .models import CalificacionTributaria, DetalleFactor, EjercicioArchivado, EventoCorporativo
+
+ESQUEMA = 'archivo'
+# Orden en que se mueven: primero lo que referencia a los demás
+MODELOS = (DetalleFactor, CalificacionTributaria, EventoCorporativo)
+# Variable de la transacción que permite escribir en el archivo (sólo mientras se mueve)
+MOVIENDO = 'archivo.moviendo'
+
+
+def archivados(ejercicios=None):
+    """Ejercicios archivados (de sólo lectura); con 'ejercicios', sólo los de esa lista."""
+    consulta = EjercicioArchivado.objects.values_list('ejercicio', flat=True)
+    if ejercicios is not None:
+        consulta = consulta.filter(ejercicio__in=set(ejercicios))
+    return set(consulta)
+
+
+def mensaje(ejercicio):
+    return f"El ejercicio {ejercicio} está archivado: sus calificaciones son de sólo lectura."
+
+
+def _tabla(modelo):
+    return connection.ops.quote_name(modelo._meta.db_table)
+
+
+def _archivo(modelo):
+    return f'{ESQUEMA}.{_tabla(modelo)}'
+
+
+def preparar(cursor):
+    """Crea (si faltan) el esquema, las tablas de archivo y los triggers. Idempotente."""
+    cursor.execute(f'CREATE SCHEMA IF NOT EXISTS {ESQUEMA}')
+    espacio = getattr(settings, 'ARCHIVO_TABLESPACE', None)
+    if espacio:
+        # Tablas e índices del archivo en otro almacenamiento (p. ej. discos más baratos)
+        cursor.execute(f'SET LOCAL default_tablespace = {connection.ops.quote_name(espacio)}')
+    for modelo in MODELOS:
+        cursor.execute(
+            f'CREATE TABLE IF NOT EXISTS {_archivo(modelo)} (LIKE {_tabla(modelo)} INCLUDING INDEXES) '
+            f'INHERITS ({_tabla(modelo)})'
+        )
+        cursor.execute(f'ALTER TABLE {_archivo(modelo)} SET (autovacuum_enabled = false)')
+    if espacio:
+        cursor.execute('SET LOCAL default_tablespace = DEFAULT')
+
+    cursor.execute(f"""
+        CREATE OR REPLACE FUNCTION {ESQUEMA}.solo_lectura() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' AND current_setting('{MOVIENDO}', true) = 'si' THEN
+                RETURN NEW;
+            END IF;
+            RAISE EXCEPTION 'Ejercicio archivado: % es de sólo lectura', TG_TABLE_NAME
+                USING ERRCODE = 'read_only_sql_transaction';
+        END $$
+    """)
+    cursor.execute(f"""
+        CREATE OR REPLACE FUNCTION {ESQUEMA}.ejercicio_abierto() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM {_tabla(EjercicioArchivado)} WHERE ejercicio = NEW.ejercicio_comercial) THEN
+                RAISE EXCEPTION 'El ejercicio % está archivado: es de sólo lectura', NEW.ejercicio_comercial
+                    USING ERRCODE = 'read_only_sql_transaction';
+            END IF;
+            RETURN NEW;
+        END $$
+    """)
+    for modelo in MODELOS:
+        cursor.execute(f'DROP TRIGGER IF EXISTS solo_lectura ON {_archivo(modelo)}')
+        cursor.execute(
+            f'CREATE TRIGGER solo_lectura BEFORE INSERT OR UPDATE OR DELETE ON {_archivo(modelo)} '
+            f'FOR EACH ROW EXECUTE FUNCTION {ESQUEMA}.solo_lectura()'
+        )
+    # En la tabla caliente no entran eventos nuevos de un ejercicio archivado (ni se mueven a uno).
+    # Calificaciones y factores no lo necesitan: sus FK sólo ven las filas de la tabla caliente.
+    cursor.execute(f'DROP TRIGGER IF EXISTS ejercicio_abierto ON {_tabla(EventoCorporativo)}')
+    cursor.execute(
+        f'CREATE TRIGGER ejercicio_abierto BEFORE INSERT OR UPDATE OF ejercicio_comercial '
+        f'ON {_tabla(EventoCorporativo)} FOR EACH ROW EXECUTE FUNCTION {ESQUEMA}.ejercicio_abierto()'
+    )
+
+
+def _mover(cursor, modelo, hasta):
+    """Mueve a su tabla de archivo las filas de los ejercicios <= hasta. Devuelve {ejercicio: filas}."""
+    evento, calificacion = _tabla(EventoCorporativo), _tabla(CalificacionTributaria)
+    if modelo is EventoCorporativo:
+        otras, condicion, ejercicio = '', 't.ejercicio_comercial <= %s', 't.ejercicio_comercial'
+    elif modelo is CalificacionTributaria:
+        otras = f'USING ONLY {evento} e'
+        condicion, ejercicio = 't.evento_id = e.id AND e.ejercicio_comercial <= %s', 'e.ejercicio_comercial'
+    else:
+        otras = f'USING ONLY {calificacion} c, ONLY {evento} e'
+        condicion = 't.calificacion_id = c.id AND c.evento_id = e.id AND e.ejercicio_comercial <= %s'
+        ejercicio = 'e.ejercicio_comercial'
+    columnas = [connection.ops.quote_name(f.column) for f in modelo._meta.concrete_fields]
+    cursor.execute(
+        f'WITH movidas AS ('
+        f'  DELETE FROM ONLY {_tabla(modelo)} t {otras} WHERE {condicion}'
+        f'  RETURNING {", ".join("t." + c for c in columnas)}, {ejercicio} AS ejercicio_archivo'
+        f'), copiadas AS ('
+        f'  INSERT INTO {_archivo(modelo)} ({", ".join(columnas)}) SELECT {", ".join(columnas)} FROM movidas'
+        f') SELECT ejercicio_archivo, COUNT(*) FROM movidas GROUP BY 1',
+        [hasta],
+    )
+    return dict(cursor.fetchall())
+
+
+def archivar(hasta):
+    """
+    Mueve al archivo los ejercicios <= hasta que sigan en las tablas calientes. Devuelve
+    [EjercicioArchivado] de los ejercicios nuevos. Los eventos quedan bloqueados para
+    escritura mientras dura (las lecturas siguen).
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        preparar(cursor)
+        cursor.execute(f'LOCK TABLE ONLY {_tabla(EventoCorporativo)} IN SHARE ROW EXCLUSIVE MODE')
+        cursor.execute(f"SET LOCAL {MOVIENDO} = 'si'")
+        movidas = {modelo: _mover(cursor, modelo, hasta) for modelo in MODELOS}
+        cursor.execute(f"SET LOCAL {MOVIENDO} = ''")
+
+        ya_archivados = archivados()
+        nuevos = EjercicioArchivado.objects.bulk_create([
+            EjercicioArchivado(
+                ejercicio=ejercicio,
+                eventos=movidas[EventoCorporativo][ejercicio],
+                calificaciones=movidas[CalificacionTributaria].get(ejercicio, 0),
+                factores=movidas[DetalleFactor].get(ejercicio, 0),
+            )
+            for ejercicio in sorted(movidas[EventoCorporativo].keys() - ya_archivados)
+        ])
+
+        # Con el rango en un CHECK, el planificador ni abre el archivo de eventos en las
+        # consultas de ejercicios abiertos (constraint_exclusion = partition, por defecto)
+        archivo_eventos = _archivo(EventoCorporativo)
+        cursor.execute(f'ALTER TABLE {archivo_eventos} DROP CONSTRAINT IF EXISTS archivo_ejercicio_check')
+        cursor.execute(
+            f'ALTER TABLE {archivo_eventos} ADD CONSTRAINT archivo_ejercicio_check '
+            f'CHECK (ejercicio_comercial <= {int(max(ya_archivados | {hasta}))})'
+        )
+    return nuevos
+
+
+def mantener(reindexar=False):
+    """
+    Tras archivar (fuera de una transacción): congela el archivo, que ya no cambia, y
+    deja reutilizable en las tablas calientes el espacio de las filas movidas. VACUUM no
+    achica los índices; con reindexar=True se reconstruyen (sin bloquear escrituras).
+    """
+    with connection.cursor() as cursor:
+        for modelo in MODELOS:
+            cursor.execute(f'VACUUM (FREEZE, ANALYZE) {_archivo(modelo)}')
+            cursor.execute(f'VACUUM (ANALYZE) {_tabla(modelo)}')
+            if reindexar:
+                cursor.execute(f'REINDEX TABLE CONCURRENTLY {_tabla(modelo)}')
+
+
+def tamanos():
+    """{tabla: {'filas', 'tabla_mb', 'indices_mb'}} de las tablas calientes y de archivo."""
+    resultado = {}
+    with connection.cursor() as cursor:
+        for modelo in MODELOS:
+            for nombre, esquema in ((modelo._meta.db_table, None), (f'{ESQUEMA}.{modelo._meta.db_table}', ESQUEMA)):
+                cursor.execute('SELECT to_regclass(%s)', [nombre])
+                if cursor.fetchone()[0] is None:
+                    continue
+                cursor.execute(
+                    'SELECT c.reltuples::bigint, pg_table_size(c.oid), pg_indexes_size(c.oid) '
+                    'FROM pg_class c WHERE c.oid = %s::regclass', [nombre],
+                )
+                filas, tabla, indices = cursor.fetchone()
+                resultado[nombre] = {'filas': max(filas, 0), 'tabla_mb': tabla / 2**20, 'indices_mb': indices / 2**20}
+    return resultado
@@ -0,0 +1,58 @@
+# core/auditoria.py
+import json
+from collections import Counter
+from django.contrib.contenttypes.models import ContentType
+from django.core.serializers.json import DjangoJSONEncoder
+from . import metricas
+from .models import AuditLog
+
+
+def usuario_actual():
+    """Devuelve el usuario de la request en curso (o None si es anónimo / proceso batch)."""
+    from .middleware import get_current_user
+
+    user = get_current_user()
+    if user and not user.is_authenticated:
+        user = None
+    return user
+
+
+def registrar_lote(modelo, resumen, user=None):
+    """
+    Registra UN solo AuditLog que resume una operación masiva sobre 'modelo'.
+    Las operaciones set-based (bulk_create / update) no disparan las señales de
+    auditoría por registro, así que dejamos constancia del lote completo.
+    """
+    log = AuditLog.objects.create(
+        user=user or usuario_actual(),
+        action='BULK',
+        content_type=ContentType.objects.get_for_model(modelo),
+        changes=json.loads(json.dumps(resumen, cls=DjangoJSONEncoder)),
+    )
+    metricas.AUDITORIA_REGISTROS.inc_al_confirmar(accion='BULK')
+    return log
+
+
+def registrar_objetos(cambios, user=None):
+    """
+    Registra un AuditLog POR objeto, con el mismo formato que las señales de
+    core/signals.py, para escrituras set-based (bulk_create / bulk_update /
+    DELETE directo) que no disparan esas señales.
+    'cambios' es una lista de (acción, instancia, dict_de_cambios). Un solo INSERT.
+    """
+    if not cambios:
+        return []
+    user = user or usuario_actual()
+    logs = AuditLog.objects.bulk_create([
+        AuditLog(
+            user=user,
+            action=action,
+            content_type=ContentType.objects.get_for_model(instancia),
+            object_id=str(instancia.pk),
+            changes=json.loads(json.dumps(detalle, cls=DjangoJSONEncoder)),
+        )
+        for action, instancia, detalle in cambios
+    ])
+    for action, cantidad in Counter(action for action, _, _ in cambios).items():
+        metricas.AUDITORIA_REGISTROS.inc_al_confirmar(cantidad, accion=action)
+    return logs
@@ -0,0 +1,174 @@
+# core/avisos.py
+# Avisos de cambios de calificaciones a sistemas externos (patrón outbox). Cada
+# cambio deja una fila en AvisoSalida en la MISMA transacción que lo escribe (ver
+# cambios.registrar_cambios): si la transacción se revierte no hay aviso, y si se
+# confirma el aviso no se pierde. Las requests no esperan a nadie: el comando
+# despachar_avisos toma lotes con FOR UPDATE SKIP LOCKED (varios despachadores en
+# paralelo no se pisan), junta los cambios de una misma calificación en un solo
+# evento con su estado vigente y lo entrega a los destinos configurados.
+#
+# Entrega "al menos una vez": tras un fallo el lote completo se reintenta (con espera
+# creciente), así que un destino puede recibir un evento repetido o uno más antiguo
+# después de uno nuevo. Cada evento lleva la 'version' de la calificación para
+# descartar esos casos.
+import hashlib
+import hmac
+import json
+import logging
+import sys
+import urllib.request
+from datetime import timedelta
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from . import metricas
+from .models import AvisoSalida
+from .serializers import CalificacionLecturaSerializer
+
+logger = logging.getLogger(__name__)
+
+LOTE = 500
+# Espera antes del reintento n: ESPERA_BASE * 2^(n-1) segundos, hasta ESPERA_MAXIMA
+ESPERA_BASE = 5
+ESPERA_MAXIMA = 3600
+
+
+def activos():
+    return getattr(settings, 'AVISOS_ACTIVOS', False)
+
+
+def registrar(calificacion_ids):
+    """Deja los avisos de estas calificaciones en la transacción en curso (si los avisos están activos)."""
+    if activos() and calificacion_ids:
+        AvisoSalida.objects.bulk_create([AvisoSalida(calificacion_id=i) for i in calificacion_ids], batch_size=1000)
+
+
+# --- Destinos ---
+# Un destino es cualquier clase con enviar(eventos) que lanza una excepción si no pudo
+# entregar. Se configuran en AVISOS_DESTINOS: [{'clase': 'ruta.Clase', **opciones}].
+
+def _json(eventos):
+    return json.dumps(eventos, cls=DjangoJSONEncoder, ensure_ascii=False)
+
+
+class Consola:
+    """Un evento JSON por línea en la salida estándar (pruebas locales)."""
+
+    def __init__(self, flujo=None):
+        self.flujo = flujo or sys.stdout
+
+    def enviar(self, eventos):
+        for evento in eventos:
+            self.flujo.write(_json(evento) + '\n')
+        self.flujo.flush()
+
+
+class Archivo:
+    """Agrega los eventos a un archivo NDJSON."""
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+
+    def enviar(self, eventos):
+        with open(self.ruta, 'a', encoding='utf-8') as archivo:
+            Consola(archivo).enviar(eventos)
+
+
+class Webhook:
+    """
+    POST de {'eventos': [...]} a la URL; cualquier respuesta que no sea 2xx es un fallo.
+    Con 'secreto', el cuerpo va firmado en X-Firma (HMAC-SHA256, hexadecimal).
+    """
+
+    def __init__(self, url, secreto=None, timeout=10):
+        self.url, self.secreto, self.timeout = url, secreto, timeout
+
+    def enviar(self, eventos):
+        cuerpo = _json({'eventos': eventos}).encode()
+        cabeceras = {'Content-Type': 'application/json'}
+        if self.secreto:
+            cabeceras['X-Firma'] = hmac.new(self.secreto.encode(), cuerpo, hashlib.sha256).hexdigest()
+        peticion = urllib.request.Request(self.url, data=cuerpo, headers=cabeceras, method='POST')
+        # urlopen lanza HTTPError con las respuestas 4xx / 5xx
+        with urllib.request.urlopen(peticion, timeout=self.timeout):
+            pass
+
+
+def destinos(configuracion=None):
+    """Instancia los destinos de AVISOS_DESTINOS (o de 'configuracion')."""
+    configuracion = getattr(settings, 'AVISOS_DESTINOS', []) if configuracion is None else configuracion
+    return [import_string(c['clase'])(**{k: v for k, v in c.items() if k != 'clase'}) for c in configuracion]
+
+
+# --- Despacho ---
+
+def espera(intentos):
+    return timedelta(seconds=min(ESPERA_BASE * 2 ** (intentos - 1), ESPERA_MAXIMA))
+
+
+def eventos(calificacion_ids):
+    """Un evento por calificación con su estado vigente (o la eliminación si ya no existe)."""
+    # Mismo formato que el change feed de la API (/api/calificaciones/cambios/).
+    # Import diferido: cambios importa este módulo para registrar los avisos.
+    from .cambios import calificaciones_vigentes
+
+    representar = CalificacionLecturaSerializer().compilado()
+    vigentes = {c.pk: representar(c) for c in calificaciones_vigentes(calificacion_ids)}
+    return [
+        {'accion': 'upsert', 'id': i, 'version': vigentes[i]['version'], 'calificacion': vigentes[i]}
+        if i in vigentes else {'accion': 'delete', 'id': i}
+        for i in calificacion_ids
+    ]
+
+
+def despachar(lista_destinos, lote=LOTE, max_intentos=None):
+    """
+    Entrega un lote de avisos vencidos a todos los destinos. Devuelve (eventos entregados,
+    avisos que quedaron para reintento). Los avisos entregados se eliminan.
+    """
+    max_intentos = max_intentos or getattr(settings, 'AVISOS_MAX_INTENTOS', 10)
+    ahora = timezone.now()
+    with transaction.atomic():
+        # SKIP LOCKED: las filas que otro despachador está entregando se saltan, no se esperan
+        avisos = list(
+            AvisoSalida.objects.select_for_update(skip_locked=True)
+            .filter(proximo_intento__lte=ahora)
+            .order_by('proximo_intento', 'id')
+            .values_list('id', 'calificacion_id', 'intentos')[:lote]
+        )
+        if not avisos:
+            return 0, 0
+
+        # Varios cambios de una calificación: un solo evento con su estado vigente
+        calificacion_ids = list(dict.fromkeys(calificacion_id for _, calificacion_id, _ in avisos))
+        lote_eventos = eventos(calificacion_ids)
+        try:
+            for destino in lista_destinos:
+                destino.enviar(lote_eventos)
+        except Exception as e:
+            por_intentos = {}
+            for aviso_id, _, intentos in avisos:
+                por_intentos.setdefault(intentos + 1, []).append(aviso_id)
+            for intentos, ids in por_intentos.items():
+                AvisoSalida.objects.filter(id__in=ids).update(
+                    intentos=intentos,
+                    proximo_intento=ahora + espera(intentos) if intentos < max_intentos else None,
+                    error=f'{type(e).__name__}: {e}'[:2000],
+                )
+            logger.warning('No se pudieron entregar %s avisos (se reintentará): %s', len(avisos), e)
+            metricas.AVISOS_FALLIDOS.inc(len(avisos))
+            return 0, len(avisos)
+
+        entregados = AvisoSalida.objects.filter(id__in=[aviso_id for aviso_id, _, _ in avisos])
+        entregados._raw_delete(entregados.db)
+    metricas.AVISOS_ENTREGADOS.inc(len(lote_eventos))
+    return len(lote_eventos), 0
+
+
+def reintentar_agotados():
+    """Vuelve a poner en la cola los avisos que agotaron sus reintentos. Devuelve cuántos."""
+    return AvisoSalida.objects.filter(proximo_intento__isnull=True).update(
+        proximo_intento=timezone.now(), intentos=0,
+    )
@@ -0,0 +1,32 @@
+# core/bloqueos.py
+# Locks consultivos (advisory locks) de PostgreSQL por clave de negocio. La carga
+# masiva bloquea sólo las claves que va a escribir, p. ej. (emisor, ejercicio): dos
+# archivos independientes se guardan en paralelo y dos que comparten claves se
+# ordenan entre sí, sin fallar por las restricciones únicas. Las claves se piden
+# ordenadas y de una vez, así dos cargas nunca se esperan mutuamente (deadlock).
+import hashlib
+from django.db import connection
+from . import metricas
+
+
+def _numero(espacio, clave):
+    """Clave de 64 bits (con signo, como la pide pg_advisory_xact_lock) para (espacio, clave)."""
+    partes = clave if isinstance(clave, tuple) else (clave,)
+    texto = '\x1f'.join(map(str, (espacio, *partes))).encode()
+    return int.from_bytes(hashlib.blake2b(texto, digest_size=8).digest(), 'big', signed=True)
+
+
+def bloquear(espacio, claves):
+    """
+    Toma un lock por cada clave de 'espacio' hasta el fin de la transacción en curso
+    (espera si otra transacción lo tiene). Dentro de una transacción, cada espacio se
+    bloquea en un solo llamado y siempre en el mismo orden entre espacios.
+    """
+    if not connection.in_atomic_block:
+        raise RuntimeError('bloquear() debe llamarse dentro de transaction.atomic().')
+    numeros = sorted({_numero(espacio, clave) for clave in claves})
+    if not numeros:
+        return
+    with metricas.BLOQUEOS_ESPERA.cronometro(espacio=espacio), connection.cursor() as cursor:
+        # unnest entrega el arreglo en orden: los locks se toman en el orden de 'numeros'
+        cursor.execute('SELECT pg_advisory_xact_lock(k) FROM unnest(%s::bigint[]) AS k', [numeros])
@@ -0,0 +1,304 @@
+# core/bulk.py
+# Carga masiva de calificaciones vía API: valida cada elemento con las mismas
+# reglas de negocio que la interfaz y guarda los válidos con upserts set-based
+# (INSERT ... ON CONFLICT) en una sola transacción. Los elementos inválidos se
+# informan uno a uno sin impedir que el resto del lote se guarde.
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.settings import api_settings
+from .auditoria import registrar_lote, usuario_actual
+from .bloqueos import bloquear
+from .cambios import registrar_cambios
+from . import resumenes
+from .archivo import archivados, mensaje
+from .models import ConflictoVersion, Emisor, EventoCorporativo, CalificacionTributaria, ConceptoFactor, DetalleFactor
+from .versiones import conflicto
+from .serializers import CalificacionBulkItemSerializer
+from .validacion import validar_matriz
+
+# Tamaño de cada INSERT masivo
+LOTE_BD = 1000
+# Máximo de elementos aceptados por petición
+MAX_ITEMS = getattr(settings, 'BULK_MAX_ITEMS', 10000)
+# Campos que se sobrescriben cuando el evento / la calificación ya existen
+CAMPOS_EVENTO = ('mercado', 'fecha_pago', 'fecha_registro', 'secuencia')
+CAMPOS_CALIFICACION = ('monto_total_distribuido', 'monto_unitario_pesos', 'estado')
+# Veces que se reaplica el lote si un editor guarda una de sus filas mientras se escribe
+REINTENTOS = 3
+
+
+def validar_items(items, conceptos):
+    """
+    Valida cada elemento del lote.
+    Devuelve (validos, errores): validos = [(indice, datos)], errores = {indice: detalle}.
+    """
+    validador = CalificacionBulkItemSerializer(context={'columnas_validas': set(conceptos)})
+    validos, errores = [], {}
+    for indice, item in enumerate(items):
+        if not isinstance(item, dict):
+            errores[indice] = {'non_field_errors': ['Cada elemento debe ser un objeto JSON.']}
+            continue
+        try:
+            validos.append((indice, validador.run_validation(item)))
+        except serializers.ValidationError as exc:
+            errores[indice] = exc.detail
+
+    # Reglas de negocio de los factores: una sola validación sobre la matriz del lote
+    columnas = sorted(conceptos)
+    validacion = validar_matriz(
+        [[datos['factores'].get(c) for c in columnas] for _, datos in validos],
+        columnas,
+    )
+    for fila, errores_fila in validacion.errores_por_fila().items():
+        detalle = {}
+        for error in errores_fila:
+            clave = api_settings.NON_FIELD_ERRORS_KEY if error['columna'] is None else str(error['columna'])
+            detalle.setdefault(clave, []).append(error['mensaje'])
+        errores[validos[fila][0]] = {'factores': detalle}
+    if validacion.errores:
+        validos = [v for fila, v in enumerate(validos) if fila not in validacion.filas_con_error]
+    return validos, errores
+
+
+def procesar_lote(items, user=None):
+    """Valida y guarda un lote de calificaciones. Devuelve el resumen con el resultado por elemento."""
+    user = user or usuario_actual()
+    conceptos = dict(ConceptoFactor.objects.values_list('columna_dj', 'id'))
+    validos, errores = validar_items(items, conceptos)
+
+    # Emisores resueltos en una sola consulta
+    nemonicos = {datos['nemonico'] for _, datos in validos}
+    emisores = dict(Emisor.objects.filter(nemonico__in=nemonicos).values_list('nemonico', 'id'))
+    cerrados = archivados(datos['ejercicio_comercial'] for _, datos in validos)
+
+    # Agrupamos por la clave natural del evento (unique_together)
+    por_clave = {}
+    for indice, datos in validos:
+        if datos['ejercicio_comercial'] in cerrados:
+            errores[indice] = {'ejercicio_comercial': [mensaje(datos['ejercicio_comercial'])]}
+            continue
+        emisor_id = emisores.get(datos['nemonico'])
+        if emisor_id is None:
+            errores[indice] = {'nemonico': [f"El instrumento '{datos['nemonico']}' no existe."]}
+            continue
+        clave = (emisor_id, datos['numero_dividendo'], datos['ejercicio_comercial'])
+        if clave in por_clave:
+            errores[indice] = {'non_field_errors': [
+                f"Duplicado del elemento {por_clave[clave][0]} (mismo instrumento, dividendo y ejercicio)."
+            ]}
+            continue
+        por_clave[clave] = (indice, datos)
+
+    resultados = {
+        indice: {'indice': indice, 'resultado': 'error', 'errores': detalle}
+        for indice, detalle in errores.items()
+    }
+    if por_clave:
+        with transaction.atomic():
+            resultados.update(persistir(por_clave, conceptos, user))
+
+    resultados = [resultados[i] for i in sorted(resultados)]
+    return {
+        'total': len(items),
+        'creados': sum(1 for r in resultados if r['resultado'] == 'creado'),
+        'actualizados': sum(1 for r in resultados if r['resultado'] == 'actualizado'),
+        'con_error': sum(1 for r in resultados if r['resultado'] in ('error', 'conflicto')),
+        'resultados': resultados,
+    }
+
+
+def persistir(por_clave, conceptos, user, campos_evento=CAMPOS_EVENTO, campos_calificacion=CAMPOS_CALIFICACION,
+               reemplazar_factores=True, origen='API carga masiva'):
+    """
+    Upserts set-based de eventos, calificaciones y factores. En los registros existentes sólo se
+    sobrescriben 'campos_evento' / 'campos_calificacion' (el resto conserva su valor, también en
+    el historial). Con reemplazar_factores=False los factores no enviados se mantienen.
+    Debe llamarse dentro de una transacción: bloquea las claves (emisor, ejercicio) que escribe.
+
+    Concurrencia optimista (ver core/versiones.py): un elemento con 'version' sólo se guarda
+    si es la vigente de su calificación; si no, su resultado es 'conflicto' con lo que cambió.
+    Los editores no toman el lock de las claves: si uno guarda una fila del lote entre su
+    lectura y el upsert, el lote se deshace y se vuelve a aplicar sobre lo vigente.
+    """
+    # Otra carga con las mismas claves espera a que ésta termine (y viceversa); las demás
+    # siguen en paralelo. Con el lock, 'existentes' es fiable: creado / actualizado no se
+    # confunde y los upserts no chocan. Las filas se escriben en orden de clave.
+    bloquear('calificaciones', {(emisor_id, ejercicio) for emisor_id, _, ejercicio in por_clave})
+    por_clave = dict(sorted(por_clave.items()))
+    for intento in range(1, REINTENTOS + 1):
+        try:
+            with transaction.atomic():
+                return _persistir(por_clave, conceptos, user, campos_evento, campos_calificacion,
+                                  reemplazar_factores, origen)
+        except ConflictoVersion:
+            if intento == REINTENTOS:
+                raise
+
+
+def _verificar_versiones(por_clave, existentes):
+    """Resultados 'conflicto' de los elementos cuya 'version' no es la vigente de su calificación."""
+    enviadas = {clave: datos['version'] for clave, (_, datos) in por_clave.items() if datos.get('version') is not None}
+    if not enviadas:
+        return {}
+    vigentes = {
+        evento_id: (pk, version) for pk, evento_id, version in CalificacionTributaria.objects.filter(
+            evento_id__in=[existentes[clave]['id'] for clave in enviadas if clave in existentes]
+        ).values_list('pk', 'evento_id', 'version')
+    }
+    resultados = {}
+    for clave, enviada in enviadas.items():
+        indice = por_clave[clave][0]
+        pk, version = vigentes.get(existentes[clave]['id'], (None, None)) if clave in existentes else (None, None)
+        if pk is None:
+            resultados[indice] = {'indice': indice, 'resultado': 'conflicto', 'errores': {
+                'version': [f'La calificación no existe (se envió la versión {enviada}).']
+            }}
+        elif version != enviada:
+            detalle = conflicto(ConflictoVersion(CalificacionTributaria(pk=pk), enviada))
+            resultados[indice] = {'indice': indice, 'resultado': 'conflicto', 'id': pk,
+                                  'errores': {'version': [detalle.pop('detail')]}, 'conflicto': detalle}
+    return resultados
+
+
+def _persistir(por_clave, conceptos, user, campos_evento, campos_calificacion, reemplazar_factores, origen):
+    ahora = timezone.now()
+    user_id = getattr(user, 'pk', None)
+    conservar_evento = [c for c in CAMPOS_EVENTO if c not in campos_evento]
+    conservar_calificacion = [c for c in CAMPOS_CALIFICACION if c not in campos_calificacion]
+
+    # --- 1. Eventos (upsert por emisor + dividendo + ejercicio) ---
+    existentes = {
+        (e['emisor_id'], e['numero_dividendo'], e['ejercicio_comercial']): e
+        for e in EventoCorporativo.objects.filter(
+            emisor_id__in={c[0] for c in por_clave},
+            ejercicio_comercial__in={c[2] for c in por_clave},
+        ).values('id', 'emisor_id', 'numero_dividendo', 'ejercicio_comercial', 'creado_por_id', 'fecha_creacion',
+                 'version', *conservar_evento)
+    }
+    conflictos = _verificar_versiones(por_clave, existentes)
+    por_clave = {clave: item for clave, item in por_clave.items() if item[0] not in conflictos}
+    if not por_clave:
+        return conflictos
+
+    eventos = []
+    for clave, (_, datos) in por_clave.items():
+        previo = existentes.get(clave)
+        evento = EventoCorporativo(
+            emisor_id=clave[0],
+            numero_dividendo=clave[1],
+            ejercicio_comercial=clave[2],
+            creado_por_id=previo['creado_por_id'] if previo else user_id,
+            # La que debe quedar tras el upsert (el trigger suma 1 a la vigente)
+            version=previo['version'] + 1 if previo else 1,
+            **{c: previo[c] if previo and c in conservar_evento else datos[c] for c in CAMPOS_EVENTO},
+        )
+        eventos.append(evento)
+    EventoCorporativo.objects.bulk_create(
+        eventos,
+        batch_size=LOTE_BD,
+        update_conflicts=True,
+        unique_fields=['emisor', 'numero_dividendo', 'ejercicio_comercial'],
+        update_fields=list(campos_evento),
+    )
+
+    # --- 2. Calificaciones (upsert 1:1 con el evento) ---
+    calificaciones_previas = {
+        c['evento_id']: c
+        for c in CalificacionTributaria.objects.filter(evento_id__in=[e.pk for e in eventos])
+        .values('evento_id', 'version', *conservar_calificacion)
+    }
+    calificaciones = []
+    for evento, (_, datos) in zip(eventos, por_clave.values()):
+        previa = calificaciones_previas.get(evento.pk)
+        calificaciones.append(CalificacionTributaria(
+            evento_id=evento.pk,
+            modificado_por_id=user_id,
+            version=previa['version'] + 1 if previa else 1,
+            **{c: previa[c] if previa and c in conservar_calificacion else datos[c] for c in CAMPOS_CALIFICACION},
+        ))
+    CalificacionTributaria.objects.bulk_create(
+        calificaciones,
+        batch_size=LOTE_BD,
+        update_conflicts=True,
+        unique_fields=['evento'],
+        update_fields=[*campos_calificacion, 'modificado_por', 'ultima_modificacion'],
+    )
+
+    # Si otro guardó una fila entre la lectura y el upsert, su versión quedó más adelante de lo
+    # esperado: lo leído (y lo conservado) ya no es lo vigente. Las filas quedan bloqueadas hasta el fin.
+    esperadas = {c.pk: (c.version, e.version) for c, e in zip(calificaciones, eventos)}
+    for pk, version, version_evento in CalificacionTributaria.objects.filter(pk__in=esperadas).values_list(
+        'pk', 'version', 'evento__version'
+    ):
+        if (version, version_evento) != esperadas[pk]:
+            raise ConflictoVersion(CalificacionTributaria(pk=pk), esperadas[pk][0] - 1)
+
+    # --- 3. Factores: el vector enviado reemplaza al vigente (o sólo se actualizan los enviados) ---
+    cal_ids = [c.pk for c in calificaciones]
+    actuales = {
+        (cal_id, concepto_id): det_id
+        for det_id, cal_id, concepto_id in DetalleFactor.objects.filter(
+            calificacion_id__in=cal_ids
+        ).values_list('id', 'calificacion_id', 'concepto_id')
+    }
+    detalles = []
+    vigentes = set()
+    for calificacion, (_, datos) in zip(calificaciones, por_clave.values()):
+        for columna, valor in datos['factores'].items():
+            concepto_id = conceptos[columna]
+            vigentes.add((calificacion.pk, concepto_id))
+            detalles.append(DetalleFactor(calificacion_id=calificacion.pk, concepto_id=concepto_id, valor=valor))
+
+    sobrantes = [det_id for clave, det_id in actuales.items() if clave not in vigentes] if reemplazar_factores else []
+    if sobrantes:
+        # _raw_delete: un solo DELETE, sin cargar objetos ni disparar auditoría por fila
+        sobrantes_qs = DetalleFactor.objects.filter(id__in=sobrantes)
+        sobrantes_qs._raw_delete(sobrantes_qs.db)
+    DetalleFactor.objects.bulk_create(
+        detalles,
+        batch_size=LOTE_BD,
+        update_conflicts=True,
+        unique_fields=['calificacion', 'concepto'],
+        update_fields=['valor'],
+    )
+
+    # --- 4. Historial (simple_history) y auditoría resumida del lote ---
+    for evento in eventos:
+        previo = existentes.get((evento.emisor_id, evento.numero_dividendo, evento.ejercicio_comercial))
+        if previo:
+            evento.fecha_creacion = previo['fecha_creacion']
+    _historial(EventoCorporativo, eventos, lambda e: (e.emisor_id, e.numero_dividendo, e.ejercicio_comercial) in existentes, user, ahora, origen)
+    _historial(CalificacionTributaria, calificaciones, lambda c: c.evento_id in calificaciones_previas, user, ahora, origen)
+
+    resultados = conflictos
+    for calificacion, (indice, _) in zip(calificaciones, por_clave.values()):
+        resultado = 'actualizado' if calificacion.evento_id in calificaciones_previas else 'creado'
+        resultados[indice] = {'indice': indice, 'resultado': resultado, 'id': calificacion.pk}
+
+    registrar_cambios(cal_ids)
+    resumenes.marcar((emisor_id, ejercicio) for emisor_id, _, ejercicio in por_clave)
+    registrar_lote(CalificacionTributaria, {
+        'origen': origen,
+        'creados': sum(1 for r in resultados.values() if r['resultado'] == 'creado'),
+        'actualizados': sum(1 for r in resultados.values() if r['resultado'] == 'actualizado'),
+        'factores_eliminados': len(sobrantes),
+        'ids': cal_ids,
+    }, user=user)
+    return resultados
+
+
+def _historial(modelo, objetos, es_actualizacion, user, fecha, origen):
+    nuevos = [o for o in objetos if not es_actualizacion(o)]
+    actualizados = [o for o in objetos if es_actualizacion(o)]
+    for grupo, update in ((nuevos, False), (actualizados, True)):
+        if grupo:
+            modelo.history.bulk_history_create(
+                grupo,
+                batch_size=LOTE_BD,
+                update=update,
+                default_user=user,
+                default_change_reason=origen,
+                default_date=fecha,
+            )
@@ -0,0 +1,67 @@
+# core/cambios.py
+# Change feed de calificaciones: quién escribe los cambios y cómo se leen.
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from . import avisos, historial
+from .models import CambioCalificacion, CalificacionTributaria
+
+# Transacciones con id menor a este valor ya terminaron (commit o rollback)
+_XMIN = RawSQL('pg_snapshot_xmin(pg_current_snapshot())::text::bigint', [])
+
+
+def registrar_cambios(calificacion_ids, accion='UPSERT'):
+    """Anota en el change feed que estas calificaciones cambiaron (una fila por id)."""
+    filas = [CambioCalificacion(calificacion_id=i, accion=accion) for i in dict.fromkeys(calificacion_ids)]
+    if filas:
+        CambioCalificacion.objects.bulk_create(filas, batch_size=1000)
+        # Outbox: el aviso a los sistemas externos se confirma (o revierte) junto con el cambio
+        avisos.registrar([f.calificacion_id for f in filas])
+        # Las diferencias del historial se calculan al confirmar, con los factores ya escritos
+        historial.marcar(f.calificacion_id for f in filas)
+
+
+def parsear_token(token):
+    """'<transaccion>-<id>' -> (transaccion, id). Vacío o '0' = desde el principio."""
+    if not token or token == '0':
+        return (-1, 0)
+    transaccion, _, cambio_id = token.partition('-')
+    return (int(transaccion), int(cambio_id))
+
+
+def leer_cambios(token, limite):
+    """
+    Devuelve (cambios, siguiente_token, hay_mas).
+    Recorre el feed en orden (transaccion, id) y sólo considera transacciones
+    terminadas, por lo que el token nunca deja atrás un cambio aún no confirmado.
+    Cada calificación aparece una sola vez en la página, con su último estado.
+    """
+    transaccion, cambio_id = parsear_token(token)
+    filas = list(
+        CambioCalificacion.objects
+        .filter(transaccion__lt=_XMIN)
+        .filter(Q(transaccion__gt=transaccion) | Q(transaccion=transaccion, id__gt=cambio_id))
+        .order_by('transaccion', 'id')
+        .values_list('id', 'transaccion', 'calificacion_id', 'accion')[:limite + 1]
+    )
+    hay_mas = len(filas) > limite
+    filas = filas[:limite]
+    if not filas:
+        return [], token or '0', False
+
+    # Nos quedamos con el último cambio de cada calificación dentro de la página
+    ultimos = {}
+    for fila in filas:
+        ultimos.pop(fila[2], None)
+        ultimos[fila[2]] = fila
+    ultima = filas[-1]
+    return list(ultimos.values()), f'{ultima[1]}-{ultima[0]}', hay_mas
+
+
+def calificaciones_vigentes(ids):
+    """Queryset listo para la lectura compilada de las calificaciones indicadas."""
+    return (
+        CalificacionTributaria.objects
+        .select_related('evento__emisor')
+        .prefetch_related('detalles')
+        .filter(id__in=ids)
+    )
@@ -0,0 +1,170 @@
+# core/carga_excel.py
+# Carga masiva desde un archivo .xlsx: lectura, validación de todo el archivo y
+# guardado set-based (ver bulk.persistir). Es el único módulo de la aplicación web que
+# usa pandas y openpyxl: views.py lo importa recién al recibir una carga, así los
+# workers que sólo atienden la API o el login no cargan pandas ni su memoria.
+import pandas as pd
+from django.db import transaction
+from django.forms.models import model_to_dict
+from .archivo import archivados, mensaje
+from .auditoria import registrar_objetos
+from .bloqueos import bloquear
+from .bulk import persistir
+from .models import ConceptoFactor, Emisor, EventoCorporativo
+from .validacion import a_decimal, validar_matriz
+
+COLUMNAS_OBLIGATORIAS = ['Instrumento', 'RUT', 'Numero de dividendo', 'Ejercicio', 'Fecha']
+
+
+class ColumnasFaltantes(Exception):
+    def __init__(self, columnas):
+        super().__init__(f"Faltan columnas obligatorias: {', '.join(columnas)}")
+        self.columnas = columnas
+
+
+def procesar_archivo(archivo, user):
+    """
+    Valida y guarda el archivo. Devuelve {'procesados', 'creados', 'errores'}; si hay
+    errores no se guarda nada. ColumnasFaltantes si el archivo no tiene el formato esperado.
+    """
+    df = pd.read_excel(archivo, engine='openpyxl')
+    df.columns = df.columns.astype(str).str.strip()
+
+    # Validación de columnas
+    missing = [col for col in COLUMNAS_OBLIGATORIAS if col not in df.columns]
+    if missing:
+        raise ColumnasFaltantes(missing)
+
+    registros_creados = 0
+    registros_procesados = 0
+    errores_acumulados = [] # <--- LISTA PARA GUARDAR TODOS LOS ERRORES
+
+    # --- A. Validaciones de Negocio (todo el archivo de una vez) ---
+    # Solo las columnas 'Factor N' que existen en el catálogo
+    conceptos = dict(ConceptoFactor.objects.values_list('columna_dj', 'id'))
+    columnas_factor = {}
+    for col in df.columns:
+        partes = col.split(' ')
+        if len(partes) == 2 and partes[0] == 'Factor' and partes[1].isdigit() and int(partes[1]) in conceptos:
+            columnas_factor[int(partes[1])] = col
+    columnas = sorted(columnas_factor)
+    validacion = validar_matriz(df[[columnas_factor[c] for c in columnas]].to_numpy(), columnas)
+    errores_factores = validacion.errores_por_fila()
+
+    montos = pd.to_numeric(df['Monto Unitario'], errors='coerce').fillna(0) if 'Monto Unitario' in df.columns else pd.Series(0, index=df.index)
+    montos_negativos = set(df.index[montos < 0])
+
+    # --- B. Preparación por fila (sin consultas): clave natural del evento y datos a guardar ---
+    filas = {}  # (instrumento, dividendo, ejercicio) -> (fila_excel, rut, tipo_sociedad, datos)
+    for posicion, (index, row) in enumerate(df.iterrows()):
+        fila_excel = index + 2
+        errores_fila = [e['mensaje'] for e in errores_factores.get(posicion, [])]
+
+        if index in montos_negativos:
+            errores_fila.append("Monto negativo")
+
+        # 1. VALIDACIÓN DE RUT OBLIGATORIO
+        # (si el RUT está vacío o es 'nan' (vacío de pandas), es un error)
+        rut_excel = str(row.get('RUT', '')).strip()
+        if not rut_excel or rut_excel.lower() == 'nan':
+            errores_fila.append("El campo RUT es obligatorio y no puede estar vacío.")
+
+        # Si la fila tiene errores, los guardamos y pasamos a la siguiente
+        if errores_fila:
+            errores_acumulados.append(f"Fila {fila_excel}: {', '.join(errores_fila)}")
+            continue
+
+        try:
+            mercado = str(row.get('Mercado', 'ACN')).strip().upper()
+            clave = (str(row['Instrumento']).strip(), int(row['Numero de dividendo']), int(row['Ejercicio']))
+            datos = {
+                'mercado': mercado if mercado in dict(EventoCorporativo.MERCADO_CHOICES) else 'ACN',
+                'fecha_pago': pd.to_datetime(row['Fecha']).date(),
+                'fecha_registro': None,
+                'secuencia': 0,
+                'monto_total_distribuido': 0,
+                'monto_unitario_pesos': a_decimal(montos[index]) or 0,
+                'estado': 'BORRADOR',
+                # Valores exactos entregados por el motor de validación
+                'factores': validacion.decimales(posicion),
+            }
+        except (TypeError, ValueError) as e:
+            errores_acumulados.append(f"Fila {fila_excel}: Error técnico ({str(e)})")
+            continue
+
+        registros_procesados += 1
+        if clave in filas:
+            # Evento repetido en el archivo: gana la última fila y los factores se acumulan
+            datos['factores'] = {**filas[clave][3]['factores'], **datos['factores']}
+        tipo_soc = 'C' if 'CERRADA' in str(row.get('Tipo sociedad', 'A')).upper() else 'A'
+        filas[clave] = (fila_excel, rut_excel, tipo_soc, datos)
+
+    # Los ejercicios archivados son de sólo lectura
+    cerrados = archivados(clave[2] for clave in filas) if filas and not errores_acumulados else set()
+    for (_, _, ejercicio), (fila_excel, _, _, _) in filas.items():
+        if ejercicio in cerrados:
+            errores_acumulados.append(f"Fila {fila_excel}: {mensaje(ejercicio)}")
+
+    # Usamos atomic para que si hay errores, no se guarde NADA del archivo. Las cargas
+    # concurrentes sólo se esperan si comparten claves (ver core/bloqueos.py)
+    with transaction.atomic():
+        if filas and not errores_acumulados:
+            # --- C. Guardado set-based: un número fijo de consultas sin importar las filas ---
+            emisores = _emisores_carga(filas, user, errores_acumulados)
+            if not errores_acumulados:
+                por_clave = {
+                    (emisores[instrumento], dividendo, ejercicio): (fila_excel, datos)
+                    for (instrumento, dividendo, ejercicio), (fila_excel, _, _, datos) in filas.items()
+                }
+                # Como la carga fila a fila: sólo fecha de pago, mercado, monto unitario y los factores informados
+                resultados = persistir(
+                    por_clave, conceptos, user,
+                    campos_evento=('mercado', 'fecha_pago'),
+                    campos_calificacion=('monto_unitario_pesos',),
+                    reemplazar_factores=False,
+                    origen='Carga masiva Excel',
+                )
+                registros_creados = sum(1 for r in resultados.values() if r['resultado'] == 'creado')
+
+        if errores_acumulados:
+            # Si hubo errores, cancelamos TODO (Rollback)
+            transaction.set_rollback(True)
+
+    return {'procesados': registros_procesados, 'creados': registros_creados, 'errores': errores_acumulados}
+
+
+def _emisores_carga(filas, user, errores):
+    """
+    {instrumento: emisor_id} de la carga: los existentes en una consulta y los nuevos
+    (con el RUT del archivo) en un solo INSERT. Un RUT ya usado por otro instrumento es error de la fila.
+    """
+    emisores = dict(Emisor.objects.filter(nemonico__in={clave[0] for clave in filas}).values_list('nemonico', 'id'))
+    candidatos = {}
+    for (instrumento, _, _), (fila_excel, rut, tipo_soc, _) in filas.items():
+        if instrumento not in emisores and instrumento not in candidatos:
+            candidatos[instrumento] = (fila_excel, rut, tipo_soc)
+    if not candidatos:
+        return emisores
+
+    # Dos cargas con el mismo instrumento nuevo: la segunda espera y lo encuentra creado
+    bloquear('emisores', [*(('nemonico', i) for i in candidatos), *(('rut', c[1]) for c in candidatos.values())])
+    emisores.update(Emisor.objects.filter(nemonico__in=candidatos).values_list('nemonico', 'id'))
+    nuevos = {
+        instrumento: (fila_excel, Emisor(nemonico=instrumento, rut=rut, razon_social=instrumento, tipo_sociedad=tipo_soc))
+        for instrumento, (fila_excel, rut, tipo_soc) in candidatos.items() if instrumento not in emisores
+    }
+    ruts_usados = set(Emisor.objects.filter(rut__in=[e.rut for _, e in nuevos.values()]).values_list('rut', flat=True))
+    for fila_excel, emisor in nuevos.values():
+        if emisor.rut in ruts_usados:
+            errores.append(f"Fila {fila_excel}: El RUT {emisor.rut} ya está registrado para otro instrumento.")
+        ruts_usados.add(emisor.rut)
+    if errores or not nuevos:
+        return emisores
+
+    creados = Emisor.objects.bulk_create([e for _, e in nuevos.values()])
+    # bulk_create no dispara las señales: misma auditoría que una creación individual
+    registrar_objetos([
+        ('CREATE', e, {k: {'old': None, 'new': str(v)} for k, v in model_to_dict(e).items()}) for e in creados
+    ], user=user)
+    emisores.update((e.nemonico, e.pk) for e in creados)
+    return emisores
@@ -2,6 +2,18 @@
 
 from django.core.exceptions import PermissionDenied
 from functools import wraps
+from . import metricas
+
+
+def grupos_de(user):
+    """Nombres de los grupos del usuario, consultados una sola vez por request (se guardan en el objeto)."""
+    grupos = getattr(user, '_grupos_cache', None)
+    if grupos is None:
+        metricas.CACHE_CONSULTAS.inc(cache='grupos', resultado='miss')
+        grupos = user._grupos_cache = frozenset(user.groups.values_list('name', flat=True))
+    else:
+        metricas.CACHE_CONSULTAS.inc(cache='grupos', resultado='hit')
+    return grupos
 
 def group_required(group_names):
     """
@@ -16,10 +28,7 @@ def group_required(group_names):
                     return view_func(request, *args, **kwargs)
                 
                 # Comprobamos si el usuario pertenece a alguno de los grupos requeridos
-                user_groups = set(request.user.groups.values_list('name', flat=True))
-                required_groups = set(group_names)
-                
-                if user_groups.intersection(required_groups):
+                if grupos_de(request.user).intersection(group_names):
                     return view_func(request, *args, **kwargs)
             
             # Si no cumple ninguna condición, se niega el acceso.
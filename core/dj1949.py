@@ -0,0 +1,297 @@
+# core/dj1949.py
+# Generación del archivo anual de la DJ 1949 para un ejercicio comercial.
+# Un registro por evento (calificación) con los factores de las columnas 8 a 37
+# y un registro final con los totales. Se lee con cursor del lado del servidor
+# (.iterator) y se escribe directo a disco; si el ejercicio es grande, las
+# secciones por emisor se arman en paralelo (un proceso por grupo de emisores)
+# y luego se concatenan en orden.
+import csv
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.db import connections
+from django.db.models import BigIntegerField, Count, F, OuterRef, Subquery
+from django.db.models.functions import Cast
+from .models import CalificacionTributaria, DetalleFactor
+
+COLUMNAS = tuple(range(8, 38))
+FORMATOS = ('txt', 'csv')
+CHUNK_SIZE = 2000
+# Desde cuántas calificaciones conviene repartir el trabajo entre procesos
+UMBRAL_PARALELO = 20000
+
+# Escalas (decimales implícitos en el formato de ancho fijo)
+ESCALA_FACTOR = 8
+ESCALA_UNITARIO = 6
+ESCALA_TOTAL = 4
+
+# --- Formato de ancho fijo (ISO-8859-1, un registro por línea) ---
+# 0 Encabezado: tipo(1) ejercicio(4) fecha_generacion(8)
+# 1 Detalle:    tipo(1) rut(12) nemonico(20) mercado(3) fecha_pago(8) n_dividendo(6)
+#               monto_unitario(15, 6 dec.) monto_total(20, 4 dec.) factores 8..37 (10 c/u, 8 dec.)
+# 9 Totales:    tipo(1) registros(10) monto_total(22, 4 dec.) suma de cada factor 8..37 (16 c/u, 8 dec.)
+ENCODING_TXT = 'latin-1'
+
+
+def _texto(valor, ancho):
+    return str(valor or '')[:ancho].ljust(ancho)
+
+
+def _numero(valor, ancho):
+    return f'{valor:0{ancho}d}'
+
+
+def _decimal_str(entero, escala):
+    """Entero escalado -> texto decimal exacto (123456, 4 -> '12.3456')."""
+    signo = '-' if entero < 0 else ''
+    entero = abs(entero)
+    return f'{signo}{entero // 10 ** escala}.{entero % 10 ** escala:0{escala}d}'
+
+
+class Totales:
+    """Acumulado exacto (enteros escalados) de una sección o del archivo completo."""
+
+    def __init__(self):
+        self.registros = 0
+        self.monto_total = 0
+        self.factores = dict.fromkeys(COLUMNAS, 0)
+
+    def sumar(self, fila):
+        self.registros += 1
+        self.monto_total += fila['monto_total']
+        for columna, valor in fila['factores'].items():
+            self.factores[columna] += valor
+
+    def combinar(self, otro):
+        self.registros += otro.registros
+        self.monto_total += otro.monto_total
+        for columna, valor in otro.factores.items():
+            self.factores[columna] += valor
+        return self
+
+
+def _queryset(ejercicio, estados):
+    queryset = CalificacionTributaria.objects.filter(evento__ejercicio_comercial=ejercicio)
+    if estados:
+        queryset = queryset.filter(estado__in=estados)
+    return queryset
+
+
+def emisores_del_ejercicio(ejercicio, estados=None):
+    """[(emisor_id, cantidad)] en el orden del archivo (RUT del emisor)."""
+    return list(
+        _queryset(ejercicio, estados)
+        .values('evento__emisor_id', 'evento__emisor__rut')
+        .annotate(n=Count('id'))
+        .order_by('evento__emisor__rut', 'evento__emisor_id')
+        .values_list('evento__emisor_id', 'n')
+    )
+
+
+def filas(ejercicio, emisor_ids, estados=None):
+    """
+    Itera los registros de detalle de los emisores indicados.
+    Montos y factores llegan desde la BD como enteros escalados: totales exactos sin Decimal por celda.
+    """
+    factores = DetalleFactor.objects.filter(
+        calificacion=OuterRef('pk'), concepto__columna_dj__in=COLUMNAS,
+    ).order_by().values('calificacion')
+    escalado = lambda expresion, escala: Cast(expresion * 10 ** escala, BigIntegerField())
+    registros = (
+        _queryset(ejercicio, estados)
+        .filter(evento__emisor_id__in=emisor_ids)
+        .annotate(
+            unitario=escalado(F('monto_unitario_pesos'), ESCALA_UNITARIO),
+            total=escalado(F('monto_total_distribuido'), ESCALA_TOTAL),
+            columnas=Subquery(factores.annotate(
+                a=ArrayAgg('concepto__columna_dj', ordering='concepto__columna_dj')
+            ).values('a')),
+            valores=Subquery(factores.annotate(
+                a=ArrayAgg(escalado(F('valor'), ESCALA_FACTOR), ordering='concepto__columna_dj')
+            ).values('a')),
+        )
+        .order_by('evento__emisor__rut', 'evento__emisor_id', 'evento__fecha_pago', 'evento__numero_dividendo', 'id')
+        .values_list(
+            'evento__emisor__rut', 'evento__emisor__nemonico', 'evento__mercado', 'evento__fecha_pago',
+            'evento__numero_dividendo', 'unitario', 'total', 'columnas', 'valores',
+        )
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+    for rut, nemonico, mercado, fecha_pago, dividendo, unitario, total, columnas, valores in registros:
+        yield {
+            'rut': rut.replace('.', ''),
+            'nemonico': nemonico,
+            'mercado': mercado,
+            'fecha_pago': fecha_pago,
+            'numero_dividendo': dividendo,
+            'monto_unitario': unitario,
+            'monto_total': total,
+            'factores': dict(zip(columnas or (), valores or ())),
+        }
+
+
+# --- Escritores por formato ---
+
+class _EscritorTxt:
+    encoding = ENCODING_TXT
+
+    def __init__(self, archivo):
+        self.archivo = archivo
+
+    def encabezado(self, ejercicio):
+        self.archivo.write(f"0{_numero(ejercicio, 4)}{date.today():%Y%m%d}\n")
+
+    def detalle(self, fila):
+        factores = fila['factores']
+        self.archivo.write(''.join((
+            '1',
+            _texto(fila['rut'], 12),
+            _texto(fila['nemonico'], 20),
+            _texto(fila['mercado'], 3),
+            f"{fila['fecha_pago']:%Y%m%d}",
+            _numero(fila['numero_dividendo'], 6),
+            _numero(fila['monto_unitario'], 15),
+            _numero(fila['monto_total'], 20),
+            ''.join(_numero(factores.get(c, 0), 10) for c in COLUMNAS),
+            '\n',
+        )))
+
+    def totales(self, totales):
+        self.archivo.write(''.join((
+            '9',
+            _numero(totales.registros, 10),
+            _numero(totales.monto_total, 22),
+            ''.join(_numero(totales.factores[c], 16) for c in COLUMNAS),
+            '\n',
+        )))
+
+
+class _EscritorCsv:
+    encoding = 'utf-8'
+    CABECERA = ['tipo', 'rut', 'nemonico', 'mercado', 'fecha_pago', 'numero_dividendo',
+                'monto_unitario', 'monto_total'] + [f'factor_{c}' for c in COLUMNAS]
+
+    def __init__(self, archivo):
+        self.writer = csv.writer(archivo, lineterminator='\n')
+
+    def encabezado(self, ejercicio):
+        self.writer.writerow(self.CABECERA)
+
+    def detalle(self, fila):
+        factores = fila['factores']
+        self.writer.writerow(
+            ['1', fila['rut'], fila['nemonico'], fila['mercado'], fila['fecha_pago'].isoformat(),
+             fila['numero_dividendo'], _decimal_str(fila['monto_unitario'], ESCALA_UNITARIO),
+             _decimal_str(fila['monto_total'], ESCALA_TOTAL)]
+            + [_decimal_str(factores[c], ESCALA_FACTOR) if c in factores else '' for c in COLUMNAS]
+        )
+
+    def totales(self, totales):
+        self.writer.writerow(
+            ['9', '', '', '', '', totales.registros, '', _decimal_str(totales.monto_total, ESCALA_TOTAL)]
+            + [_decimal_str(totales.factores[c], ESCALA_FACTOR) for c in COLUMNAS]
+        )
+
+
+ESCRITORES = {'txt': _EscritorTxt, 'csv': _EscritorCsv}
+
+
+def _abrir(ruta, formato, modo='w'):
+    return open(ruta, modo, encoding=ESCRITORES[formato].encoding, errors='replace', newline='')
+
+
+def escribir_seccion(archivo, formato, ejercicio, emisor_ids, estados=None):
+    """Escribe los detalles de un grupo de emisores en 'archivo' y devuelve sus totales."""
+    escritor = ESCRITORES[formato](archivo)
+    totales = Totales()
+    for fila in filas(ejercicio, emisor_ids, estados):
+        escritor.detalle(fila)
+        totales.sumar(fila)
+    return totales
+
+
+def _seccion_en_proceso(args):
+    """Trabajo de un proceso hijo: escribe su sección en un archivo temporal."""
+    ruta, formato, ejercicio, emisor_ids, estados = args
+    try:
+        with _abrir(ruta, formato) as archivo:
+            return escribir_seccion(archivo, formato, ejercicio, emisor_ids, estados)
+    finally:
+        connections.close_all()
+
+
+def _repartir(emisores, partes):
+    """Grupos contiguos de emisores (se conserva el orden del archivo) con carga parecida."""
+    total = sum(n for _, n in emisores)
+    objetivo = total / partes
+    grupos, actual, acumulado = [], [], 0
+    for emisor_id, n in emisores:
+        actual.append(emisor_id)
+        acumulado += n
+        if acumulado >= objetivo * (len(grupos) + 1) and len(grupos) < partes - 1:
+            grupos.append(actual)
+            actual = []
+    if actual:
+        grupos.append(actual)
+    return grupos
+
+
+def generar(ejercicio, ruta, formato='txt', estados=('VALIDADO',), procesos=1):
+    """
+    Genera la DJ 1949 del ejercicio en 'ruta' (se escribe a un temporal y se renombra al final).
+    Devuelve los Totales del archivo.
+    """
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato no soportado: {formato}. Use {' o '.join(FORMATOS)}.")
+    emisores = emisores_del_ejercicio(ejercicio, estados)
+    total_registros = sum(n for _, n in emisores)
+    paralelo = procesos > 1 and total_registros >= UMBRAL_PARALELO and len(emisores) > 1
+
+    directorio = os.path.dirname(os.path.abspath(ruta))
+    temporal = tempfile.NamedTemporaryFile(dir=directorio, prefix='.dj1949-', delete=False)
+    temporal.close()
+    try:
+        with _abrir(temporal.name, formato) as archivo:
+            escritor = ESCRITORES[formato](archivo)
+            escritor.encabezado(ejercicio)
+            if paralelo:
+                totales = _generar_en_paralelo(archivo, formato, ejercicio, emisores, estados, procesos, directorio)
+            else:
+                totales = escribir_seccion(archivo, formato, ejercicio, [e for e, _ in emisores], estados)
+            escritor.totales(totales)
+        os.replace(temporal.name, ruta)
+    except BaseException:
+        os.unlink(temporal.name)
+        raise
+    return totales
+
+
+def _generar_en_paralelo(archivo, formato, ejercicio, emisores, estados, procesos, directorio):
+    grupos = _repartir(emisores, procesos)
+    rutas = [os.path.join(directorio, f'.dj1949-{os.getpid()}-{i}.part') for i in range(len(grupos))]
+    # Los hijos (fork) abren sus propias conexiones: no heredamos la del padre
+    connections.close_all()
+    contexto = multiprocessing.get_context('fork')
+    try:
+        with ProcessPoolExecutor(max_workers=len(grupos), mp_context=contexto) as pool:
+            parciales = list(pool.map(
+                _seccion_en_proceso,
+                [(r, formato, ejercicio, g, estados) for r, g in zip(rutas, grupos)],
+            ))
+        # Concatenamos las secciones en el orden del archivo
+        archivo.flush()
+        for ruta in rutas:
+            with _abrir(ruta, formato, 'r') as seccion:
+                shutil.copyfileobj(seccion, archivo)
+    finally:
+        for ruta in rutas:
+            if os.path.exists(ruta):
+                os.unlink(ruta)
+    totales = Totales()
+    for parcial in parciales:
+        totales.combinar(parcial)
+    return totales
@@ -0,0 +1,100 @@
+# core/exporters.py
+# Exportación masiva de calificaciones (NDJSON / CSV) para sistemas externos.
+# Lee con un cursor del lado del servidor (.iterator) y arma cada registro
+# directamente desde las filas de values(), sin pasar por ModelSerializer,
+# por lo que la memoria usada no depende del tamaño del resultado.
+import csv
+import json
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.db.models import OuterRef, Subquery, TextField
+from django.db.models.functions import Cast
+from .models import ConceptoFactor, DetalleFactor
+
+# Filas que se piden al cursor del servidor en cada viaje a la BD
+CHUNK_SIZE = 2000
+
+CAMPOS = (
+    'id',
+    'evento_id',
+    'evento__emisor__nemonico',
+    'evento__emisor__rut',
+    'evento__mercado',
+    'evento__fecha_pago',
+    'evento__ejercicio_comercial',
+    'evento__numero_dividendo',
+    'estado',
+    'monto_total_distribuido',
+    'monto_unitario_pesos',
+    'ultima_modificacion',
+)
+
+CABECERA_CSV = [
+    'id', 'evento_id', 'nemonico', 'rut', 'mercado', 'fecha_pago', 'ejercicio',
+    'numero_dividendo', 'estado', 'monto_total_distribuido', 'monto_unitario_pesos',
+    'ultima_modificacion',
+]
+
+
+def filas_exportacion(queryset):
+    """
+    Itera las calificaciones del queryset como diccionarios planos.
+    Los factores llegan en la misma fila (subconsultas ARRAY_AGG correlacionadas):
+    sin GROUP BY sobre todo el resultado, Postgres entrega las filas a medida que las lee.
+    """
+    factores = DetalleFactor.objects.filter(calificacion=OuterRef('pk')).order_by().values('calificacion')
+    filas = (
+        queryset
+        .order_by('id')
+        .values(*CAMPOS)
+        .annotate(
+            columnas=Subquery(factores.annotate(
+                a=ArrayAgg('concepto__columna_dj', ordering='concepto__columna_dj')
+            ).values('a')),
+            # Los valores viajan como texto: evita construir un Decimal por factor en el driver
+            valores=Subquery(factores.annotate(
+                a=ArrayAgg(Cast('valor', TextField()), ordering='concepto__columna_dj')
+            ).values('a')),
+        )
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+    for f in filas:
+        yield {
+            'id': f['id'],
+            'evento_id': f['evento_id'],
+            'nemonico': f['evento__emisor__nemonico'],
+            'rut': f['evento__emisor__rut'],
+            'mercado': f['evento__mercado'],
+            'fecha_pago': f['evento__fecha_pago'].isoformat(),
+            'ejercicio': f['evento__ejercicio_comercial'],
+            'numero_dividendo': f['evento__numero_dividendo'],
+            'estado': f['estado'],
+            'monto_total_distribuido': str(f['monto_total_distribuido']),
+            'monto_unitario_pesos': str(f['monto_unitario_pesos']),
+            'ultima_modificacion': f['ultima_modificacion'].isoformat(),
+            'factores': dict(zip(map(str, f['columnas'] or ()), f['valores'] or ())),
+        }
+
+
+def exportar_ndjson(queryset):
+    """Genera una línea JSON por calificación."""
+    dumps = json.dumps
+    for fila in filas_exportacion(queryset):
+        yield dumps(fila, ensure_ascii=False) + '\n'
+
+
+class _Eco:
+    """Pseudo-archivo para csv.writer: devuelve la línea en vez de escribirla."""
+    def write(self, valor):
+        return valor
+
+
+def exportar_csv(queryset):
+    """Genera el CSV línea a línea, con una columna por cada factor del catálogo (8-37)."""
+    columnas = list(ConceptoFactor.objects.values_list('columna_dj', flat=True))
+    writer = csv.writer(_Eco())
+    yield writer.writerow(CABECERA_CSV + [f'Factor {c}' for c in columnas])
+    for fila in filas_exportacion(queryset):
+        factores = fila['factores']
+        yield writer.writerow(
+            [fila[c] for c in CABECERA_CSV] + [factores.get(str(c), '') for c in columnas]
+        )
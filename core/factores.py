@@ -0,0 +1,58 @@
+# core/factores.py
+# Guardado de los factores de UNA calificación por diferencias: se carga el
+# vector vigente una vez, se compara con el enviado y sólo se escriben los
+# factores que cambiaron (a lo más un INSERT, un UPDATE y un DELETE).
+from decimal import Decimal
+from django.forms.models import model_to_dict
+from .auditoria import registrar_objetos, usuario_actual
+from .cambios import registrar_cambios
+from . import resumenes
+from .models import DetalleFactor
+
+# Misma precisión que DetalleFactor.valor: '0.5' y '0.50000000' no son un cambio
+_PRECISION = Decimal('1E-8')
+
+
+def guardar_factores(calificacion, factores, user=None):
+    """
+    Deja la calificación exactamente con los factores {concepto_id: valor}.
+    Los conceptos que no vienen se eliminan. Devuelve (creados, actualizados, eliminados).
+    """
+    user = user or usuario_actual()
+    nuevos = {concepto_id: Decimal(valor).quantize(_PRECISION) for concepto_id, valor in factores.items()}
+    actuales = {d.concepto_id: d for d in DetalleFactor.objects.filter(calificacion=calificacion)}
+
+    creados = [
+        DetalleFactor(calificacion=calificacion, concepto_id=concepto_id, valor=valor)
+        for concepto_id, valor in nuevos.items() if concepto_id not in actuales
+    ]
+    actualizados, cambios = [], []
+    for concepto_id, valor in nuevos.items():
+        detalle = actuales.get(concepto_id)
+        if detalle is not None and detalle.valor != valor:
+            cambios.append((detalle, {'valor': {'old': str(detalle.valor), 'new': str(valor)}}))
+            detalle.valor = valor
+            actualizados.append(detalle)
+    eliminados = [d for concepto_id, d in actuales.items() if concepto_id not in nuevos]
+
+    if creados:
+        DetalleFactor.objects.bulk_create(creados)
+    if actualizados:
+        DetalleFactor.objects.bulk_update(actualizados, ['valor'])
+    if eliminados:
+        # _raw_delete: un solo DELETE, sin cargar objetos ni disparar auditoría por fila
+        eliminados_qs = DetalleFactor.objects.filter(pk__in=[d.pk for d in eliminados])
+        eliminados_qs._raw_delete(eliminados_qs.db)
+
+    # Auditoría sólo de los factores que cambiaron (mismo formato que core/signals.py)
+    registrar_objetos(
+        [('CREATE', d, {k: {'old': None, 'new': str(v)} for k, v in model_to_dict(d).items()}) for d in creados]
+        + [('UPDATE', d, detalle) for d, detalle in cambios]
+        + [('DELETE', d, model_to_dict(d)) for d in eliminados],
+        user=user,
+    )
+
+    if creados or actualizados or eliminados:
+        registrar_cambios([calificacion.pk])
+        resumenes.recordar_calificacion(calificacion)
+    return creados, actualizados, eliminados
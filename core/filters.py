@@ -1,7 +1,8 @@
 # /app/core/filters.py
 import django_filters
 from django import forms
-from .models import AuditLog
+from django.db.models import Exists, OuterRef
+from .models import AnomaliaCalificacion, AuditLog, CalificacionTributaria, EventoCorporativo
 
 class AuditLogFilter(django_filters.FilterSet):
     # Definimos las opciones manualmente aquí para evitar el error de atributo
@@ -9,6 +10,7 @@ class AuditLogFilter(django_filters.FilterSet):
         ('CREATE', 'Creación'),
         ('UPDATE', 'Edición'),
         ('DELETE', 'Eliminación'),
+        ('BULK', 'Operación Masiva'),
     ]
 
     username = django_filters.CharFilter(
@@ -34,4 +36,31 @@ class AuditLogFilter(django_filters.FilterSet):
 
     class Meta:
         model = AuditLog
-        fields = ['username', 'action', 'start_date', 'end_date']
\ No newline at end of file
+        fields = ['username', 'action', 'start_date', 'end_date']
+
+
+class CalificacionFilter(django_filters.FilterSet):
+    """Filtros de la API de calificaciones (respaldados por los índices compuestos de EventoCorporativo)."""
+    ejercicio = django_filters.NumberFilter(field_name='evento__ejercicio_comercial', label='Ejercicio comercial')
+    # Alias histórico de 'ejercicio'
+    year = django_filters.NumberFilter(field_name='evento__ejercicio_comercial', label='Ejercicio comercial')
+    mercado = django_filters.ChoiceFilter(field_name='evento__mercado', choices=EventoCorporativo.MERCADO_CHOICES)
+    estado = django_filters.ChoiceFilter(choices=CalificacionTributaria.ESTADO_CHOICES)
+    emisor = django_filters.NumberFilter(field_name='evento__emisor', label='Id del emisor')
+    nemonico = django_filters.CharFilter(field_name='evento__emisor__nemonico', lookup_expr='icontains')
+    fecha_pago_desde = django_filters.DateFilter(field_name='evento__fecha_pago', lookup_expr='gte')
+    fecha_pago_hasta = django_filters.DateFilter(field_name='evento__fecha_pago', lookup_expr='lte')
+    anomalia = django_filters.ChoiceFilter(
+        choices=[('con', 'Con anomalías')] + AnomaliaCalificacion.CODIGO_CHOICES, method='filtrar_anomalia',
+        label='Con anomalías (cualquiera o por código)',
+    )
+
+    class Meta:
+        model = CalificacionTributaria
+        fields = ['ejercicio', 'year', 'mercado', 'estado', 'emisor', 'nemonico', 'fecha_pago_desde', 'fecha_pago_hasta', 'anomalia']
+
+    def filtrar_anomalia(self, queryset, name, value):
+        anomalias = AnomaliaCalificacion.objects.filter(calificacion=OuterRef('pk'))
+        if value != 'con':
+            anomalias = anomalias.filter(codigo=value)
+        return queryset.filter(Exists(anomalias))
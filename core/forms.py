@@ -1,4 +1,5 @@
 from django import forms
+from .archivo import archivados, mensaje
 from .models import EventoCorporativo, CalificacionTributaria, Emisor
 
 class EstiloBootstrapMixin:
@@ -24,6 +25,14 @@ class EventoForm(EstiloBootstrapMixin, forms.ModelForm):
             'numero_dividendo': 'N° Dividendo',
         }
 
+    def clean_ejercicio_comercial(self):
+        # Los ejercicios archivados son de sólo lectura: ni crear en ellos ni editar lo archivado
+        ejercicio = self.cleaned_data['ejercicio_comercial']
+        cerrados = archivados({ejercicio, self.instance.ejercicio_comercial} if self.instance.pk else {ejercicio})
+        if cerrados:
+            raise forms.ValidationError(mensaje(min(cerrados)))
+        return ejercicio
+
 class CalificacionForm(EstiloBootstrapMixin, forms.ModelForm):
     class Meta:
         model = CalificacionTributaria
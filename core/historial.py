@@ -0,0 +1,140 @@
+# core/historial.py
+# Diferencias precalculadas entre versiones consecutivas de una calificación.
+# Cada transacción que toca calificaciones (ver registrar_cambios) las marca; al
+# confirmar se comparan sus versiones nuevas de simple_history contra la última
+# diferencia guardada y se guarda qué campos y qué factores cambiaron. Como
+# DetalleFactor no tiene historial, cada diferencia guarda también el vector de
+# factores vigente, que es contra lo que se compara la siguiente.
+from django.utils import timezone
+from .auditoria import usuario_actual
+from .models import CalificacionTributaria, DetalleFactor, DiferenciaHistorial
+from .pendientes import al_confirmar
+from .router import en_primaria
+
+# Campos de la cabecera que se comparan entre versiones
+CAMPOS = ('evento_id', 'monto_total_distribuido', 'monto_unitario_pesos', 'estado', 'modificado_por_id')
+ETIQUETAS = {
+    'evento_id': 'Evento',
+    'monto_total_distribuido': 'Monto total distribuido',
+    'monto_unitario_pesos': 'Monto unitario',
+    'estado': 'Estado',
+    'modificado_por_id': 'Modificado por',
+}
+LOTE = 500
+
+
+def marcar(calificacion_ids):
+    """Calcula las diferencias de estas calificaciones al confirmar la transacción."""
+    al_confirmar('historial', calificacion_ids, procesar)
+
+
+@en_primaria()
+def procesar(calificacion_ids):
+    """
+    Guarda las diferencias de las versiones que aún no la tienen. Devuelve cuántas se crearon.
+    Lee de la primaria: también se llama en GET (historial de una calificación).
+    """
+    ids = sorted(set(calificacion_ids))
+    return sum(_procesar_lote(ids[i:i + LOTE]) for i in range(0, len(ids), LOTE))
+
+
+def _texto(valor):
+    return None if valor is None else str(valor)
+
+
+def _comparar(anterior, actual):
+    """{clave: {old, new}} de lo que cambió entre dos diccionarios."""
+    return {
+        clave: {'old': anterior.get(clave), 'new': actual.get(clave)}
+        for clave in sorted(anterior.keys() | actual.keys(), key=str)
+        if anterior.get(clave) != actual.get(clave)
+    }
+
+
+def _procesar_lote(ids):
+    historico = CalificacionTributaria.history.model
+    columnas = ('id', 'history_id', 'history_date', 'history_type', 'history_user_id') + CAMPOS
+
+    pendientes = {}
+    for version in (
+        historico.objects.filter(id__in=ids, diferencia__isnull=True)
+        .order_by('id', 'history_date', 'history_id').values(*columnas)
+    ):
+        pendientes.setdefault(version['id'], []).append(version)
+
+    # Punto de partida de cada calificación: su última versión ya procesada y el último vector guardado
+    previas = {
+        v['id']: v for v in
+        historico.objects.filter(id__in=ids, diferencia__isnull=False)
+        .order_by('id', '-history_date', '-history_id').distinct('id').values(*columnas)
+    }
+    vectores_previos = dict(
+        DiferenciaHistorial.objects.filter(calificacion_id__in=ids)
+        .order_by('calificacion_id', '-id').distinct('calificacion_id')
+        .values_list('calificacion_id', 'vector')
+    )
+
+    vigentes = {}
+    for calificacion_id, columna, valor in (
+        DetalleFactor.objects.filter(calificacion_id__in=ids).order_by()
+        .values_list('calificacion_id', 'concepto__columna_dj', 'valor')
+    ):
+        vigentes.setdefault(calificacion_id, {})[str(columna)] = str(valor)
+
+    diferencias = []
+    for calificacion_id in ids:
+        anterior = previas.get(calificacion_id)
+        vector = vectores_previos.get(calificacion_id)
+        versiones = pendientes.get(calificacion_id, [])
+        for posicion, version in enumerate(versiones):
+            if anterior is not None:
+                cambios = _comparar({c: _texto(anterior[c]) for c in CAMPOS}, {c: _texto(version[c]) for c in CAMPOS})
+            elif version['history_type'] == '+':
+                cambios = {c: {'old': None, 'new': _texto(version[c])} for c in CAMPOS}
+            else:
+                cambios = {}  # Primera versión conocida de un registro anterior: sólo línea base
+
+            factores = {}
+            if posicion == len(versiones) - 1:
+                # Los factores se escriben después de la cabecera: se atribuyen a la última versión de la transacción
+                nuevo = {} if version['history_type'] == '-' else vigentes.get(calificacion_id, {})
+                if vector is not None or version['history_type'] == '+':
+                    factores = _comparar(vector or {}, nuevo)
+                vector = nuevo
+
+            diferencias.append(DiferenciaHistorial(
+                historial_id=version['history_id'],
+                calificacion_id=calificacion_id,
+                fecha=version['history_date'],
+                usuario_id=version['history_user_id'],
+                tipo=version['history_type'],
+                cambios=cambios,
+                factores=factores,
+                vector=vector,
+            ))
+            anterior = version
+
+        # Cambio sólo de factores (sin versión nueva de la cabecera)
+        if not versiones and vector is not None and vigentes.get(calificacion_id, {}) != vector:
+            usuario = usuario_actual()
+            nuevo = vigentes.get(calificacion_id, {})
+            diferencias.append(DiferenciaHistorial(
+                calificacion_id=calificacion_id,
+                fecha=timezone.now(),
+                usuario_id=getattr(usuario, 'pk', None),
+                tipo='~',
+                factores=_comparar(vector, nuevo),
+                vector=nuevo,
+            ))
+
+    # ignore_conflicts: si otra transacción ya calculó la misma versión, se conserva la suya
+    DiferenciaHistorial.objects.bulk_create(diferencias, batch_size=LOTE, ignore_conflicts=True)
+    return len(diferencias)
+
+
+def calificaciones_pendientes():
+    """Ids de calificaciones con versiones sin diferencia calculada (para el cálculo inicial)."""
+    return (
+        CalificacionTributaria.history.model.objects
+        .filter(diferencia__isnull=True).order_by('id').values_list('id', flat=True).distinct()
+    )
@@ -0,0 +1,48 @@
+# core/management/commands/archivar_ejercicios.py
+
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from core.archivo import archivar, mantener, tamanos
+
+
+class Command(BaseCommand):
+    help = ('Mueve los eventos, calificaciones y factores de los ejercicios cerrados a las tablas de archivo '
+            '(sólo lectura, se siguen consultando igual). El ejercicio actual y el anterior no se archivan.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hasta', type=int, help='Último ejercicio a archivar (por defecto, el año actual - 2).')
+        parser.add_argument('--reindexar', action='store_true',
+                            help='Reconstruir los índices de las tablas calientes para liberar ya el espacio.')
+        parser.add_argument('--tamanos', action='store_true', help='Sólo mostrar el tamaño de las tablas.')
+
+    def handle(self, *args, **options):
+        if options['tamanos']:
+            self._tamanos()
+            return
+        limite = timezone.localdate().year - 2
+        hasta = options['hasta'] if options['hasta'] is not None else limite
+        if hasta > limite:
+            raise CommandError(f'Sólo se archivan ejercicios cerrados (hasta {limite}).')
+
+        inicio = time.perf_counter()
+        nuevos = archivar(hasta)
+        for ejercicio in nuevos:
+            self.stdout.write(
+                f'Ejercicio {ejercicio.ejercicio}: {ejercicio.eventos} eventos, '
+                f'{ejercicio.calificaciones} calificaciones, {ejercicio.factores} factores.'
+            )
+        if not connection.in_atomic_block:
+            mantener(reindexar=options['reindexar'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Archivados {len(nuevos)} ejercicios hasta {hasta} ({time.perf_counter() - inicio:.1f} s).'
+        ))
+        self._tamanos()
+
+    def _tamanos(self):
+        for tabla, tamano in tamanos().items():
+            self.stdout.write(
+                f"  {tabla:<40} {tamano['filas']:>10} filas  {tamano['tabla_mb']:8.1f} MB  "
+                f"índices {tamano['indices_mb']:8.1f} MB"
+            )
@@ -0,0 +1,64 @@
+# core/management/commands/benchmark_serializers.py
+
+import time
+from datetime import date
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from core.models import Emisor, EventoCorporativo, CalificacionTributaria, ConceptoFactor, DetalleFactor
+from core.serializers import CalificacionTributariaSerializer, CalificacionLecturaSerializer
+
+
+def _calificaciones_en_memoria(cantidad, columnas=30):
+    """Arma calificaciones completas (evento, emisor, factores) sin tocar la base de datos."""
+    conceptos = [ConceptoFactor(id=i, columna_dj=7 + i, descripcion=f'Factor {7 + i}') for i in range(1, columnas + 1)]
+    emisor = Emisor(id=1, rut='96.505.760-9', razon_social='Empresas Copec S.A.', nemonico='COPEC', tipo_sociedad='A')
+    ahora = timezone.now()
+    calificaciones = []
+    for i in range(1, cantidad + 1):
+        evento = EventoCorporativo(
+            id=i, emisor=emisor, mercado='ACN', fecha_pago=date(2024, 5, 1), numero_dividendo=i,
+            secuencia=i, ejercicio_comercial=2024, creado_por_id=1, fecha_creacion=ahora,
+        )
+        calificacion = CalificacionTributaria(
+            id=i, evento=evento, monto_total_distribuido=Decimal('1500000.0000'),
+            monto_unitario_pesos=Decimal('125.500000'), estado='VALIDADO', ultima_modificacion=ahora, modificado_por_id=1,
+        )
+        detalles = [
+            DetalleFactor(id=i * 100 + c.id, calificacion=calificacion, concepto=c, valor=Decimal('0.01234567'))
+            for c in conceptos
+        ]
+        calificacion._prefetched_objects_cache = {'detalles': detalles}
+        calificaciones.append(calificacion)
+    return calificaciones, [c.id for c in conceptos]
+
+
+class Command(BaseCommand):
+    help = 'Microbenchmark: serializer actual de calificaciones vs. lectura compilada.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--registros', type=int, default=2000)
+        parser.add_argument('--repeticiones', type=int, default=5)
+
+    def handle(self, *args, **options):
+        calificaciones, columnas = _calificaciones_en_memoria(options['registros'])
+        candidatos = [
+            ('CalificacionTributariaSerializer', lambda: CalificacionTributariaSerializer(calificaciones, many=True).data),
+            ('CalificacionLecturaSerializer', lambda: CalificacionLecturaSerializer(calificaciones, many=True, context={'columnas': columnas}).data),
+        ]
+
+        resultados = {}
+        for nombre, serializar in candidatos:
+            mejor = min(self._medir(serializar) for _ in range(options['repeticiones']))
+            resultados[nombre] = mejor
+            self.stdout.write(
+                f"{nombre:<36} {mejor * 1000:9.1f} ms   {options['registros'] / mejor:10.0f} registros/s"
+            )
+
+        base, rapido = resultados.values()
+        self.stdout.write(self.style.SUCCESS(f'Aceleración: x{base / rapido:.1f}'))
+
+    def _medir(self, serializar):
+        inicio = time.perf_counter()
+        serializar()
+        return time.perf_counter() - inicio
@@ -0,0 +1,206 @@
+# core/management/commands/benchmark_suite.py
+
+import json
+import math
+import platform
+import statistics
+import subprocess
+import time
+from io import BytesIO, StringIO
+from django import get_version
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.utils import timezone
+from django_otp.plugins.otp_totp.models import TOTPDevice
+from rest_framework.test import APIClient
+from core.bulk import MAX_ITEMS
+from core.models import CalificacionTributaria
+from core.sinteticos import crear_emisores, generar, items_bulk
+
+
+def _percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, math.ceil(p / 100 * len(ordenados)) - 1)]
+
+
+class Command(BaseCommand):
+    help = ('Benchmark de punta a punta (carga, mantenedor, API, exportación, auditoría) sobre una base de datos '
+            'temporal con datos sintéticos, para cada tamaño indicado. Escribe un reporte JSON comparable entre versiones.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tamanos', type=int, nargs='+', default=[1000, 10000],
+                            help='Cantidad aproximada de calificaciones de cada corrida.')
+        parser.add_argument('--eventos', type=int, default=20, help='Eventos por emisor y ejercicio.')
+        parser.add_argument('--anios', type=int, default=3, help='Ejercicios generados.')
+        parser.add_argument('--filas-xlsx', type=int, default=200, help='Filas del archivo .xlsx de carga medido.')
+        parser.add_argument('--repeticiones', type=int, default=5)
+        parser.add_argument('--semilla', type=int, default=1949)
+        parser.add_argument('--salida', help='Archivo del reporte JSON (por defecto, la salida estándar).')
+        parser.add_argument('--comparar', metavar='REPORTE', help='Reporte JSON anterior contra el cual comparar.')
+
+    def handle(self, *args, **options):
+        anterior = None
+        if options['comparar']:
+            with open(options['comparar'], encoding='utf-8') as archivo:
+                anterior = json.load(archivo)
+
+        # Base de datos propia: el benchmark nunca toca los datos reales
+        setup_test_environment()
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = f"benchmark_{connection.settings_dict['NAME']}"
+        nombre_original = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            corridas = [self._corrida(tamano, options) for tamano in options['tamanos']]
+        finally:
+            connection.creation.destroy_test_db(nombre_original, verbosity=0)
+            teardown_test_environment()
+
+        reporte = {
+            'fecha': timezone.now().isoformat(),
+            'version': self._version(),
+            'parametros': {c: options[c] for c in ('eventos', 'anios', 'filas_xlsx', 'repeticiones', 'semilla')},
+            'corridas': corridas,
+        }
+        texto = json.dumps(reporte, indent=2, ensure_ascii=False)
+        if options['salida']:
+            with open(options['salida'], 'w', encoding='utf-8') as archivo:
+                archivo.write(texto)
+            self.stderr.write(f"Reporte escrito en {options['salida']}")
+        else:
+            self.stdout.write(texto)
+        if anterior:
+            self._comparar(anterior, reporte)
+
+    # --- Una corrida por tamaño ---
+
+    def _corrida(self, tamano, options):
+        call_command('flush', interactive=False, verbosity=0)
+        call_command('seed_factores', stdout=StringIO())
+        user = User.objects.create_superuser('benchmark', 'benchmark@example.com', 'benchmark')
+        web = Client()
+        web.force_login(user)
+        sesion = web.session
+        sesion['otp_device_id'] = TOTPDevice.objects.create(user=user, name='benchmark', confirmed=True).persistent_id
+        sesion.save()
+        api = APIClient()
+        api.force_authenticate(user)
+
+        eventos, anios = options['eventos'], options['anios']
+        emisores = max(1, math.ceil(tamano / (eventos * anios)))
+        desde = 2024 - anios + 1
+        # Un ejercicio más que se sube como archivo .xlsx (no se carga antes)
+        filas = generar(emisores, eventos, anios + 1, desde, options['semilla'])
+        ultimo = desde + anios - 1
+        self.stderr.write(f"Tamaño {tamano}: {emisores} emisores x {anios} ejercicios x {eventos} eventos...")
+
+        resultado = {'tamano': tamano, 'calificaciones': 0, 'emisores': emisores, 'carga': {}, 'mediciones': {}}
+        resultado['carga']['api_bulk'] = self._cargar_api(api, filas[filas['Ejercicio'] <= ultimo])
+        resultado['calificaciones'] = CalificacionTributaria.objects.count()
+        resultado['carga']['xlsx'] = self._cargar_xlsx(web, filas[filas['Ejercicio'] > ultimo].head(options['filas_xlsx']))
+
+        ids = list(CalificacionTributaria.objects.order_by('?').values_list('pk', flat=True)[:options['repeticiones']])
+        nemonico = filas['Instrumento'].iloc[0]
+        peticiones = {
+            'mantenedor_ejercicio': lambda i: web.get('/', {'periodo': ultimo}),
+            'mantenedor_instrumento': lambda i: web.get('/', {'instrumento': nemonico}),
+            # Las filas del mantenedor: primera ventana de la grilla y una del medio
+            'grilla_ejercicio': lambda i: web.get('/grilla/', {'periodo': ultimo}),
+            'grilla_instrumento': lambda i: web.get('/grilla/', {'instrumento': nemonico}),
+            'grilla_desplazada': lambda i: web.get('/grilla/', {'desde': resultado['calificaciones'] // 2}),
+            'api_lista': lambda i: api.get('/api/calificaciones/', {'ejercicio': ultimo}),
+            'api_detalle': lambda i: api.get(f'/api/calificaciones/{ids[i % len(ids)]}/'),
+            'api_export_ndjson': lambda i: api.get('/api/calificaciones/export/', {'ejercicio': ultimo}),
+            'api_export_csv': lambda i: api.get('/api/calificaciones/export/', {'formato': 'csv'}),
+            'auditoria': lambda i: web.get('/historial/'),
+            'auditoria_filtrada': lambda i: web.get('/historial/', {'action': 'CREATE'}),
+        }
+        for nombre, peticion in peticiones.items():
+            resultado['mediciones'][nombre] = self._medir(peticion, options['repeticiones'])
+        return resultado
+
+    def _cargar_api(self, api, filas):
+        crear_emisores(filas)
+        items = list(items_bulk(filas))
+        inicio = time.perf_counter()
+        for desde in range(0, len(items), MAX_ITEMS):
+            respuesta = api.post('/api/calificaciones/bulk/', items[desde:desde + MAX_ITEMS], format='json')
+            if respuesta.status_code != 200 or respuesta.data['con_error']:
+                raise CommandError(f'La carga masiva falló ({respuesta.status_code}): {str(respuesta.data)[:500]}')
+        segundos = time.perf_counter() - inicio
+        return {'filas': len(items), 'segundos': round(segundos, 3), 'filas_por_s': round(len(items) / segundos, 1)}
+
+    def _cargar_xlsx(self, web, filas):
+        archivo = BytesIO()
+        filas.to_excel(archivo, index=False, engine='openpyxl')
+        archivo.seek(0)
+        archivo.name = 'benchmark.xlsx'
+        antes = CalificacionTributaria.objects.count()
+        inicio = time.perf_counter()
+        respuesta = web.post('/upload/', {'archivo_excel': archivo})
+        segundos = time.perf_counter() - inicio
+        # La vista responde 200 también con errores: se verifica que se hayan creado todas las filas
+        if respuesta.status_code != 200 or CalificacionTributaria.objects.count() != antes + len(filas):
+            mensajes = [str(m) for m in respuesta.context['messages']] if respuesta.context else []
+            raise CommandError(f'La carga del .xlsx falló ({respuesta.status_code}): {mensajes}')
+        return {'filas': len(filas), 'segundos': round(segundos, 3), 'filas_por_s': round(len(filas) / segundos, 1)}
+
+    def _medir(self, peticion, repeticiones):
+        tiempos, consultas, bytes_respuesta = [], 0, 0
+        for i in range(repeticiones + 1):
+            with CaptureQueriesContext(connection) as capturadas:
+                inicio = time.perf_counter()
+                respuesta = peticion(i)
+                # Las respuestas en stream se consumen completas dentro de la medición
+                contenido = b''.join(respuesta.streaming_content) if respuesta.streaming else respuesta.content
+                segundos = time.perf_counter() - inicio
+            if respuesta.status_code != 200:
+                raise CommandError(f'{respuesta.request["PATH_INFO"]} respondió {respuesta.status_code}.')
+            if i == 0:
+                continue  # Calentamiento (cachés, plantillas)
+            tiempos.append(segundos * 1000)
+            consultas, bytes_respuesta = len(capturadas), len(contenido)
+        return {
+            'mediana_ms': round(statistics.median(tiempos), 2),
+            'p95_ms': round(_percentil(tiempos, 95), 2),
+            'min_ms': round(min(tiempos), 2),
+            'consultas': consultas,
+            'bytes': bytes_respuesta,
+        }
+
+    # --- Reporte ---
+
+    def _version(self):
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            'commit': commit,
+            'python': platform.python_version(),
+            'django': get_version(),
+            'postgresql': connection.pg_version,
+        }
+
+    def _comparar(self, anterior, actual):
+        """Mediana actual vs. anterior de cada medición, para los tamaños presentes en ambos reportes."""
+        previas = {c['tamano']: c for c in anterior.get('corridas', [])}
+        for corrida in actual['corridas']:
+            previa = previas.get(corrida['tamano'])
+            if previa is None:
+                continue
+            self.stderr.write(f"\n{corrida['calificaciones']} calificaciones (anterior: {anterior['version'].get('commit')})")
+            for nombre, medicion in corrida['mediciones'].items():
+                antes = previa['mediciones'].get(nombre)
+                if antes:
+                    razon = medicion['mediana_ms'] / max(antes['mediana_ms'], 1e-9)
+                    estilo = self.style.ERROR if razon > 1.2 else self.style.SUCCESS if razon < 0.8 else str
+                    self.stderr.write(estilo(
+                        f"  {nombre:<24} {antes['mediana_ms']:10.1f} ms -> {medicion['mediana_ms']:10.1f} ms   x{razon:.2f}"
+                    ))
@@ -0,0 +1,21 @@
+# core/management/commands/calcular_diferencias_historial.py
+
+import time
+from django.core.management.base import BaseCommand
+from core.historial import LOTE, calificaciones_pendientes, procesar
+
+
+class Command(BaseCommand):
+    help = ('Calcula las diferencias del historial de calificaciones que aún no las tienen '
+            '(versiones anteriores a este registro). Las nuevas se calculan solas al guardar.')
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        ids = list(calificaciones_pendientes())
+        creadas = 0
+        for i in range(0, len(ids), LOTE):
+            creadas += procesar(ids[i:i + LOTE])
+        self.stdout.write(self.style.SUCCESS(
+            f"{creadas} diferencias calculadas para {len(ids)} calificaciones "
+            f"({time.perf_counter() - inicio:.1f} s)."
+        ))
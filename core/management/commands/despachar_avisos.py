@@ -0,0 +1,54 @@
+# core/management/commands/despachar_avisos.py
+
+import time
+from django.core.management.base import BaseCommand, CommandError
+from core import avisos
+
+
+class Command(BaseCommand):
+    help = ('Entrega a los sistemas externos los avisos de cambios de calificaciones (bandeja AvisoSalida) '
+            'por lotes, un evento por calificación con su estado vigente. Se pueden correr varios a la vez.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--destino', action='append', default=[],
+            help="consola, archivo:<ruta> o webhook:<url> (se puede repetir). Por defecto, AVISOS_DESTINOS.",
+        )
+        parser.add_argument('--lote', type=int, default=avisos.LOTE, help='Avisos por lote.')
+        parser.add_argument('--continuo', action='store_true',
+                            help='No terminar al vaciar la bandeja: seguir consultando cada --pausa segundos.')
+        parser.add_argument('--pausa', type=float, default=2.0)
+        parser.add_argument('--reintentar-agotados', action='store_true',
+                            help='Volver a encolar los avisos que agotaron sus reintentos.')
+
+    def handle(self, *args, **options):
+        destinos = [self._destino(d) for d in options['destino']] or avisos.destinos()
+        if not destinos:
+            raise CommandError('No hay destinos: configure AVISOS_DESTINOS o indique --destino.')
+        if options['reintentar_agotados']:
+            self.stderr.write(f'{avisos.reintentar_agotados()} avisos agotados vuelven a la cola.')
+
+        total = fallidos = 0
+        try:
+            while True:
+                entregados, pendientes = avisos.despachar(destinos, lote=options['lote'])
+                total, fallidos = total + entregados, fallidos + pendientes
+                if entregados:
+                    continue  # Puede haber más: siguiente lote sin esperar
+                if not options['continuo']:
+                    break
+                time.sleep(options['pausa'])
+        except KeyboardInterrupt:
+            pass
+        # stderr: con --destino consola, stdout lleva sólo los eventos
+        self.stderr.write(f'Eventos entregados: {total}. Avisos con entrega fallida (se reintentarán): {fallidos}.')
+
+    def _destino(self, valor):
+        tipo, _, parametro = valor.partition(':')
+        if tipo == 'consola':
+            return avisos.Consola(self.stdout)
+        if tipo == 'archivo' and parametro:
+            return avisos.Archivo(parametro)
+        if tipo == 'webhook' and parametro:
+            return avisos.Webhook(parametro)
+        raise CommandError(f"Destino no válido: '{valor}'. Use consola, archivo:<ruta> o webhook:<url>.")
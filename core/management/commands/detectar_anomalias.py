@@ -0,0 +1,24 @@
+# core/management/commands/detectar_anomalias.py
+
+import time
+from django.core.management.base import BaseCommand
+from core.anomalias import analizar
+
+
+class Command(BaseCommand):
+    help = ('Analiza los factores de uno o más ejercicios contra la historia de los anteriores '
+            '(por emisor y por columna) y guarda las anomalías encontradas.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('ejercicios', nargs='*', type=int,
+                            help='Ejercicios a analizar (por defecto, toda la historia).')
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        resultado = analizar(options['ejercicios'] or None)
+        for ejercicio, cantidad in sorted(resultado.items()):
+            self.stdout.write(f"Ejercicio {ejercicio}: {cantidad} anomalías.")
+        self.stdout.write(self.style.SUCCESS(
+            f"Análisis terminado: {sum(resultado.values())} anomalías en {len(resultado)} ejercicios "
+            f"({time.perf_counter() - inicio:.1f} s)."
+        ))
@@ -0,0 +1,45 @@
+# core/management/commands/generar_datos_sinteticos.py
+
+import time
+from pathlib import Path
+from django.core.management.base import BaseCommand, CommandError
+from core.models import ConceptoFactor
+from core.sinteticos import cargar, escribir_xlsx, generar
+
+
+class Command(BaseCommand):
+    help = ('Genera datos sintéticos realistas (emisores x ejercicios x eventos) y los carga con la carga masiva '
+            'y/o los escribe como archivos .xlsx de carga (uno por ejercicio).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--emisores', type=int, default=300)
+        parser.add_argument('--eventos', type=int, default=20, help='Eventos por emisor y ejercicio.')
+        parser.add_argument('--anios', type=int, default=6, help='Cantidad de ejercicios.')
+        parser.add_argument('--desde', type=int, default=2019, help='Primer ejercicio.')
+        parser.add_argument('--semilla', type=int, default=1949, help='Misma semilla = mismos datos.')
+        parser.add_argument('--xlsx', metavar='DIRECTORIO', help='Escribir también los archivos de carga .xlsx.')
+        parser.add_argument('--sin-bd', action='store_true', help='No guardar en la base de datos (sólo --xlsx).')
+
+    def handle(self, *args, **options):
+        if options['sin_bd'] and not options['xlsx']:
+            raise CommandError('Con --sin-bd indique --xlsx DIRECTORIO.')
+        if not options['sin_bd'] and not ConceptoFactor.objects.exists():
+            raise CommandError('No hay conceptos de factores. Ejecute antes: python manage.py seed_factores')
+
+        inicio = time.perf_counter()
+        filas = generar(options['emisores'], options['eventos'], options['anios'], options['desde'], options['semilla'])
+        self.stdout.write(f"Generadas {len(filas)} filas ({time.perf_counter() - inicio:.1f} s).")
+
+        if options['xlsx']:
+            directorio = Path(options['xlsx'])
+            directorio.mkdir(parents=True, exist_ok=True)
+            for ruta in escribir_xlsx(filas, directorio):
+                self.stdout.write(f"  {ruta}")
+
+        if not options['sin_bd']:
+            inicio = time.perf_counter()
+            guardados = cargar(filas)
+            segundos = time.perf_counter() - inicio
+            self.stdout.write(self.style.SUCCESS(
+                f"Guardadas {guardados} calificaciones ({segundos:.1f} s, {guardados / max(segundos, 1e-9):.0f} por segundo)."
+            ))
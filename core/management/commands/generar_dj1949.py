@@ -0,0 +1,39 @@
+# core/management/commands/generar_dj1949.py
+
+import os
+import time
+from django.core.management.base import BaseCommand, CommandError
+from core.dj1949 import FORMATOS, generar
+
+
+class Command(BaseCommand):
+    help = 'Genera el archivo anual de la DJ 1949 (ancho fijo o CSV) para un ejercicio comercial.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('ejercicio', type=int, help='Ejercicio comercial (Ej: 2024)')
+        parser.add_argument('--formato', choices=FORMATOS, default='txt')
+        parser.add_argument('--salida', help='Ruta del archivo (por defecto DJ1949_<ejercicio>.<formato>)')
+        parser.add_argument('--procesos', type=int, default=os.cpu_count() or 1,
+                            help='Procesos para armar las secciones por emisor en paralelo.')
+        parser.add_argument('--todas', action='store_true',
+                            help='Incluir calificaciones no validadas (por defecto sólo VALIDADO).')
+
+    def handle(self, *args, **options):
+        ejercicio = options['ejercicio']
+        ruta = options['salida'] or f"DJ1949_{ejercicio}.{options['formato']}"
+        inicio = time.perf_counter()
+        try:
+            totales = generar(
+                ejercicio,
+                ruta,
+                formato=options['formato'],
+                estados=None if options['todas'] else ('VALIDADO',),
+                procesos=max(1, options['procesos']),
+            )
+        except (OSError, ValueError) as exc:
+            raise CommandError(str(exc))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"DJ 1949 {ejercicio}: {totales.registros} registros en {ruta} "
+            f"({time.perf_counter() - inicio:.1f} s)."
+        ))
@@ -0,0 +1,84 @@
+# core/management/commands/medir_arranque.py
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Lo que hace un worker al arrancar: settings, apps, middleware y URLconf (vistas, API)
+ARRANQUE = """
+import json, os, resource, sys, time
+inicio = time.perf_counter()
+from django.core.wsgi import get_wsgi_application
+from django.urls import get_resolver
+get_wsgi_application()
+get_resolver().url_patterns
+ms = (time.perf_counter() - inicio) * 1000
+try:
+    # RSS actual: ru_maxrss se hereda del proceso padre a través de exec en Linux
+    with open('/proc/self/status') as status:
+        rss_kb = next(int(l.split()[1]) for l in status if l.startswith('VmRSS:'))
+except OSError:
+    rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({
+    'ms': ms,
+    'rss_mb': rss_kb / 1024,
+    'modulos': sorted(sys.modules),
+}))
+"""
+# Sólo se cargan en la carga masiva (core/carga_excel.py) y en la configuración de 2FA
+PESADOS = ('pandas', 'openpyxl', 'qrcode')
+
+
+def medir(importtime=False):
+    """Arranca un proceso nuevo como un worker. Devuelve (medición, salida de -X importtime)."""
+    comando = [sys.executable, *(['-X', 'importtime'] if importtime else []), '-c', ARRANQUE]
+    entorno = {**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'config.settings')}
+    proceso = subprocess.run(comando, cwd=settings.BASE_DIR, env=entorno, capture_output=True, text=True)
+    if proceso.returncode:
+        raise CommandError(f'El arranque falló:\n{proceso.stderr[-2000:]}')
+    return json.loads(proceso.stdout.strip().splitlines()[-1]), proceso.stderr
+
+
+def importaciones(salida):
+    """[(ms acumulados, módulo)] de lo importado directamente por el arranque, del más lento al más rápido."""
+    paquetes = []
+    for linea in salida.splitlines():
+        if not linea.startswith('import time:') or 'cumulative' in linea:
+            continue
+        _, acumulado, nombre = linea[len('import time:'):].split('|')
+        if not nombre.startswith('  '):  # Sin sangría: importado directamente por el arranque
+            paquetes.append((int(acumulado) / 1000, nombre.strip()))
+    return sorted(paquetes, reverse=True)
+
+
+class Command(BaseCommand):
+    help = ('Mide el arranque en frío de un worker (tiempo y memoria RSS) y las importaciones más lentas '
+            '(python -X importtime). Falla si se cargan pandas/openpyxl/qrcode o si se superan los límites.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeticiones', type=int, default=3)
+        parser.add_argument('--top', type=int, default=15, help='Paquetes más lentos a mostrar.')
+        parser.add_argument('--max-ms', type=float, help='Límite de tiempo de arranque (mediana).')
+        parser.add_argument('--max-rss-mb', type=float, help='Límite de memoria RSS tras el arranque.')
+
+    def handle(self, *args, **options):
+        mediciones = [medir()[0] for _ in range(options['repeticiones'])]
+        ms = statistics.median(m['ms'] for m in mediciones)
+        rss = max(m['rss_mb'] for m in mediciones)
+        _, salida = medir(importtime=True)
+
+        self.stdout.write(f'Arranque: {ms:.0f} ms (mediana de {len(mediciones)}), RSS {rss:.1f} MB')
+        for acumulado, paquete in importaciones(salida)[:options['top']]:
+            self.stdout.write(f'  {acumulado:8.1f} ms  {paquete}')
+
+        problemas = [f'{m} se importa al arrancar' for m in PESADOS if m in mediciones[0]['modulos']]
+        if options['max_ms'] is not None and ms > options['max_ms']:
+            problemas.append(f"arranque de {ms:.0f} ms (límite {options['max_ms']:.0f} ms)")
+        if options['max_rss_mb'] is not None and rss > options['max_rss_mb']:
+            problemas.append(f"RSS de {rss:.1f} MB (límite {options['max_rss_mb']:.1f} MB)")
+        if problemas:
+            raise CommandError('; '.join(problemas))
@@ -0,0 +1,149 @@
+# core/management/commands/prueba_carga.py
+
+import json
+import statistics
+import threading
+import time
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models.functions import Length
+from django_otp.plugins.otp_totp.models import TOTPDevice
+from rest_framework.authtoken.models import Token
+from core.management.commands.benchmark_suite import _percentil
+from core.models import CalificacionTributaria
+
+
+class Command(BaseCommand):
+    help = ('Prueba de carga contra un servidor en marcha (runserver, gunicorn...): requests por segundo y '
+            'latencias del mantenedor y la API con varios clientes concurrentes. Usa la misma base de datos '
+            'que el servidor para autenticarse.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='URL base del servidor.')
+        parser.add_argument('--usuario', required=True, help='Superusuario con el que se hacen las requests.')
+        parser.add_argument('--concurrencia', type=int, default=8, help='Clientes simultáneos.')
+        parser.add_argument('--duracion', type=float, default=10, help='Segundos por ruta.')
+        # El mantenedor pide sus filas a /grilla/ por ventanas: se mide la primera, filtrada por un instrumento
+        parser.add_argument('--rutas', nargs='+',
+                            default=['/grilla/?instrumento={nemonico}', '/api/calificaciones/', '/api/calificaciones/{id}/'],
+                            help="Rutas a medir; '{id}' y '{nemonico}' se reemplazan por una calificación existente.")
+        parser.add_argument('--salida', help='Archivo del reporte JSON (por defecto, la salida estándar).')
+        parser.add_argument('--comparar', metavar='REPORTE', help='Reporte JSON anterior contra el cual comparar.')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['usuario'], is_superuser=True)
+        except User.DoesNotExist:
+            raise CommandError(f"No existe el superusuario '{options['usuario']}'.")
+        # El filtro del mantenedor es 'contiene': el nemónico más largo trae menos filas de otros emisores
+        calificacion = (
+            CalificacionTributaria.objects.order_by(Length('evento__emisor__nemonico').desc(), 'pk')
+            .values('pk', 'evento__emisor__nemonico').first()
+        )
+        if calificacion is None:
+            raise CommandError('No hay calificaciones (ver generar_datos_sinteticos).')
+
+        cabeceras_web, cabeceras_api = self._credenciales(user)
+        resultados = {}
+        for ruta in options['rutas']:
+            ruta = ruta.replace('{id}', str(calificacion['pk'])).replace('{nemonico}', calificacion['evento__emisor__nemonico'])
+            cabeceras = cabeceras_api if ruta.startswith('/api/') else cabeceras_web
+            resultados[ruta] = self._medir(options['url'] + ruta, cabeceras, options['concurrencia'], options['duracion'])
+            r = resultados[ruta]
+            self.stderr.write(
+                f"{ruta:<32} {r['rps']:8.1f} req/s   p50 {r['p50_ms']:7.1f} ms   p95 {r['p95_ms']:7.1f} ms   "
+                f"errores {r['errores']}"
+            )
+
+        reporte = {
+            'url': options['url'],
+            'concurrencia': options['concurrencia'],
+            'duracion': options['duracion'],
+            'rutas': resultados,
+        }
+        texto = json.dumps(reporte, indent=2, ensure_ascii=False)
+        if options['salida']:
+            with open(options['salida'], 'w', encoding='utf-8') as archivo:
+                archivo.write(texto)
+        else:
+            self.stdout.write(texto)
+        if options['comparar']:
+            with open(options['comparar'], encoding='utf-8') as archivo:
+                self._comparar(json.load(archivo), reporte)
+
+    def _credenciales(self, user):
+        """Cookie de una sesión ya verificada con 2FA (para las vistas) y token (para la API)."""
+        dispositivo = TOTPDevice.objects.filter(user=user, confirmed=True).first()
+        if dispositivo is None:
+            dispositivo = TOTPDevice.objects.create(user=user, name='prueba_carga', confirmed=True)
+        sesion = SessionStore()
+        sesion[SESSION_KEY] = str(user.pk)
+        sesion[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        sesion[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        sesion['otp_device_id'] = dispositivo.persistent_id
+        sesion.create()
+        token, _ = Token.objects.get_or_create(user=user)
+        return (
+            {'Cookie': f'{settings.SESSION_COOKIE_NAME}={sesion.session_key}'},
+            {'Authorization': f'Token {token.key}', 'Accept': 'application/json'},
+        )
+
+    def _medir(self, url, cabeceras, concurrencia, duracion):
+        latencias, errores = [], []
+        lock = threading.Lock()
+
+        def pedir():
+            inicio = time.perf_counter()
+            try:
+                with urlopen(Request(url, headers=cabeceras), timeout=60) as respuesta:
+                    respuesta.read()
+                    # Una redirección (p. ej. al login) no cuenta como éxito
+                    ok = respuesta.status == 200 and respuesta.geturl() == url
+            except (HTTPError, URLError, OSError) as e:
+                ok = False
+                with lock:
+                    errores.append(str(e))
+            return ok, (time.perf_counter() - inicio) * 1000
+
+        def cliente(fin):
+            while time.perf_counter() < fin:
+                ok, ms = pedir()
+                if ok:
+                    with lock:
+                        latencias.append(ms)
+
+        # Calentamiento: una request por cliente (imports, plantillas, conexiones)
+        for _ in range(concurrencia):
+            pedir()
+        errores.clear()
+
+        inicio = time.perf_counter()
+        hilos = [threading.Thread(target=cliente, args=(inicio + duracion,)) for _ in range(concurrencia)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        segundos = time.perf_counter() - inicio
+        if not latencias:
+            raise CommandError(f'{url}: ninguna request exitosa ({errores[:3]}).')
+        return {
+            'requests': len(latencias),
+            'errores': len(errores),
+            'rps': round(len(latencias) / segundos, 1),
+            'p50_ms': round(statistics.median(latencias), 1),
+            'p95_ms': round(_percentil(latencias, 95), 1),
+        }
+
+    def _comparar(self, anterior, actual):
+        self.stderr.write(f"\nreq/s: {anterior['url']} -> {actual['url']}")
+        for ruta, medicion in actual['rutas'].items():
+            antes = anterior['rutas'].get(ruta)
+            if antes:
+                razon = medicion['rps'] / max(antes['rps'], 1e-9)
+                estilo = self.style.SUCCESS if razon > 1.2 else self.style.ERROR if razon < 0.8 else str
+                self.stderr.write(estilo(f"  {ruta:<32} {antes['rps']:8.1f} -> {medicion['rps']:8.1f}   x{razon:.2f}"))
@@ -0,0 +1,35 @@
+# core/management/commands/reconstruir_resumenes.py
+
+import time
+from django.core.management.base import BaseCommand
+from core.models import EventoCorporativo, ResumenEmisor
+from core.resumenes import recalcular, reconstruir
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye las tablas de resumen por emisor / ejercicio desde las calificaciones y sus factores.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ejercicio', type=int, action='append',
+                            help='Recalcular sólo este ejercicio (se puede repetir).')
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        ejercicios = options['ejercicio']
+        if ejercicios:
+            claves = (
+                EventoCorporativo.objects.filter(ejercicio_comercial__in=ejercicios)
+                .values_list('emisor_id', 'ejercicio_comercial').distinct()
+            )
+            # Se agregan también las claves con resumen y sin eventos, para que se eliminen
+            claves = set(claves) | set(
+                ResumenEmisor.objects.filter(ejercicio__in=ejercicios).values_list('emisor_id', 'ejercicio')
+            )
+            resumenes = recalcular(claves)
+        else:
+            resumenes = reconstruir()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Resúmenes reconstruidos: {resumenes} (ejercicio, mercado, emisor) "
+            f"({time.perf_counter() - inicio:.1f} s)."
+        ))
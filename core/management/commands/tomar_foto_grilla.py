@@ -0,0 +1,27 @@
+# core/management/commands/tomar_foto_grilla.py
+
+import time
+from django.core.management.base import BaseCommand
+from core.models import FotoGrilla
+from core.reconstruccion import tomar_foto
+
+
+class Command(BaseCommand):
+    help = ('Guarda una foto completa de la grilla (calificaciones, eventos y factores). '
+            'Acota el historial que recorre la vista "al instante"; programar periódicamente (cron).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--conservar', type=int, default=None,
+                            help='Conservar sólo las N fotos más recientes.')
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        foto = tomar_foto()
+        borradas = 0
+        if options['conservar']:
+            antiguas = FotoGrilla.objects.values_list('pk', flat=True)[options['conservar']:]
+            borradas, _ = FotoGrilla.objects.filter(pk__in=list(antiguas)).delete()
+        self.stdout.write(self.style.SUCCESS(
+            f"{foto} ({time.perf_counter() - inicio:.1f} s)."
+            + (f" Fotos antiguas eliminadas: {borradas}." if borradas else '')
+        ))
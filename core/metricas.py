@@ -0,0 +1,271 @@
+# core/metricas.py
+# Registro de métricas (contadores e histogramas) compartido entre procesos.
+# Cada proceso acumula en memoria y vuelca sus valores a un archivo propio en
+# METRICAS_DIR (escritura atómica, como mucho cada METRICAS_INTERVALO segundos y al
+# salir); /metrics suma los archivos de todos los procesos. Los archivos de procesos
+# que ya terminaron se fusionan en 'acumulado.json', así los contadores nunca bajan
+# cuando gunicorn recicla workers.
+import atexit
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from functools import partial
+from pathlib import Path
+from django.conf import settings
+from django.db import transaction
+
+# Límites (segundos) de los histogramas de duración
+BUCKETS_DURACION = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+ACUMULADO = 'acumulado.json'
+
+_REGISTRO = {}  # nombre -> métrica
+_lock = threading.RLock()
+logger = logging.getLogger('core.metricas')
+
+
+class _Estado:
+    """Valores de este proceso. Tras un fork (gunicorn --preload) el hijo parte de cero."""
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.archivo = f'{self.pid}-{uuid.uuid4().hex[:8]}.json'
+        self.contadores = {}  # (nombre, etiquetas) -> valor
+        self.histogramas = {}  # (nombre, etiquetas) -> [cuentas por bucket..., suma, total]
+        self.guardado = 0.0
+        self.timer = None
+
+
+_estado = _Estado()
+
+
+def _actual():
+    global _estado
+    if _estado.pid != os.getpid():
+        _estado = _Estado()
+    return _estado
+
+
+def _etiquetas(etiquetas):
+    return tuple(sorted((k, str(v)) for k, v in etiquetas.items()))
+
+
+class Contador:
+    tipo = 'counter'
+
+    def __init__(self, nombre, ayuda):
+        self.nombre, self.ayuda = nombre, ayuda
+
+    def inc(self, valor=1, **etiquetas):
+        if not valor:
+            return
+        with _lock:
+            estado = _actual()
+            clave = (self.nombre, _etiquetas(etiquetas))
+            estado.contadores[clave] = estado.contadores.get(clave, 0) + valor
+        _programar_guardado()
+
+    def inc_al_confirmar(self, valor=1, **etiquetas):
+        """Como inc, pero sólo si la transacción en curso se confirma (lo revertido no se cuenta)."""
+        transaction.on_commit(partial(self.inc, valor, **etiquetas))
+
+
+class Histograma:
+    tipo = 'histogram'
+
+    def __init__(self, nombre, ayuda, buckets=BUCKETS_DURACION):
+        self.nombre, self.ayuda, self.buckets = nombre, ayuda, tuple(buckets)
+
+    def observar(self, valor, **etiquetas):
+        with _lock:
+            estado = _actual()
+            clave = (self.nombre, _etiquetas(etiquetas))
+            fila = estado.histogramas.get(clave)
+            if fila is None:
+                fila = estado.histogramas[clave] = [0] * (len(self.buckets) + 2)
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    fila[i] += 1
+                    break
+            fila[-2] += valor
+            fila[-1] += 1
+        _programar_guardado()
+
+    def cronometro(self, **etiquetas):
+        return _Cronometro(self, etiquetas)
+
+
+class _Cronometro:
+    def __init__(self, histograma, etiquetas):
+        self.histograma, self.etiquetas = histograma, etiquetas
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histograma.observar(time.perf_counter() - self.inicio, **self.etiquetas)
+
+
+def contador(nombre, ayuda):
+    return _REGISTRO.setdefault(nombre, Contador(nombre, ayuda))
+
+
+def histograma(nombre, ayuda, buckets=BUCKETS_DURACION):
+    return _REGISTRO.setdefault(nombre, Histograma(nombre, ayuda, buckets))
+
+
+# --- Persistencia por proceso ---
+
+def _directorio():
+    directorio = Path(settings.METRICAS_DIR)
+    directorio.mkdir(parents=True, exist_ok=True)
+    return directorio
+
+
+def _programar_guardado():
+    """Guarda ya si pasó el intervalo; si no, un timer guarda lo pendiente al cumplirse."""
+    with _lock:
+        estado = _actual()
+        espera = estado.guardado + settings.METRICAS_INTERVALO - time.monotonic()
+        if espera <= 0:
+            guardar()
+        elif estado.timer is None:
+            estado.timer = threading.Timer(espera, guardar)
+            estado.timer.daemon = True
+            estado.timer.start()
+
+
+def guardar():
+    """Vuelca los valores de este proceso a su archivo (reemplazo atómico)."""
+    with _lock:
+        estado = _actual()
+        if estado.timer is not None:
+            estado.timer.cancel()
+            estado.timer = None
+        estado.guardado = time.monotonic()
+        if not estado.contadores and not estado.histogramas:
+            return
+        datos = _serializar(estado.contadores, estado.histogramas)
+    try:
+        directorio = _directorio()
+        temporal = directorio / f'.{estado.archivo}.tmp'
+        temporal.write_text(json.dumps(datos))
+        os.replace(temporal, directorio / estado.archivo)
+    except OSError as e:
+        # Las métricas nunca interrumpen una carga o una request
+        logger.warning('No se pudieron guardar las métricas en %s: %s', settings.METRICAS_DIR, e)
+
+
+atexit.register(guardar)
+
+
+def _serializar(contadores, histogramas):
+    return {
+        'contadores': [[n, e, v] for (n, e), v in contadores.items()],
+        'histogramas': [[n, e, f] for (n, e), f in histogramas.items()],
+    }
+
+
+def _sumar(destino, datos):
+    contadores, histogramas = destino
+    for nombre, etiquetas, valor in datos.get('contadores', []):
+        clave = (nombre, tuple(map(tuple, etiquetas)))
+        contadores[clave] = contadores.get(clave, 0) + valor
+    for nombre, etiquetas, fila in datos.get('histogramas', []):
+        clave = (nombre, tuple(map(tuple, etiquetas)))
+        previa = histogramas.get(clave)
+        histogramas[clave] = fila if previa is None else [a + b for a, b in zip(previa, fila)]
+
+
+def _vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def recolectar():
+    """(contadores, histogramas) sumados de todos los procesos, vivos o terminados."""
+    guardar()
+    directorio = _directorio()
+    total = ({}, {})
+    with open(directorio / '.lock', 'w') as cerrojo:
+        # Un solo proceso a la vez fusiona los archivos de procesos terminados
+        fcntl.flock(cerrojo, fcntl.LOCK_EX)
+        acumulado = directorio / ACUMULADO
+        terminados = ({}, {})
+        if acumulado.exists():
+            _sumar(terminados, json.loads(acumulado.read_text()))
+        muertos = []
+        for archivo in directorio.glob('*-*.json'):
+            try:
+                datos = json.loads(archivo.read_text())
+            except (OSError, ValueError):
+                continue  # Borrado o reemplazado mientras se leía
+            if _vivo(int(archivo.name.split('-')[0])):
+                _sumar(total, datos)
+            else:
+                _sumar(terminados, datos)
+                muertos.append(archivo)
+        if muertos:
+            temporal = directorio / f'.{ACUMULADO}.tmp'
+            temporal.write_text(json.dumps(_serializar(*terminados)))
+            os.replace(temporal, acumulado)
+            for archivo in muertos:
+                archivo.unlink(missing_ok=True)
+    _sumar(total, _serializar(*terminados))
+    return total
+
+
+# --- Formato de texto de Prometheus ---
+
+def _formato_etiquetas(etiquetas):
+    if not etiquetas:
+        return ''
+    escapar = lambda v: v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{k}="{escapar(v)}"' for k, v in etiquetas) + '}'
+
+
+def exponer():
+    """Todas las métricas registradas en el formato de exposición de texto de Prometheus."""
+    contadores, histogramas = recolectar()
+    lineas = []
+    for nombre, metrica in sorted(_REGISTRO.items()):
+        lineas.append(f'# HELP {nombre} {metrica.ayuda}')
+        lineas.append(f'# TYPE {nombre} {metrica.tipo}')
+        if metrica.tipo == 'counter':
+            for (n, etiquetas), valor in sorted(contadores.items()):
+                if n == nombre:
+                    lineas.append(f'{nombre}{_formato_etiquetas(etiquetas)} {valor}')
+            continue
+        for (n, etiquetas), fila in sorted(histogramas.items()):
+            if n != nombre:
+                continue
+            acumulado = 0
+            for limite, cuenta in zip(metrica.buckets, fila):
+                acumulado += cuenta
+                lineas.append(f'{nombre}_bucket{_formato_etiquetas((*etiquetas, ("le", str(limite))))} {acumulado}')
+            lineas.append(f'{nombre}_bucket{_formato_etiquetas((*etiquetas, ("le", "+Inf")))} {fila[-1]}')
+            lineas.append(f'{nombre}_sum{_formato_etiquetas(etiquetas)} {fila[-2]}')
+            lineas.append(f'{nombre}_count{_formato_etiquetas(etiquetas)} {fila[-1]}')
+    return '\n'.join(lineas) + '\n'
+
+
+# --- Métricas de la aplicación ---
+
+CARGA_FILAS = contador('carga_filas_total', 'Filas guardadas por la carga masiva.')
+CARGA_ERRORES = contador('carga_errores_validacion_total', 'Filas rechazadas por la validación de la carga masiva.')
+CARGA_DURACION = histograma('carga_duracion_segundos', 'Duración de cada carga masiva.')
+API_DURACION = histograma('api_request_duracion_segundos', 'Latencia de las requests de la API.')
+AUDITORIA_REGISTROS = contador('auditoria_registros_total', 'Registros de auditoría (AuditLog) escritos.')
+CACHE_CONSULTAS = contador('cache_consultas_total', 'Consultas a las cachés de la aplicación, por resultado (hit / miss).')
+BLOQUEOS_ESPERA = histograma('bloqueos_espera_segundos', 'Espera por los locks consultivos de la carga masiva, por espacio de claves.')
+AVISOS_ENTREGADOS = contador('avisos_entregados_total', 'Eventos de cambios entregados a los sistemas externos.')
+AVISOS_FALLIDOS = contador('avisos_fallidos_total', 'Avisos cuya entrega falló (quedan para reintento).')
@@ -1,8 +1,18 @@
+import logging
 import threading
+import time
+from contextlib import ExitStack
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
 from django.shortcuts import redirect
 from django.urls import reverse
 from django_otp.plugins.otp_totp.models import TOTPDevice
 from django.utils.cache import add_never_cache_headers
+from rest_framework.response import Response
+from . import perfilado, router
+
+logger = logging.getLogger('core.perfilado')
 
 # ==========================================
 # 1. LÓGICA DE AUDITORÍA 
@@ -21,8 +31,11 @@ class CurrentUserMiddleware:
     def __call__(self, request):
         # Intercepta la request y guarda el usuario en el hilo actual
         _thread_locals.user = request.user
-        response = self.get_response(request)
-        return response
+        try:
+            return self.get_response(request)
+        finally:
+            # El hilo se reutiliza: no dejamos el usuario "pegado" para lo que se ejecute después
+            _thread_locals.user = None
 
 
 # ==========================================
@@ -79,4 +92,84 @@ class NoCacheMiddleware:
         if not request.path.startswith('/static/'):
             add_never_cache_headers(response)
         
-        return response
\ No newline at end of file
+        return response
+
+
+# ==========================================
+# 3. PERFILADO (Server-Timing y log de requests lentas)
+# ==========================================
+
+class PerfiladoMiddleware:
+    """
+    Debe ir primero en MIDDLEWARE para que el total incluya a los demás. Sólo se
+    instala con PERFILADO = True; si no, Django lo descarta al arrancar.
+    """
+    def __init__(self, get_response):
+        if not getattr(settings, 'PERFILADO', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.lento_ms = getattr(settings, 'PERFILADO_LENTO_MS', 1000)
+        self.top_consultas = getattr(settings, 'PERFILADO_TOP_CONSULTAS', 5)
+
+    def __call__(self, request):
+        perfil = perfilado.iniciar(self.top_consultas)
+        try:
+            with ExitStack() as pila:
+                for conexion in connections.all():
+                    pila.enter_context(conexion.execute_wrapper(perfil.medir_sql))
+                response = self.get_response(request)
+        finally:
+            perfilado.terminar()
+
+        response['Server-Timing'] = perfil.server_timing()
+        if perfil.total_ms >= self.lento_ms:
+            lentas = ''.join(f'\n  {ms:8.1f} ms  {sql[:500]}' for ms, sql in perfil.consultas_lentas())
+            logger.warning(
+                'Request lenta: %s %s -> %s en %.0f ms (SQL %.0f ms / %d consultas, plantillas %.0f ms, '
+                'serialización %.0f ms). Consultas más lentas:%s',
+                request.method, request.get_full_path(), response.status_code, perfil.total_ms,
+                perfil.sql_ms, perfil.consultas, perfil.plantillas_ms, perfil.serializacion_ms, lentas,
+            )
+        return response
+
+    def process_template_response(self, request, response):
+        # Es el último process_template_response antes de response.render(): lo que sigue
+        # es el render. En las respuestas de la API eso es la serialización (JSON, CSV...)
+        perfil = perfilado.actual()
+        if perfil is not None and isinstance(response, Response):
+            inicio = time.perf_counter()
+
+            def medir(rendered):
+                perfil.serializacion_ms += (time.perf_counter() - inicio) * 1000
+
+            response.add_post_render_callback(medir)
+        return response
+
+
+
+# ==========================================
+# 4. RÉPLICA DE LECTURA (ver core/router.py)
+# ==========================================
+
+class ReplicaMiddleware:
+    """
+    Marca las requests de sólo lectura (GET/HEAD/OPTIONS) para que ReplicaRouter las
+    envíe a la réplica. Tras una escritura deja una cookie por REPLICA_PEGAR_SEGUNDOS:
+    mientras exista, las requests de ese navegador leen de la primaria y el usuario ve
+    sus propios cambios aunque la réplica vaya atrasada. Sin REPLICA_LECTURA, Django lo descarta.
+    """
+    COOKIE = 'primaria'
+    SEGURAS = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'REPLICA_LECTURA', None):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.pegar_segundos = getattr(settings, 'REPLICA_PEGAR_SEGUNDOS', 15)
+
+    def __call__(self, request):
+        router.permitir_replica(request.method in self.SEGURAS and self.COOKIE not in request.COOKIES)
+        response = self.get_response(request)
+        if request.method not in self.SEGURAS or router.escribio():
+            response.set_cookie(self.COOKIE, '1', max_age=self.pegar_segundos, httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.8 on 2026-10-19 14:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_auditlog_bulk_action'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CambioCalificacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('calificacion_id', models.BigIntegerField(db_index=True)),
+                ('accion', models.CharField(choices=[('UPSERT', 'Creación / Actualización'), ('DELETE', 'Eliminación')], default='UPSERT', max_length=6)),
+                ('fecha', models.DateTimeField(auto_now_add=True)),
+                ('transaccion', models.BigIntegerField(db_default=models.Func(function='pg_current_xact_id', template='%(function)s()::text::bigint'))),
+            ],
+            options={
+                'verbose_name': 'Cambio de Calificación',
+                'verbose_name_plural': 'Cambios de Calificaciones',
+                'indexes': [models.Index(fields=['transaccion', 'id'], name='cambio_feed_idx')],
+            },
+        ),
+        # Punto de partida del feed: las calificaciones ya existentes entran como UPSERT
+        migrations.RunSQL(
+            sql="""
+                INSERT INTO core_cambiocalificacion (calificacion_id, accion, fecha)
+                SELECT id, 'UPSERT', NOW() FROM core_calificaciontributaria ORDER BY id
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.8 on 2026-10-19 14:19
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_cambiocalificacion'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='eventocorporativo',
+            name='emisor',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, to='core.emisor'),
+        ),
+        migrations.AddIndex(
+            model_name='eventocorporativo',
+            index=models.Index(fields=['ejercicio_comercial', 'mercado', 'fecha_pago'], include=('id', 'emisor'), name='evento_ejer_merc_fpago_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='eventocorporativo',
+            index=models.Index(fields=['ejercicio_comercial', 'fecha_pago'], include=('id',), name='evento_ejer_fpago_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='eventocorporativo',
+            index=models.Index(fields=['emisor', 'ejercicio_comercial', 'fecha_pago'], include=('id',), name='evento_emisor_ejer_fpago_idx'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.8 on 2026-10-19 14:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_indices_filtros_calificaciones'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumenEmisor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ejercicio', models.PositiveIntegerField()),
+                ('mercado', models.CharField(choices=[('ACN', 'Acciones'), ('CFI', 'Cuotas Fondos de Inversión'), ('CFM', 'Cuotas Fondos Mutuos')], max_length=3)),
+                ('eventos', models.PositiveIntegerField(default=0)),
+                ('monto_total', models.DecimalField(decimal_places=4, default=0, max_digits=24)),
+                ('actualizado', models.DateTimeField(auto_now=True)),
+                ('emisor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumenes', to='core.emisor')),
+            ],
+            options={
+                'verbose_name': 'Resumen por Emisor',
+                'verbose_name_plural': 'Resúmenes por Emisor',
+                'ordering': ['-ejercicio', 'mercado', 'emisor'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ResumenFactor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cantidad', models.PositiveIntegerField(default=0)),
+                ('suma', models.DecimalField(decimal_places=8, default=0, max_digits=20)),
+                ('maximo', models.DecimalField(decimal_places=8, default=0, max_digits=10)),
+                ('concepto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.conceptofactor')),
+                ('resumen', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='factores', to='core.resumenemisor')),
+            ],
+            options={
+                'verbose_name': 'Resumen de Factor',
+                'verbose_name_plural': 'Resúmenes de Factores',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='resumenemisor',
+            constraint=models.UniqueConstraint(fields=('ejercicio', 'mercado', 'emisor'), name='resumen_emisor_clave_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='resumenfactor',
+            constraint=models.UniqueConstraint(fields=('resumen', 'concepto'), name='resumen_factor_clave_uniq'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.8 on 2026-10-19 14:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_resumenes_preagregados'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnomaliaCalificacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ejercicio', models.PositiveIntegerField(db_index=True)),
+                ('codigo', models.CharField(choices=[('DESVIO_EMISOR', 'Lejos de la historia del emisor'), ('DESVIO_COLUMNA', 'Lejos de la historia de la columna'), ('COLUMNA_INUSUAL', 'Columna que el emisor nunca usó'), ('SUMA_LIMITE', 'Suma de créditos cerca del tope'), ('SIN_FACTORES', 'Sin factores informados')], max_length=20)),
+                ('columna_dj', models.PositiveSmallIntegerField(blank=True, help_text='Vacío = hallazgo de la fila completa', null=True)),
+                ('valor', models.DecimalField(blank=True, decimal_places=8, max_digits=12, null=True)),
+                ('referencia', models.DecimalField(blank=True, decimal_places=8, max_digits=12, null=True)),
+                ('puntaje', models.FloatField(blank=True, null=True)),
+                ('detectada', models.DateTimeField(auto_now_add=True)),
+                ('calificacion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='anomalias', to='core.calificaciontributaria')),
+            ],
+            options={
+                'verbose_name': 'Anomalía de Calificación',
+                'verbose_name_plural': 'Anomalías de Calificaciones',
+                'ordering': ['calificacion', 'columna_dj'],
+                'indexes': [models.Index(fields=['codigo', 'calificacion'], name='anomalia_codigo_calif_idx')],
+            },
+        ),
+    ]
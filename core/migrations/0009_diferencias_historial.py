@@ -0,0 +1,35 @@
+# Generated by Django 5.2.8 on 2026-10-19 14:41
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_anomalias_calificacion'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DiferenciaHistorial',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('calificacion_id', models.BigIntegerField()),
+                ('fecha', models.DateTimeField()),
+                ('tipo', models.CharField(choices=[('+', 'Creación'), ('~', 'Edición'), ('-', 'Eliminación')], max_length=1)),
+                ('cambios', models.JSONField(default=dict, help_text='{campo: {old, new}}')),
+                ('factores', models.JSONField(default=dict, help_text='{columna_dj: {old, new}}')),
+                ('vector', models.JSONField(blank=True, null=True)),
+                ('historial', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='diferencia', to='core.historicalcalificaciontributaria')),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Diferencia de Historial',
+                'verbose_name_plural': 'Diferencias de Historial',
+                'indexes': [models.Index(fields=['calificacion_id', '-fecha', '-id'], name='diferencia_calif_fecha_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 5.2.8 on 2026-10-19 14:45
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_diferencias_historial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FotoCalificacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('calificacion_id', models.BigIntegerField()),
+                ('calificacion', models.JSONField()),
+                ('evento', models.JSONField()),
+                ('factores', models.JSONField(default=dict)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FotoGrilla',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateTimeField(unique=True)),
+                ('calificaciones', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Foto de la Grilla',
+                'verbose_name_plural': 'Fotos de la Grilla',
+                'ordering': ['-fecha'],
+            },
+        ),
+        migrations.AlterField(
+            model_name='historicalcalificaciontributaria',
+            name='history_date',
+            field=models.DateTimeField(),
+        ),
+        migrations.AlterField(
+            model_name='historicaleventocorporativo',
+            name='history_date',
+            field=models.DateTimeField(),
+        ),
+        migrations.AddIndex(
+            model_name='diferenciahistorial',
+            index=models.Index(fields=['fecha', 'calificacion_id'], name='diferencia_fecha_calif_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='historicalcalificaciontributaria',
+            index=models.Index(fields=['history_date', 'id'], name='core_histor_history_35c8b3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='historicaleventocorporativo',
+            index=models.Index(fields=['history_date', 'id'], name='core_histor_history_b65575_idx'),
+        ),
+        migrations.AddField(
+            model_name='fotocalificacion',
+            name='foto',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='filas', to='core.fotogrilla'),
+        ),
+        migrations.AddConstraint(
+            model_name='fotocalificacion',
+            constraint=models.UniqueConstraint(fields=('foto', 'calificacion_id'), name='foto_calificacion_uniq'),
+        ),
+    ]
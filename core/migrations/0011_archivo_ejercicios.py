@@ -0,0 +1,35 @@
+# Generated by Django 5.2.8 on 2026-10-19 15:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_reconstruccion_al_instante'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EjercicioArchivado',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ejercicio', models.PositiveIntegerField(unique=True)),
+                ('fecha', models.DateTimeField(auto_now_add=True)),
+                ('eventos', models.PositiveIntegerField(default=0)),
+                ('calificaciones', models.PositiveIntegerField(default=0)),
+                ('factores', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Ejercicio Archivado',
+                'verbose_name_plural': 'Ejercicios Archivados',
+                'ordering': ['ejercicio'],
+            },
+        ),
+        migrations.AlterField(
+            model_name='anomaliacalificacion',
+            name='calificacion',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='anomalias', to='core.calificaciontributaria'),
+        ),
+    ]
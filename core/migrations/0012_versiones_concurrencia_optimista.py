@@ -0,0 +1,52 @@
+# Generated by Django 5.2.8 on 2026-10-19 15:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_archivo_ejercicios'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='calificaciontributaria',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.AddField(
+            model_name='eventocorporativo',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.AddField(
+            model_name='historicalcalificaciontributaria',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.AddField(
+            model_name='historicaleventocorporativo',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        # Cada UPDATE sube la versión, venga del ORM, de un queryset.update o de un upsert
+        migrations.RunSQL(
+            sql="""
+                CREATE OR REPLACE FUNCTION core_version_siguiente() RETURNS trigger LANGUAGE plpgsql AS $$
+                BEGIN
+                    NEW.version := OLD.version + 1;
+                    RETURN NEW;
+                END $$;
+                CREATE TRIGGER version_siguiente BEFORE UPDATE ON core_calificaciontributaria
+                    FOR EACH ROW EXECUTE FUNCTION core_version_siguiente();
+                CREATE TRIGGER version_siguiente BEFORE UPDATE ON core_eventocorporativo
+                    FOR EACH ROW EXECUTE FUNCTION core_version_siguiente();
+            """,
+            reverse_sql="""
+                DROP TRIGGER IF EXISTS version_siguiente ON core_calificaciontributaria;
+                DROP TRIGGER IF EXISTS version_siguiente ON core_eventocorporativo;
+                DROP FUNCTION IF EXISTS core_version_siguiente();
+            """,
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.8 on 2026-10-19 15:48
+
+import django.db.models.functions.datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_versiones_concurrencia_optimista'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AvisoSalida',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('calificacion_id', models.BigIntegerField()),
+                ('fecha', models.DateTimeField(auto_now_add=True)),
+                ('intentos', models.PositiveIntegerField(default=0)),
+                ('proximo_intento', models.DateTimeField(blank=True, db_default=django.db.models.functions.datetime.Now(), null=True)),
+                ('error', models.TextField(blank=True)),
+            ],
+            options={
+                'verbose_name': 'Aviso de Salida',
+                'verbose_name_plural': 'Avisos de Salida',
+                'indexes': [models.Index(fields=['proximo_intento', 'id'], name='aviso_pendiente_idx')],
+            },
+        ),
+    ]
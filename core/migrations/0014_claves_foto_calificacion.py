@@ -0,0 +1,68 @@
+# Generated by Django 5.2.8 on 2026-10-19 16:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_avisos_salida'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fotocalificacion',
+            name='ejercicio_comercial',
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='fotocalificacion',
+            name='emisor_id',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='fotocalificacion',
+            name='estado',
+            field=models.CharField(blank=True, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='fotocalificacion',
+            name='evento_id',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='fotocalificacion',
+            name='fecha_pago',
+            field=models.DateField(null=True),
+        ),
+        migrations.AddField(
+            model_name='fotocalificacion',
+            name='mercado',
+            field=models.CharField(blank=True, max_length=3),
+        ),
+        # Fotos ya tomadas: las claves salen de sus JSON (los valores se guardaron como texto)
+        migrations.RunSQL(
+            sql="""
+                UPDATE core_fotocalificacion SET
+                    evento_id = (evento->>'id')::bigint,
+                    emisor_id = (evento->>'emisor_id')::bigint,
+                    mercado = COALESCE(evento->>'mercado', ''),
+                    ejercicio_comercial = (evento->>'ejercicio_comercial')::integer,
+                    fecha_pago = (evento->>'fecha_pago')::date,
+                    estado = COALESCE(calificacion->>'estado', '');
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='fotocalificacion',
+            index=models.Index(fields=['foto', 'ejercicio_comercial', 'mercado', 'fecha_pago'], name='foto_calif_ejer_merc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fotocalificacion',
+            index=models.Index(fields=['foto', 'emisor_id', 'ejercicio_comercial'], name='foto_calif_emisor_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fotocalificacion',
+            index=models.Index(fields=['foto', 'evento_id'], name='foto_calif_evento_idx'),
+        ),
+    ]
@@ -1,12 +1,46 @@
 # core/models.py
 
 from django.db import models
+from django.db.models.functions import Now
 from django.conf import settings
 from django.contrib.auth.models import User
 from simple_history.models import HistoricalRecords
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
 
+# --- CONCURRENCIA OPTIMISTA (ver core/versiones.py) ---
+
+class ConflictoVersion(Exception):
+    """El registro cambió desde que se leyó: su versión ya no es la esperada."""
+
+    def __init__(self, instancia, esperada):
+        self.modelo = type(instancia)
+        self.pk = instancia.pk
+        self.esperada = esperada
+        super().__init__(
+            f"{self.modelo._meta.verbose_name.capitalize()} #{self.pk}: otro usuario o proceso guardó "
+            f"cambios después de que se leyó."
+        )
+
+
+class Versionado:
+    """
+    Modelos con columna 'version'. save() escribe con UPDATE ... WHERE id = %s AND
+    version = <la leída>: si otro ya guardó, lanza ConflictoVersion en vez de pisar sus
+    cambios. La versión la sube el trigger 'version_siguiente' en cada UPDATE, también
+    en los masivos (queryset.update, upserts de la carga).
+    """
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        esperada = self.version
+        if super()._do_update(base_qs.filter(version=esperada), using, pk_val, values, update_fields, forced_update):
+            self.version = esperada + 1
+            return True
+        if base_qs.filter(pk=pk_val).exists():
+            raise ConflictoVersion(self, esperada)
+        return False  # Ya no existe: save() lo vuelve a insertar, como siempre
+
+
 # --- TABLAS MAESTRAS (Catálogos) ---
 
 class Emisor(models.Model):
@@ -33,13 +67,14 @@ class ConceptoFactor(models.Model):
 
 # --- TABLAS TRANSACCIONALES ---
 #Entidad transaccional vinculada por FK
-class EventoCorporativo(models.Model):
+class EventoCorporativo(Versionado, models.Model):
     MERCADO_CHOICES = [
         ('ACN', 'Acciones'),
         ('CFI', 'Cuotas Fondos de Inversión'),
         ('CFM', 'Cuotas Fondos Mutuos'),
     ]
-    emisor = models.ForeignKey(Emisor, on_delete=models.PROTECT, db_index=True)
+    # Sin índice propio: lo cubre evento_emisor_ejer_fpago_idx (columna inicial emisor)
+    emisor = models.ForeignKey(Emisor, on_delete=models.PROTECT, db_index=False)
     mercado = models.CharField(max_length=3, choices=MERCADO_CHOICES, default='ACN')
     
     fecha_pago = models.DateField(db_index=True)
@@ -51,16 +86,27 @@ class EventoCorporativo(models.Model):
 
     creado_por = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
     fecha_creacion = models.DateTimeField(auto_now_add=True)
+    # Concurrencia optimista: ver Versionado
+    version = models.PositiveIntegerField(default=1, editable=False)
     history = HistoricalRecords()
 
     class Meta:
         unique_together = ('emisor', 'numero_dividendo', 'ejercicio_comercial')
+        indexes = [
+            # Mantenedor / API: filtro por ejercicio (+ mercado) ordenado por fecha de pago.
+            # INCLUDE id/emisor: los COUNT(*) de la paginación y el join con la calificación se resuelven sólo con el índice
+            models.Index(fields=['ejercicio_comercial', 'mercado', 'fecha_pago'], include=['id', 'emisor'], name='evento_ejer_merc_fpago_idx'),
+            # Sólo ejercicio (el filtro 'periodo' más común), ordenado por fecha de pago
+            models.Index(fields=['ejercicio_comercial', 'fecha_pago'], include=['id'], name='evento_ejer_fpago_idx'),
+            # Filtro por emisor (+ ejercicio) ordenado por fecha de pago. También cubre la FK emisor_id.
+            models.Index(fields=['emisor', 'ejercicio_comercial', 'fecha_pago'], include=['id'], name='evento_emisor_ejer_fpago_idx'),
+        ]
     
     def __str__(self):
         return f"{self.emisor} - Div #{self.numero_dividendo} ({self.ejercicio_comercial})"
 
 #Cabecera de la calificación (1:1 con Evento)
-class CalificacionTributaria(models.Model):
+class CalificacionTributaria(Versionado, models.Model):
     # 1. Definimos las opciones como un atributo de la clase.
     ESTADO_CHOICES = [
         ('BORRADOR', 'Borrador'),
@@ -68,6 +114,13 @@ class CalificacionTributaria(models.Model):
         ('VALIDADO', 'Validado'),
         ('RECHAZADO', 'Rechazado'),
     ]
+    # Flujo de revisión: estado actual -> estados a los que puede pasar
+    TRANSICIONES = {
+        'BORRADOR': {'EN_REVISION'},
+        'EN_REVISION': {'VALIDADO', 'RECHAZADO', 'BORRADOR'},
+        'RECHAZADO': {'BORRADOR', 'EN_REVISION'},
+        'VALIDADO': {'EN_REVISION'},  # Reapertura
+    }
 
     evento = models.OneToOneField(EventoCorporativo, on_delete=models.CASCADE, related_name='calificacion')
     
@@ -84,6 +137,8 @@ class CalificacionTributaria(models.Model):
     
     ultima_modificacion = models.DateTimeField(auto_now=True)
     modificado_por = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    # Concurrencia optimista: ver Versionado
+    version = models.PositiveIntegerField(default=1, editable=False)
     history = HistoricalRecords()
 
     def __str__(self):
@@ -106,6 +161,7 @@ class AuditLog(models.Model):
         ('UPDATE', 'Actualización'),
         ('DELETE', 'Eliminación'),
         ('LOGIN', 'Inicio de Sesión'),
+        ('BULK', 'Operación Masiva'),
     )
 
     # Quién
@@ -139,4 +195,227 @@ class AuditLog(models.Model):
         verbose_name_plural = 'Registros de Auditoría'
 
     def __str__(self):
-        return f"{self.timestamp} - {self.user} - {self.action}"
\ No newline at end of file
+        return f"{self.timestamp} - {self.user} - {self.action}"
+
+#Registro de cambios para sincronización incremental (change feed)
+class CambioCalificacion(models.Model):
+    ACCION_CHOICES = [
+        ('UPSERT', 'Creación / Actualización'),
+        ('DELETE', 'Eliminación'),
+    ]
+
+    # Sin FK: la fila debe sobrevivir al borrado de la calificación (tombstone)
+    calificacion_id = models.BigIntegerField(db_index=True)
+    accion = models.CharField(max_length=6, choices=ACCION_CHOICES, default='UPSERT')
+    fecha = models.DateTimeField(auto_now_add=True)
+    # Transacción que escribió el cambio. El feed se recorre por (transaccion, id) y sólo
+    # entrega transacciones ya terminadas: un cambio que confirma tarde no se salta nunca.
+    transaccion = models.BigIntegerField(db_default=models.Func(function='pg_current_xact_id', template='%(function)s()::text::bigint'))
+
+    class Meta:
+        indexes = [models.Index(fields=['transaccion', 'id'], name='cambio_feed_idx')]
+        verbose_name = 'Cambio de Calificación'
+        verbose_name_plural = 'Cambios de Calificaciones'
+
+    def __str__(self):
+        return f"#{self.pk} {self.accion} calificación {self.calificacion_id}"
+
+# Bandeja de salida (outbox) de avisos a sistemas externos (ver core/avisos.py). Se
+# escribe en la misma transacción que el cambio; despachar_avisos la vacía por lotes.
+class AvisoSalida(models.Model):
+    # Sin FK: el aviso de una calificación eliminada también se entrega
+    calificacion_id = models.BigIntegerField()
+    fecha = models.DateTimeField(auto_now_add=True)
+    intentos = models.PositiveIntegerField(default=0)
+    # Cuándo se puede volver a intentar. Vacío = agotó los reintentos (queda para revisión)
+    proximo_intento = models.DateTimeField(null=True, blank=True, db_default=Now())
+    error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['proximo_intento', 'id'], name='aviso_pendiente_idx')]
+        verbose_name = 'Aviso de Salida'
+        verbose_name_plural = 'Avisos de Salida'
+
+    def __str__(self):
+        return f"#{self.pk} calificación {self.calificacion_id} ({self.intentos} intentos)"
+
+
+# --- RESÚMENES PRE-AGREGADOS (ver core/resumenes.py) ---
+# Totales por (ejercicio, mercado, emisor) que se mantienen al día al cambiar
+# calificaciones o factores. Los reportes leen sólo de aquí.
+class ResumenEmisor(models.Model):
+    ejercicio = models.PositiveIntegerField()
+    mercado = models.CharField(max_length=3, choices=EventoCorporativo.MERCADO_CHOICES)
+    emisor = models.ForeignKey(Emisor, on_delete=models.CASCADE, related_name='resumenes')
+
+    eventos = models.PositiveIntegerField(default=0)
+    monto_total = models.DecimalField(max_digits=24, decimal_places=4, default=0)
+    actualizado = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['ejercicio', 'mercado', 'emisor'], name='resumen_emisor_clave_uniq'),
+        ]
+        ordering = ['-ejercicio', 'mercado', 'emisor']
+        verbose_name = 'Resumen por Emisor'
+        verbose_name_plural = 'Resúmenes por Emisor'
+
+    def __str__(self):
+        return f"{self.emisor} {self.mercado} ({self.ejercicio})"
+
+
+class ResumenFactor(models.Model):
+    resumen = models.ForeignKey(ResumenEmisor, on_delete=models.CASCADE, related_name='factores')
+    concepto = models.ForeignKey(ConceptoFactor, on_delete=models.CASCADE)
+
+    # Calificaciones con el factor informado, suma y máximo de sus valores
+    cantidad = models.PositiveIntegerField(default=0)
+    suma = models.DecimalField(max_digits=20, decimal_places=8, default=0)
+    maximo = models.DecimalField(max_digits=10, decimal_places=8, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['resumen', 'concepto'], name='resumen_factor_clave_uniq'),
+        ]
+        verbose_name = 'Resumen de Factor'
+        verbose_name_plural = 'Resúmenes de Factores'
+
+    @property
+    def promedio(self):
+        return self.suma / self.cantidad if self.cantidad else None
+
+    def __str__(self):
+        return f"{self.resumen} - {self.concepto}"
+
+
+# --- ANOMALÍAS DE FACTORES (ver core/anomalias.py) ---
+# Resultado del último análisis de cada ejercicio: una fila por hallazgo
+# (celda o calificación completa). El mantenedor filtra por estas marcas.
+class AnomaliaCalificacion(models.Model):
+    CODIGO_CHOICES = [
+        ('DESVIO_EMISOR', 'Lejos de la historia del emisor'),
+        ('DESVIO_COLUMNA', 'Lejos de la historia de la columna'),
+        ('COLUMNA_INUSUAL', 'Columna que el emisor nunca usó'),
+        ('SUMA_LIMITE', 'Suma de créditos cerca del tope'),
+        ('SIN_FACTORES', 'Sin factores informados'),
+    ]
+
+    # Sin restricción en la BD: las calificaciones de ejercicios archivados viven en otra
+    # tabla (ver core/archivo.py); el borrado en cascada lo sigue haciendo Django
+    calificacion = models.ForeignKey(CalificacionTributaria, on_delete=models.CASCADE, related_name='anomalias', db_constraint=False)
+    ejercicio = models.PositiveIntegerField(db_index=True)
+    codigo = models.CharField(max_length=20, choices=CODIGO_CHOICES)
+    columna_dj = models.PositiveSmallIntegerField(null=True, blank=True, help_text="Vacío = hallazgo de la fila completa")
+    valor = models.DecimalField(max_digits=12, decimal_places=8, null=True, blank=True)
+    # Valor esperado según la historia (promedio) y qué tan lejos está (desviaciones estándar)
+    referencia = models.DecimalField(max_digits=12, decimal_places=8, null=True, blank=True)
+    puntaje = models.FloatField(null=True, blank=True)
+    detectada = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['codigo', 'calificacion'], name='anomalia_codigo_calif_idx')]
+        ordering = ['calificacion', 'columna_dj']
+        verbose_name = 'Anomalía de Calificación'
+        verbose_name_plural = 'Anomalías de Calificaciones'
+
+    def __str__(self):
+        columna = f" col. {self.columna_dj}" if self.columna_dj else ''
+        return f"{self.get_codigo_display()}{columna} ({self.calificacion_id})"
+
+
+# --- DIFERENCIAS DEL HISTORIAL (ver core/historial.py) ---
+# Qué cambió en cada versión de una calificación, calculado una sola vez al
+# confirmar la transacción. DetalleFactor no tiene historial propio: cada fila
+# guarda el vector de factores vigente tras la versión para comparar con la siguiente.
+class DiferenciaHistorial(models.Model):
+    TIPO_CHOICES = [('+', 'Creación'), ('~', 'Edición'), ('-', 'Eliminación')]
+
+    # Vacío = cambio sólo de factores, sin versión de la cabecera
+    historial = models.OneToOneField(
+        'core.HistoricalCalificacionTributaria', on_delete=models.CASCADE,
+        null=True, blank=True, related_name='diferencia',
+    )
+    # Sin FK: el historial sobrevive al borrado de la calificación
+    calificacion_id = models.BigIntegerField()
+    fecha = models.DateTimeField()
+    usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    tipo = models.CharField(max_length=1, choices=TIPO_CHOICES)
+
+    cambios = models.JSONField(default=dict, help_text="{campo: {old, new}}")
+    factores = models.JSONField(default=dict, help_text="{columna_dj: {old, new}}")
+    # Factores {columna_dj: valor} tras esta versión (vacío = desconocido, anterior a este registro)
+    vector = models.JSONField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['calificacion_id', '-fecha', '-id'], name='diferencia_calif_fecha_idx'),
+            # Reconstrucción "al instante": vectores de factores dentro de un rango de fechas
+            models.Index(fields=['fecha', 'calificacion_id'], name='diferencia_fecha_calif_idx'),
+        ]
+        verbose_name = 'Diferencia de Historial'
+        verbose_name_plural = 'Diferencias de Historial'
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} calificación {self.calificacion_id} ({self.fecha:%Y-%m-%d %H:%M})"
+
+
+# --- FOTOS DE LA GRILLA (ver core/reconstruccion.py) ---
+# Estado completo de calificaciones, eventos y factores en un instante. La
+# reconstrucción "al instante" parte de la última foto anterior y sólo recorre
+# el historial posterior a ella.
+class FotoGrilla(models.Model):
+    fecha = models.DateTimeField(unique=True)
+    calificaciones = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-fecha']
+        verbose_name = 'Foto de la Grilla'
+        verbose_name_plural = 'Fotos de la Grilla'
+
+    def __str__(self):
+        return f"Foto {self.fecha:%Y-%m-%d %H:%M} ({self.calificaciones} calificaciones)"
+
+
+class FotoCalificacion(models.Model):
+    foto = models.ForeignKey(FotoGrilla, on_delete=models.CASCADE, related_name='filas')
+    calificacion_id = models.BigIntegerField()
+    # Campos (attname: valor) de la calificación y de su evento, y factores {columna_dj: valor}
+    calificacion = models.JSONField()
+    evento = models.JSONField()
+    factores = models.JSONField(default=dict)
+    # Claves de los filtros del mantenedor / API, copiadas del JSON: se filtra en SQL
+    evento_id = models.BigIntegerField(null=True)
+    emisor_id = models.BigIntegerField(null=True)
+    mercado = models.CharField(max_length=3, blank=True)
+    ejercicio_comercial = models.PositiveIntegerField(null=True)
+    fecha_pago = models.DateField(null=True)
+    estado = models.CharField(max_length=20, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['foto', 'calificacion_id'], name='foto_calificacion_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['foto', 'ejercicio_comercial', 'mercado', 'fecha_pago'], name='foto_calif_ejer_merc_idx'),
+            models.Index(fields=['foto', 'emisor_id', 'ejercicio_comercial'], name='foto_calif_emisor_idx'),
+            models.Index(fields=['foto', 'evento_id'], name='foto_calif_evento_idx'),
+        ]
+
+
+# --- ARCHIVO DE EJERCICIOS CERRADOS (ver core/archivo.py) ---
+# Ejercicios cuyos eventos, calificaciones y factores se movieron a las tablas del
+# esquema 'archivo' (heredan de las tablas de la aplicación: se siguen consultando igual).
+class EjercicioArchivado(models.Model):
+    ejercicio = models.PositiveIntegerField(unique=True)
+    fecha = models.DateTimeField(auto_now_add=True)
+    eventos = models.PositiveIntegerField(default=0)
+    calificaciones = models.PositiveIntegerField(default=0)
+    factores = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['ejercicio']
+        verbose_name = 'Ejercicio Archivado'
+        verbose_name_plural = 'Ejercicios Archivados'
+
+    def __str__(self):
+        return f"Ejercicio {self.ejercicio} (archivado {self.fecha:%Y-%m-%d})"
@@ -0,0 +1,47 @@
+# core/pendientes.py
+# Trabajo diferido al commit: durante la transacción se acumulan valores (ids,
+# claves) y al confirmar se llama UNA vez a la función con todos ellos. Si la
+# transacción (o el savepoint donde se registró) se revierte, se descarta.
+from django.db import transaction
+
+
+class Pendientes:
+
+    def __init__(self, funcion):
+        self.funcion = funcion
+        self.valores = set()
+        # Datos auxiliares de la transacción (p.ej. cachés para no repetir consultas)
+        self.cache = {}
+        self.aplicado = False
+
+    def aplicar(self):
+        self.aplicado = True
+        self.funcion(self.valores)
+
+
+def pendientes(nombre, funcion):
+    """Pendientes de la transacción en curso para 'nombre' (se registra el on_commit la primera vez)."""
+    conexion = transaction.get_connection()
+    registro = conexion.__dict__.setdefault('_pendientes', {})
+    actual = registro.get(nombre)
+    # Ya aplicado, o descartado por un rollback (sale de run_on_commit): empezamos de nuevo
+    if (actual is None or actual.aplicado
+            or not any(f == actual.aplicar for _, f, _ in conexion.run_on_commit)):
+        actual = registro[nombre] = Pendientes(funcion)
+        transaction.on_commit(actual.aplicar)
+    return actual
+
+
+def en_transaccion():
+    return transaction.get_connection().in_atomic_block
+
+
+def al_confirmar(nombre, valores, funcion):
+    """Acumula 'valores' para llamar funcion(valores) al confirmar; sin transacción, la llama de inmediato."""
+    valores = set(valores)
+    if not valores:
+        return
+    if not en_transaccion():
+        funcion(valores)
+        return
+    pendientes(nombre, funcion).valores.update(valores)
@@ -0,0 +1,114 @@
+# core/perfilado.py
+# Desglose del tiempo de cada request: SQL (tiempo y cantidad, vía execute_wrapper),
+# render de plantillas, serialización de respuestas de la API y total. Lo activa
+# PerfiladoMiddleware (core/middleware.py) con PERFILADO = True; mientras no haya
+# un perfil en curso, el backend de plantillas de este módulo no mide nada.
+import heapq
+import threading
+import time
+from django.template.backends.django import DjangoTemplates as _DjangoTemplates
+
+_actual = threading.local()
+
+
+class Perfil:
+    """Tiempos (ms) acumulados de una request y sus N consultas más lentas."""
+
+    def __init__(self, top_consultas):
+        self.inicio = time.perf_counter()
+        self.sql_ms = 0.0
+        self.consultas = 0
+        self.plantillas_ms = 0.0
+        self.serializacion_ms = 0.0
+        self.total_ms = None
+        self.top_consultas = top_consultas
+        self._lentas = []  # heap de (ms, orden, sql): sólo se guardan las N más lentas
+        self._profundidad = 0  # Plantillas renderizadas dentro de otra: se cuentan una vez
+
+    def medir_sql(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            ms = (time.perf_counter() - inicio) * 1000
+            self.sql_ms += ms
+            self.consultas += 1
+            if self.top_consultas:
+                entrada = (ms, self.consultas, sql)
+                if len(self._lentas) < self.top_consultas:
+                    heapq.heappush(self._lentas, entrada)
+                else:
+                    heapq.heappushpop(self._lentas, entrada)
+
+    def terminar(self):
+        self.total_ms = (time.perf_counter() - self.inicio) * 1000
+
+    @property
+    def aplicacion_ms(self):
+        """Lo que no es SQL, plantillas ni serialización (lógica de la vista, middleware)."""
+        return max(self.total_ms - self.sql_ms - self.plantillas_ms - self.serializacion_ms, 0.0)
+
+    def consultas_lentas(self):
+        """[(ms, sql)] de la más lenta a la más rápida."""
+        return [(ms, sql) for ms, _, sql in sorted(self._lentas, reverse=True)]
+
+    def server_timing(self):
+        """Valor del header Server-Timing."""
+        metricas = [
+            ('sql', self.sql_ms, f'SQL ({self.consultas} consultas)'),
+            ('tpl', self.plantillas_ms, 'Plantillas'),
+            ('ser', self.serializacion_ms, 'Serialización'),
+            ('app', self.aplicacion_ms, 'Aplicación'),
+            ('total', self.total_ms, 'Total'),
+        ]
+        return ', '.join(f'{nombre};dur={ms:.1f};desc="{desc}"' for nombre, ms, desc in metricas)
+
+
+def iniciar(top_consultas):
+    _actual.perfil = Perfil(top_consultas)
+    return _actual.perfil
+
+
+def terminar():
+    perfil = getattr(_actual, 'perfil', None)
+    _actual.perfil = None
+    if perfil is not None:
+        perfil.terminar()
+    return perfil
+
+
+def actual():
+    return getattr(_actual, 'perfil', None)
+
+
+# --- Plantillas ---
+
+class _PlantillaMedida:
+    def __init__(self, plantilla):
+        self.plantilla = plantilla
+
+    def __getattr__(self, nombre):
+        return getattr(self.plantilla, nombre)
+
+    def render(self, context=None, request=None):
+        perfil = actual()
+        if perfil is None:
+            return self.plantilla.render(context, request)
+        perfil._profundidad += 1
+        inicio = time.perf_counter()
+        try:
+            return self.plantilla.render(context, request)
+        finally:
+            perfil._profundidad -= 1
+            if not perfil._profundidad:
+                perfil.plantillas_ms += (time.perf_counter() - inicio) * 1000
+
+
+class DjangoTemplates(_DjangoTemplates):
+    """El backend de plantillas de Django, con el tiempo de render medido en el perfil en curso."""
+
+    def from_string(self, template_code):
+        return _PlantillaMedida(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return _PlantillaMedida(super().get_template(template_name))
@@ -0,0 +1,323 @@
+# core/reconstruccion.py
+# Grilla "al instante": calificaciones, eventos y factores tal como estaban en un
+# momento dado. Se parte de la última foto (FotoGrilla) anterior al instante y se
+# le aplica sólo el historial posterior a ella: por tabla, la última versión de
+# cada registro dentro del rango (DISTINCT ON id ... ORDER BY id, history_date DESC),
+# sobre el índice (history_date, id). DetalleFactor no tiene historial: los
+# factores salen de los vectores guardados en DiferenciaHistorial. Los filtros se
+# aplican en la base: la foto guarda sus claves (mercado, ejercicio, emisor, fecha de
+# pago, estado) en columnas indexadas y del historial se leen sólo las últimas
+# versiones que pueden quedar en el resultado.
+# Sin fotos se recorre el historial completo (sólo aparecen los registros creados
+# con el historial activo); por eso conviene tomar una foto inicial y luego
+# periódicamente (comando tomar_foto_grilla).
+import operator
+from collections.abc import Sequence
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from functools import reduce
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef, Q, Subquery, TextField
+from django.db.models.functions import Cast
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from . import metricas
+from .models import (
+    CalificacionTributaria, ConceptoFactor, DetalleFactor, DiferenciaHistorial,
+    Emisor, EventoCorporativo, FotoCalificacion, FotoGrilla,
+)
+
+CAMPOS_CALIFICACION = tuple(f.attname for f in CalificacionTributaria._meta.concrete_fields)
+CAMPOS_EVENTO = tuple(f.attname for f in EventoCorporativo._meta.concrete_fields)
+# Las versiones escritas poco antes de la foto pueden confirmarse después de ella:
+# se vuelven a aplicar (aplicar la última versión es idempotente)
+MARGEN = timedelta(minutes=10)
+# Campos del evento que la foto guarda también como columnas (para filtrar en SQL)
+CLAVES_EVENTO_FOTO = ('emisor_id', 'mercado', 'ejercicio_comercial', 'fecha_pago')
+LOTE_BD = 1000
+
+
+# --- Fotos ---
+
+def tomar_foto():
+    """Guarda el estado completo de la grilla. Devuelve la FotoGrilla creada."""
+    aislar = not connection.in_atomic_block
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            if aislar:
+                # Una sola instantánea para todas las lecturas de la foto
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+            # clock_timestamp(): posterior a la instantánea, así nada de lo leído queda "en el futuro"
+            cursor.execute('SELECT clock_timestamp()')
+            fecha = cursor.fetchone()[0]
+
+        factores = DetalleFactor.objects.filter(calificacion=OuterRef('pk')).order_by().values('calificacion')
+        filas = (
+            CalificacionTributaria.objects.order_by()
+            .annotate(
+                # Mismo orden en ambos arreglos: se emparejan por posición
+                columnas=Subquery(factores.annotate(
+                    a=ArrayAgg('concepto__columna_dj', ordering='concepto__columna_dj')
+                ).values('a')),
+                valores=Subquery(factores.annotate(
+                    a=ArrayAgg(Cast('valor', TextField()), ordering='concepto__columna_dj')
+                ).values('a')),
+            )
+            .values_list(
+                *CAMPOS_CALIFICACION, *(f'evento__{c}' for c in CAMPOS_EVENTO), 'columnas', 'valores',
+            )
+        )
+        n_cal, n_ev = len(CAMPOS_CALIFICACION), len(CAMPOS_EVENTO)
+        foto = FotoGrilla.objects.create(fecha=fecha)
+        nuevas = []
+        for fila in filas.iterator(chunk_size=LOTE_BD):
+            calificacion = dict(zip(CAMPOS_CALIFICACION, fila[:n_cal]))
+            evento = dict(zip(CAMPOS_EVENTO, fila[n_cal:n_cal + n_ev]))
+            nuevas.append(FotoCalificacion(
+                foto=foto,
+                calificacion_id=calificacion['id'],
+                calificacion=_texto(calificacion),
+                evento=_texto(evento),
+                factores=dict(zip(map(str, fila[-2] or ()), fila[-1] or ())),
+                evento_id=evento['id'],
+                estado=calificacion['estado'],
+                **{campo: evento[campo] for campo in CLAVES_EVENTO_FOTO},
+            ))
+        FotoCalificacion.objects.bulk_create(nuevas, batch_size=LOTE_BD)
+        foto.calificaciones = len(nuevas)
+        foto.save(update_fields=['calificaciones'])
+    return foto
+
+
+def _texto(campos):
+    return {c: None if v is None else str(v) for c, v in campos.items()}
+
+
+def _tipar(modelo, campos):
+    """Inverso de _texto: cada valor al tipo de su campo."""
+    return {
+        f.attname: f.to_python(campos[f.attname])
+        for f in modelo._meta.concrete_fields if f.attname in campos
+    }
+
+
+# --- Reconstrucción ---
+
+def _versiones(modelo, desde, hasta):
+    versiones = modelo.history.model.objects.filter(history_date__lte=hasta)
+    if desde is not None:
+        versiones = versiones.filter(history_date__gt=desde)
+    return versiones
+
+
+def _ultimas_versiones(modelo, campos, desde, hasta, ids=None, filtro=None):
+    """
+    {id: campos | None si estaba borrado} con la última versión de cada registro en (desde, hasta].
+    'filtro' (Q) se aplica en la base a esa última versión, no a cualquiera del rango.
+    """
+    versiones = _versiones(modelo, desde, hasta)
+    if ids is not None:
+        versiones = versiones.filter(id__in=ids)
+    ultimas = versiones.order_by('id', '-history_date', '-history_id').distinct('id')
+    if filtro is not None:
+        ultimas = modelo.history.model.objects.filter(history_id__in=ultimas.values('history_id')).filter(filtro)
+    return {v['id']: None if v.pop('history_type') == '-' else v for v in ultimas.values('history_type', *campos)}
+
+
+def _aplicar(estado, versiones):
+    for pk, campos in versiones.items():
+        if campos is None:
+            estado.pop(pk, None)
+        else:
+            estado[pk] = campos
+
+
+class Grilla(Sequence):
+    """
+    Grilla reconstruida: filas livianas (diccionarios) que se convierten en instancias
+    sólo al leerlas, así la API pagina sin materializar las calificaciones fuera de la página.
+    """
+
+    def __init__(self, filas, emisores, conceptos):
+        self.filas = filas
+        self.emisores = emisores
+        self.conceptos = conceptos
+
+    def __len__(self):
+        return len(self.filas)
+
+    def __getitem__(self, indice):
+        if isinstance(indice, slice):
+            return [self._instancia(*fila) for fila in self.filas[indice]]
+        return self._instancia(*self.filas[indice])
+
+    def _instancia(self, campos, datos_evento, vector):
+        evento = EventoCorporativo(**datos_evento)
+        evento.emisor = self.emisores.get(evento.emisor_id)
+        calificacion = CalificacionTributaria(**campos)
+        calificacion.evento = evento
+        detalles = []
+        for columna, valor in sorted(vector.items(), key=lambda par: int(par[0])):
+            concepto = self.conceptos.get(int(columna))
+            if concepto is not None:
+                # Posicional y con el concepto directo a la caché: es el constructor más barato
+                detalle = DetalleFactor(None, calificacion.pk, concepto.pk, Decimal(valor))
+                detalle._state.fields_cache['concepto'] = concepto
+                detalles.append(detalle)
+        # Como si viniera de prefetch_related('detalles__concepto')
+        prefetch = DetalleFactor.objects.none()
+        prefetch._result_cache, prefetch._prefetch_done = detalles, True
+        calificacion._prefetched_objects_cache = {'detalles': prefetch}
+        return calificacion
+
+
+def _filtro_evento(mercado, nemonico, ejercicio, emisor, fecha_pago_desde, fecha_pago_hasta):
+    """
+    Filtros del evento como Q sobre mercado, ejercicio_comercial, emisor_id y fecha_pago:
+    sirve igual para los eventos, su historial y las filas de la foto. None si no hay filtros.
+    """
+    condiciones = []
+    if mercado:
+        condiciones.append(Q(mercado=mercado))
+    if ejercicio is not None:
+        condiciones.append(Q(ejercicio_comercial=ejercicio))
+    if emisor is not None:
+        condiciones.append(Q(emisor_id=emisor))
+    if nemonico:
+        condiciones.append(Q(emisor_id__in=Emisor.objects.filter(nemonico__icontains=nemonico).values('id')))
+    if fecha_pago_desde is not None:
+        condiciones.append(Q(fecha_pago__gte=fecha_pago_desde))
+    if fecha_pago_hasta is not None:
+        condiciones.append(Q(fecha_pago__lte=fecha_pago_hasta))
+    return reduce(operator.and_, condiciones) if condiciones else None
+
+
+def _y(*condiciones):
+    """AND de las condiciones que no son None (None = sin restricción)."""
+    condiciones = [c for c in condiciones if c is not None]
+    return reduce(operator.and_, condiciones) if condiciones else None
+
+
+def _o(*condiciones):
+    """OR de las condiciones; si alguna es None (sin restricción), el resultado tampoco restringe."""
+    return None if any(c is None for c in condiciones) else reduce(operator.or_, condiciones)
+
+
+def estado_al(instante, mercado=None, nemonico=None, ejercicio=None, estado=None, emisor=None,
+              fecha_pago_desde=None, fecha_pago_hasta=None):
+    """
+    Calificaciones tal como estaban en 'instante' (con los filtros del mantenedor / API),
+    ordenadas por fecha de pago descendente. Las instancias no están guardadas.
+    Los filtros se aplican en la base (columnas indexadas de la foto y última versión de
+    cada registro en el historial): sólo se leen las filas que pueden quedar en el resultado.
+    Los vectores de factores salen de las diferencias del historial, que se calculan al
+    confirmar cada cambio; las versiones anteriores a ellas las completa una sola vez el
+    comando calcular_diferencias_historial (no se calculan aquí: esto es una lectura).
+    """
+    filtro_evento = _filtro_evento(mercado, nemonico, ejercicio, emisor, fecha_pago_desde, fecha_pago_hasta)
+    filtro_estado = Q(estado=estado) if estado else None
+
+    foto = FotoGrilla.objects.filter(fecha__lte=instante).first()
+    metricas.CACHE_CONSULTAS.inc(cache='foto_grilla', resultado='miss' if foto is None else 'hit')
+    desde = foto.fecha - MARGEN if foto is not None else None
+    filas_foto = foto.filas.all() if foto is not None else FotoCalificacion.objects.none()
+    eventos_foto = filas_foto.filter(filtro_evento or Q()).values('evento_id')
+
+    # Eventos cambiados después de la foto: los de la foto que cumplían los filtros (pueden
+    # dejar de cumplirlos) y los que los cumplen al instante
+    eventos = _ultimas_versiones(
+        EventoCorporativo, CAMPOS_EVENTO, desde, instante,
+        filtro=_o(Q(id__in=eventos_foto), filtro_evento) if foto is not None else filtro_evento,
+    )
+    cambiados = [pk for pk, evento in eventos.items() if evento is not None]
+
+    calificaciones, vectores = {}, {}
+    seleccion_foto = filas_foto.filter(_y(_o(filtro_evento, Q(evento_id__in=cambiados)), filtro_estado) or Q())
+    for fila in seleccion_foto.iterator(chunk_size=LOTE_BD):
+        calificaciones[fila.calificacion_id] = _tipar(CalificacionTributaria, fila.calificacion)
+        eventos.setdefault(fila.evento_id, _tipar(EventoCorporativo, fila.evento))
+        vectores[fila.calificacion_id] = fila.factores
+
+    # Calificaciones cambiadas después de la foto: las leídas de ella, y las que cumplen el estado
+    # con un evento que puede cumplir los filtros (de la foto, cambiado, o sin foto ni historial en el rango)
+    if foto is not None:
+        evento_desconocido = (
+            ~Exists(filas_foto.filter(evento_id=OuterRef('evento_id')))
+            & ~Exists(_versiones(EventoCorporativo, desde, instante).filter(id=OuterRef('evento_id')))
+        )
+        candidatas = _o(
+            Q(id__in=seleccion_foto.values('calificacion_id')),
+            _y(filtro_estado, _o(Q(evento_id__in=eventos_foto), Q(evento_id__in=cambiados), evento_desconocido)
+               if filtro_evento else None),
+        )
+    else:
+        evento_desconocido = ~Exists(_versiones(EventoCorporativo, None, instante).filter(id=OuterRef('evento_id')))
+        candidatas = _y(filtro_estado, _o(Q(evento_id__in=cambiados), evento_desconocido) if filtro_evento else None)
+    _aplicar(calificaciones, _ultimas_versiones(CalificacionTributaria, CAMPOS_CALIFICACION, desde, instante, filtro=candidatas))
+
+    # Eventos que no cambiaron desde la foto (o sin foto): el de la foto, su última versión anterior, o el registro actual
+    faltantes = {c['evento_id'] for c in calificaciones.values()} - eventos.keys()
+    if faltantes:
+        for evento in filas_foto.filter(evento_id__in=faltantes).values_list('evento', flat=True):
+            evento = _tipar(EventoCorporativo, evento)
+            eventos[evento['id']] = evento
+        faltantes -= eventos.keys()
+    if faltantes:
+        eventos.update(_ultimas_versiones(EventoCorporativo, CAMPOS_EVENTO, None, instante, faltantes))
+        faltantes -= eventos.keys()
+        eventos.update(
+            (e['id'], e) for e in EventoCorporativo.objects.filter(pk__in=faltantes).values(*CAMPOS_EVENTO)
+        )
+
+    emisores = Emisor.objects.in_bulk({
+        eventos[c['evento_id']]['emisor_id'] for c in calificaciones.values() if eventos.get(c['evento_id'])
+    })
+    nemonico = (nemonico or '').lower()
+    filas = []
+    for pk, campos in calificaciones.items():
+        evento = eventos.get(campos['evento_id'])
+        if evento is None:
+            continue  # Evento borrado: la calificación se fue con él (CASCADE)
+        if (
+            (mercado and evento['mercado'] != mercado)
+            or (ejercicio is not None and evento['ejercicio_comercial'] != ejercicio)
+            or (estado and campos['estado'] != estado)
+            or (emisor is not None and evento['emisor_id'] != emisor)
+            or (fecha_pago_desde is not None and evento['fecha_pago'] < fecha_pago_desde)
+            or (fecha_pago_hasta is not None and evento['fecha_pago'] > fecha_pago_hasta)
+            or (nemonico and (evento['emisor_id'] not in emisores
+                              or nemonico not in emisores[evento['emisor_id']].nemonico.lower()))
+        ):
+            continue
+        filas.append((campos, evento))
+
+    # Vectores cambiados después de la foto, sólo de las calificaciones del resultado
+    diferencias = DiferenciaHistorial.objects.filter(vector__isnull=False, fecha__lte=instante)
+    if desde is not None:
+        diferencias = diferencias.filter(fecha__gt=desde)
+    vectores.update(
+        diferencias.filter(calificacion_id__in=[campos['id'] for campos, _ in filas])
+        .order_by('calificacion_id', '-fecha', '-id').distinct('calificacion_id')
+        .values_list('calificacion_id', 'vector')
+    )
+
+    filas.sort(key=lambda fila: (fila[1]['fecha_pago'], fila[0]['id']), reverse=True)
+    return Grilla(
+        [(campos, evento, vectores.get(campos['id']) or {}) for campos, evento in filas],
+        emisores, {c.columna_dj: c for c in ConceptoFactor.objects.all()},
+    )
+
+
+def parsear_instante(texto):
+    """'2024-05-01T10:30' o '2024-05-01' (= fin del día) -> datetime con zona. ValueError si no es válido."""
+    texto = (texto or '').strip()
+    instante = parse_datetime(texto)
+    if instante is None:
+        dia = parse_date(texto)
+        if dia is None:
+            raise ValueError(f"Fecha inválida: '{texto}'. Use AAAA-MM-DD o AAAA-MM-DDTHH:MM.")
+        instante = datetime.combine(dia, time.max)
+    if timezone.is_naive(instante):
+        instante = timezone.make_aware(instante)
+    return instante
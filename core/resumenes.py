@@ -0,0 +1,178 @@
+# core/resumenes.py
+# Tablas de resumen pre-agregadas (ResumenEmisor / ResumenFactor).
+# Cada escritura marca las claves (emisor, ejercicio) que tocó; al confirmar la
+# transacción se recalculan SOLO esas claves (todos sus mercados) con dos GROUP BY
+# acotados y se guardan con upserts. Recalcular es idempotente, así que marcar de
+# más nunca deja el resumen incorrecto. 'reconstruir' rehace todo desde cero.
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+from . import metricas
+from .models import CalificacionTributaria, EventoCorporativo, DetalleFactor, ResumenEmisor, ResumenFactor
+from .pendientes import al_confirmar, en_transaccion, pendientes
+
+LOTE_BD = 1000
+
+
+def recalcular(claves=None):
+    """
+    Recalcula los resúmenes de las claves [(emisor_id, ejercicio)] (None = todas).
+    Devuelve la cantidad de resúmenes vigentes dentro del alcance.
+    """
+    if claves is not None:
+        claves = set(claves)
+        if not claves:
+            return 0
+        emisores = {e for e, _ in claves}
+        ejercicios = {a for _, a in claves}
+    with transaction.atomic():
+        eventos = EventoCorporativo.objects.all()
+        factores = DetalleFactor.objects.all()
+        resumenes = ResumenEmisor.objects.all()
+        if claves is not None:
+            # Alcance = emisores x ejercicios marcados: puede incluir claves de más, nunca de menos
+            eventos = eventos.filter(emisor_id__in=emisores, ejercicio_comercial__in=ejercicios)
+            factores = factores.filter(
+                calificacion__evento__emisor_id__in=emisores,
+                calificacion__evento__ejercicio_comercial__in=ejercicios,
+            )
+            resumenes = resumenes.filter(emisor_id__in=emisores, ejercicio__in=ejercicios)
+
+        # --- 1. Totales por (ejercicio, mercado, emisor) ---
+        filas = (
+            eventos.order_by()
+            .values('ejercicio_comercial', 'mercado', 'emisor_id')
+            .annotate(n=Count('id'), monto=Sum('calificacion__monto_total_distribuido'))
+        )
+        nuevos = [
+            ResumenEmisor(
+                ejercicio=f['ejercicio_comercial'], mercado=f['mercado'], emisor_id=f['emisor_id'],
+                eventos=f['n'], monto_total=f['monto'] or 0,
+            )
+            for f in filas
+        ]
+        ResumenEmisor.objects.bulk_create(
+            nuevos,
+            batch_size=LOTE_BD,
+            update_conflicts=True,
+            unique_fields=['ejercicio', 'mercado', 'emisor'],
+            update_fields=['eventos', 'monto_total', 'actualizado'],
+        )
+        vigentes = {(r.ejercicio, r.mercado, r.emisor_id): r.pk for r in nuevos}
+
+        # Claves del alcance que ya no tienen eventos
+        sobrantes = resumenes.exclude(pk__in=vigentes.values())
+        _borrar(ResumenFactor.objects.filter(resumen__in=sobrantes))
+        _borrar(sobrantes)
+
+        # --- 2. Factores por columna: cantidad, suma y máximo ---
+        filas = (
+            factores.order_by()
+            .values(
+                'calificacion__evento__ejercicio_comercial', 'calificacion__evento__mercado',
+                'calificacion__evento__emisor_id', 'concepto_id',
+            )
+            .annotate(n=Count('id'), suma=Sum('valor'), maximo=Max('valor'))
+        )
+        detalle = [
+            ResumenFactor(
+                resumen_id=vigentes[(
+                    f['calificacion__evento__ejercicio_comercial'], f['calificacion__evento__mercado'],
+                    f['calificacion__evento__emisor_id'],
+                )],
+                concepto_id=f['concepto_id'], cantidad=f['n'], suma=f['suma'], maximo=f['maximo'],
+            )
+            for f in filas
+        ]
+        ResumenFactor.objects.bulk_create(
+            detalle,
+            batch_size=LOTE_BD,
+            update_conflicts=True,
+            unique_fields=['resumen', 'concepto'],
+            update_fields=['cantidad', 'suma', 'maximo'],
+        )
+        _borrar(
+            ResumenFactor.objects.filter(resumen_id__in=vigentes.values())
+            .exclude(pk__in=[d.pk for d in detalle])
+        )
+    return len(vigentes)
+
+
+def reconstruir():
+    """Rehace todas las tablas de resumen desde cero."""
+    with transaction.atomic():
+        _borrar(ResumenFactor.objects.all())
+        _borrar(ResumenEmisor.objects.all())
+        return recalcular()
+
+
+def _borrar(queryset):
+    # _raw_delete: un solo DELETE, sin cargar objetos ni pasar por las señales de auditoría
+    queryset._raw_delete(queryset.db)
+
+
+# --- Marcado incremental ---
+
+def marcar(claves):
+    """Marca claves (emisor_id, ejercicio) para recalcular al confirmar la transacción."""
+    al_confirmar('resumenes', claves, recalcular)
+
+
+def marcar_evento(evento):
+    marcar([(evento.emisor_id, evento.ejercicio_comercial)])
+
+
+def marcar_calificaciones(calificacion_ids):
+    """Marca las claves de estas calificaciones (se resuelven con una consulta, o desde la caché)."""
+    ids = set(calificacion_ids)
+    if not ids:
+        return
+    if not en_transaccion():
+        marcar(_claves_de(ids).values())
+        return
+    # calificacion_id -> clave, para no consultar la clave de cada factor guardado
+    claves = pendientes('resumenes', recalcular).cache
+    faltantes = ids - claves.keys()
+    metricas.CACHE_CONSULTAS.inc(len(ids) - len(faltantes), cache='claves_resumen', resultado='hit')
+    metricas.CACHE_CONSULTAS.inc(len(faltantes), cache='claves_resumen', resultado='miss')
+    if faltantes:
+        claves.update(_claves_de(faltantes))
+    marcar(claves[i] for i in ids if i in claves)
+
+
+def recordar_calificacion(calificacion):
+    """Marca la clave de una calificación cuyo evento ya está en memoria (sin consulta extra)."""
+    evento = calificacion.evento
+    clave = (evento.emisor_id, evento.ejercicio_comercial)
+    if en_transaccion():
+        pendientes('resumenes', recalcular).cache[calificacion.pk] = clave
+    marcar([clave])
+
+
+def _claves_de(calificacion_ids):
+    return {
+        pk: (emisor_id, ejercicio)
+        for pk, emisor_id, ejercicio in CalificacionTributaria.objects.filter(pk__in=calificacion_ids)
+        .values_list('pk', 'evento__emisor_id', 'evento__ejercicio_comercial')
+    }
+
+
+# --- Lectura (reportes y API: sólo tablas de resumen) ---
+
+def por_columna(resumenes):
+    """Combina los ResumenFactor de los resúmenes indicados: una fila por columna DJ."""
+    filas = (
+        ResumenFactor.objects.filter(resumen__in=resumenes)
+        .values('concepto__columna_dj', 'concepto__descripcion')
+        .annotate(cantidad=Sum('cantidad'), suma=Sum('suma'), maximo=Max('maximo'))
+        .order_by('concepto__columna_dj')
+    )
+    return [
+        {
+            'columna_dj': f['concepto__columna_dj'],
+            'descripcion': f['concepto__descripcion'],
+            'cantidad': f['cantidad'],
+            'promedio': f['suma'] / f['cantidad'] if f['cantidad'] else None,
+            'maximo': f['maximo'],
+        }
+        for f in filas
+    ]
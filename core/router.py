@@ -0,0 +1,73 @@
+# core/router.py
+# Lecturas en la réplica (alias REPLICA_LECTURA de DATABASES). Sólo se usa la réplica
+# dentro de una request que ReplicaMiddleware marcó como de lectura (GET/HEAD/OPTIONS
+# sin escrituras recientes del usuario) y mientras la request no haya escrito nada;
+# todo lo demás (comandos, tareas, transacciones, vistas que escriben) va a la primaria.
+import threading
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.signals import request_finished
+from django.db import DEFAULT_DB_ALIAS, connections
+
+_estado = threading.local()
+
+
+def permitir_replica(permitir):
+    """Llamado por ReplicaMiddleware al comenzar cada request."""
+    _estado.replica = permitir
+    _estado.escribio = False
+
+
+def escribio():
+    """True si en la request en curso ya se escribió en la primaria."""
+    return getattr(_estado, 'escribio', False)
+
+
+def _terminar(**kwargs):
+    # Al cerrar la respuesta (también las que se envían por partes, como la exportación)
+    _estado.replica = False
+    _estado.escribio = False
+
+
+request_finished.connect(_terminar, dispatch_uid='core.router.terminar')
+
+
+@contextmanager
+def en_primaria():
+    """Las lecturas dentro del bloque van a la primaria (leer y luego escribir en base a lo leído)."""
+    _estado.primaria = getattr(_estado, 'primaria', 0) + 1
+    try:
+        yield
+    finally:
+        _estado.primaria -= 1
+
+
+def alias_lectura():
+    """Alias al que van las lecturas en este momento."""
+    replica = getattr(settings, 'REPLICA_LECTURA', None)
+    if (not replica or not getattr(_estado, 'replica', False) or escribio()
+            or getattr(_estado, 'primaria', 0)
+            # En una transacción se lee lo que ella misma escribió (y select_for_update)
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block):
+        return DEFAULT_DB_ALIAS
+    return replica
+
+
+class ReplicaRouter:
+    """Lecturas a la réplica cuando se puede; escrituras y migraciones siempre a la primaria."""
+
+    def db_for_read(self, model, **hints):
+        return alias_lectura()
+
+    def db_for_write(self, model, **hints):
+        # Desde aquí la request lee de la primaria: el usuario ve lo que acaba de guardar
+        _estado.escribio = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Mismos datos en ambas bases
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # La réplica recibe el esquema por la replicación de PostgreSQL
+        return db == DEFAULT_DB_ALIAS
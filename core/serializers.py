@@ -1,5 +1,9 @@
+from decimal import Decimal
+from operator import attrgetter
+from django.db import models
 from rest_framework import serializers
-from .models import Emisor, EventoCorporativo, CalificacionTributaria, DetalleFactor
+from rest_framework.settings import api_settings
+from .models import Emisor, EventoCorporativo, CalificacionTributaria, ConceptoFactor, DetalleFactor, ResumenEmisor, ResumenFactor
 
 class EmisorSerializer(serializers.ModelSerializer):
     class Meta:
@@ -28,4 +32,255 @@ class CalificacionTributariaSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = CalificacionTributaria
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+
+
+# --- LECTURA RÁPIDA (API list / retrieve) ---
+
+def _formateador(campo):
+    """Elige UNA vez, por campo, cómo convertir el valor del modelo a su representación."""
+    if isinstance(campo, serializers.DecimalField):
+        cuantizador = Decimal(1).scaleb(-campo.decimal_places) if campo.decimal_places is not None else None
+        if getattr(campo, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING):
+            if cuantizador is None:
+                return lambda valor: format(valor, 'f')
+            return lambda valor: format(valor.quantize(cuantizador), 'f')
+        return (lambda valor: valor.quantize(cuantizador)) if cuantizador is not None else None
+    if isinstance(campo, serializers.PrimaryKeyRelatedField):
+        return lambda valor: valor.pk
+    if isinstance(campo, (serializers.IntegerField, serializers.BooleanField,
+                          serializers.CharField, serializers.ChoiceField)):
+        return None  # Llegan desde la BD con el tipo correcto
+    # Fechas, choices y demás: delegamos en el propio campo de DRF
+    return campo.to_representation
+
+
+def compilar(serializer):
+    """
+    Convierte un serializer en una función instancia -> dict equivalente a su
+    to_representation(), resolviendo de antemano el accesor y el formateador de
+    cada campo (incluidos los serializers anidados). Así no se recorren los
+    objetos Field de DRF por cada registro.
+    """
+    pasos = []
+    for nombre, campo in serializer.fields.items():
+        if campo.write_only:
+            continue
+        if isinstance(campo, serializers.ListSerializer):
+            formatear = campo.to_representation
+        elif isinstance(campo, serializers.BaseSerializer):
+            formatear = compilar(campo)
+        else:
+            formatear = _formateador(campo)
+        if isinstance(campo, serializers.PrimaryKeyRelatedField):
+            # Evitamos cargar el objeto relacionado: basta con la columna *_id
+            obtener, formatear = attrgetter(campo.source + '_id'), None
+        else:
+            obtener = attrgetter(campo.source)
+        pasos.append((nombre, obtener, formatear))
+
+    def representar(instancia):
+        datos = {}
+        for nombre, obtener, formatear in pasos:
+            valor = obtener(instancia)
+            datos[nombre] = valor if valor is None or formatear is None else formatear(valor)
+        return datos
+    return representar
+
+
+class CalificacionLecturaListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.manager.BaseManager) else data
+        # Compilamos una sola vez por respuesta, no por registro
+        representar = self.child.compilado()
+        return [representar(item) for item in iterable]
+
+
+class CalificacionLecturaSerializer(serializers.ModelSerializer):
+    """
+    Serializer de solo lectura para listar / consultar calificaciones rápido.
+    Declara sus campos como cualquier ModelSerializer (drf_spectacular documenta
+    el esquema real), pero la representación se arma con accesores precalculados
+    y los factores se entregan como un arreglo compacto ordenado por columna_dj.
+    """
+    evento = EventoCorporativoSerializer(read_only=True)
+    factores = serializers.ListField(
+        child=serializers.DecimalField(max_digits=10, decimal_places=8, allow_null=True),
+        read_only=True,
+        help_text="Valores de los factores en el orden de columna_dj del catálogo "
+                  "(posición 0 = columna 8 ... posición 29 = columna 37). null si el factor no está informado.",
+    )
+
+    class Meta:
+        model = CalificacionTributaria
+        fields = ['id', 'evento', 'monto_total_distribuido', 'monto_unitario_pesos', 'estado',
+                  'ultima_modificacion', 'modificado_por', 'version', 'factores']
+        list_serializer_class = CalificacionLecturaListSerializer
+
+    def compilado(self):
+        """Función instancia -> dict con los factores como arreglo por columna."""
+        columnas = self.context.get('columnas')
+        if columnas is None:
+            columnas = list(ConceptoFactor.objects.values_list('id', flat=True))
+        posicion = {concepto_id: i for i, concepto_id in enumerate(columnas)}
+        formatear_factor = _formateador(self.fields['factores'].child)
+        representar_cabecera = compilar(self._campos_cabecera())
+        total = len(columnas)
+
+        def representar(instancia):
+            datos = representar_cabecera(instancia)
+            factores = [None] * total
+            for detalle in instancia.detalles.all():
+                i = posicion.get(detalle.concepto_id)
+                if i is not None:
+                    factores[i] = formatear_factor(detalle.valor)
+            datos['factores'] = factores
+            return datos
+        return representar
+
+    def _campos_cabecera(self):
+        # Copia del serializer sin el campo 'factores' (se arma aparte)
+        cabecera = CalificacionLecturaSerializer(context=self.context)
+        cabecera.fields.pop('factores')
+        return cabecera
+
+    def to_representation(self, instance):
+        return self.compilado()(instance)
+
+# --- CARGA MASIVA VÍA API ---
+
+# Máximo de una columna integer de PostgreSQL: un valor mayor haría fallar el INSERT de todo el lote
+ENTERO_MAX = 2147483647
+
+
+class CalificacionBulkItemSerializer(serializers.Serializer):
+    """Un elemento de la carga masiva: evento + calificación + vector de factores."""
+    nemonico = serializers.CharField(max_length=20)
+    mercado = serializers.ChoiceField(choices=EventoCorporativo.MERCADO_CHOICES, default='ACN')
+    ejercicio_comercial = serializers.IntegerField(min_value=1900, max_value=ENTERO_MAX)
+    numero_dividendo = serializers.IntegerField(min_value=0, max_value=ENTERO_MAX)
+    secuencia = serializers.IntegerField(min_value=0, max_value=ENTERO_MAX, default=0)
+    fecha_pago = serializers.DateField()
+    fecha_registro = serializers.DateField(required=False, allow_null=True, default=None)
+    monto_total_distribuido = serializers.DecimalField(max_digits=20, decimal_places=4, min_value=0, default=0)
+    monto_unitario_pesos = serializers.DecimalField(max_digits=12, decimal_places=6, min_value=0, default=0)
+    estado = serializers.ChoiceField(choices=CalificacionTributaria.ESTADO_CHOICES, default='BORRADOR')
+    version = serializers.IntegerField(
+        min_value=1, max_value=ENTERO_MAX, required=False,
+        help_text="Versión de la calificación que se editó (ETag del detalle). Si ya no es la vigente, "
+                  "el elemento no se guarda y se informa como 'conflicto'.",
+    )
+    # Factores indexados por columna DJ: {"8": "0.12345678", "9": "0.5", ...}
+    factores = serializers.DictField(
+        child=serializers.DecimalField(max_digits=10, decimal_places=8),
+        required=False,
+        default=dict,
+    )
+
+    def validate_factores(self, factores):
+        # Aquí sólo la forma del vector (columnas del catálogo). Las reglas de negocio
+        # (negativos, rango, suma 8-19) se aplican a todo el lote con core.validacion.
+        columnas_validas = self.context.get('columnas_validas')
+        errores = {}
+        limpios = {}
+        for clave, valor in factores.items():
+            try:
+                columna = int(clave)
+            except (TypeError, ValueError):
+                errores[clave] = 'La columna debe ser un número entre 8 y 37.'
+                continue
+            if columnas_validas is not None and columna not in columnas_validas:
+                errores[clave] = f'La columna {columna} no existe en el catálogo de factores.'
+            else:
+                limpios[columna] = valor
+
+        if errores:
+            raise serializers.ValidationError(errores)
+        return limpios
+
+
+class BulkItemResultadoSerializer(serializers.Serializer):
+    indice = serializers.IntegerField()
+    resultado = serializers.ChoiceField(choices=['creado', 'actualizado', 'error', 'conflicto'])
+    id = serializers.IntegerField(required=False)
+    errores = serializers.DictField(required=False)
+    conflicto = serializers.DictField(
+        required=False, help_text="Lo que cambió desde la versión enviada: {version, cambios, factores, usuarios}.",
+    )
+
+
+class BulkResultadoSerializer(serializers.Serializer):
+    total = serializers.IntegerField()
+    creados = serializers.IntegerField()
+    actualizados = serializers.IntegerField()
+    con_error = serializers.IntegerField()
+    resultados = BulkItemResultadoSerializer(many=True)
+
+
+# --- TRANSICIÓN MASIVA DE ESTADO ---
+
+class TransicionSerializer(serializers.Serializer):
+    estado = serializers.ChoiceField(choices=CalificacionTributaria.ESTADO_CHOICES, help_text='Estado de destino.')
+    ids = serializers.ListField(
+        child=serializers.IntegerField(), required=False, allow_empty=False,
+        help_text='Calificaciones a cambiar. Si no se indica, se usan los filtros de la URL.',
+    )
+    motivo = serializers.CharField(required=False, allow_blank=True, default='', max_length=255)
+
+
+class TransicionResultadoSerializer(serializers.Serializer):
+    estado = serializers.CharField()
+    actualizadas = serializers.IntegerField()
+    desde = serializers.DictField(child=serializers.IntegerField(), help_text='Actualizadas por estado de origen.')
+    omitidas = serializers.DictField(child=serializers.IntegerField(), help_text="No admitían la transición, por estado ('ARCHIVADA': de un ejercicio archivado).")
+    ids = serializers.ListField(child=serializers.IntegerField())
+
+
+# --- CHANGE FEED ---
+
+class CambioSerializer(serializers.Serializer):
+    accion = serializers.ChoiceField(choices=['upsert', 'delete'])
+    id = serializers.IntegerField(help_text='Id de la calificación.')
+    secuencia = serializers.IntegerField(help_text='Id del cambio en el feed.')
+    calificacion = CalificacionLecturaSerializer(required=False, help_text='Estado actual (sólo en upsert).')
+
+
+class CambiosResultadoSerializer(serializers.Serializer):
+    desde = serializers.CharField()
+    siguiente = serializers.CharField(help_text="Token para la próxima consulta (?desde=...).")
+    hay_mas = serializers.BooleanField()
+    cambios = CambioSerializer(many=True)
+
+
+# --- RESÚMENES PRE-AGREGADOS ---
+
+class ResumenFactorSerializer(serializers.ModelSerializer):
+    columna_dj = serializers.IntegerField(source='concepto.columna_dj', read_only=True)
+    promedio = serializers.DecimalField(max_digits=20, decimal_places=8, read_only=True, allow_null=True)
+
+    class Meta:
+        model = ResumenFactor
+        fields = ['columna_dj', 'cantidad', 'promedio', 'maximo']
+
+
+class ResumenEmisorSerializer(serializers.ModelSerializer):
+    nemonico = serializers.CharField(source='emisor.nemonico', read_only=True)
+    factores = ResumenFactorSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = ResumenEmisor
+        fields = ['id', 'ejercicio', 'mercado', 'emisor', 'nemonico', 'eventos', 'monto_total', 'actualizado', 'factores']
+
+
+class ResumenColumnaSerializer(serializers.Serializer):
+    columna_dj = serializers.IntegerField()
+    descripcion = serializers.CharField()
+    cantidad = serializers.IntegerField(help_text='Calificaciones con el factor informado.')
+    promedio = serializers.DecimalField(max_digits=20, decimal_places=8, allow_null=True)
+    maximo = serializers.DecimalField(max_digits=10, decimal_places=8)
+
+
+class ResumenTotalesSerializer(serializers.Serializer):
+    eventos = serializers.IntegerField()
+    monto_total = serializers.DecimalField(max_digits=28, decimal_places=4)
+    columnas = ResumenColumnaSerializer(many=True)
@@ -1,16 +1,25 @@
 # core/signals.py
 import json
-from django.db.models.signals import post_save, post_delete, pre_save
+from django.db.models.signals import post_save, post_delete, pre_save, pre_delete
 from django.dispatch import receiver
 from django.forms.models import model_to_dict
 from django.core.serializers.json import DjangoJSONEncoder
-from .models import AuditLog
+from simple_history.models import HistoricalChanges
+from .models import AuditLog, CalificacionTributaria, EventoCorporativo, DetalleFactor
+from .cambios import registrar_cambios
+from . import metricas, resumenes
 
-EXCLUDED_MODELS = ['AuditLog', 'Session']
+EXCLUDED_MODELS = ['AuditLog', 'Session', 'Migration', 'ContentType', 'CambioCalificacion', 'ResumenEmisor', 'ResumenFactor', 'AnomaliaCalificacion', 'DiferenciaHistorial',
+                   'FotoGrilla', 'FotoCalificacion', 'AvisoSalida']
+
+
+def _auditable(sender):
+    # Las versiones de simple_history (Historical*) ya son un registro de cambios: auditarlas es ruido
+    return sender.__name__ not in EXCLUDED_MODELS and not issubclass(sender, HistoricalChanges)
 
 @receiver(pre_save)
 def audit_log_pre_save(sender, instance, **kwargs):
-    if sender.__name__ in EXCLUDED_MODELS:
+    if not _auditable(sender):
         return
 
     if instance.pk:
@@ -24,7 +33,7 @@ def audit_log_pre_save(sender, instance, **kwargs):
 
 @receiver(post_save)
 def audit_log_post_save(sender, instance, created, **kwargs):
-    if sender.__name__ in EXCLUDED_MODELS:
+    if not _auditable(sender):
         return
 
     from .middleware import get_current_user 
@@ -58,10 +67,11 @@ def audit_log_post_save(sender, instance, created, **kwargs):
         content_object=instance,
         changes=json.loads(json.dumps(changes, cls=DjangoJSONEncoder))
     )
+    metricas.AUDITORIA_REGISTROS.inc_al_confirmar(accion=action)
 
 @receiver(post_delete)
 def audit_log_post_delete(sender, instance, **kwargs):
-    if sender.__name__ in EXCLUDED_MODELS:
+    if not _auditable(sender):
         return
 
     from .middleware import get_current_user
@@ -78,4 +88,55 @@ def audit_log_post_delete(sender, instance, **kwargs):
         action='DELETE',
         content_object=instance,
         changes=json.loads(json.dumps(old_state, cls=DjangoJSONEncoder))
-    )
\ No newline at end of file
+    )
+    metricas.AUDITORIA_REGISTROS.inc_al_confirmar(accion='DELETE')
+
+
+# --- CHANGE FEED (ver core/cambios.py) ---
+
+@receiver(post_save, sender=CalificacionTributaria)
+def cambio_calificacion_guardada(sender, instance, **kwargs):
+    registrar_cambios([instance.pk])
+
+@receiver(post_delete, sender=CalificacionTributaria)
+def cambio_calificacion_eliminada(sender, instance, **kwargs):
+    registrar_cambios([instance.pk], accion='DELETE')
+
+@receiver(post_save, sender=EventoCorporativo)
+def cambio_evento_guardado(sender, instance, created, **kwargs):
+    if not created:
+        registrar_cambios(CalificacionTributaria.objects.filter(evento_id=instance.pk).values_list('id', flat=True))
+
+@receiver(post_save, sender=DetalleFactor)
+@receiver(post_delete, sender=DetalleFactor)
+def cambio_factor(sender, instance, **kwargs):
+    registrar_cambios([instance.calificacion_id])
+
+
+# --- RESÚMENES PRE-AGREGADOS (ver core/resumenes.py) ---
+
+@receiver(post_save, sender=EventoCorporativo)
+def resumen_evento_guardado(sender, instance, **kwargs):
+    # Si cambió el emisor o el ejercicio, también hay que recalcular la clave anterior
+    anterior = getattr(instance, '_old_state', None) or {}
+    if anterior:
+        resumenes.marcar([(anterior.get('emisor'), anterior.get('ejercicio_comercial'))])
+    resumenes.marcar_evento(instance)
+
+@receiver(post_delete, sender=EventoCorporativo)
+def resumen_evento_eliminado(sender, instance, **kwargs):
+    resumenes.marcar_evento(instance)
+
+@receiver(post_save, sender=CalificacionTributaria)
+def resumen_calificacion_guardada(sender, instance, **kwargs):
+    resumenes.recordar_calificacion(instance)
+
+@receiver(pre_delete, sender=CalificacionTributaria)
+def resumen_calificacion_eliminada(sender, instance, **kwargs):
+    # pre_delete: el evento todavía existe (también en el borrado en cascada)
+    resumenes.recordar_calificacion(instance)
+
+@receiver(post_save, sender=DetalleFactor)
+@receiver(post_delete, sender=DetalleFactor)
+def resumen_factor(sender, instance, **kwargs):
+    resumenes.marcar_calificaciones([instance.calificacion_id])
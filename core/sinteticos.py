@@ -0,0 +1,146 @@
+# core/sinteticos.py
+# Datos sintéticos con volumen y distribución realistas, para pruebas de escala y
+# benchmarks. Cada emisor tiene un perfil fijo (mercado, columnas de crédito y de
+# otros factores que informa, valores típicos) y cada evento es una variación de
+# ese perfil; unos pocos eventos traen valores atípicos. La suma de créditos
+# (8-19) nunca supera el tope, así que todo pasa la validación de la carga.
+# Las filas tienen el formato del archivo de carga masiva (.xlsx).
+import numpy as np
+import pandas as pd
+from datetime import date, timedelta
+from .bulk import MAX_ITEMS, procesar_lote
+from .models import Emisor
+from .validacion import COLUMNAS_CREDITO
+
+COLUMNAS = tuple(range(8, 38))
+_CREDITO = [i for i, c in enumerate(COLUMNAS) if COLUMNAS_CREDITO[0] <= c <= COLUMNAS_CREDITO[1]]
+_OTRAS = [i for i, c in enumerate(COLUMNAS) if i not in _CREDITO]
+# Proporción de eventos con un factor fuera del perfil de su emisor
+TASA_ATIPICOS = 0.002
+MERCADOS = ('ACN', 'ACN', 'ACN', 'CFI', 'CFM')  # Mayoría de acciones
+
+
+def digito_verificador(numero):
+    """Dígito verificador (módulo 11) de un RUT."""
+    suma, factor = 0, 2
+    for digito in reversed(str(numero)):
+        suma += int(digito) * factor
+        factor = 2 if factor == 7 else factor + 1
+    resto = 11 - suma % 11
+    return {11: '0', 10: 'K'}.get(resto, str(resto))
+
+
+def generar(emisores=300, eventos=20, anios=6, desde=2019, semilla=1949):
+    """
+    DataFrame con una fila por evento (emisores x anios x eventos), con las columnas
+    del archivo de carga masiva: Instrumento, RUT, Tipo sociedad, Mercado, Numero de
+    dividendo, Ejercicio, Fecha, Monto Unitario y 'Factor 8' ... 'Factor 37' (vacío = no informado).
+    """
+    rng = np.random.default_rng(semilla)
+    n_credito, n_otras = len(_CREDITO), len(_OTRAS)
+
+    # --- Perfil de cada emisor ---
+    ruts = 76_000_000 + rng.choice(20_000_000, size=emisores, replace=False)
+    mercados = rng.choice(MERCADOS, size=emisores)
+    cerradas = rng.random(emisores) < 0.2
+    monto_base = rng.lognormal(mean=4.5, sigma=1.2, size=emisores)
+    # 1-4 columnas de crédito y 0-4 de otros factores informadas por emisor
+    usa_credito = np.zeros((emisores, n_credito), dtype=bool)
+    usa_otras = np.zeros((emisores, n_otras), dtype=bool)
+    for e in range(emisores):
+        usa_credito[e, rng.choice(n_credito, size=rng.integers(1, 5), replace=False)] = True
+        usa_otras[e, rng.choice(n_otras, size=rng.integers(0, 5), replace=False)] = True
+    # Participación de cada crédito (Dirichlet) sobre un total típico del emisor
+    total_credito = rng.beta(5, 3, size=emisores) * 0.9
+    participacion = rng.gamma(2.0, size=(emisores, n_credito)) * usa_credito
+    participacion /= participacion.sum(axis=1, keepdims=True)
+    base_credito = participacion * total_credito[:, None]
+    base_otras = rng.beta(2, 5, size=(emisores, n_otras)) * usa_otras
+
+    # --- Eventos: variaciones del perfil ---
+    total = emisores * anios * eventos
+    emisor = np.repeat(np.arange(emisores), anios * eventos)
+    anio = np.tile(np.repeat(np.arange(anios), eventos), emisores)
+    dividendo = np.tile(np.arange(1, eventos + 1), emisores * anios)
+
+    credito = base_credito[emisor] * rng.lognormal(0, 0.08, size=(total, n_credito))
+    suma = credito.sum(axis=1, keepdims=True)
+    credito = np.where(suma > 0.999, credito / suma * 0.999, credito)
+    otras = np.minimum(base_otras[emisor] * rng.lognormal(0, 0.15, size=(total, n_otras)), 99)
+
+    valores = np.full((total, len(COLUMNAS)), np.nan)
+    valores[:, _CREDITO] = np.where(usa_credito[emisor], credito, np.nan)
+    valores[:, _OTRAS] = np.where(usa_otras[emisor], otras, np.nan)
+    # Atípicos: una columna de otros factores con un valor lejos del perfil
+    atipicos = np.flatnonzero(rng.random(total) < TASA_ATIPICOS)
+    valores[atipicos, rng.choice(_OTRAS, size=len(atipicos))] = rng.uniform(1, 50, size=len(atipicos))
+    valores = np.round(valores, 8)
+
+    fechas = [
+        date(desde + a, 1, 1) + timedelta(days=int(d))
+        for a, d in zip(anio, ((dividendo - 1) * 365 // eventos + rng.integers(0, 365 // eventos, size=total)))
+    ]
+    filas = pd.DataFrame({
+        'Instrumento': [f'SIN{e:05d}' for e in emisor],
+        'RUT': [f'{ruts[e]}-{digito_verificador(ruts[e])}' for e in emisor],
+        'Tipo sociedad': np.where(cerradas[emisor], 'Cerrada', 'Abierta'),
+        'Mercado': mercados[emisor],
+        'Numero de dividendo': dividendo,
+        'Ejercicio': desde + anio,
+        'Fecha': fechas,
+        'Monto Unitario': np.round(monto_base[emisor] * rng.lognormal(0, 0.1, size=total), 6),
+    })
+    factores = pd.DataFrame(valores, columns=[f'Factor {c}' for c in COLUMNAS])
+    return pd.concat([filas, factores], axis=1)
+
+
+def escribir_xlsx(filas, directorio):
+    """Un archivo de carga masiva por ejercicio. Devuelve las rutas escritas."""
+    rutas = []
+    for ejercicio, grupo in filas.groupby('Ejercicio'):
+        ruta = directorio / f'carga_{ejercicio}.xlsx'
+        grupo.to_excel(ruta, index=False, engine='openpyxl')
+        rutas.append(ruta)
+    return rutas
+
+
+def items_bulk(filas):
+    """Las filas en el formato de la carga masiva vía API (ver CalificacionBulkItemSerializer)."""
+    columnas = [(c, f'Factor {c}') for c in COLUMNAS]
+    for fila in filas.to_dict('records'):
+        yield {
+            'nemonico': fila['Instrumento'],
+            'mercado': fila['Mercado'],
+            'ejercicio_comercial': int(fila['Ejercicio']),
+            'numero_dividendo': int(fila['Numero de dividendo']),
+            'fecha_pago': fila['Fecha'].isoformat(),
+            'monto_unitario_pesos': f"{fila['Monto Unitario']:.6f}",
+            'estado': 'VALIDADO',
+            'factores': {str(c): f'{fila[nombre]:.8f}' for c, nombre in columnas if fila[nombre] == fila[nombre]},
+        }
+
+
+def crear_emisores(filas):
+    """Crea los emisores de las filas que aún no existen (la carga masiva vía API no los crea)."""
+    emisores = filas.drop_duplicates('Instrumento')
+    Emisor.objects.bulk_create(
+        [
+            Emisor(
+                nemonico=f['Instrumento'], rut=f['RUT'], razon_social=f"Sintético {f['Instrumento']}",
+                tipo_sociedad='C' if f['Tipo sociedad'] == 'Cerrada' else 'A',
+            )
+            for f in emisores.to_dict('records')
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def cargar(filas, user=None, lote=MAX_ITEMS):
+    """Guarda las filas con la carga masiva (mismas validaciones y efectos que la API). Devuelve el total guardado."""
+    crear_emisores(filas)
+    items = list(items_bulk(filas))
+    guardados = 0
+    for inicio in range(0, len(items), lote):
+        resultado = procesar_lote(items[inicio:inicio + lote], user=user)
+        guardados += resultado['creados'] + resultado['actualizados']
+    return guardados
@@ -1,4 +1,5 @@
 from django import template
+from core.decorators import grupos_de
 
 register = template.Library()
 
@@ -9,7 +10,8 @@ def has_group(user, group_name):
     """
     if user.is_superuser:
         return True
-    return user.groups.filter(name=group_name).exists()
+    # Una sola consulta por request aunque la plantilla pregunte por varios grupos
+    return group_name in grupos_de(user)
 
 @register.filter(name='lookup_factor')
 def lookup_factor(post_data, key):
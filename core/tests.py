@@ -1,3 +1,1921 @@
-from django.test import TestCase
+import csv
+import hashlib
+import hmac
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import traceback
+from collections import Counter
+from io import BytesIO, StringIO
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.cache import caches
+from django.contrib.auth.models import Group, User
+from django.db import DatabaseError, connection, connections, transaction
+from django.db.models import F
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import LiveServerTestCase, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django_otp.plugins.otp_totp.models import TOTPDevice
+from rest_framework import serializers
+from rest_framework.test import APIClient, APITestCase
+from django.utils import timezone
+from . import anomalias, archivo, avisos, bloqueos, bulk, dj1949, historial, metricas, reconstruccion, resumenes, router, sinteticos
+from .bulk import procesar_lote
+from .factores import guardar_factores
+from .models import (
+    AuditLog, Emisor, EventoCorporativo, CalificacionTributaria, ConceptoFactor, DetalleFactor,
+    ResumenEmisor, ResumenFactor, AnomaliaCalificacion, DiferenciaHistorial, FotoGrilla, FotoCalificacion, EjercicioArchivado,
+    ConflictoVersion, AvisoSalida,
+)
+from .forms import EventoForm
+from .serializers import CalificacionLecturaSerializer
+from .validacion import validar_matriz, validar_vector
 
-# Create your tests here.
+
+def poblar_calificaciones(emisores=300, ejercicios=6, dividendos=20):
+    """Crea un volumen realista de eventos/calificaciones y actualiza las estadísticas del planificador."""
+    emisores = Emisor.objects.bulk_create([
+        Emisor(rut=f'{i}-K', razon_social=f'Emisor {i}', nemonico=f'EM{i}') for i in range(emisores)
+    ])
+    mercados = [m for m, _ in EventoCorporativo.MERCADO_CHOICES]
+    eventos = EventoCorporativo.objects.bulk_create([
+        EventoCorporativo(
+            emisor=emisor,
+            mercado=mercados[(emisor.pk + d) % len(mercados)],
+            ejercicio_comercial=2019 + e,
+            numero_dividendo=d,
+            fecha_pago=date(2019 + e, 1, 1) + timedelta(days=d * 17),
+        )
+        for emisor in emisores for e in range(ejercicios) for d in range(dividendos)
+    ], batch_size=5000)
+    CalificacionTributaria.objects.bulk_create([
+        CalificacionTributaria(evento=ev, estado='RECHAZADO' if ev.pk % 97 == 0 else 'VALIDADO')
+        for ev in eventos
+    ], batch_size=5000)
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+    return emisores
+
+
+class PlanesFiltrosCalificacionTests(TestCase):
+    """Los filtros del mantenedor/API deben resolverse con los índices compuestos, no con Seq Scan."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.emisores = poblar_calificaciones()
+
+    def plan(self, **filtros):
+        return (
+            CalificacionTributaria.objects
+            .select_related('evento__emisor')
+            .filter(**filtros)
+            .order_by('-evento__fecha_pago')[:50]
+            .explain()
+        )
+
+    def test_ejercicio_y_mercado(self):
+        plan = self.plan(evento__ejercicio_comercial=2023, evento__mercado='CFI')
+        self.assertIn('evento_ejer_merc_fpago_idx', plan)
+
+    def test_solo_ejercicio(self):
+        plan = self.plan(evento__ejercicio_comercial=2020)
+        self.assertIn('evento_ejer_fpago_idx', plan)
+
+    def test_emisor_y_ejercicio(self):
+        plan = self.plan(evento__emisor=self.emisores[5], evento__ejercicio_comercial=2023)
+        self.assertIn('evento_emisor_ejer_fpago_idx', plan)
+
+    def test_rango_fecha_pago(self):
+        plan = self.plan(evento__fecha_pago__range=(date(2021, 3, 1), date(2021, 3, 10)))
+        self.assertNotIn('Seq Scan on core_eventocorporativo', plan)
+
+
+class CalificacionFilterApiTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.emisores = poblar_calificaciones(emisores=3, ejercicios=2, dividendos=4)
+        cls.user = User.objects.create_user('analista', password='x')
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def ids(self, **params):
+        response = self.client.get('/api/calificaciones/', params)
+        self.assertEqual(response.status_code, 200)
+        return {c['id'] for c in response.json()['results']}
+
+    def test_filtros_combinados(self):
+        esperado = set(CalificacionTributaria.objects.filter(
+            evento__ejercicio_comercial=2020,
+            evento__mercado='ACN',
+            evento__fecha_pago__gte=date(2020, 1, 20),
+        ).values_list('id', flat=True))
+        self.assertTrue(esperado)
+        self.assertEqual(self.ids(ejercicio=2020, mercado='ACN', fecha_pago_desde='2020-01-20'), esperado)
+
+    def test_emisor_y_rango(self):
+        emisor = self.emisores[1]
+        esperado = set(CalificacionTributaria.objects.filter(
+            evento__emisor=emisor,
+            evento__fecha_pago__range=(date(2019, 1, 1), date(2019, 12, 31)),
+        ).values_list('id', flat=True))
+        self.assertEqual(len(esperado), 4)
+        self.assertEqual(self.ids(emisor=emisor.pk, fecha_pago_desde='2019-01-01', fecha_pago_hasta='2019-12-31'), esperado)
+
+    def test_mercado_invalido(self):
+        response = self.client.get('/api/calificaciones/', {'mercado': 'XXX'})
+        self.assertEqual(response.status_code, 400)
+
+
+class MotorValidacionFactoresTests(SimpleTestCase):
+    columnas = list(range(8, 38))
+
+    def codigos(self, factores):
+        return [(e['columna'], e['codigo']) for e in validar_vector(factores, self.columnas).errores]
+
+    def test_reglas_por_celda(self):
+        self.assertEqual(self.codigos({8: '0.5', 9: '', 20: None, 30: '2'}), [])
+        self.assertEqual(self.codigos({8: '-0.1'}), [(8, 'negativo')])
+        self.assertEqual(self.codigos({10: 'abc', 25: 'inf'}), [(10, 'formato'), (25, 'formato')])
+        self.assertEqual(self.codigos({21: '100'}), [(21, 'rango')])
+
+    def test_suma_creditos_exacta_en_el_borde(self):
+        # 0.1 + 0.2 + 0.7 + 0.000001 en float no es exactamente 1.000001: decide Decimal
+        self.assertEqual(self.codigos({8: 0.1, 9: 0.2, 10: 0.7, 11: '0.000001'}), [])
+        self.assertEqual(self.codigos({8: '0.5', 9: '0.5000010001'}), [(None, 'suma')])
+        # Las columnas 20 en adelante no cuentan para la suma
+        self.assertEqual(self.codigos({8: '0.9', 20: '0.9'}), [])
+
+    def test_decimales_exactos(self):
+        resultado = validar_vector({8: '0.12345678', 30: 0.1}, self.columnas)
+        self.assertEqual(resultado.decimales(0), {8: Decimal('0.12345678'), 30: Decimal('0.1')})
+
+    def test_matriz_grande_vectorizada(self):
+        matriz = np.random.default_rng(0).random((100_000, 30)) * 0.05
+        matriz[10, 0] = -1
+        matriz[20, :12] = 0.1
+        inicio = time.perf_counter()
+        resultado = validar_matriz(matriz, self.columnas)
+        duracion = time.perf_counter() - inicio
+        self.assertEqual([(e['fila'], e['codigo']) for e in resultado.errores], [(10, 'negativo'), (20, 'suma')])
+        self.assertLess(duracion, 0.5)
+
+
+class GuardarFactoresTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.conceptos = ConceptoFactor.objects.bulk_create([
+            ConceptoFactor(columna_dj=c, descripcion=f'Factor {c}') for c in range(8, 38)
+        ])
+        emisor = Emisor.objects.create(rut='1-9', razon_social='Emisor', nemonico='EMI')
+        evento = EventoCorporativo.objects.create(emisor=emisor, fecha_pago=date(2024, 5, 1))
+        cls.calificacion = CalificacionTributaria.objects.create(evento=evento)
+        DetalleFactor.objects.bulk_create([
+            DetalleFactor(calificacion=cls.calificacion, concepto=c, valor=Decimal('0.01')) for c in cls.conceptos[:20]
+        ])
+
+    def test_solo_se_escriben_las_diferencias(self):
+        factores = {c.pk: Decimal('0.01') for c in self.conceptos[:20]}
+        factores[self.conceptos[0].pk] = Decimal('0.02')      # cambia
+        factores[self.conceptos[2].pk] = '0.010000000'         # mismo valor con otra escala
+        del factores[self.conceptos[1].pk]                     # se elimina
+        factores[self.conceptos[25].pk] = Decimal('1.5')       # nuevo
+        AuditLog.objects.all().delete()
+
+        with CaptureQueriesContext(connection) as consultas:
+            creados, actualizados, eliminados = guardar_factores(self.calificacion, factores)
+
+        self.assertEqual((len(creados), len(actualizados), len(eliminados)), (1, 1, 1))
+        # SELECT vigentes + INSERT + UPDATE + DELETE + auditoría + change feed
+        self.assertLessEqual(len(consultas), 7)
+        self.assertEqual(
+            sorted(AuditLog.objects.values_list('action', flat=True)),
+            ['CREATE', 'DELETE', 'UPDATE'],
+        )
+        self.assertEqual(
+            AuditLog.objects.get(action='UPDATE').changes,
+            {'valor': {'old': '0.01000000', 'new': '0.02000000'}},
+        )
+        self.assertEqual(self.calificacion.detalles.count(), 20)
+
+    def test_sin_cambios_no_escribe(self):
+        with CaptureQueriesContext(connection) as consultas:
+            guardar_factores(self.calificacion, {c.pk: '0.01' for c in self.conceptos[:20]})
+        self.assertEqual(len(consultas), 1)
+
+
+class AuditoriaSenalesTests(TestCase):
+
+    def test_las_versiones_del_historial_no_se_auditan(self):
+        emisor = Emisor.objects.create(rut='3-5', razon_social='Emisor', nemonico='AUD')
+        calificacion = CalificacionTributaria.objects.create(evento=EventoCorporativo.objects.create(emisor=emisor, fecha_pago=date(2024, 5, 1)))
+        calificacion.monto_total_distribuido = Decimal('10')
+        calificacion.save()
+        pk = calificacion.pk
+        calificacion.delete()
+
+        # simple_history guarda sus versiones (creación, cambio y borrado)...
+        self.assertEqual(CalificacionTributaria.history.filter(id=pk).count(), 3)
+        # ...pero la auditoría registra solo los modelos del negocio, no las filas Historical*
+        auditados = set(AuditLog.objects.values_list('content_type__model', flat=True))
+        self.assertEqual(auditados, {'emisor', 'eventocorporativo', 'calificaciontributaria'})
+        self.assertEqual(
+            sorted(AuditLog.objects.filter(content_type__model='calificaciontributaria').values_list('action', flat=True)),
+            ['CREATE', 'DELETE', 'UPDATE'],
+        )
+
+
+class CargaMasivaApiTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        ConceptoFactor.objects.bulk_create([ConceptoFactor(columna_dj=c, descripcion=f'Factor {c}') for c in sinteticos.COLUMNAS])
+        cls.filas = sinteticos.generar(emisores=2, eventos=3, anios=1, desde=2024)
+        sinteticos.crear_emisores(cls.filas)
+        cls.user = User.objects.create_user('carga', password='x')
+
+    def setUp(self):
+        connection._pendientes = {}
+        self.client.force_authenticate(self.user)
+
+    def _items(self):
+        return list(sinteticos.items_bulk(self.filas))
+
+    def _cargar(self, items):
+        return self.client.post('/api/calificaciones/bulk/', items, format='json')
+
+    def _factores(self, calificacion_id):
+        return dict(DetalleFactor.objects.filter(calificacion_id=calificacion_id).values_list('concepto__columna_dj', 'valor'))
+
+    def test_crea_y_luego_actualiza(self):
+        items = self._items()
+        respuesta = self._cargar(items)
+        self.assertEqual(respuesta.status_code, 200)
+        resumen = respuesta.json()
+        self.assertEqual((resumen['total'], resumen['creados'], resumen['actualizados'], resumen['con_error']), (6, 6, 0, 0))
+        self.assertEqual([r['indice'] for r in resumen['resultados']], list(range(6)))
+        ids = [r['id'] for r in resumen['resultados']]
+        self.assertEqual(CalificacionTributaria.objects.count(), 6)
+
+        # Misma clave (instrumento, dividendo, ejercicio): se actualiza y se reemplazan sus factores
+        items[0]['monto_unitario_pesos'] = '99.500000'
+        items[0]['factores'] = {'8': '0.25000000', '37': '0.10000000'}
+        resumen = self._cargar(items[:2]).json()
+        self.assertEqual((resumen['creados'], resumen['actualizados']), (0, 2))
+        self.assertEqual([r['id'] for r in resumen['resultados']], ids[:2])
+        self.assertEqual(CalificacionTributaria.objects.count(), 6)
+        self.assertEqual(CalificacionTributaria.objects.get(pk=ids[0]).monto_unitario_pesos, Decimal('99.5'))
+        self.assertEqual(self._factores(ids[0]), {8: Decimal('0.25'), 37: Decimal('0.1')})
+        self.assertEqual(self._factores(ids[1]), {int(c): Decimal(v) for c, v in items[1]['factores'].items()})
+
+    def test_fallo_parcial_y_duplicados_en_el_lote(self):
+        items = self._items()
+        items[1]['nemonico'] = 'NOEXISTE'
+        items[2]['factores'] = {'8': '-0.50000000'}
+        items[3]['fecha_pago'] = 'ayer'
+        items.append(dict(items[0], monto_unitario_pesos='1.000000'))  # Misma clave que el 0
+        respuesta = self._cargar(items)
+        self.assertEqual(respuesta.status_code, 207)
+        resumen = respuesta.json()
+        self.assertEqual((resumen['total'], resumen['creados'], resumen['con_error']), (7, 3, 4))
+        resultados = {r['indice']: r for r in resumen['resultados']}
+        self.assertEqual([i for i, r in resultados.items() if r['resultado'] == 'creado'], [0, 4, 5])
+        self.assertIn('nemonico', resultados[1]['errores'])
+        self.assertIn('8', resultados[2]['errores']['factores'])
+        self.assertIn('fecha_pago', resultados[3]['errores'])
+        self.assertIn('Duplicado del elemento 0', resultados[6]['errores']['non_field_errors'][0])
+        # Sólo se guardaron los válidos; el duplicado no pisó al primero
+        self.assertEqual(CalificacionTributaria.objects.count(), 3)
+        self.assertNotEqual(CalificacionTributaria.objects.get(pk=resultados[0]['id']).monto_unitario_pesos, Decimal(1))
+
+        todo_mal = self._cargar([{'nemonico': 'NOEXISTE'}])
+        self.assertEqual((todo_mal.status_code, todo_mal.json()['con_error']), (400, 1))
+        self.assertEqual(self._cargar({'no': 'es una lista'}).status_code, 400)
+
+    def test_enteros_fuera_de_rango_se_informan_por_elemento(self):
+        items = self._items()
+        items[1]['numero_dividendo'] = 3_000_000_000
+        items[2]['secuencia'] = 2 ** 31
+        items[3]['ejercicio_comercial'] = 2 ** 31
+        respuesta = self._cargar(items)
+        self.assertEqual(respuesta.status_code, 207)
+        resumen = respuesta.json()
+        self.assertEqual((resumen['creados'], resumen['con_error']), (3, 3))
+        errores = {r['indice']: set(r['errores']) for r in resumen['resultados'] if r['resultado'] == 'error'}
+        self.assertEqual(errores, {1: {'numero_dividendo'}, 2: {'secuencia'}, 3: {'ejercicio_comercial'}})
+
+
+class ExportacionApiTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        ConceptoFactor.objects.bulk_create([ConceptoFactor(columna_dj=c, descripcion=f'Factor {c}') for c in sinteticos.COLUMNAS])
+        sinteticos.cargar(sinteticos.generar(emisores=2, eventos=3, anios=2, desde=2023))
+        cls.user = User.objects.create_user('exporta', password='x')
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def _exportar(self, **params):
+        respuesta = self.client.get('/api/calificaciones/export/', params)
+        self.assertEqual(respuesta.status_code, 200)
+        return respuesta, b''.join(respuesta.streaming_content).decode()
+
+    def test_ndjson_una_linea_por_calificacion(self):
+        respuesta, contenido = self._exportar()
+        self.assertEqual(respuesta['Content-Type'], 'application/x-ndjson')
+        registros = [json.loads(linea) for linea in contenido.splitlines()]
+        self.assertEqual([r['id'] for r in registros], list(CalificacionTributaria.objects.order_by('id').values_list('id', flat=True)))
+
+        calificacion = CalificacionTributaria.objects.select_related('evento__emisor').get(pk=registros[0]['id'])
+        registro = registros[0]
+        self.assertEqual(
+            (registro['nemonico'], registro['rut'], registro['mercado'], registro['fecha_pago'], registro['ejercicio'], registro['estado']),
+            (calificacion.evento.emisor.nemonico, calificacion.evento.emisor.rut, calificacion.evento.mercado,
+             calificacion.evento.fecha_pago.isoformat(), calificacion.evento.ejercicio_comercial, calificacion.estado),
+        )
+        self.assertEqual(Decimal(registro['monto_unitario_pesos']), calificacion.monto_unitario_pesos)
+        self.assertEqual(
+            {int(c): Decimal(v) for c, v in registro['factores'].items()},
+            dict(calificacion.detalles.values_list('concepto__columna_dj', 'valor')),
+        )
+        self.assertEqual(list(registro['factores']), sorted(registro['factores'], key=int))
+
+    def test_csv_con_una_columna_por_factor(self):
+        respuesta, contenido = self._exportar(formato='csv')
+        self.assertEqual(respuesta['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('attachment', respuesta['Content-Disposition'])
+        filas = list(csv.reader(StringIO(contenido)))
+        cabecera, filas = filas[0], filas[1:]
+        self.assertEqual(cabecera[:3], ['id', 'evento_id', 'nemonico'])
+        self.assertEqual(cabecera[-30:], [f'Factor {c}' for c in range(8, 38)])
+        self.assertEqual(len(filas), 12)
+
+        fila = dict(zip(cabecera, filas[0]))
+        factores = dict(DetalleFactor.objects.filter(calificacion_id=fila['id']).values_list('concepto__columna_dj', 'valor'))
+        for columna in range(8, 38):
+            valor = fila[f'Factor {columna}']
+            self.assertEqual(Decimal(valor) if valor else None, factores.get(columna), columna)
+
+    def test_filtros_y_formato_invalido(self):
+        _, contenido = self._exportar(ejercicio=2024, nemonico='SIN00001')
+        registros = [json.loads(linea) for linea in contenido.splitlines()]
+        self.assertEqual(len(registros), 3)
+        self.assertEqual({(r['ejercicio'], r['nemonico']) for r in registros}, {(2024, 'SIN00001')})
+        _, contenido = self._exportar(formato='csv', mercado='CFM', ejercicio=2023)
+        esperadas = CalificacionTributaria.objects.filter(evento__mercado='CFM', evento__ejercicio_comercial=2023).count()
+        self.assertEqual(len(contenido.splitlines()) - 1, esperadas)
+        self.assertEqual(self.client.get('/api/calificaciones/export/', {'formato': 'xml'}).status_code, 400)
+
+
+class LecturaCompiladaTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        ConceptoFactor.objects.bulk_create([ConceptoFactor(columna_dj=c, descripcion=f'Factor {c}') for c in sinteticos.COLUMNAS])
+        sinteticos.cargar(sinteticos.generar(emisores=2, eventos=3, anios=1, desde=2024))
+        cls.user = User.objects.create_user('lector', password='x')
+        # Valores opcionales informados en una, vacíos en las demás
+        calificacion = CalificacionTributaria.objects.select_related('evento').order_by('id').first()
+        calificacion.modificado_por = cls.user
+        calificacion.save()
+        calificacion.evento.fecha_registro = date(2024, 4, 30)
+        calificacion.evento.save()
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def _generico(self, calificacion):
+        """La representación de DRF campo a campo, sin la compilación."""
+        cabecera = CalificacionLecturaSerializer()._campos_cabecera()
+        datos = dict(serializers.ModelSerializer.to_representation(cabecera, calificacion))
+        valores = {d.concepto_id: d.valor for d in calificacion.detalles.all()}
+        campo = CalificacionLecturaSerializer().fields['factores'].child
+        datos['factores'] = [
+            campo.to_representation(valores[c]) if c in valores else None
+            for c in ConceptoFactor.objects.values_list('id', flat=True)
+        ]
+        return datos
+
+    def test_compilado_igual_a_drf(self):
+        calificaciones = list(CalificacionTributaria.objects.select_related('evento__emisor').prefetch_related('detalles').order_by('id'))
+        self.assertTrue(any(None in self._generico(c)['factores'] for c in calificaciones))
+        representar = CalificacionLecturaSerializer().compilado()
+        for calificacion in calificaciones:
+            with self.subTest(calificacion.pk):
+                self.assertEqual(representar(calificacion), self._generico(calificacion))
+
+        esperado = [json.loads(json.dumps(self._generico(c), cls=DjangoJSONEncoder)) for c in calificaciones]
+        self.assertEqual(self.client.get('/api/calificaciones/', {'ordering': 'id'}).json()['results'], esperado)
+        self.assertEqual(self.client.get(f'/api/calificaciones/{calificaciones[0].pk}/').json(), esperado[0])
+        self.assertEqual((esperado[0]['modificado_por'], esperado[0]['evento']['fecha_registro']), (self.user.pk, '2024-04-30'))
+
+
+class ChangeFeedTests(TransactionTestCase):
+    """El feed sólo ve transacciones confirmadas: cada cambio se hace en su propia transacción."""
+
+    def setUp(self):
+        ConceptoFactor.objects.bulk_create([ConceptoFactor(columna_dj=c, descripcion=f'Factor {c}') for c in sinteticos.COLUMNAS])
+        filas = sinteticos.generar(emisores=2, eventos=3, anios=1, desde=2024)
+        sinteticos.crear_emisores(filas)
+        resultado = procesar_lote(list(sinteticos.items_bulk(filas)))
+        self.ids = [r['id'] for r in resultado['resultados']]
+        self.api = APIClient()
+        self.api.force_authenticate(User.objects.create_user('feed', password='x'))
+
+    def _feed(self, desde='', **params):
+        respuesta = self.api.get('/api/calificaciones/cambios/', {'desde': desde, **params})
+        self.assertEqual(respuesta.status_code, 200)
+        return respuesta.json()
+
+    def _leer_todo(self, desde):
+        pagina = self._feed(desde)
+        return [(c['accion'], c['id']) for c in pagina['cambios']], pagina['siguiente']
+
+    def _editar(self, pk, monto):
+        calificacion = CalificacionTributaria.objects.get(pk=pk)
+        calificacion.monto_unitario_pesos = monto
+        calificacion.save()
+
+    def test_paginas_por_token(self):
+        primera = self._feed(limite=4)
+        self.assertEqual(([c['id'] for c in primera['cambios']], primera['hay_mas']), (self.ids[:4], True))
+        self.assertEqual({c['accion'] for c in primera['cambios']}, {'upsert'})
+        self.assertEqual(primera['cambios'][0]['calificacion']['id'], self.ids[0])
+        segunda = self._feed(primera['siguiente'], limite=4)
+        self.assertEqual(([c['id'] for c in segunda['cambios']], segunda['hay_mas']), (self.ids[4:], False))
+        # Al día: página vacía y el mismo token
+        vacia = self._feed(segunda['siguiente'])
+        self.assertEqual((vacia['cambios'], vacia['siguiente']), ([], segunda['siguiente']))
+        self.assertEqual(self.api.get('/api/calificaciones/cambios/', {'desde': 'x-1'}).status_code, 400)
+
+    def test_junta_los_cambios_y_deja_tombstones(self):
+        _, token = self._leer_todo('')
+        a, b, c = self.ids[:3]
+        self._editar(a, '1.000000')
+        self._editar(b, '2.000000')
+        self._editar(a, '3.000000')
+        self._editar(c, '4.000000')
+        CalificacionTributaria.objects.get(pk=c).delete()
+
+        pagina = self._feed(token)
+        # Una entrada por calificación, en la posición de su último cambio y con su estado vigente
+        self.assertEqual([(x['accion'], x['id']) for x in pagina['cambios']], [('upsert', b), ('upsert', a), ('delete', c)])
+        self.assertEqual(pagina['cambios'][1]['calificacion']['monto_unitario_pesos'], '3.000000')
+        self.assertNotIn('calificacion', pagina['cambios'][2])
+
+    def test_no_avanza_mas_alla_de_una_transaccion_abierta(self):
+        _, token = self._leer_todo('')
+        escrito, confirmar = threading.Event(), threading.Event()
+
+        def transaccion_lenta():
+            try:
+                with transaction.atomic():
+                    self._editar(self.ids[0], '5.000000')
+                    escrito.set()
+                    confirmar.wait(10)
+            finally:
+                connection.close()
+
+        hilo = threading.Thread(target=transaccion_lenta)
+        hilo.start()
+        try:
+            self.assertTrue(escrito.wait(10))
+            self._editar(self.ids[1], '6.000000')  # Confirma antes, pero empezó después
+            # pg_snapshot_xmin: nada desde la transacción abierta, aunque haya cambios confirmados después
+            self.assertEqual(self._leer_todo(token), ([], token))
+        finally:
+            confirmar.set()
+            hilo.join()
+        self.assertEqual(self._leer_todo(token)[0], [('upsert', self.ids[0]), ('upsert', self.ids[1])])
+
+
+class TransicionMasivaApiTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('revisor', password='x')
+        emisor = Emisor.objects.create(rut='2-7', razon_social='Emisor', nemonico='REV')
+        eventos = EventoCorporativo.objects.bulk_create([
+            EventoCorporativo(emisor=emisor, numero_dividendo=i, fecha_pago=date(2024, 1, 1),
+                              ejercicio_comercial=2024 if i < 4 else 2023)
+            for i in range(6)
+        ])
+        cls.calificaciones = CalificacionTributaria.objects.bulk_create([
+            CalificacionTributaria(evento=e, estado='VALIDADO' if i == 0 else 'EN_REVISION') for i, e in enumerate(eventos)
+        ])
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def test_por_filtro_con_un_solo_lote(self):
+        response = self.client.post('/api/calificaciones/transicion/?ejercicio=2024', {'estado': 'VALIDADO'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['actualizadas'], 3)
+        self.assertEqual(response.json()['omitidas'], {'VALIDADO': 1})
+        self.assertEqual(CalificacionTributaria.objects.filter(estado='VALIDADO').count(), 4)
+        # Un AuditLog resumido para el lote y un registro de historial por calificación cambiada
+        self.assertEqual(AuditLog.objects.filter(action='BULK').count(), 1)
+        self.assertEqual(CalificacionTributaria.history.filter(history_change_reason__startswith='Transición masiva').count(), 3)
+
+    def test_transicion_no_permitida(self):
+        ids = [c.pk for c in self.calificaciones[:1]]
+        response = self.client.post('/api/calificaciones/transicion/', {'estado': 'BORRADOR', 'ids': ids}, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(CalificacionTributaria.objects.get(pk=ids[0]).estado, 'VALIDADO')
+
+    def test_exige_ids_o_filtro(self):
+        response = self.client.post('/api/calificaciones/transicion/', {'estado': 'VALIDADO'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class DJ1949Tests(TransactionTestCase):
+    """TransactionTestCase: los procesos hijos deben ver los datos confirmados."""
+
+    def setUp(self):
+        conceptos = ConceptoFactor.objects.bulk_create([
+            ConceptoFactor(columna_dj=c, descripcion=f'Factor {c}') for c in (8, 9, 30)
+        ])
+        for i in range(3):
+            emisor = Emisor.objects.create(rut=f'9{i}.000.000-{i}', razon_social=f'Emisor {i}', nemonico=f'DJ{i}')
+            for d in range(4):
+                evento = EventoCorporativo.objects.create(
+                    emisor=emisor, numero_dividendo=d, ejercicio_comercial=2024, fecha_pago=date(2024, 3, 1 + d),
+                )
+                calificacion = CalificacionTributaria.objects.create(
+                    evento=evento, estado='VALIDADO' if d < 3 else 'BORRADOR',
+                    monto_unitario_pesos=Decimal('10.5'), monto_total_distribuido=Decimal('1000.0001'),
+                )
+                DetalleFactor.objects.bulk_create([
+                    DetalleFactor(calificacion=calificacion, concepto=c, valor=Decimal('0.12345678')) for c in conceptos
+                ])
+        self.directorio = tempfile.mkdtemp()
+
+    def generar(self, nombre, **opciones):
+        ruta = os.path.join(self.directorio, nombre)
+        totales = dj1949.generar(2024, ruta, **opciones)
+        with open(ruta, encoding='latin-1') as archivo:
+            return totales, archivo.read().splitlines()
+
+    def test_ancho_fijo_y_totales(self):
+        totales, lineas = self.generar('dj.txt')
+        self.assertEqual(totales.registros, 9)  # sólo VALIDADO
+        self.assertEqual([l[0] for l in lineas], ['0'] + ['1'] * 9 + ['9'])
+        self.assertEqual({len(l) for l in lineas[1:-1]}, {1 + 12 + 20 + 3 + 8 + 6 + 15 + 20 + 30 * 10})
+        self.assertEqual(totales.factores[8], 9 * 12345678)
+        self.assertEqual(totales.monto_total, 9 * 10000001)
+
+    def test_paralelo_igual_a_secuencial(self):
+        with mock.patch.object(dj1949, 'UMBRAL_PARALELO', 0):
+            secuencial = self.generar('a.csv', formato='csv', estados=None)
+            paralelo = self.generar('b.csv', formato='csv', estados=None, procesos=3)
+        self.assertEqual(secuencial[1], paralelo[1])
+        self.assertEqual(paralelo[1][-1].split(',')[5], '12')
+
+    def _descargar(self, **patch_generar):
+        cliente = APIClient()
+        cliente.force_authenticate(User.objects.create_user('dj', password='x'))
+        mkdtemp = tempfile.mkdtemp
+        with mock.patch('core.api_views.generar_dj1949', **patch_generar) as generar, \
+                mock.patch.object(tempfile, 'mkdtemp', side_effect=lambda prefix: mkdtemp(prefix=prefix, dir=self.directorio)):
+            respuesta = cliente.get('/api/calificaciones/dj1949/?ejercicio=2024')
+            return generar, respuesta
+
+    def test_descarga_api_en_un_proceso_y_sin_residuos(self):
+        generar, respuesta = self._descargar(wraps=dj1949.generar)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(len(b''.join(respuesta.streaming_content).splitlines()), 11)
+        # Nunca se hace fork desde el worker web
+        self.assertEqual(generar.call_args.kwargs['procesos'], 1)
+        self.assertEqual(os.listdir(self.directorio), [])
+
+    def test_descarga_api_fallida_no_deja_el_directorio_temporal(self):
+        with self.assertRaises(RuntimeError):
+            self._descargar(side_effect=RuntimeError('falla'))
+        self.assertEqual(os.listdir(self.directorio), [])
+
+
+class ResumenesTests(APITestCase):
+    """Los resúmenes incrementales deben quedar iguales a una reconstrucción completa."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('reportes', password='x')
+        cls.conceptos = ConceptoFactor.objects.bulk_create([
+            ConceptoFactor(columna_dj=c, descripcion=f'Factor {c}') for c in (8, 9)
+        ])
+        cls.emisores = Emisor.objects.bulk_create([
+            Emisor(rut=f'3{i}-1', razon_social=f'Emisor {i}', nemonico=f'RES{i}') for i in range(2)
+        ])
+        for emisor in cls.emisores:
+            for d in range(3):
+                evento = EventoCorporativo.objects.create(
+                    emisor=emisor, numero_dividendo=d, ejercicio_comercial=2024, fecha_pago=date(2024, 2, 1),
+                    mercado='ACN' if d < 2 else 'CFI',
+                )
+                calificacion = CalificacionTributaria.objects.create(evento=evento, monto_total_distribuido=100 + d)
+                DetalleFactor.objects.bulk_create([
+                    DetalleFactor(calificacion=calificacion, concepto=c, valor=Decimal('0.1') * (d + 1))
+                    for c in cls.conceptos
+                ])
+        resumenes.reconstruir()
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+        # El on_commit pendiente de setUpTestData nunca se ejecuta dentro de TestCase: empezamos de cero
+        connection._pendientes = {}
+
+    def foto(self):
+        return (
+            sorted(ResumenEmisor.objects.values_list('ejercicio', 'mercado', 'emisor_id', 'eventos', 'monto_total')),
+            sorted(ResumenFactor.objects.values_list(
+                'resumen__ejercicio', 'resumen__mercado', 'resumen__emisor_id', 'concepto_id', 'cantidad', 'suma', 'maximo',
+            )),
+        )
+
+    def assertIgualAReconstruir(self):
+        incremental = self.foto()
+        resumenes.reconstruir()
+        self.assertEqual(incremental, self.foto())
+
+    def test_reconstruir(self):
+        resumen = ResumenEmisor.objects.get(emisor=self.emisores[0], mercado='ACN')
+        self.assertEqual((resumen.eventos, resumen.monto_total), (2, Decimal('201')))
+        factor = resumen.factores.get(concepto=self.conceptos[0])
+        self.assertEqual((factor.cantidad, factor.maximo, factor.promedio), (2, Decimal('0.2'), Decimal('0.15')))
+
+    def test_incremental_al_guardar_factores_y_mover_evento(self):
+        calificacion = CalificacionTributaria.objects.filter(evento__emisor=self.emisores[0]).order_by('pk').first()
+        with self.captureOnCommitCallbacks(execute=True):
+            guardar_factores(calificacion, {self.conceptos[0].pk: Decimal('0.9')})
+        self.assertEqual(
+            ResumenFactor.objects.get(resumen__emisor=self.emisores[0], resumen__mercado='ACN', concepto=self.conceptos[0]).maximo,
+            Decimal('0.9'),
+        )
+        # Cambio de mercado y de ejercicio: se recalculan la clave anterior y la nueva
+        evento = calificacion.evento
+        with self.captureOnCommitCallbacks(execute=True):
+            evento.mercado, evento.ejercicio_comercial = 'CFM', 2025
+            evento.save()
+        self.assertTrue(ResumenEmisor.objects.filter(ejercicio=2025, mercado='CFM', emisor=self.emisores[0]).exists())
+        self.assertIgualAReconstruir()
+
+    def test_incremental_al_eliminar_y_carga_masiva(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            CalificacionTributaria.objects.filter(evento__emisor=self.emisores[1], evento__mercado='CFI').get().evento.delete()
+        self.assertFalse(ResumenEmisor.objects.filter(emisor=self.emisores[1], mercado='CFI').exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            resultado = procesar_lote([{
+                'nemonico': 'RES1', 'numero_dividendo': 7, 'ejercicio_comercial': 2024, 'mercado': 'CFI',
+                'fecha_pago': '2024-06-01', 'monto_total_distribuido': '50', 'factores': {'8': '0.5'},
+            }], user=self.user)
+        self.assertEqual(resultado['creados'], 1, resultado)
+        self.assertIgualAReconstruir()
+
+    def test_api_lee_solo_resumenes(self):
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.get('/api/resumenes/totales/?ejercicio=2024&mercado=ACN')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['eventos'], 4)
+        self.assertEqual([c['columna_dj'] for c in response.json()['columnas']], [8, 9])
+        sql = ' '.join(q['sql'] for q in consultas)
+        self.assertNotIn('core_detallefactor', sql)
+        self.assertNotIn('core_calificaciontributaria', sql)
+
+        response = self.client.get(f'/api/resumenes/?emisor={self.emisores[0].pk}')
+        self.assertEqual(response.json()['count'], 2)
+        self.assertEqual(len(response.json()['results'][0]['factores']), 2)
+
+
+class AnomaliasTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('auditor', password='x')
+        cls.conceptos = {c.columna_dj: c for c in ConceptoFactor.objects.bulk_create([
+            ConceptoFactor(columna_dj=c, descripcion=f'Factor {c}') for c in (8, 10, 19, 30)
+        ])}
+        habitual = Emisor.objects.create(rut='4-1', razon_social='Habitual', nemonico='HAB')
+        nuevo = Emisor.objects.create(rut='4-2', razon_social='Nuevo', nemonico='NUE')
+
+        def calificacion(emisor, ejercicio, dividendo, factores):
+            evento = EventoCorporativo.objects.create(
+                emisor=emisor, numero_dividendo=dividendo, ejercicio_comercial=ejercicio, fecha_pago=date(ejercicio, 4, 1),
+            )
+            calif = CalificacionTributaria.objects.create(evento=evento)
+            DetalleFactor.objects.bulk_create([
+                DetalleFactor(calificacion=calif, concepto=cls.conceptos[c], valor=Decimal(v)) for c, v in factores.items()
+            ])
+            return calif
+
+        for anio in (2021, 2022, 2023):
+            for d in range(2):
+                calificacion(habitual, anio, d, {8: '0.1', 30: '0.05'})
+        cls.estable = calificacion(habitual, 2024, 0, {8: '0.1', 30: '0.05'})
+        cls.desviada = calificacion(habitual, 2024, 1, {8: '0.6', 30: '0.05'})
+        cls.columna_nueva = calificacion(habitual, 2024, 2, {8: '0.1', 10: '0.2', 30: '0.05'})
+        cls.al_tope = calificacion(habitual, 2024, 3, {8: '0.1', 19: '0.89', 30: '0.05'})
+        cls.sin_historia = calificacion(nuevo, 2024, 0, {30: '7.5'})
+        cls.vacia = calificacion(nuevo, 2024, 1, {})
+
+    def test_detecta_y_guarda(self):
+        self.assertEqual(anomalias.analizar([2024]), {2024: 6})
+        encontradas = set(AnomaliaCalificacion.objects.values_list('calificacion_id', 'codigo', 'columna_dj'))
+        self.assertEqual(encontradas, {
+            (self.desviada.pk, 'DESVIO_EMISOR', 8),
+            (self.columna_nueva.pk, 'COLUMNA_INUSUAL', 10),
+            (self.al_tope.pk, 'COLUMNA_INUSUAL', 19),
+            (self.al_tope.pk, 'SUMA_LIMITE', None),
+            (self.sin_historia.pk, 'DESVIO_COLUMNA', 30),
+            (self.vacia.pk, 'SIN_FACTORES', None),
+        })
+        desvio = AnomaliaCalificacion.objects.get(codigo='DESVIO_EMISOR')
+        self.assertEqual((desvio.valor, desvio.referencia), (Decimal('0.6'), Decimal('0.1')))
+
+        # Un nuevo análisis reemplaza al anterior del mismo ejercicio
+        DetalleFactor.objects.filter(calificacion=self.desviada, concepto=self.conceptos[8]).update(valor=Decimal('0.1'))
+        anomalias.analizar([2024])
+        self.assertFalse(AnomaliaCalificacion.objects.filter(codigo='DESVIO_EMISOR').exists())
+
+    def test_filtro_api(self):
+        anomalias.analizar([2024])
+        self.client.force_authenticate(self.user)
+        response = self.client.get('/api/calificaciones/?anomalia=COLUMNA_INUSUAL')
+        self.assertEqual(sorted(r['id'] for r in response.json()['results']), [self.columna_nueva.pk, self.al_tope.pk])
+        response = self.client.get('/api/calificaciones/?anomalia=con&ejercicio=2024')
+        self.assertEqual(response.json()['count'], 5)
+
+
+class DiferenciasHistorialTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.conceptos = ConceptoFactor.objects.bulk_create([
+            ConceptoFactor(columna_dj=c, descripcion=f'Factor {c}') for c in (8, 9)
+        ])
+        cls.emisor = Emisor.objects.create(rut='5-1', razon_social='Historia', nemonico='HIS')
+
+    def setUp(self):
+        connection._pendientes = {}
+
+    def test_diferencias_de_campos_y_factores(self):
+        f8, f9 = (c.pk for c in self.conceptos)
+        with self.captureOnCommitCallbacks(execute=True):
+            evento = EventoCorporativo.objects.create(emisor=self.emisor, fecha_pago=date(2024, 1, 1))
+            calificacion = CalificacionTributaria.objects.create(evento=evento, monto_total_distribuido=10)
+            guardar_factores(calificacion, {f8: '0.1'})
+        with self.captureOnCommitCallbacks(execute=True):
+            calificacion.monto_total_distribuido = 20
+            calificacion.save()
+            guardar_factores(calificacion, {f8: '0.2', f9: '0.3'})
+        with self.captureOnCommitCallbacks(execute=True):
+            guardar_factores(calificacion, {f9: '0.3'})
+
+        creacion, edicion, solo_factores = DiferenciaHistorial.objects.filter(calificacion_id=calificacion.pk).order_by('id')
+        self.assertEqual(creacion.tipo, '+')
+        self.assertEqual(creacion.factores, {'8': {'old': None, 'new': '0.10000000'}})
+        self.assertEqual(edicion.cambios, {'monto_total_distribuido': {'old': '10.0000', 'new': '20.0000'}})
+        self.assertEqual(edicion.factores, {
+            '8': {'old': '0.10000000', 'new': '0.20000000'},
+            '9': {'old': None, 'new': '0.30000000'},
+        })
+        self.assertIsNone(solo_factores.historial_id)
+        self.assertEqual(solo_factores.factores, {'8': {'old': '0.20000000', 'new': None}})
+
+        # Procesar de nuevo no duplica nada
+        self.assertEqual(historial.procesar([calificacion.pk]), 0)
+
+    def test_versiones_anteriores_quedan_como_linea_base(self):
+        evento = EventoCorporativo.objects.create(emisor=self.emisor, fecha_pago=date(2024, 1, 1))
+        calificacion = CalificacionTributaria.objects.create(evento=evento)
+        calificacion.history.all().update(history_type='~')  # Versión sin su creación registrada
+        DiferenciaHistorial.objects.all().delete()
+
+        self.assertEqual(historial.procesar([calificacion.pk]), 1)
+        diferencia = DiferenciaHistorial.objects.get()
+        self.assertEqual((diferencia.cambios, diferencia.factores, diferencia.vector), ({}, {}, {}))
+
+
+class ReconstruccionAlInstanteTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('historico', password='x')
+        cls.conceptos = ConceptoFactor.objects.bulk_create([
+            ConceptoFactor(columna_dj=c, descripcion=f'Factor {c}') for c in (8, 9)
+        ])
+        cls.emisor = Emisor.objects.create(rut='6-1', razon_social='Instante', nemonico='INS')
+
+    def setUp(self):
+        connection._pendientes = {}
+        self.client.force_authenticate(self.user)
+
+    def _crear(self, dividendo, monto, factores):
+        with self.captureOnCommitCallbacks(execute=True):
+            evento = EventoCorporativo.objects.create(
+                emisor=self.emisor, numero_dividendo=dividendo, fecha_pago=date(2024, 1, dividendo),
+            )
+            calificacion = CalificacionTributaria.objects.create(evento=evento, monto_total_distribuido=monto)
+            guardar_factores(calificacion, factores)
+        return calificacion
+
+    def _vista(self, instante):
+        return {
+            c.pk: (c.monto_total_distribuido, c.evento.fecha_pago, {d.concepto.columna_dj: d.valor for d in c.detalles.all()})
+            for c in reconstruccion.estado_al(instante)
+        }
+
+    def test_reconstruye_cabecera_evento_y_factores(self):
+        f8, f9 = (c.pk for c in self.conceptos)
+        antes = timezone.now()
+        calificacion = self._crear(1, 10, {f8: '0.1'})
+        t1 = timezone.now()
+        with self.captureOnCommitCallbacks(execute=True):
+            calificacion.monto_total_distribuido = 20
+            calificacion.save()
+            calificacion.evento.fecha_pago = date(2024, 2, 1)
+            calificacion.evento.save()
+            guardar_factores(calificacion, {f8: '0.2', f9: '0.3'})
+        t2 = timezone.now()
+        otra = self._crear(2, 5, {})
+        with self.captureOnCommitCallbacks(execute=True):
+            otra.delete()
+
+        self.assertEqual(self._vista(antes), {})
+        self.assertEqual(self._vista(t1), {calificacion.pk: (Decimal('10'), date(2024, 1, 1), {8: Decimal('0.1')})})
+        self.assertEqual(self._vista(t2), {
+            calificacion.pk: (Decimal('20'), date(2024, 2, 1), {8: Decimal('0.2'), 9: Decimal('0.3')}),
+        })
+        self.assertEqual(list(self._vista(timezone.now())), [calificacion.pk])
+
+    def test_foto_incluye_registros_sin_historial(self):
+        antigua = self._crear(1, 10, {self.conceptos[0].pk: '0.4'})
+        # Registro cargado antes de activar el historial
+        antigua.history.all().delete()
+        DiferenciaHistorial.objects.all().delete()
+        self.assertEqual(self._vista(timezone.now()), {})
+
+        foto = reconstruccion.tomar_foto()
+        self.assertEqual(foto.calificaciones, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            antigua.monto_total_distribuido = 30
+            antigua.save()
+        self.assertEqual(self._vista(foto.fecha), {antigua.pk: (Decimal('10'), date(2024, 1, 1), {8: Decimal('0.4')})})
+        self.assertEqual(self._vista(timezone.now())[antigua.pk][0], Decimal('30'))
+
+        # Antes de la primera foto sólo existe lo que tiene historial
+        self.assertEqual(self._vista(foto.fecha - timedelta(seconds=1)), {})
+        self.assertEqual(FotoGrilla.objects.count(), 1)
+
+    def test_api_al_instante(self):
+        calificacion = self._crear(1, 10, {self.conceptos[0].pk: '0.1'})
+        t1 = timezone.now()
+        with self.captureOnCommitCallbacks(execute=True):
+            calificacion.estado = 'EN_REVISION'
+            calificacion.save()
+
+        respuesta = self.client.get('/api/calificaciones/', {'al': t1.isoformat(), 'estado': 'BORRADOR'})
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual([r['id'] for r in respuesta.data['results']], [calificacion.pk])
+        self.assertEqual(respuesta.data['results'][0]['factores'][0], '0.10000000')
+        respuesta = self.client.get('/api/calificaciones/', {'al': t1.isoformat(), 'estado': 'EN_REVISION'})
+        self.assertEqual(respuesta.data['results'], [])
+
+        self.assertEqual(self.client.get('/api/calificaciones/', {'al': 'ayer'}).status_code, 400)
+
+    def test_la_lectura_no_calcula_diferencias(self):
+        calificacion = self._crear(1, 10, {self.conceptos[0].pk: '0.1'})
+        # Versión anterior al cálculo de diferencias (o cuyo cálculo al confirmar no corrió)
+        DiferenciaHistorial.objects.all().delete()
+        with CaptureQueriesContext(connection) as consultas:
+            vista = self._vista(timezone.now())
+        self.assertFalse([c['sql'] for c in consultas if not c['sql'].lstrip().upper().startswith('SELECT')])
+        # Sin la diferencia falta el vector de factores, hasta que el comando la calcula
+        self.assertEqual(vista, {calificacion.pk: (Decimal('10'), date(2024, 1, 1), {})})
+
+        call_command('calcular_diferencias_historial', stdout=StringIO())
+        self.assertEqual(self._vista(timezone.now()), {calificacion.pk: (Decimal('10'), date(2024, 1, 1), {8: Decimal('0.1')})})
+
+    def _grilla(self, instante, **filtros):
+        return [
+            (c.pk, c.estado, c.evento.emisor.nemonico, c.evento.mercado, c.evento.ejercicio_comercial,
+             c.evento.fecha_pago, {d.concepto.columna_dj: d.valor for d in c.detalles.all()})
+            for c in reconstruccion.estado_al(instante, **filtros)
+        ]
+
+    def test_filtros_en_sql_iguales_a_filtrar_la_grilla_completa(self):
+        otro = Emisor.objects.create(rut='6-2', razon_social='Otro', nemonico='OTR')
+        f8 = self.conceptos[0].pk
+
+        def crear(dividendo, emisor=self.emisor, mercado='ACN', ejercicio=2024, estado='BORRADOR'):
+            with self.captureOnCommitCallbacks(execute=True):
+                evento = EventoCorporativo.objects.create(
+                    emisor=emisor, numero_dividendo=dividendo, mercado=mercado, ejercicio_comercial=ejercicio,
+                    fecha_pago=date(ejercicio, 1, dividendo),
+                )
+                calificacion = CalificacionTributaria.objects.create(evento=evento, estado=estado)
+                guardar_factores(calificacion, {f8: f'0.{dividendo}'})
+            return calificacion
+
+        sale_del_mercado, cambia_estado, entra_al_ejercicio, borrada = (
+            crear(1), crear(2), crear(3, ejercicio=2023), crear(4, emisor=otro),
+        )
+        crear(5, mercado='CFI', estado='VALIDADO')
+        crear(6, emisor=otro, ejercicio=2023)
+        # Evento sin calificación ni historial en la foto (cargado antes de activar el historial)
+        suelto = EventoCorporativo.objects.create(emisor=otro, numero_dividendo=7, fecha_pago=date(2024, 1, 7))
+        suelto.history.all().delete()
+        # Todo lo anterior queda fuera del MARGEN de la foto: sólo lo posterior sale del historial
+        hace_una_hora = F('history_date') - timedelta(hours=1)
+        CalificacionTributaria.history.update(history_date=hace_una_hora)
+        EventoCorporativo.history.update(history_date=hace_una_hora)
+        DiferenciaHistorial.objects.update(fecha=F('fecha') - timedelta(hours=1))
+        foto = reconstruccion.tomar_foto()
+        self.assertEqual(FotoCalificacion.objects.filter(foto=foto, mercado='CFI', estado='VALIDADO').count(), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            sale_del_mercado.evento.mercado = 'CFM'
+            sale_del_mercado.evento.save()
+            cambia_estado.estado = 'EN_REVISION'
+            cambia_estado.save()
+            entra_al_ejercicio.evento.ejercicio_comercial = 2024
+            entra_al_ejercicio.evento.save()
+            guardar_factores(entra_al_ejercicio, {f8: '0.9'})
+            borrada.delete()
+            CalificacionTributaria.objects.create(evento=suelto, estado='EN_REVISION')
+        crear(8, mercado='CFI')
+        despues = timezone.now()
+
+        filtros = [
+            {'mercado': 'ACN'}, {'mercado': 'CFM'}, {'ejercicio': 2024}, {'ejercicio': 2023},
+            {'estado': 'BORRADOR'}, {'estado': 'EN_REVISION'}, {'emisor': otro.pk}, {'nemonico': 'otr'},
+            {'fecha_pago_desde': date(2024, 1, 3), 'fecha_pago_hasta': date(2024, 1, 7)},
+            {'mercado': 'ACN', 'ejercicio': 2024, 'estado': 'EN_REVISION'},
+        ]
+
+        def cumple(fila, f):
+            _, estado, nemonico, mercado, ejercicio, fecha_pago, _ = fila
+            return (
+                f.get('mercado', mercado) == mercado and f.get('ejercicio', ejercicio) == ejercicio
+                and f.get('estado', estado) == estado
+                and ('emisor' not in f or nemonico == 'OTR') and f.get('nemonico', '') in nemonico.lower()
+                and f.get('fecha_pago_desde', fecha_pago) <= fecha_pago <= f.get('fecha_pago_hasta', fecha_pago)
+            )
+
+        for instante in (foto.fecha, despues):
+            completa = self._grilla(instante)
+            for f in filtros:
+                with self.subTest(instante=instante, **f):
+                    self.assertEqual(self._grilla(instante, **f), [fila for fila in completa if cumple(fila, f)])
+        # Lo que cambió después de la foto
+        self.assertIn((entra_al_ejercicio.pk, 'BORRADOR', 'INS', 'ACN', 2024, date(2023, 1, 3), {8: Decimal('0.9')}),
+                      self._grilla(despues, ejercicio=2024))
+        self.assertEqual([f[0] for f in self._grilla(despues, estado='EN_REVISION')], [suelto.calificacion.pk, cambia_estado.pk])
+
+        # Sin foto, desde el historial completo
+        FotoGrilla.objects.all().delete()
+        completa = self._grilla(despues)
+        for f in filtros:
+            with self.subTest(sin_foto=True, **f):
+                self.assertEqual(self._grilla(despues, **f), [fila for fila in completa if cumple(fila, f)])
+
+    def test_api_al_instante_reconstruye_una_vez_por_filtros(self):
+        calificacion = self._crear(1, 10, {})
+        parametros = {'al': timezone.now().isoformat(), 'mercado': 'ACN'}
+        with mock.patch('core.api_views.estado_al', wraps=reconstruccion.estado_al) as estado_al:
+            for _ in range(2):
+                respuesta = self.client.get('/api/calificaciones/', parametros)
+                self.assertEqual([r['id'] for r in respuesta.data['results']], [calificacion.pk])
+            self.assertEqual(estado_al.call_count, 1)
+            self.client.get('/api/calificaciones/', {**parametros, 'mercado': 'CFI'})
+            self.assertEqual(estado_al.call_count, 2)
+
+
+class DatosSinteticosTests(TestCase):
+
+    def test_generacion_reproducible_y_valida(self):
+        filas = sinteticos.generar(emisores=12, eventos=5, anios=2, desde=2023, semilla=7)
+        self.assertEqual(len(filas), 12 * 5 * 2)
+        self.assertTrue(filas.equals(sinteticos.generar(emisores=12, eventos=5, anios=2, desde=2023, semilla=7)))
+        self.assertEqual(sorted(filas['Ejercicio'].unique()), [2023, 2024])
+        self.assertEqual((sinteticos.digito_verificador(12345678), sinteticos.digito_verificador(11111111)), ('5', '1'))
+
+        columnas = list(sinteticos.COLUMNAS)
+        validacion = validar_matriz(filas[[f'Factor {c}' for c in columnas]].to_numpy(), columnas)
+        self.assertEqual(validacion.errores, [])
+
+    def test_carga_en_la_base(self):
+        ConceptoFactor.objects.bulk_create([ConceptoFactor(columna_dj=c, descripcion=f'Factor {c}') for c in sinteticos.COLUMNAS])
+        filas = sinteticos.generar(emisores=3, eventos=4, anios=1, desde=2024)
+        self.assertEqual(sinteticos.cargar(filas), 12)
+        self.assertEqual(CalificacionTributaria.objects.filter(evento__emisor__nemonico='SIN00002').count(), 4)
+        self.assertEqual(DetalleFactor.objects.count(), int(filas.filter(like='Factor').notna().sum().sum()))
+
+
+class GrillaMantenedorTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        ConceptoFactor.objects.bulk_create([ConceptoFactor(columna_dj=c, descripcion=f'Factor {c}') for c in sinteticos.COLUMNAS])
+        sinteticos.cargar(sinteticos.generar(emisores=3, eventos=4, anios=1, desde=2024))
+        # En TestCase no hay commit: las diferencias del historial se calculan como al confirmar
+        historial.procesar(historial.calificaciones_pendientes())
+        cls.user = User.objects.create_user('grilla', password='x')
+
+    def setUp(self):
+        connection._pendientes = {}
+        caches['grilla'].clear()
+        self.client.force_login(self.user)
+        sesion = self.client.session
+        sesion['otp_device_id'] = TOTPDevice.objects.create(user=self.user, name='t', confirmed=True).persistent_id
+        sesion.save()
+
+    def _grilla(self, **params):
+        respuesta = self.client.get('/grilla/', params)
+        self.assertEqual(respuesta.status_code, 200)
+        return respuesta.json()
+
+    def test_mantenedor_no_dibuja_filas(self):
+        respuesta = self.client.get('/')
+        self.assertContains(respuesta, '/grilla/')
+        self.assertNotContains(respuesta, 'SIN00001')
+        self.assertContains(self.client.get('/', {'al': '2024-01-01'}), 'Vista histórica')
+
+    def test_ventanas_columnares(self):
+        ventanas = [self._grilla(desde=desde, cantidad=5) for desde in (0, 5, 10)]
+        self.assertEqual({v['total'] for v in ventanas}, {12})
+        self.assertEqual([len(v['id']) for v in ventanas], [5, 5, 2])
+        ids = [i for v in ventanas for i in v['id']]
+        self.assertCountEqual(ids, CalificacionTributaria.objects.values_list('pk', flat=True))
+        fechas = [f for v in ventanas for f in v['fecha_pago']]
+        self.assertEqual(fechas, sorted(fechas, reverse=True))
+
+        primera = ventanas[0]
+        self.assertEqual(primera['columnas'], list(range(8, 38)))
+        calificacion = CalificacionTributaria.objects.select_related('evento__emisor').get(pk=primera['id'][0])
+        emisor = calificacion.evento.emisor
+        self.assertEqual(primera['emisores'][str(emisor.pk)], [emisor.nemonico, emisor.rut])
+        self.assertEqual(primera['emisor'][0], emisor.pk)
+        self.assertEqual(primera['monto'][0], float(calificacion.monto_unitario_pesos))
+        factores = {d.concepto.columna_dj: float(d.valor) for d in calificacion.detalles.select_related('concepto')}
+        self.assertEqual(primera['factores'][0], [factores.get(c, 0) for c in range(8, 38)])
+        # Fuera del total no hay filas, y la ventana está acotada
+        self.assertEqual(self._grilla(desde=50)['id'], [])
+        self.assertEqual(len(self._grilla(cantidad=100000)['id']), 12)
+        with mock.patch('core.views.VENTANA_GRILLA', 4):
+            self.assertEqual(len(self._grilla(cantidad=100000)['id']), 4)
+
+    def test_filtros_y_vista_historica(self):
+        self.assertEqual(self._grilla(instrumento='SIN00002')['total'], 4)
+        calificacion = CalificacionTributaria.objects.first()
+        AnomaliaCalificacion.objects.create(calificacion=calificacion, ejercicio=2024, codigo='SIN_FACTORES')
+        anomalas = self._grilla(anomalia='con')
+        self.assertEqual((anomalas['id'], anomalas['anomalias']), ([calificacion.pk], [True]))
+
+        historica = self._grilla(al=timezone.now().isoformat(), instrumento='SIN00002')
+        self.assertEqual(historica['total'], 4)
+        actual = self._grilla(instrumento='SIN00002')
+        self.assertEqual((historica['id'], historica['factores']), (actual['id'], actual['factores']))
+        self.assertEqual(self.client.get('/grilla/', {'al': 'ayer'}).status_code, 400)
+        for params in ({'periodo': '2024x'}, {'periodo': '2024x', 'al': timezone.now().isoformat()}):
+            respuesta = self.client.get('/grilla/', params)
+            self.assertEqual(respuesta.status_code, 400)
+            self.assertIn('Periodo inválido', respuesta.json()['detail'])
+        self.assertEqual(self._grilla(periodo=' 2024 ')['total'], 12)
+
+    def test_la_vista_historica_se_reconstruye_una_vez(self):
+        al = timezone.now().isoformat()
+        with mock.patch('core.views.estado_al', wraps=reconstruccion.estado_al) as estado_al, \
+                mock.patch('core.views.VENTANA_GRILLA', 5):
+            ventanas = [self._grilla(al=al, desde=desde, cantidad=5) for desde in (0, 5, 10, 3)]
+        self.assertEqual(estado_al.call_count, 1)
+        self.assertEqual([len(v['id']) for v in ventanas], [5, 5, 2, 5])
+        todas = [i for v in ventanas[:3] for i in v['id']]
+        self.assertEqual(todas, self._grilla(desde=0, cantidad=12)['id'])
+        self.assertEqual(ventanas[3]['id'], todas[3:8])
+
+
+# --- Presupuestos de consultas y latencia ---
+
+_RAIZ = str(settings.BASE_DIR)
+
+
+def _origen_consulta():
+    """Archivo:línea (función) del código del proyecto más cercano a la consulta, fuera de los tests."""
+    for marco in reversed(traceback.extract_stack()[:-2]):
+        if marco.filename.startswith(_RAIZ) and not marco.filename.endswith('tests.py'):
+            return f"{os.path.relpath(marco.filename, _RAIZ)}:{marco.lineno} ({marco.name})"
+    return '(fuera del proyecto)'
+
+
+class Medicion:
+    """Consultas (SQL, origen, ms) y duración total de una petición."""
+
+    def __init__(self, consultas, ms):
+        self.consultas = consultas
+        self.ms = ms
+
+    def __len__(self):
+        return len(self.consultas)
+
+    def reporte(self):
+        """Consultas agrupadas por SQL normalizado, las repetidas primero (posibles N+1)."""
+        grupos = Counter()
+        origenes, tiempos = {}, Counter()
+        for sql, origen, ms in self.consultas:
+            clave = re.sub(r"\b\d+\b|'[^']*'", '?', sql)[:160]
+            grupos[clave] += 1
+            tiempos[clave] += ms
+            origenes.setdefault(clave, Counter())[origen] += 1
+        return '\n'.join(
+            f"  x{n:<4} {tiempos[clave]:7.1f} ms  {clave}\n"
+            + ''.join(f"          <- {origen} x{m}\n" for origen, m in origenes[clave].most_common(3))
+            for clave, n in grupos.most_common()
+        )
+
+
+class PresupuestoMixin:
+    """
+    Ejecuta una petición registrando cada consulta con su origen en el código y falla con un
+    reporte legible si supera el presupuesto de consultas o de latencia.
+    """
+
+    def medir(self, peticion):
+        consultas = []
+
+        def registrar(execute, sql, params, many, context):
+            inicio = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                consultas.append((sql, _origen_consulta(), (time.perf_counter() - inicio) * 1000))
+
+        inicio = time.perf_counter()
+        with connection.execute_wrapper(registrar):
+            respuesta = peticion()
+            if respuesta.streaming:
+                b''.join(respuesta.streaming_content)
+        self.assertLess(respuesta.status_code, 400, respuesta)
+        return Medicion(consultas, (time.perf_counter() - inicio) * 1000)
+
+    def assertPresupuesto(self, nombre, medicion, max_consultas, max_ms):
+        excesos = []
+        if len(medicion) > max_consultas:
+            excesos.append(f"{len(medicion)} consultas (presupuesto {max_consultas})")
+        if medicion.ms > max_ms:
+            excesos.append(f"{medicion.ms:.0f} ms (presupuesto {max_ms} ms)")
+        if excesos:
+            self.fail(f"{nombre}: {', '.join(excesos)}\n{medicion.reporte()}")
+
+
+class PresupuestoVistasTests(PresupuestoMixin, TestCase):
+    # nombre: (máximo de consultas, máximo de ms). Las consultas no deben depender del volumen de datos.
+    PRESUPUESTOS = {
+        'carga_excel': (29, 3000),  # Incluye los locks por clave, la relectura de emisores nuevos y la verificación de versiones
+        'mantenedor': (6, 500),
+        'grilla': (8, 800),
+        'edicion': (11, 800),
+        'historial_calificacion': (9, 800),
+        'auditoria': (7, 800),
+        'admin_auditoria': (13, 1500),
+        'api_lista': (4, 800),
+        'api_detalle': (3, 500),
+        'api_export': (1, 800),
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        ConceptoFactor.objects.bulk_create([ConceptoFactor(columna_dj=c, descripcion=f'Factor {c}') for c in sinteticos.COLUMNAS])
+        cls.analista = User.objects.create_user('analista', password='x')
+        cls.analista.groups.add(Group.objects.create(name='Analista Tributario'), Group.objects.create(name='Auditor Interno'))
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'x')
+
+    def setUp(self):
+        connection._pendientes = {}
+        self.web, self.web_admin = self._cliente(self.analista), self._cliente(self.admin)
+        self.api = APIClient()
+        self.api.force_authenticate(self.analista)
+
+    def _cliente(self, user):
+        cliente = self.client_class()
+        cliente.force_login(user)
+        sesion = cliente.session
+        sesion['otp_device_id'] = TOTPDevice.objects.create(user=user, name='t', confirmed=True).persistent_id
+        sesion.save()
+        return cliente
+
+    def _sembrar(self, emisores, desde, ediciones):
+        sinteticos.cargar(sinteticos.generar(emisores=emisores, eventos=5, anios=1, desde=desde, semilla=desde))
+        # Ediciones individuales: auditoría por objeto (con content_object) y versiones en el historial
+        for calificacion in CalificacionTributaria.objects.select_related('evento')[:ediciones]:
+            for monto in range(3):
+                calificacion.monto_total_distribuido = monto + calificacion.monto_total_distribuido + 1
+                calificacion.save()
+            calificacion.evento.secuencia += 1
+            calificacion.evento.save()
+        # En TestCase no hay commit: las diferencias del historial se calculan como al confirmar
+        historial.procesar(historial.calificaciones_pendientes())
+
+    def _archivo(self, filas):
+        archivo = BytesIO()
+        filas.to_excel(archivo, index=False, engine='openpyxl')
+        archivo.seek(0)
+        archivo.name = 'carga.xlsx'
+        return archivo
+
+    def _medir_todo(self, desde_carga, filas_carga):
+        calificacion = CalificacionTributaria.objects.order_by('id').first()
+        archivo = self._archivo(sinteticos.generar(emisores=filas_carga, eventos=1, anios=1, desde=desde_carga))
+        # La carga primero: crea emisores, así la auditoría ya tiene todos sus tipos de objeto en ambas mediciones
+        peticiones = {
+            'carga_excel': lambda: self.web.post('/upload/', {'archivo_excel': archivo}),
+            'mantenedor': lambda: self.web.get('/'),
+            'grilla': lambda: self.web.get('/grilla/', {'desde': 5}),
+            'edicion': lambda: self.web.get(f'/calificacion/{calificacion.pk}/edit/'),
+            'historial_calificacion': lambda: self.web.get(f'/calificacion/{calificacion.pk}/history/'),
+            'auditoria': lambda: self.web.get('/historial/'),
+            'admin_auditoria': lambda: self.web_admin.get('/admin/core/auditlog/'),
+            'api_lista': lambda: self.api.get('/api/calificaciones/'),
+            'api_detalle': lambda: self.api.get(f'/api/calificaciones/{calificacion.pk}/'),
+            'api_export': lambda: self.api.get('/api/calificaciones/export/'),
+        }
+        return {nombre: self.medir(peticion) for nombre, peticion in peticiones.items()}
+
+    def test_consultas_acotadas_y_sin_crecer_con_los_datos(self):
+        self._sembrar(emisores=2, desde=2024, ediciones=1)
+        chico = self._medir_todo(desde_carga=2030, filas_carga=3)
+        self._sembrar(emisores=8, desde=2023, ediciones=6)
+        grande = self._medir_todo(desde_carga=2031, filas_carga=15)
+        self.assertGreater(CalificacionTributaria.objects.count(), 50)
+
+        for nombre, (max_consultas, max_ms) in self.PRESUPUESTOS.items():
+            with self.subTest(nombre):
+                self.assertPresupuesto(nombre, grande[nombre], max_consultas, max_ms)
+                if len(grande[nombre]) > len(chico[nombre]):
+                    self.fail(
+                        f"{nombre}: las consultas crecen con los datos ({len(chico[nombre])} -> {len(grande[nombre])})\n"
+                        f"Con más datos:\n{grande[nombre].reporte()}"
+                    )
+
+
+class PerfiladoTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'x')
+
+    def _cliente(self):
+        # El middleware se carga con el primer request de cada cliente: se crea dentro de override_settings
+        cliente = self.client_class()
+        cliente.force_login(self.admin)
+        sesion = cliente.session
+        sesion['otp_device_id'] = TOTPDevice.objects.create(user=self.admin, name='t', confirmed=True).persistent_id
+        sesion.save()
+        return cliente
+
+    @staticmethod
+    def _tiempos(respuesta):
+        return {
+            metrica.split(';')[0].strip(): float(metrica.split('dur=')[1].split(';')[0])
+            for metrica in respuesta['Server-Timing'].split(',')
+        }
+
+    @override_settings(PERFILADO=True, PERFILADO_LENTO_MS=60_000)
+    def test_server_timing_desglosa_sql_plantillas_y_serializacion(self):
+        cliente = self._cliente()
+        web = cliente.get('/')
+        tiempos = self._tiempos(web)
+        self.assertEqual(set(tiempos), {'sql', 'tpl', 'ser', 'app', 'total'})
+        self.assertGreater(tiempos['tpl'], 0)
+        self.assertEqual(tiempos['ser'], 0)
+        self.assertRegex(web['Server-Timing'], r'desc="SQL \([1-9]\d* consultas\)"')
+        self.assertLessEqual(tiempos['sql'] + tiempos['tpl'], tiempos['total'])
+
+        api = self._tiempos(cliente.get('/api/calificaciones/', HTTP_ACCEPT='application/json'))
+        self.assertGreater(api['ser'], 0)
+        self.assertEqual(api['tpl'], 0)
+
+    @override_settings(PERFILADO=True, PERFILADO_LENTO_MS=0, PERFILADO_TOP_CONSULTAS=2)
+    def test_log_de_requests_lentas_con_las_consultas_mas_lentas(self):
+        cliente = self._cliente()
+        with self.assertLogs('core.perfilado', 'WARNING') as logs:
+            cliente.get('/')
+        self.assertEqual(len(logs.records), 1)
+        mensaje = logs.records[0].getMessage()
+        self.assertIn('GET / -> 200', mensaje)
+        self.assertEqual(mensaje.count(' ms  SELECT'), 2)
+
+    def test_inactivo_por_defecto(self):
+        self.assertNotIn('Server-Timing', self._cliente().get('/'))
+
+
+class MetricasTests(APITestCase):
+    def setUp(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        ajustes = override_settings(METRICAS_DIR=directorio.name, METRICAS_INTERVALO=0)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.directorio = directorio.name
+
+    @staticmethod
+    def _valor(texto, linea):
+        for fila in texto.splitlines():
+            if fila.startswith(linea + ' '):
+                return float(fila.rsplit(' ', 1)[1])
+        return 0.0
+
+    def test_suma_procesos_vivos_y_terminados(self):
+        import multiprocessing
+        metricas.CARGA_FILAS.inc(1, origen='prueba')
+
+        def trabajador():
+            metricas.CARGA_FILAS.inc(2, origen='prueba')
+            metricas.CARGA_DURACION.observar(0.3, origen='prueba')
+
+        procesos = [multiprocessing.get_context('fork').Process(target=trabajador) for _ in range(2)]
+        for proceso in procesos:
+            proceso.start()
+        for proceso in procesos:
+            proceso.join()
+            self.assertEqual(proceso.exitcode, 0)
+
+        texto = metricas.exponer()
+        self.assertEqual(self._valor(texto, 'carga_filas_total{origen="prueba"}'), 5)
+        self.assertEqual(self._valor(texto, 'carga_duracion_segundos_bucket{origen="prueba",le="0.25"}'), 0)
+        self.assertEqual(self._valor(texto, 'carga_duracion_segundos_bucket{origen="prueba",le="0.5"}'), 2)
+        self.assertEqual(self._valor(texto, 'carga_duracion_segundos_bucket{origen="prueba",le="+Inf"}'), 2)
+        self.assertEqual(self._valor(texto, 'carga_duracion_segundos_count{origen="prueba"}'), 2)
+        # Los archivos de los procesos terminados se fusionaron: el total no cambia al volver a leer
+        self.assertTrue(os.path.exists(os.path.join(self.directorio, metricas.ACUMULADO)))
+        self.assertEqual(len([a for a in os.listdir(self.directorio) if a.endswith('.json')]), 2)
+        self.assertEqual(self._valor(metricas.exponer(), 'carga_filas_total{origen="prueba"}'), 5)
+
+    def test_endpoint_protegido_en_formato_prometheus(self):
+        self.assertIn(self.client.get('/metrics').status_code, (401, 403))
+        analista = User.objects.create_user('analista', password='x')
+        self.client.force_authenticate(analista)
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'x')
+        self.client.force_authenticate(admin)
+        self.client.get('/api/calificaciones/')
+        respuesta = self.client.get('/metrics')
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertTrue(respuesta['Content-Type'].startswith('text/plain; version=0.0.4'))
+        texto = respuesta.content.decode()
+        self.assertIn('# TYPE api_request_duracion_segundos histogram', texto)
+        self.assertGreaterEqual(
+            self._valor(texto, 'api_request_duracion_segundos_count{accion="list",estado="2xx",vista="calificaciontributaria"}'), 1
+        )
+
+    def test_carga_masiva_cuenta_filas_y_errores(self):
+        ConceptoFactor.objects.bulk_create([ConceptoFactor(columna_dj=c, descripcion=f'Factor {c}') for c in sinteticos.COLUMNAS])
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'x')
+        self.client.force_authenticate(admin)
+        filas = sinteticos.generar(emisores=2, eventos=3, anios=1)
+        sinteticos.crear_emisores(filas)
+        antes = metricas.exponer()
+        items = list(sinteticos.items_bulk(filas))
+        items[0]['factores'] = {'8': '2'}  # Suma de créditos sobre el tope
+        self.client.post('/api/calificaciones/bulk/', items, format='json')
+        despues = metricas.exponer()
+        for linea, esperado in (('carga_filas_total{origen="api"}', 5), ('carga_errores_validacion_total{origen="api"}', 1)):
+            self.assertEqual(self._valor(despues, linea) - self._valor(antes, linea), esperado)
+
+
+class PruebaCargaTests(LiveServerTestCase):
+    databases = '__all__'  # El servidor lee de la réplica si está configurada
+
+    def test_mide_mantenedor_y_api_autenticado(self):
+        ConceptoFactor.objects.bulk_create([ConceptoFactor(columna_dj=c, descripcion=f'Factor {c}') for c in sinteticos.COLUMNAS])
+        sinteticos.cargar(sinteticos.generar(emisores=2, eventos=3, anios=1))
+        User.objects.create_superuser('carga', 'carga@example.com', 'x')
+        salida = StringIO()
+        call_command(
+            'prueba_carga', url=self.live_server_url, usuario='carga', concurrencia=2, duracion=0.3,
+            stdout=salida, stderr=StringIO(),
+        )
+        rutas = json.loads(salida.getvalue())['rutas']
+        self.assertEqual(len(rutas), 3)
+        for ruta, medicion in rutas.items():
+            # Sin redirecciones al login ni a la verificación 2FA
+            self.assertGreater(medicion['requests'], 0, ruta)
+            self.assertEqual(medicion['errores'], 0, ruta)
+
+
+class ArranqueTests(SimpleTestCase):
+    # Arranque en frío de un worker. Con pandas y qrcode cargados al importar las vistas era ~115 MB
+    MAX_MS = 3000
+    MAX_RSS_MB = 100
+
+    def test_arranque_sin_importaciones_pesadas_y_dentro_del_presupuesto(self):
+        from .management.commands.medir_arranque import PESADOS, importaciones, medir
+        medicion, salida = medir(importtime=True)
+        lentas = '\n'.join(f'  {ms:8.1f} ms  {modulo}' for ms, modulo in importaciones(salida)[:10])
+        self.assertEqual([m for m in PESADOS if m in medicion['modulos']], [], lentas)
+        self.assertLess(medicion['rss_mb'], self.MAX_RSS_MB, lentas)
+        self.assertLess(medir()[0]['ms'], self.MAX_MS, lentas)
+
+
+class ReplicaLecturaTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'x')
+
+    def tearDown(self):
+        router.permitir_replica(False)
+
+    def _cliente(self):
+        cliente = self.client_class()
+        cliente.force_login(self.admin)
+        sesion = cliente.session
+        sesion['otp_device_id'] = TOTPDevice.objects.create(user=self.admin, name='t', confirmed=True).persistent_id
+        sesion.save()
+        return cliente
+
+    @override_settings(REPLICA_LECTURA='replica')
+    def test_router_lee_de_la_replica_hasta_la_primera_escritura(self):
+        ruteo = router.ReplicaRouter()
+        leer = lambda: ruteo.db_for_read(CalificacionTributaria)
+        router.permitir_replica(True)
+        # TestCase envuelve cada test en una transacción: fuera de ella es una request normal
+        with mock.patch.object(connections['default'], 'in_atomic_block', False):
+            self.assertEqual(leer(), 'replica')
+            with router.en_primaria():
+                self.assertEqual(leer(), 'default')
+            self.assertEqual(leer(), 'replica')
+            self.assertEqual(ruteo.db_for_write(CalificacionTributaria), 'default')
+            self.assertEqual(leer(), 'default')
+        router.permitir_replica(True)
+        self.assertEqual(leer(), 'default')  # Dentro de una transacción
+        self.assertFalse(ruteo.allow_migrate('replica', 'core'))
+
+    @override_settings(REPLICA_LECTURA=None)
+    def test_sin_replica_configurada_todo_va_a_la_primaria(self):
+        router.permitir_replica(True)
+        with mock.patch.object(connections['default'], 'in_atomic_block', False):
+            self.assertEqual(router.ReplicaRouter().db_for_read(CalificacionTributaria), 'default')
+        self.assertNotIn('primaria', self._cliente().post('/reportes/anomalias/').cookies)
+
+    @override_settings(REPLICA_LECTURA='replica', REPLICA_PEGAR_SEGUNDOS=30)
+    def test_middleware_pega_a_la_primaria_tras_una_escritura(self):
+        cliente = self._cliente()
+        with mock.patch.object(router, 'permitir_replica', wraps=router.permitir_replica) as permitir:
+            self.assertNotIn('primaria', cliente.get('/').cookies)
+            permitir.assert_called_with(True)
+            # Al cerrar la respuesta el hilo deja de usar la réplica
+            with mock.patch.object(connections['default'], 'in_atomic_block', False):
+                self.assertEqual(router.alias_lectura(), 'default')
+
+            respuesta = cliente.post('/reportes/anomalias/')
+            permitir.assert_called_with(False)
+            self.assertEqual(respuesta.cookies['primaria']['max-age'], 30)
+            self.assertTrue(respuesta.cookies['primaria']['httponly'])
+
+            # Mientras dure la cookie, también las lecturas van a la primaria
+            cliente.get('/')
+            permitir.assert_called_with(False)
+
+
+@skipUnless('replica' in settings.DATABASES, 'Sin réplica configurada (DB_REPLICA_HOST)')
+class ReplicaIntegracionTests(TransactionTestCase):
+    # En los tests la réplica es un espejo (TEST MIRROR) de la base de pruebas
+    databases = '__all__'
+
+    def test_get_de_la_api_lee_de_la_replica_y_escrituras_de_la_primaria(self):
+        emisor = Emisor.objects.create(rut='1-9', razon_social='Uno', nemonico='UNO')
+        evento = EventoCorporativo.objects.create(emisor=emisor, ejercicio_comercial=2024, numero_dividendo=1, fecha_pago=date(2024, 5, 1))
+        calificacion = CalificacionTributaria.objects.create(evento=evento)
+        cliente = APIClient()
+        cliente.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'x'))
+
+        with CaptureQueriesContext(connections['replica']) as replica, CaptureQueriesContext(connections['default']) as primaria:
+            self.assertEqual(cliente.get(f'/api/calificaciones/{calificacion.pk}/').status_code, 200)
+        self.assertTrue(any('core_calificaciontributaria' in q['sql'] for q in replica.captured_queries))
+        self.assertFalse(any('core_calificaciontributaria' in q['sql'] for q in primaria.captured_queries))
+
+        respuesta = cliente.patch(f'/api/calificaciones/{calificacion.pk}/', {'monto_unitario_pesos': '5'}, format='json')
+        self.assertEqual(respuesta.status_code, 200, respuesta.content)
+        self.assertIn('primaria', respuesta.cookies)
+        with CaptureQueriesContext(connections['replica']) as replica:
+            cliente.get(f'/api/calificaciones/{calificacion.pk}/')
+        self.assertEqual(replica.captured_queries, [])
+
+
+class ArchivoEjerciciosTests(APITestCase):
+    def setUp(self):
+        ConceptoFactor.objects.bulk_create([ConceptoFactor(columna_dj=c, descripcion=f'Factor {c}') for c in sinteticos.COLUMNAS])
+        self.filas = sinteticos.generar(emisores=2, eventos=3, anios=3, desde=2019)
+        sinteticos.cargar(self.filas)
+        self.client.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'x'))
+
+    @staticmethod
+    def _contar(tabla):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM {tabla}')
+            return cursor.fetchone()[0]
+
+    def test_archiva_los_ejercicios_cerrados_y_se_siguen_consultando(self):
+        vieja = CalificacionTributaria.objects.filter(evento__ejercicio_comercial=2019).first()
+        antes = self.client.get(f'/api/calificaciones/{vieja.pk}/').json()
+        factores, factores_2021 = DetalleFactor.objects.count(), DetalleFactor.objects.filter(calificacion__evento__ejercicio_comercial=2021).count()
+
+        call_command('archivar_ejercicios', hasta=2020, stdout=StringIO())
+
+        self.assertEqual(
+            list(EjercicioArchivado.objects.values_list('ejercicio', 'eventos', 'calificaciones')),
+            [(2019, 6, 6), (2020, 6, 6)],
+        )
+        # Las tablas calientes sólo tienen el ejercicio abierto; el ORM sigue viendo todo
+        self.assertEqual(self._contar('ONLY core_eventocorporativo'), 6)
+        self.assertEqual(self._contar('ONLY core_detallefactor'), factores_2021)
+        self.assertEqual(self._contar('archivo.core_detallefactor'), factores - factores_2021)
+        self.assertEqual(DetalleFactor.objects.count(), factores)
+        self.assertEqual(self.client.get(f'/api/calificaciones/{vieja.pk}/').json(), antes)
+        # Las consultas de ejercicios abiertos no abren el archivo de eventos
+        plan = EventoCorporativo.objects.filter(ejercicio_comercial=2021).explain()
+        self.assertNotIn('archivo', plan)
+
+    def test_los_ejercicios_archivados_son_de_solo_lectura(self):
+        archivo.archivar(2019)
+        vieja = CalificacionTributaria.objects.select_related('evento').filter(evento__ejercicio_comercial=2019).first()
+
+        self.assertEqual(self.client.delete(f'/api/calificaciones/{vieja.pk}/').status_code, 400)
+        self.assertEqual(self.client.patch(f'/api/eventos/{vieja.evento_id}/', {'ejercicio_comercial': 2021}, format='json').status_code, 400)
+        items = list(sinteticos.items_bulk(self.filas[self.filas['Ejercicio'].isin([2019, 2020])]))
+        resumen = self.client.post('/api/calificaciones/bulk/', items, format='json').json()
+        self.assertEqual((resumen['con_error'], resumen['actualizados']), (6, 6))
+        formulario = EventoForm(instance=vieja.evento, data={
+            'emisor': vieja.evento.emisor_id, 'mercado': 'ACN', 'ejercicio_comercial': 2021,
+            'numero_dividendo': 1, 'fecha_pago': '2021-05-01',
+        })
+        self.assertIn('ejercicio_comercial', formulario.errors)
+
+        # Y si algo llega igual a la base de datos, la rechaza
+        for escritura in (
+            lambda: DetalleFactor.objects.filter(calificacion=vieja).update(valor=0),
+            lambda: CalificacionTributaria.objects.filter(pk=vieja.pk).delete(),
+            lambda: EventoCorporativo.objects.create(emisor=vieja.evento.emisor, ejercicio_comercial=2019, numero_dividendo=99, fecha_pago=date(2019, 5, 1)),
+        ):
+            with self.assertRaises(DatabaseError), transaction.atomic():
+                escritura()
+        self.assertEqual(DetalleFactor.objects.filter(calificacion=vieja).exclude(valor=0).count(), vieja.detalles.count())
+
+    def test_la_transicion_masiva_omite_los_archivados(self):
+        archivo.archivar(2019)
+        respuesta = self.client.post('/api/calificaciones/transicion/?ejercicio=2019', {'estado': 'EN_REVISION'}, format='json')
+        self.assertEqual(respuesta.status_code, 409)
+        self.assertEqual((respuesta.json()['actualizadas'], respuesta.json()['omitidas']), (0, {'ARCHIVADA': 6}))
+
+        vieja, nueva = (CalificacionTributaria.objects.filter(evento__ejercicio_comercial=e).first() for e in (2019, 2021))
+        respuesta = self.client.post('/api/calificaciones/transicion/', {'estado': 'EN_REVISION', 'ids': [vieja.pk, nueva.pk]}, format='json')
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual((respuesta.json()['ids'], respuesta.json()['omitidas']), ([nueva.pk], {'ARCHIVADA': 1}))
+
+        # Desde el mantenedor: aviso, sin error
+        web = self.client_class()
+        web.force_login(User.objects.get(username='admin'))
+        sesion = web.session
+        sesion['otp_device_id'] = TOTPDevice.objects.create(user=User.objects.get(username='admin'), name='t', confirmed=True).persistent_id
+        sesion.save()
+        respuesta = web.post('/calificacion/transicion/', {'estado': 'RECHAZADO', 'ids': [vieja.pk]}, follow=True)
+        self.assertContains(respuesta, '1 calificaciones de ejercicios archivados')
+        self.assertEqual(CalificacionTributaria.objects.get(pk=vieja.pk).estado, vieja.estado)
+
+    def test_no_archiva_el_ejercicio_actual_ni_el_anterior(self):
+        with self.assertRaises(CommandError):
+            call_command('archivar_ejercicios', hasta=timezone.localdate().year - 1, stdout=StringIO())
+        self.assertFalse(EjercicioArchivado.objects.exists())
+
+
+class CargasConcurrentesTests(TransactionTestCase):
+    """Varias cargas .xlsx a la vez, cada una en su hilo (y su conexión), como en gunicorn con threads."""
+
+    def setUp(self):
+        ConceptoFactor.objects.bulk_create([ConceptoFactor(columna_dj=c, descripcion=f'Factor {c}') for c in sinteticos.COLUMNAS])
+        self.user = User.objects.create_user('analista', password='x')
+        self.directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directorio.cleanup)
+
+    def _archivo(self, nombre, filas):
+        ruta = os.path.join(self.directorio.name, f'{nombre}.xlsx')
+        filas.to_excel(ruta, index=False, engine='openpyxl')
+        return ruta
+
+    def _cargar_en_hilo(self, ruta, resultados, inicio=None):
+        from .carga_excel import procesar_archivo
+
+        def cargar():
+            try:
+                if inicio is not None:
+                    inicio.wait()
+                with open(ruta, 'rb') as archivo:
+                    resultados[ruta] = procesar_archivo(archivo, self.user)
+            except Exception as e:  # El test revisa que no haya ninguno
+                resultados[ruta] = e
+            finally:
+                connection.close()
+
+        hilo = threading.Thread(target=cargar)
+        hilo.start()
+        return hilo
+
+    def test_un_editor_que_guarda_durante_la_carga_no_se_pierde(self):
+        filas = sinteticos.generar(emisores=1, eventos=2, anios=1, desde=2024)
+        sinteticos.cargar(filas, user=self.user)
+        items = list(sinteticos.items_bulk(filas))
+        evento_id = EventoCorporativo.objects.order_by('pk').values_list('pk', flat=True).first()
+
+        def editar():
+            try:
+                evento = EventoCorporativo.objects.get(pk=evento_id)
+                evento.fecha_registro = evento.fecha_pago
+                evento.save()
+            finally:
+                connection.close()
+
+        original, lecturas = bulk._verificar_versiones, []
+        def con_editor(*args):
+            # La primera vez, otro usuario guarda (y confirma) entre la lectura del lote y sus upserts
+            if not lecturas:
+                hilo = threading.Thread(target=editar)
+                hilo.start()
+                hilo.join()
+            lecturas.append(1)
+            return original(*args)
+
+        with mock.patch.object(bulk, '_verificar_versiones', con_editor):
+            resumen = procesar_lote(items, user=self.user)
+        # El lote se reaplicó sobre la versión del editor: cada escritura tiene su versión
+        self.assertEqual((len(lecturas), resumen['actualizados']), (2, 2))
+        self.assertEqual(
+            list(EventoCorporativo.history.filter(id=evento_id).order_by('history_date').values_list('version', flat=True)),
+            [1, 2, 3],
+        )
+
+    def test_cargas_simultaneas_con_claves_compartidas(self):
+        filas = sinteticos.generar(emisores=8, eventos=4, anios=2, desde=2023)
+        por_emisor = {n: f for n, f in filas.groupby('Instrumento')}
+        nemonicos = sorted(por_emisor)
+        rutas = [
+            self._archivo('todo_2023', filas[filas['Ejercicio'] == 2023]),
+            self._archivo('todo_2023_bis', filas[filas['Ejercicio'] == 2023]),  # Las mismas claves
+            self._archivo('todo_2024', filas[filas['Ejercicio'] == 2024]),
+            self._archivo('primeros', pd.concat(por_emisor[n] for n in nemonicos[:5])),
+            self._archivo('ultimos', pd.concat(por_emisor[n] for n in nemonicos[3:])),
+            self._archivo('todo', filas),
+        ]
+        # Todas parten a la vez y todas crean los mismos emisores nuevos
+        resultados, inicio = {}, threading.Barrier(len(rutas))
+        for hilo in [self._cargar_en_hilo(ruta, resultados, inicio) for ruta in rutas]:
+            hilo.join(timeout=120)
+
+        for ruta in rutas:
+            self.assertIsInstance(resultados[ruta], dict, resultados[ruta])
+            self.assertEqual(resultados[ruta]['errores'], [], ruta)
+        self.assertEqual(Emisor.objects.count(), 8)
+        self.assertEqual(CalificacionTributaria.objects.count(), len(filas))
+        # Con las claves bloqueadas cada calificación se informa creada exactamente una vez
+        self.assertEqual(sum(r['creados'] for r in resultados.values()), len(filas))
+        self.assertEqual(DetalleFactor.objects.count(), int(filas.filter(like='Factor').notna().sum().sum()))
+
+    def test_cargas_independientes_no_esperan_a_las_demas(self):
+        filas = sinteticos.generar(emisores=4, eventos=3, anios=1, desde=2024)
+        sinteticos.crear_emisores(filas)
+        emisores = dict(Emisor.objects.values_list('nemonico', 'id'))
+        nemonicos = sorted(emisores)
+        ocupada = self._archivo('ocupada', filas[filas['Instrumento'].isin(nemonicos[:2])])
+        libre = self._archivo('libre', filas[filas['Instrumento'].isin(nemonicos[2:])])
+
+        resultados = {}
+        with transaction.atomic():
+            # Otra carga en curso con las claves del primer archivo
+            bloqueos.bloquear('calificaciones', {(emisores[n], 2024) for n in nemonicos[:2]})
+            esperando = self._cargar_en_hilo(ocupada, resultados)
+            independiente = self._cargar_en_hilo(libre, resultados)
+            independiente.join(timeout=60)
+            self.assertFalse(independiente.is_alive())
+            self.assertEqual(resultados[libre]['creados'], 6)
+            esperando.join(timeout=0.5)
+            self.assertTrue(esperando.is_alive())
+        esperando.join(timeout=60)
+        self.assertEqual(resultados[ocupada]['creados'], 6)
+
+
+class ConcurrenciaOptimistaTests(APITestCase):
+    def setUp(self):
+        ConceptoFactor.objects.bulk_create([ConceptoFactor(columna_dj=c, descripcion=f'Factor {c}') for c in sinteticos.COLUMNAS])
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'x')
+        self.otro = User.objects.create_superuser('otro', 'otro@example.com', 'x')
+        filas = sinteticos.generar(emisores=1, eventos=2, anios=1, desde=2024)
+        sinteticos.cargar(filas, user=self.admin)
+        self.items = list(sinteticos.items_bulk(filas))
+        self.calificacion = CalificacionTributaria.objects.select_related('evento').order_by('pk').first()
+        self.client.force_authenticate(self.admin)
+
+    def _editar_por_otro(self, monto):
+        # Otro usuario guarda entre la lectura y la escritura de quien edita
+        calificacion = CalificacionTributaria.objects.get(pk=self.calificacion.pk)
+        calificacion.monto_unitario_pesos, calificacion.modificado_por = monto, self.otro
+        calificacion._history_user = self.otro
+        calificacion.save()
+
+    def test_save_es_condicional_y_todo_update_sube_la_version(self):
+        primera = CalificacionTributaria.objects.get(pk=self.calificacion.pk)
+        segunda = CalificacionTributaria.objects.get(pk=self.calificacion.pk)
+        primera.save()
+        self.assertEqual(primera.version, 2)
+        with self.assertRaises(ConflictoVersion), transaction.atomic():
+            segunda.save()
+        # Los UPDATE masivos también la suben (trigger)
+        CalificacionTributaria.objects.filter(pk=self.calificacion.pk).update(estado='BORRADOR')
+        self.assertEqual(CalificacionTributaria.objects.get(pk=self.calificacion.pk).version, 3)
+
+    def test_api_if_match_con_etag(self):
+        url = f'/api/calificaciones/{self.calificacion.pk}/'
+        respuesta = self.client.get(url)
+        self.assertEqual((respuesta['ETag'], respuesta.json()['version']), ('"1"', 1))
+
+        respuesta = self.client.patch(url, {'estado': 'EN_REVISION'}, format='json', HTTP_IF_MATCH='"1"')
+        self.assertEqual((respuesta.status_code, respuesta['ETag']), (200, '"2"'))
+
+        self._editar_por_otro(Decimal('123.5'))
+        respuesta = self.client.patch(url, {'estado': 'BORRADOR'}, format='json', HTTP_IF_MATCH='"2"')
+        self.assertEqual(respuesta.status_code, 412)
+        conflicto = respuesta.json()
+        self.assertEqual((conflicto['version'], conflicto['version_editada']), (3, 2))
+        self.assertEqual(conflicto['cambios']['monto_unitario_pesos']['new'], '123.500000')
+        self.assertEqual(CalificacionTributaria.objects.get(pk=self.calificacion.pk).estado, 'EN_REVISION')
+        # Con el ETag vigente se guarda
+        self.assertEqual(self.client.patch(url, {'estado': 'BORRADOR'}, format='json', HTTP_IF_MATCH='"3"').status_code, 200)
+        self.assertEqual(self.client.delete(url, HTTP_IF_MATCH='"3"').status_code, 412)
+
+    def test_formulario_informa_el_conflicto_y_no_pisa_lo_guardado(self):
+        cliente = self.client_class()
+        cliente.force_login(self.admin)
+        sesion = cliente.session
+        sesion['otp_device_id'] = TOTPDevice.objects.create(user=self.admin, name='t', confirmed=True).persistent_id
+        sesion.save()
+        url = f'/calificacion/{self.calificacion.pk}/edit/'
+        self.assertEqual(cliente.get(url).context['versiones'], {'evento': 1, 'calificacion': 1})
+
+        evento = self.calificacion.evento
+        datos = {
+            'version_evento': 1, 'version_calificacion': 1,
+            'emisor': evento.emisor_id, 'mercado': evento.mercado, 'ejercicio_comercial': evento.ejercicio_comercial,
+            'numero_dividendo': evento.numero_dividendo, 'fecha_pago': evento.fecha_pago.isoformat(),
+            'monto_unitario_pesos': '10',
+            **{f'factor_{d.concepto_id}': d.valor for d in self.calificacion.detalles.all()},
+        }
+        self._editar_por_otro(Decimal('77'))
+        respuesta = cliente.post(url, datos)
+        self.assertEqual(respuesta.status_code, 200)
+        conflicto = respuesta.context['conflicto']
+        self.assertIn(('Monto unitario', str(self.calificacion.monto_unitario_pesos), '77.000000'), conflicto['cambios'])
+        self.assertEqual(respuesta.context['versiones'], {'evento': 1, 'calificacion': 2})
+        self.assertEqual(CalificacionTributaria.objects.get(pk=self.calificacion.pk).monto_unitario_pesos, Decimal('77'))
+
+        # Ya vio lo que cambió: al volver a guardar con las versiones vigentes se reemplaza
+        respuesta = cliente.post(url, {**datos, 'version_calificacion': 2})
+        self.assertEqual(respuesta.status_code, 302)
+        self.assertEqual(
+            CalificacionTributaria.objects.values_list('monto_unitario_pesos', 'version').get(pk=self.calificacion.pk),
+            (Decimal('10'), 3),
+        )
+
+    def test_carga_masiva_con_version(self):
+        self._editar_por_otro(Decimal('5'))
+        item = next(i for i in self.items if i['numero_dividendo'] == self.calificacion.evento.numero_dividendo)
+        resumen = procesar_lote([{**item, 'version': 1}], user=self.admin)
+        resultado = resumen['resultados'][0]
+        self.assertEqual((resumen['con_error'], resultado['resultado']), (1, 'conflicto'))
+        self.assertEqual(resultado['conflicto']['version'], 2)
+        self.assertIn('monto_unitario_pesos', resultado['conflicto']['cambios'])
+
+        resumen = procesar_lote([{**item, 'version': 2}], user=self.admin)
+        self.assertEqual(resumen['actualizados'], 1)
+        self.assertEqual(CalificacionTributaria.objects.get(pk=self.calificacion.pk).version, 3)
+        self.assertEqual(
+            list(self.calificacion.history.order_by('history_date').values_list('version', flat=True)), [1, 2, 3],
+        )
+
+
+@override_settings(AVISOS_ACTIVOS=True)
+class AvisosSalidaTests(TransactionTestCase):
+    def setUp(self):
+        ConceptoFactor.objects.bulk_create([ConceptoFactor(columna_dj=c, descripcion=f'Factor {c}') for c in sinteticos.COLUMNAS])
+        sinteticos.cargar(sinteticos.generar(emisores=1, eventos=3, anios=1, desde=2024))
+        self.ids = list(CalificacionTributaria.objects.order_by('pk').values_list('pk', flat=True))
+
+    class Memoria:
+        def __init__(self, falla=None):
+            self.eventos, self.falla = [], falla
+
+        def enviar(self, eventos):
+            if self.falla:
+                raise self.falla
+            self.eventos.extend(eventos)
+
+    def test_se_escriben_en_la_transaccion_del_cambio(self):
+        self.assertEqual(AvisoSalida.objects.count(), 3)
+        with transaction.atomic():
+            CalificacionTributaria.objects.get(pk=self.ids[0]).save()
+            transaction.set_rollback(True)
+        self.assertEqual(AvisoSalida.objects.count(), 3)
+        with override_settings(AVISOS_ACTIVOS=False):
+            CalificacionTributaria.objects.get(pk=self.ids[0]).save()
+        self.assertEqual(AvisoSalida.objects.count(), 3)
+
+    def test_despacho_junta_los_cambios_de_cada_calificacion(self):
+        CalificacionTributaria.objects.get(pk=self.ids[0]).save()
+        CalificacionTributaria.objects.get(pk=self.ids[1]).delete()
+        destino = self.Memoria()
+        self.assertEqual(avisos.despachar([destino]), (3, 0))
+        por_id = {e['id']: e for e in destino.eventos}
+        self.assertEqual((por_id[self.ids[0]]['accion'], por_id[self.ids[0]]['version']), ('upsert', 2))
+        self.assertEqual(por_id[self.ids[0]]['calificacion']['id'], self.ids[0])
+        self.assertEqual(por_id[self.ids[1]], {'accion': 'delete', 'id': self.ids[1]})
+        self.assertFalse(AvisoSalida.objects.exists())
+
+    def test_reintentos_con_espera_creciente(self):
+        fallido = self.Memoria(falla=OSError('sin conexión'))
+        with self.assertLogs('core.avisos', 'WARNING'):
+            self.assertEqual(avisos.despachar([fallido], max_intentos=2), (0, 3))
+        aviso = AvisoSalida.objects.first()
+        self.assertEqual((aviso.intentos, aviso.error), (1, 'OSError: sin conexión'))
+        self.assertGreater(aviso.proximo_intento, timezone.now())
+        # Aún no vence: no se vuelve a intentar
+        self.assertEqual(avisos.despachar([fallido]), (0, 0))
+
+        AvisoSalida.objects.update(proximo_intento=timezone.now())
+        with self.assertLogs('core.avisos', 'WARNING'):
+            avisos.despachar([fallido], max_intentos=2)
+        self.assertEqual(AvisoSalida.objects.filter(proximo_intento__isnull=True).count(), 3)  # Agotados
+        self.assertEqual(avisos.reintentar_agotados(), 3)
+        self.assertEqual(avisos.despachar([self.Memoria()]), (3, 0))
+
+    def test_despachadores_en_paralelo_no_se_esperan(self):
+        ocupado, liberar = threading.Event(), threading.Event()
+
+        def otro_despachador():
+            try:
+                with transaction.atomic():
+                    list(AvisoSalida.objects.select_for_update().filter(calificacion_id=self.ids[0]))
+                    ocupado.set()
+                    liberar.wait(10)
+            finally:
+                connection.close()
+
+        hilo = threading.Thread(target=otro_despachador)
+        hilo.start()
+        ocupado.wait(10)
+        destino = self.Memoria()
+        self.assertEqual(avisos.despachar([destino]), (2, 0))
+        liberar.set()
+        hilo.join()
+        self.assertEqual(list(AvisoSalida.objects.values_list('calificacion_id', flat=True)), [self.ids[0]])
+
+    def test_comando_con_archivo_y_webhook(self):
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+        recibidos = []
+
+        class Receptor(BaseHTTPRequestHandler):
+            def do_POST(self):
+                cuerpo = self.rfile.read(int(self.headers['Content-Length']))
+                recibidos.append((cuerpo, self.headers.get('X-Firma')))
+                self.send_response(204)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        servidor = HTTPServer(('127.0.0.1', 0), Receptor)
+        hilo = threading.Thread(target=servidor.serve_forever)
+        hilo.start()
+        self.addCleanup(lambda: (servidor.shutdown(), hilo.join(), servidor.server_close()))
+        ruta = os.path.join(tempfile.mkdtemp(), 'avisos.ndjson')
+        url = f'http://127.0.0.1:{servidor.server_port}/'
+
+        with override_settings(AVISOS_DESTINOS=[{'clase': 'core.avisos.Webhook', 'url': url, 'secreto': 's3'}]):
+            call_command('despachar_avisos', stderr=StringIO())
+        cuerpo, firma = recibidos[0]
+        self.assertEqual(len(json.loads(cuerpo)['eventos']), 3)
+        self.assertEqual(firma, hmac.new(b's3', cuerpo, hashlib.sha256).hexdigest())
+
+        CalificacionTributaria.objects.get(pk=self.ids[2]).save()
+        call_command('despachar_avisos', destino=[f'archivo:{ruta}'], stderr=StringIO())
+        with open(ruta, encoding='utf-8') as archivo:
+            self.assertEqual([json.loads(l)['id'] for l in archivo], [self.ids[2]])
@@ -0,0 +1,93 @@
+# core/transiciones.py
+# Cambio de estado masivo de calificaciones (flujo de revisión de fin de año).
+# Bloquea las filas seleccionadas, descarta las que no admiten la transición y
+# aplica el cambio con UN solo UPDATE; el lote queda en un único AuditLog y el
+# historial se escribe con un INSERT masivo que referencia ese registro.
+# Las de ejercicios archivados (de sólo lectura) se omiten como ARCHIVADA.
+from collections import Counter
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .archivo import archivados
+from .auditoria import registrar_lote, usuario_actual
+from .cambios import registrar_cambios
+from .models import CalificacionTributaria
+
+LOTE_HISTORIAL = 1000
+# Clave de 'omitidas' para las calificaciones de ejercicios archivados
+ARCHIVADA = 'ARCHIVADA'
+
+
+def origenes_permitidos(destino):
+    """Estados desde los que se puede pasar a 'destino'."""
+    return sorted(o for o, destinos in CalificacionTributaria.TRANSICIONES.items() if destino in destinos)
+
+
+def transicionar(queryset, destino, user=None, motivo=''):
+    """
+    Pasa a 'destino' todas las calificaciones del queryset cuyo estado lo permita
+    (las de ejercicios archivados se omiten como ARCHIVADA).
+    Devuelve el resumen: {'estado', 'actualizadas', 'desde', 'omitidas', 'ids'}.
+    """
+    if destino not in dict(CalificacionTributaria.ESTADO_CHOICES):
+        raise ValueError(f"Estado '{destino}' no válido.")
+    user = user or usuario_actual()
+    origenes = origenes_permitidos(destino)
+    ahora = timezone.now()
+    cerrados = archivados()
+
+    with transaction.atomic():
+        # FOR UPDATE sólo sobre las filas de calificación (el filtro puede venir con joins),
+        # en orden de id para que dos lotes concurrentes no se bloqueen mutuamente
+        candidatas = list(
+            CalificacionTributaria.objects
+            .filter(pk__in=queryset.order_by().values('pk'))
+            .annotate(ejercicio=F('evento__ejercicio_comercial'))
+            .select_for_update(of=('self',))
+            .order_by('pk')
+        )
+        # Las archivadas no se pueden escribir (el trigger del archivo rechazaría el UPDATE)
+        omitidas = Counter({ARCHIVADA: sum(c.ejercicio in cerrados for c in candidatas)})
+        candidatas = [c for c in candidatas if c.ejercicio not in cerrados]
+        # El estado se revisa DESPUÉS de bloquear: es el vigente, no el leído antes
+        permitidas = [c for c in candidatas if c.estado in origenes]
+        omitidas.update(c.estado for c in candidatas if c.estado not in origenes)
+        omitidas = +omitidas  # Sin las claves en cero
+        desde = Counter(c.estado for c in permitidas)
+        ids = [c.pk for c in permitidas]
+
+        if permitidas:
+            cambios = {'estado': destino, 'ultima_modificacion': ahora}
+            if user is not None:
+                cambios['modificado_por'] = user
+            CalificacionTributaria.objects.filter(pk__in=ids).update(**cambios)
+            for calificacion in permitidas:
+                for campo, valor in cambios.items():
+                    setattr(calificacion, campo, valor)
+                calificacion.version += 1  # La subió el trigger (filas bloqueadas: es exacta)
+
+            lote = registrar_lote(CalificacionTributaria, {
+                'origen': 'Transición masiva',
+                'estado': destino,
+                'desde': dict(desde),
+                'omitidas': dict(omitidas),
+                'motivo': motivo,
+                'ids': ids,
+            }, user=user)
+            CalificacionTributaria.history.bulk_history_create(
+                permitidas,
+                batch_size=LOTE_HISTORIAL,
+                update=True,
+                default_user=user,
+                default_change_reason=f'Transición masiva a {destino} (auditoría #{lote.pk})',
+                default_date=ahora,
+            )
+            registrar_cambios(ids)
+
+    return {
+        'estado': destino,
+        'actualizadas': len(ids),
+        'desde': dict(desde),
+        'omitidas': dict(omitidas),
+        'ids': ids,
+    }
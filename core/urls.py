@@ -15,6 +15,7 @@ router = DefaultRouter()
 router.register(r'emisores', api_views.EmisorViewSet)
 router.register(r'eventos', api_views.EventoViewSet)
 router.register(r'calificaciones', api_views.CalificacionViewSet)
+router.register(r'resumenes', api_views.ResumenViewSet)
 
 app_name = 'core'
 
@@ -23,6 +24,8 @@ urlpatterns = [
     path('accounts/login/', never_cache(auth_views.LoginView.as_view(redirect_authenticated_user=True)), name='login'),
     # Ruta para la página principal del mantenedor
     path('', views.mantenedor_view, name='mantenedor'),
+    #ruta para las ventanas de filas de la grilla del mantenedor (JSON columnar)
+    path('grilla/', views.grilla_view, name='grilla'),
     #ruta para crear calificacion
     path('calificacion/new/', views.create_calificacion_view, name='create_calificacion'),
     # Ruta para la carga de archivos
@@ -31,10 +34,16 @@ urlpatterns = [
     path('calificacion/<int:pk>/delete/', views.delete_calificacion_view, name='delete_calificacion'),
     #ruta para editar
     path('calificacion/<int:pk>/edit/', views.edit_calificacion_view, name='edit_calificacion'),
+    #ruta para cambiar el estado de muchas calificaciones a la vez
+    path('calificacion/transicion/', views.transicion_masiva_view, name='transicion_masiva'),
     #ruta para crear Instrumentos (Emisores)
     path('instrumento/new/', views.create_emisor_view, name='create_emisor'),
     #ruta para historial
     path('calificacion/<int:pk>/history/', views.history_calificacion_view, name='history_calificacion'),
+    #ruta para el reporte de totales por emisor / ejercicio
+    path('reportes/resumen/', views.reporte_resumen_view, name='reporte_resumen'),
+    #ruta para el análisis de anomalías de factores
+    path('reportes/anomalias/', views.anomalias_view, name='anomalias'),
     #ruta para auditoría global
     path('historial/', AuditLogListView.as_view(), name='audit_log_list'),
     #rutas para verificacion 2fa
@@ -45,4 +54,6 @@ urlpatterns = [
     path('api/login/', obtain_auth_token, name='api_token_auth'),
     path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
     path('api/docs/', SpectacularSwaggerView.as_view(url_name='core:schema'), name='swagger-ui'),
+    # Métricas para Prometheus (protegidas: usuario staff, por sesión o token)
+    path('metrics', api_views.MetricasView.as_view(), name='metricas'),
     ]
\ No newline at end of file
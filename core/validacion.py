@@ -0,0 +1,193 @@
+# core/validacion.py
+# Motor único de validación de factores tributarios.
+# Todas las vías de escritura (formularios, carga Excel, admin y API) validan
+# aquí una MATRIZ de vectores de factores (una fila por calificación, una
+# columna por columna DJ) con operaciones de NumPy sobre la matriz completa.
+# Sólo las celdas que no son numéricas y las sumas que quedan en el borde del
+# tope se revisan una a una con Decimal, para no aprobar ni rechazar por
+# errores de redondeo del float.
+from decimal import Decimal, InvalidOperation
+import numpy as np
+
+# Columnas DJ de créditos cuya suma no puede exceder el tope
+COLUMNAS_CREDITO = (8, 19)
+TOPE_CREDITOS = Decimal('1.000001')
+# DetalleFactor.valor es DecimalField(max_digits=10, decimal_places=8): máximo 99.99999999
+LIMITE_VALOR = Decimal('100')
+# Distancia al tope bajo la cual la suma en float se recalcula exacta con Decimal
+_MARGEN_FLOAT = 1e-9
+
+MENSAJES = {
+    'formato': 'El valor para Factor {columna} no es un número válido.',
+    'negativo': 'El factor {columna} no puede ser negativo.',
+    'rango': 'El factor {columna} debe ser menor que 100.',
+    'suma': 'La suma de los factores 8 al 19 es {suma:.4f}. No puede exceder 1.',
+}
+
+
+def _error(fila, columna, codigo, **datos):
+    return {
+        'fila': fila,
+        'columna': columna,
+        'codigo': codigo,
+        'mensaje': MENSAJES[codigo].format(columna=columna, **datos),
+    }
+
+
+def _es_vacio(valor):
+    if valor is None:
+        return True
+    if isinstance(valor, str):
+        return not valor.strip()
+    return isinstance(valor, float) and valor != valor  # NaN (celda vacía de pandas)
+
+
+def a_decimal(valor):
+    """Valor crudo (str, float, int o Decimal) -> Decimal exacto. None si está vacío o no es numérico."""
+    if _es_vacio(valor):
+        return None
+    if isinstance(valor, Decimal):
+        resultado = valor
+    else:
+        try:
+            # str() de un float da el decimal más corto que lo representa (0.1 -> '0.1')
+            resultado = Decimal(valor.strip() if isinstance(valor, str) else str(valor))
+        except InvalidOperation:
+            return None
+    return resultado if resultado.is_finite() else None
+
+
+def _a_flotantes(crudos):
+    """
+    Matriz de valores crudos -> (float64 con NaN en los vacíos, máscara de celdas no numéricas).
+    Si la matriz ya es numérica (p.ej. un DataFrame) no se recorre celda a celda.
+    """
+    if crudos.dtype.kind in 'fiub':
+        return crudos.astype(np.float64, copy=False), np.zeros(crudos.shape, dtype=bool)
+    try:
+        return crudos.astype(np.float64), np.zeros(crudos.shape, dtype=bool)
+    except (TypeError, ValueError):
+        pass
+
+    # Frontera: celdas vacías (None, '') o texto que no es número
+    valores = np.empty(crudos.shape, dtype=np.float64)
+    ilegibles = np.zeros(crudos.shape, dtype=bool)
+    for posicion, crudo in np.ndenumerate(crudos):
+        if _es_vacio(crudo):
+            valores[posicion] = np.nan
+            continue
+        exacto = a_decimal(crudo)
+        if exacto is None:
+            valores[posicion] = np.nan
+            ilegibles[posicion] = True
+        else:
+            valores[posicion] = float(exacto)
+    return valores, ilegibles
+
+
+def _celdas(mascara):
+    """(fila, columna) de las celdas marcadas. Lo normal es que no haya ninguna: se descarta con any()."""
+    if not mascara.any():
+        return
+    for fila in np.flatnonzero(mascara.any(axis=1)):
+        for j in np.flatnonzero(mascara[fila]):
+            yield int(fila), int(j)
+
+
+class ResultadoValidacion:
+    """
+    Resultado de validar una matriz de factores.
+    'errores' es la lista de errores por celda: {'fila', 'columna', 'codigo', 'mensaje'}
+    (columna=None para los errores de fila, como la suma de créditos).
+    """
+
+    def __init__(self, crudos, valores, columnas, errores):
+        self.crudos = crudos
+        self.valores = valores
+        self.columnas = columnas
+        self.errores = errores
+
+    def __bool__(self):
+        return not self.errores
+
+    @property
+    def filas_con_error(self):
+        return {e['fila'] for e in self.errores}
+
+    def errores_por_fila(self):
+        por_fila = {}
+        for error in self.errores:
+            por_fila.setdefault(error['fila'], []).append(error)
+        return por_fila
+
+    def decimales(self, fila):
+        """Factores informados de la fila como {columna_dj: Decimal}, listos para guardar."""
+        informados = np.flatnonzero(~np.isnan(self.valores[fila]))
+        return {self.columnas[j]: a_decimal(self.crudos[fila, j]) for j in informados}
+
+
+def validar_matriz(matriz, columnas):
+    """
+    Valida n vectores de factores a la vez.
+    'matriz' es n x len(columnas) (listas, ndarray u objetos Decimal/str/float);
+    'columnas' indica la columna DJ de cada posición. Los vacíos (None, '', NaN) se ignoran.
+    """
+    columnas = list(columnas)
+    crudos = np.asarray(matriz) if len(matriz) else np.empty((0, len(columnas)))
+    if crudos.ndim != 2 or crudos.shape[1] != len(columnas):
+        raise ValueError(f'Se esperaba una matriz de n x {len(columnas)} factores.')
+    valores, ilegibles = _a_flotantes(crudos)
+
+    errores = []
+    columnas_arr = np.asarray(columnas)
+
+    def marcar(mascara, codigo):
+        for fila, j in _celdas(mascara):
+            errores.append(_error(fila, int(columnas_arr[j]), codigo))
+
+    marcar(ilegibles, 'formato')
+    with np.errstate(invalid='ignore'):
+        marcar(valores < 0, 'negativo')
+        # Cerca del límite (o infinito) decide el valor exacto redondeado a 8 decimales, como en la BD
+        frontera = (valores >= float(LIMITE_VALOR) - 1e-8) | np.isinf(valores)
+    for fila, j in _celdas(frontera):
+        exacto = a_decimal(crudos[fila, j])
+        if exacto is None:
+            errores.append(_error(fila, int(columnas_arr[j]), 'formato'))
+        elif exacto >= LIMITE_VALOR or exacto.quantize(Decimal('1E-8')) >= LIMITE_VALOR:
+            errores.append(_error(fila, int(columnas_arr[j]), 'rango'))
+
+    # Suma de créditos (8-19) por fila: nansum vectorizado + recálculo exacto en el borde
+    credito = (columnas_arr >= COLUMNAS_CREDITO[0]) & (columnas_arr <= COLUMNAS_CREDITO[1])
+    creditos = valores.take(np.flatnonzero(credito), axis=1)
+    sumas = np.where(np.isfinite(creditos), creditos, 0.0).sum(axis=1)
+    tope = float(TOPE_CREDITOS)
+    sospechosas = np.flatnonzero(sumas > tope - _MARGEN_FLOAT)
+    posiciones_credito = np.flatnonzero(credito)
+    for fila in sospechosas:
+        if np.abs(sumas[fila] - tope) > _MARGEN_FLOAT:
+            suma = sumas[fila]
+        else:
+            suma = sum(
+                (a_decimal(crudos[fila, j]) or Decimal(0) for j in posiciones_credito if not ilegibles[fila, j]),
+                Decimal(0),
+            )
+            if suma <= TOPE_CREDITOS:
+                continue
+        errores.append(_error(int(fila), None, 'suma', suma=suma))
+
+    errores.sort(key=lambda e: (e['fila'], e['columna'] is None, e['columna'] or 0))
+    return ResultadoValidacion(crudos, valores, columnas, errores)
+
+
+def validar_vector(factores, columnas):
+    """Valida un solo vector {columna_dj: valor crudo}. Las columnas no informadas cuentan como vacías."""
+    return validar_matriz([[factores.get(c) for c in columnas]], columnas)
+
+
+def errores_por_columna(errores):
+    """Errores de una fila -> {columna_dj | None: [mensajes]} (None = errores de la fila completa)."""
+    agrupados = {}
+    for error in errores:
+        agrupados.setdefault(error['columna'], []).append(error['mensaje'])
+    return agrupados
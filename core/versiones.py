@@ -0,0 +1,78 @@
+# core/versiones.py
+# Concurrencia optimista de calificaciones y eventos (ver Versionado en models.py).
+# Quien edita guarda la versión que leyó (campo oculto del formulario, ETag de la
+# API, 'version' de la carga masiva); si al guardar ya no es la vigente, se informa
+# el conflicto con lo que cambió desde esa versión, en vez de pisarlo.
+from .historial import procesar
+from .models import CalificacionTributaria, DiferenciaHistorial
+
+
+def etag(version):
+    return f'"{version}"'
+
+
+def if_match(valor):
+    """
+    Versiones aceptadas por un encabezado If-Match. None = sin condición (ausente o '*').
+    Las etiquetas débiles (W/"n") y las inválidas no aceptan ninguna versión.
+    """
+    if not valor or valor.strip() == '*':
+        return None
+    versiones = set()
+    for etiqueta in valor.split(','):
+        etiqueta = etiqueta.strip()
+        if len(etiqueta) > 2 and etiqueta[0] == etiqueta[-1] == '"' and etiqueta[1:-1].isdigit():
+            versiones.add(int(etiqueta[1:-1]))
+    return versiones
+
+
+def _texto(valor):
+    return None if valor is None else str(valor)
+
+
+def _acumular(destino, cambios):
+    # Varias versiones seguidas: se conserva el 'old' de la primera y el 'new' de la última
+    for clave, valores in cambios.items():
+        destino.setdefault(clave, {'old': valores['old']})['new'] = valores['new']
+
+
+def diferencias(modelo, pk, desde):
+    """
+    Qué cambió en el registro desde la versión 'desde':
+    {'version': vigente (None si se eliminó), 'cambios': {campo: {old, new}},
+     'factores': {columna_dj: {old, new}}, 'usuarios': [quiénes lo cambiaron]}.
+    """
+    historico = modelo.history.model
+    version = modelo.objects.filter(pk=pk).values_list('version', flat=True).first()
+    resultado = {'version': version, 'cambios': {}, 'factores': {}, 'usuarios': []}
+    leida = historico.objects.filter(id=pk, version=desde).order_by('-history_date').first()
+    if leida is None:
+        return resultado  # Versión sin historial (anterior a éste o inexistente)
+
+    posteriores = historico.objects.filter(id=pk, history_date__gt=leida.history_date).order_by('history_date')
+    usuarios = posteriores.exclude(history_user=None).values_list('history_user__username', flat=True)
+    resultado['usuarios'] = sorted(set(usuarios))
+
+    if modelo is CalificacionTributaria:
+        # Las diferencias precalculadas del historial ya incluyen los factores
+        procesar([pk])
+        for diferencia in DiferenciaHistorial.objects.filter(
+            calificacion_id=pk, fecha__gt=leida.history_date
+        ).order_by('fecha', 'id'):
+            _acumular(resultado['cambios'], diferencia.cambios)
+            _acumular(resultado['factores'], diferencia.factores)
+    else:
+        ultima = posteriores.last()
+        if ultima is not None:
+            delta = ultima.diff_against(leida, excluded_fields=['version'])
+            resultado['cambios'] = {c.field: {'old': _texto(c.old), 'new': _texto(c.new)} for c in delta.changes}
+
+    for clave in ('cambios', 'factores'):
+        resultado[clave] = {c: v for c, v in resultado[clave].items() if v['old'] != v['new']}
+    return resultado
+
+
+def conflicto(error):
+    """Detalle de un ConflictoVersion para la API o la carga masiva."""
+    return {'detail': str(error), 'version_editada': error.esperada, **diferencias(error.modelo, error.pk, error.esperada)}
+
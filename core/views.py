@@ -1,67 +1,252 @@
 # core/views.py
 
-import pandas as pd
+import hashlib
+import json
+import time
+from urllib.parse import urlencode
+from django.http import JsonResponse
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.core.cache import caches
 from django.contrib import messages
 from django.db import transaction
-from .models import Emisor, EventoCorporativo, CalificacionTributaria, ConceptoFactor, DetalleFactor, AuditLog
-from .decorators import group_required
+from django.core.paginator import Paginator
+from django.db.models import Count, Exists, OuterRef, Sum
+from .models import Emisor, EventoCorporativo, CalificacionTributaria, ConceptoFactor, DetalleFactor, AuditLog, ResumenEmisor, AnomaliaCalificacion, DiferenciaHistorial, ConflictoVersion
+from . import metricas, versiones
+from .decorators import group_required, grupos_de
 from .forms import EventoForm, CalificacionForm, EmisorForm
 from django_filters.views import FilterView
 from .filters import AuditLogFilter
+from .anomalias import analizar as analizar_anomalias
+from .archivo import archivados, mensaje
+from .factores import guardar_factores
+from .historial import ETIQUETAS as ETIQUETAS_HISTORIAL, procesar as procesar_historial
+from .reconstruccion import estado_al, parsear_instante
+from .resumenes import por_columna
+from .transiciones import ARCHIVADA, origenes_permitidos, transicionar
+from .validacion import validar_vector, a_decimal
 from django.utils.decorators import method_decorator
-import qrcode
-import qrcode.image.svg
 from io import BytesIO
 from django_otp.plugins.otp_totp.models import TOTPDevice
 
-# Vista Principal: Mantenedor
-
-@login_required
-def mantenedor_view(request):
-    # Optimizamos la consulta para traer todo junto
-    calificaciones = CalificacionTributaria.objects.select_related('evento__emisor').prefetch_related('detalles__concepto').all()
-
-    # Filtros
-    filtro_mercado = request.GET.get('mercado', '')
-    filtro_instrumento = request.GET.get('instrumento', '')
-    filtro_periodo = request.GET.get('periodo', '')
+def _validar_factores_post(request, conceptos):
+    """
+    Valida los factores del formulario (inputs 'factor_<pk>') con el motor común.
+    Devuelve (decimales {concepto: Decimal}, errores {'factor_<pk>': mensaje}, mensajes de la fila).
+    """
+    columnas = [c.columna_dj for c in conceptos]
+    crudos = {c.columna_dj: request.POST.get(f'factor_{c.pk}') for c in conceptos}
+    validacion = validar_vector(crudos, columnas)
+    por_columna = {c.columna_dj: c for c in conceptos}
+    errores = {
+        f"factor_{por_columna[e['columna']].pk}": e['mensaje']
+        for e in validacion.errores if e['columna'] is not None
+    }
+    if validacion.errores:
+        return {}, errores, [e['mensaje'] for e in validacion.errores]
+    return {por_columna[col]: valor for col, valor in validacion.decimales(0).items()}, errores, []
+
+FILTROS_MANTENEDOR = ('mercado', 'instrumento', 'periodo', 'anomalia')
+
+def _periodo(params):
+    """El filtro 'periodo' como número (None si no viene). ValueError si no es un año."""
+    periodo = params.get('periodo', '').strip()
+    if periodo and not periodo.isdigit():
+        raise ValueError(f"Periodo inválido: '{periodo}'. Indique el año, p. ej. 2024.")
+    return int(periodo) if periodo else None
+
+def _filtrar_mantenedor(calificaciones, params):
+    """
+    Filtros del mantenedor (mercado, instrumento, periodo, anomalía); compartidos con la
+    transición masiva. ValueError si el periodo no es válido.
+    """
+    filtro_mercado = params.get('mercado', '')
+    filtro_instrumento = params.get('instrumento', '')
+    filtro_periodo = _periodo(params)
+    filtro_anomalia = params.get('anomalia', '')
 
     if filtro_mercado: calificaciones = calificaciones.filter(evento__mercado=filtro_mercado)
     if filtro_instrumento: calificaciones = calificaciones.filter(evento__emisor__nemonico__icontains=filtro_instrumento)
-    if filtro_periodo: calificaciones = calificaciones.filter(evento__ejercicio_comercial=filtro_periodo)
+    if filtro_periodo is not None: calificaciones = calificaciones.filter(evento__ejercicio_comercial=filtro_periodo)
+    if filtro_anomalia:
+        # 'con' = cualquier anomalía; si no, el código de la anomalía
+        anomalias = AnomaliaCalificacion.objects.filter(calificacion=OuterRef('pk'))
+        if filtro_anomalia != 'con':
+            anomalias = anomalias.filter(codigo=filtro_anomalia)
+        calificaciones = calificaciones.filter(Exists(anomalias))
+    return calificaciones
 
-    # --- PREPARACIÓN DE DATOS PARA TABLA SCROLLABLE ---
-    tabla_completa = []
-    columnas_indices = list(range(8, 38)) # Columnas 8 a 37
+# Vista Principal: Mantenedor
+# La página trae sólo los filtros: la grilla la arma el navegador pidiendo ventanas
+# de filas a grilla_view a medida que se desplaza (se dibujan sólo las visibles).
+
+COLUMNAS_GRILLA = list(range(8, 38))  # Factores de las columnas 8 a 37
+VENTANA_GRILLA = 200  # Filas por pedido (máximo)
+
+
+def _instante_mantenedor(request):
+    """Instante de la vista histórica (?al=), o None. Una fecha inválida se informa y se ignora."""
+    filtro_al = request.GET.get('al', '')
+    if not filtro_al:
+        return None
+    try:
+        return parsear_instante(filtro_al)
+    except ValueError as e:
+        messages.error(request, str(e))
+        return None
 
-    for cal in calificaciones:
-        # Convertimos los detalles en un diccionario para acceso rápido
-        factores_dict = {d.concepto.columna_dj: d.valor for d in cal.detalles.all()}
-        
-        # Creamos la lista ordenada de valores
-        valores_factores = []
-        for col in columnas_indices:
-            valores_factores.append(factores_dict.get(col, 0)) # Si no existe, pone 0
-
-        tabla_completa.append({
-            'obj': cal,
-            'factores': valores_factores
-        })
 
+@login_required
+def mantenedor_view(request):
     context = {
-        'tabla_completa': tabla_completa, # Usamos esta lista procesada
-        'columnas_indices': columnas_indices,
-        'filtro_mercado': filtro_mercado,
-        'filtro_instrumento': filtro_instrumento,
-        'filtro_periodo': filtro_periodo,
-        'user_groups': request.user.groups.values_list('name', flat=True)
+        'columnas_indices': COLUMNAS_GRILLA,
+        'filtro_mercado': request.GET.get('mercado', ''),
+        'filtro_instrumento': request.GET.get('instrumento', ''),
+        'filtro_periodo': request.GET.get('periodo', ''),
+        'filtro_anomalia': request.GET.get('anomalia', ''),
+        'filtro_al': request.GET.get('al', ''),
+        'instante': _instante_mantenedor(request),
+        'codigos_anomalia': AnomaliaCalificacion.CODIGO_CHOICES,
+        'user_groups': grupos_de(request.user),
+        'estados': CalificacionTributaria.ESTADO_CHOICES,
+        'ventana': VENTANA_GRILLA,
     }
-    
     return render(request, 'core/mantenedor.html', context)
 
+
+def _ventana(request):
+    """(desde, hasta) de la ventana pedida: ?desde=&cantidad= (cantidad acotada a VENTANA_GRILLA)."""
+    def entero(nombre, defecto):
+        valor = request.GET.get(nombre, '')
+        return int(valor) if valor.isdigit() else defecto
+    desde = entero('desde', 0)
+    return desde, desde + min(entero('cantidad', VENTANA_GRILLA), VENTANA_GRILLA)
+
+
+def _grilla_actual(params, desde, hasta):
+    """Ventana de la grilla vigente: (total, filas como diccionarios, {calificación: {columna: valor}})."""
+    calificaciones = _filtrar_mantenedor(CalificacionTributaria.objects.all(), params)
+    total = calificaciones.count()
+    filas = list(
+        calificaciones.annotate(
+            con_anomalias=Exists(AnomaliaCalificacion.objects.filter(calificacion=OuterRef('pk')))
+        ).order_by('-evento__fecha_pago', '-pk').values(
+            'pk', 'estado', 'monto_unitario_pesos', 'con_anomalias',
+            'evento__emisor_id', 'evento__emisor__nemonico', 'evento__emisor__rut',
+            'evento__mercado', 'evento__fecha_pago', 'evento__ejercicio_comercial',
+        )[desde:hasta]
+    ) if desde < total else []
+    vectores = {fila['pk']: {} for fila in filas}
+    for calificacion_id, columna, valor in DetalleFactor.objects.filter(
+        calificacion_id__in=vectores, concepto__columna_dj__in=COLUMNAS_GRILLA
+    ).values_list('calificacion_id', 'concepto__columna_dj', 'valor'):
+        vectores[calificacion_id][columna] = valor
+    return total, filas, vectores
+
+
+def _reconstruir_historica(instante, params):
+    """La grilla al instante en bloques de VENTANA_GRILLA filas: [(filas, vectores), ...]."""
+    grilla = estado_al(
+        instante,
+        mercado=params.get('mercado', ''),
+        nemonico=params.get('instrumento', ''),
+        ejercicio=_periodo(params),
+    )
+    filas, vectores = [], {}
+    # Se leen las filas livianas de la grilla, sin construir las instancias
+    for campos, evento, vector in grilla.filas:
+        emisor = grilla.emisores.get(evento['emisor_id'])
+        filas.append({
+            'pk': campos['id'], 'estado': campos['estado'], 'monto_unitario_pesos': campos['monto_unitario_pesos'],
+            'con_anomalias': False, 'evento__emisor_id': evento['emisor_id'],
+            'evento__emisor__nemonico': emisor.nemonico if emisor else '', 'evento__emisor__rut': emisor.rut if emisor else '',
+            'evento__mercado': evento['mercado'], 'evento__fecha_pago': evento['fecha_pago'],
+            'evento__ejercicio_comercial': evento['ejercicio_comercial'],
+        })
+        vectores[campos['id']] = {int(columna): valor for columna, valor in vector.items()}
+    return [
+        (bloque, {f['pk']: vectores[f['pk']] for f in bloque})
+        for bloque in (filas[i:i + VENTANA_GRILLA] for i in range(0, len(filas), VENTANA_GRILLA))
+    ]
+
+
+def _grilla_historica(instante, params, desde, hasta):
+    """
+    Como _grilla_actual, pero con la grilla reconstruida al instante (sin anomalías: son las de hoy).
+    Reconstruir recorre todas las filas: se hace una vez por (instante, filtros) y los bloques
+    quedan en la caché 'grilla', así cada ventana siguiente lee sólo uno o dos bloques.
+    """
+    filtros = [instante.isoformat(), VENTANA_GRILLA] + [params.get(f, '') for f in ('mercado', 'instrumento', 'periodo')]
+    clave = 'historica:' + hashlib.sha1(json.dumps(filtros).encode()).hexdigest()
+    cache = caches['grilla']
+    numeros = range(desde // VENTANA_GRILLA, (hasta - 1) // VENTANA_GRILLA + 1)
+    total = cache.get(f'{clave}:total')
+    bloques = cache.get_many([f'{clave}:{n}' for n in numeros]) if total else {}
+    if total is None or len(bloques) < len([n for n in numeros if n * VENTANA_GRILLA < total]):
+        # Primera ventana (o bloques desalojados de la caché): se reconstruye y se guarda todo
+        reconstruida = _reconstruir_historica(instante, params)
+        total = sum(len(filas) for filas, _ in reconstruida)
+        cache.set_many({f'{clave}:{n}': bloque for n, bloque in enumerate(reconstruida)})
+        cache.set(f'{clave}:total', total)
+        bloques = {f'{clave}:{n}': reconstruida[n] for n in numeros if n < len(reconstruida)}
+
+    filas, vectores = [], {}
+    for n in numeros:
+        if f'{clave}:{n}' in bloques:
+            filas_bloque, vectores_bloque = bloques[f'{clave}:{n}']
+            filas.extend(filas_bloque)
+            vectores.update(vectores_bloque)
+    inicio = desde - numeros.start * VENTANA_GRILLA
+    return total, filas[inicio:inicio + hasta - desde], vectores
+
+
+def _numero(valor):
+    return float(valor) if valor is not None else 0
+
+
+@login_required
+def grilla_view(request):
+    """
+    Una ventana de filas del mantenedor en formato columnar compacto: cada campo es un
+    arreglo (una posición por fila), los factores una matriz de filas x columnas y los
+    emisores van una sola vez en un diccionario. El costo depende de la ventana, no del total.
+    """
+    desde, hasta = _ventana(request)
+    instante = None
+    try:
+        _periodo(request.GET)
+        if request.GET.get('al'):
+            instante = parsear_instante(request.GET['al'])
+    except ValueError as e:
+        return JsonResponse({'detail': str(e)}, status=400)
+    if instante is not None:
+        total, filas, vectores = _grilla_historica(instante, request.GET, desde, hasta)
+    else:
+        total, filas, vectores = _grilla_actual(request.GET, desde, hasta)
+
+    emisores = {}
+    for fila in filas:
+        emisores.setdefault(fila['evento__emisor_id'], [fila['evento__emisor__nemonico'], fila['evento__emisor__rut']])
+    return JsonResponse({
+        'total': total,
+        'desde': desde,
+        'columnas': COLUMNAS_GRILLA,
+        'emisores': emisores,
+        'id': [f['pk'] for f in filas],
+        'emisor': [f['evento__emisor_id'] for f in filas],
+        'mercado': [f['evento__mercado'] for f in filas],
+        'fecha_pago': [f['evento__fecha_pago'] for f in filas],
+        'ejercicio': [f['evento__ejercicio_comercial'] for f in filas],
+        'monto': [_numero(f['monto_unitario_pesos']) for f in filas],
+        'estado': [f['estado'] for f in filas],
+        'anomalias': [f['con_anomalias'] for f in filas],
+        # Factor ausente = 0, como en el formulario de edición
+        'factores': [[_numero(vectores[f['pk']].get(c)) for c in COLUMNAS_GRILLA] for f in filas],
+    }, json_dumps_params={'separators': (',', ':')})
+
 # Vista de Carga Masiva
 @login_required
 @group_required(['Corredor de Bolsa', 'Analista Tributario'])
@@ -73,122 +258,41 @@ def upload_file_view(request):
             messages.error(request, "Por favor adjunta un archivo con formato .xlsx")
             return redirect('core:upload_file')
 
+        inicio = time.perf_counter()
         try:
-            df = pd.read_excel(archivo, engine='openpyxl')
-            df.columns = df.columns.str.strip()
-
-            # Validación de columnas
-            columnas_obligatorias = ['Instrumento', 'RUT', 'Numero de dividendo', 'Ejercicio', 'Fecha']
-            missing = [col for col in columnas_obligatorias if col not in df.columns]
-            if missing:
-                messages.error(request, f"Faltan columnas obligatorias: {', '.join(missing)}")
+            # pandas y openpyxl se cargan recién aquí, con la primera carga del proceso
+            from .carga_excel import ColumnasFaltantes, procesar_archivo
+            try:
+                resultado = procesar_archivo(archivo, request.user)
+            except ColumnasFaltantes as e:
+                messages.error(request, str(e))
                 return redirect('core:upload_file')
-
-            registros_creados = 0
-            registros_procesados = 0
-            errores_acumulados = [] # <--- LISTA PARA GUARDAR TODOS LOS ERRORES
-
-            # Usamos atomic para que si hay errores, no se guarde NADA del archivo
-            with transaction.atomic():
-                for index, row in df.iterrows():
-                    fila_excel = index + 2
-                    errores_fila = []
-
-                    # --- A. Validaciones de Negocio ---
-                    suma_factores = 0
-                    for i in range(8, 20):
-                        col_name = f'Factor {i}'
-                        if col_name in df.columns:
-                            val = pd.to_numeric(row.get(col_name), errors='coerce')
-                            if pd.isna(val): val = 0.0
-                            if val < 0: 
-                                errores_fila.append(f"Factor {i} es negativo")
-                            suma_factores += val
-                    
-                    if suma_factores > 1.000001:
-                        errores_fila.append(f"Suma factores 8-19 excede 1 ({suma_factores:.4f})")
-
-                    monto = pd.to_numeric(row.get('Monto Unitario', 0), errors='coerce')
-                    if pd.isna(monto): monto = 0
-                    if monto < 0: 
-                        errores_fila.append("Monto negativo")
-
-                    # Si la fila tiene errores, los guardamos y pasamos a la siguiente
-                    if errores_fila:
-                        errores_acumulados.append(f"Fila {fila_excel}: {', '.join(errores_fila)}")
-                        continue 
-
-                    # --- B. Procesamiento (Solo si no hay errores en la fila) ---
-                    try:
-                        # 1. VALIDACIÓN DE RUT OBLIGATORIO
-                        rut_excel = str(row.get('RUT', '')).strip()
-                        
-                        # Si el RUT está vacío o es 'nan' (vacío de pandas), es un error
-                        if not rut_excel or rut_excel.lower() == 'nan':
-                            errores_fila.append("El campo RUT es obligatorio y no puede estar vacío.")
-                            # Guardamos el error y saltamos a la siguiente iteración
-                            # (Al final se hará rollback porque errores_fila no estará vacío)
-                            if errores_fila:
-                                errores_acumulados.append(f"Fila {fila_excel}: {', '.join(errores_fila)}")
-                                continue
-
-                        # 2. Creación del Emisor (Sin inventar datos)
-                        tipo_soc = 'C' if 'CERRADA' in str(row.get('Tipo sociedad', 'A')).upper() else 'A'
-                        
-                        # Intentamos obtener o crear. 
-                        # OJO: Ahora usamos el RUT real del Excel.
-                        emisor, _ = Emisor.objects.get_or_create(
-                            nemonico=row['Instrumento'],
-                            defaults={
-                                'rut': rut_excel,  # <--- Usamos el dato real validado
-                                'razon_social': row['Instrumento'], 
-                                'tipo_sociedad': tipo_soc
-                            }
-                        )
-
-                        # Factores
-                        for col in df.columns:
-                            if col.startswith('Factor '):
-                                try:
-                                    num = int(col.split(' ')[1])
-                                    val = pd.to_numeric(row[col], errors='coerce') or 0.0
-                                    if val < 0: continue # Ya validado arriba
-                                    
-                                    # Optimización: Solo guardamos si el concepto existe
-                                    if ConceptoFactor.objects.filter(columna_dj=num).exists():
-                                        DetalleFactor.objects.update_or_create(
-                                            calificacion=calif,
-                                            concepto_id=ConceptoFactor.objects.get(columna_dj=num).id,
-                                            defaults={'valor': val}
-                                        )
-                                except: continue
-
-                        registros_procesados += 1
-                        if ev_created or cal_created: registros_creados += 1
-
-                    except Exception as e:
-                        errores_acumulados.append(f"Fila {fila_excel}: Error técnico ({str(e)})")
-
-                # --- DECISIÓN FINAL ---
-                if errores_acumulados:
-                    # Si hubo errores, cancelamos TODO (Rollback)
-                    transaction.set_rollback(True)
-                    
-                    # Preparamos mensaje HTML limpio
-                    msg = "<strong>La carga falló por los siguientes errores:</strong><br><ul class='mb-0'>"
-                    # Mostramos solo los primeros 10 errores para no saturar la pantalla
-                    for err in errores_acumulados[:10]:
-                        msg += f"<li>{err}</li>"
-                    if len(errores_acumulados) > 10:
-                        msg += f"<li>... y {len(errores_acumulados)-10} errores más.</li>"
-                    msg += "</ul>"
-                    
-                    messages.error(request, msg, extra_tags='safe') # 'safe' permite renderizar HTML
+            errores_acumulados = resultado['errores']
+            registros_procesados = resultado['procesados']
+            registros_creados = resultado['creados']
+
+            # --- DECISIÓN FINAL ---
+            if errores_acumulados:
+                # Preparamos mensaje HTML limpio
+                msg = "<strong>La carga falló por los siguientes errores:</strong><br><ul class='mb-0'>"
+                # Mostramos solo los primeros 10 errores para no saturar la pantalla
+                for err in errores_acumulados[:10]:
+                    msg += f"<li>{err}</li>"
+                if len(errores_acumulados) > 10:
+                    msg += f"<li>... y {len(errores_acumulados)-10} errores más.</li>"
+                msg += "</ul>"
+                
+                messages.error(request, msg, extra_tags='safe') # 'safe' permite renderizar HTML
+            else:
+                if registros_creados > 0:
+                    messages.success(request, f"Carga exitosa: {registros_procesados} registros procesados ({registros_creados} nuevos).")
                 else:
-                    if registros_creados > 0:
-                        messages.success(request, f"Carga exitosa: {registros_procesados} registros procesados ({registros_creados} nuevos).")
-                    else:
-                        messages.info(request, f"Carga completa: {registros_procesados} registros actualizados.")
+                    messages.info(request, f"Carga completa: {registros_procesados} registros actualizados.")
+
+            metricas.CARGA_ERRORES.inc(len(errores_acumulados), origen='excel')
+            if not errores_acumulados:
+                metricas.CARGA_FILAS.inc(registros_procesados, origen='excel')
+            metricas.CARGA_DURACION.observar(time.perf_counter() - inicio, origen='excel')
 
         except Exception as e:
             messages.error(request, f"Error crítico: {str(e)}")
@@ -199,7 +303,8 @@ def upload_file_view(request):
 @login_required
 @group_required(['Analista Tributario'])
 def create_calificacion_view(request):
-    conceptos = ConceptoFactor.objects.all()
+    conceptos = list(ConceptoFactor.objects.all())
+    errores_factores = {}
 
     if request.method == 'POST':
         form_evento = EventoForm(request.POST)
@@ -207,23 +312,12 @@ def create_calificacion_view(request):
 
         if form_evento.is_valid() and form_calificacion.is_valid():
             try:
-                with transaction.atomic():
-                    # --- 1. VALIDACIÓN DE NEGOCIO (Suma de Créditos) ---
-                    suma_creditos = 0
-                    # Recorremos los conceptos que corresponden a columnas 8 a 19
-                    for concepto in conceptos:
-                        if 8 <= concepto.columna_dj <= 19:
-                            valor_raw = request.POST.get(f'factor_{concepto.pk}')
-                            if valor_raw:
-                                try:
-                                    suma_creditos += float(valor_raw)
-                                except ValueError:
-                                    pass # El error de tipo se captura abajo individualmente
-                    
-                    # Verificamos la suma (con margen de error epsilon)
-                    if suma_creditos > 1.000001:
-                        raise ValueError(f"La suma de los factores de crédito (Col 8 a 19) es {suma_creditos:.4f}. No puede exceder 1.")
+                # --- 1. VALIDACIÓN DE NEGOCIO (motor común: formato, negativos, rango y suma 8-19) ---
+                factores, errores_factores, mensajes = _validar_factores_post(request, conceptos)
+                if mensajes:
+                    raise ValueError(" ".join(mensajes))
 
+                with transaction.atomic():
                     # --- 2. Guardado de Datos ---
                     evento = form_evento.save(commit=False)
                     evento.creado_por = request.user
@@ -235,25 +329,8 @@ def create_calificacion_view(request):
                     calificacion.modificado_por = request.user
                     calificacion.save()
 
-                    # --- 3. Procesar Factores Individuales ---
-                    for concepto in conceptos:
-                        valor_raw = request.POST.get(f'factor_{concepto.pk}')
-                        
-                        if valor_raw and valor_raw.strip() != '':
-                            try:
-                                valor_float = float(valor_raw)
-                                if valor_float < 0:
-                                    raise ValueError(f"El factor '{concepto.descripcion}' no puede ser negativo.")
-                                
-                                DetalleFactor.objects.create(
-                                    calificacion=calificacion,
-                                    concepto=concepto,
-                                    valor=valor_float
-                                )
-                            except ValueError as ve:
-                                if "could not convert string" in str(ve):
-                                    raise ValueError(f"El valor para '{concepto.descripcion}' no es válido.")
-                                raise ve 
+                    # --- 3. Factores informados (ya validados), en un solo INSERT ---
+                    guardar_factores(calificacion, {c.pk: v for c, v in factores.items()}, user=request.user)
 
                 messages.success(request, "Calificación creada exitosamente.")
                 return redirect('core:mantenedor')
@@ -273,6 +350,7 @@ def create_calificacion_view(request):
         'form_evento': form_evento,
         'form_calificacion': form_calificacion,
         'conceptos': conceptos,
+        'errores_factores': errores_factores,
     }
     return render(request, 'core/create_calificacion.html', context)
 
@@ -282,61 +360,49 @@ def create_calificacion_view(request):
 def edit_calificacion_view(request, pk):
     calificacion = get_object_or_404(CalificacionTributaria, pk=pk)
     evento = calificacion.evento
-    conceptos = ConceptoFactor.objects.all()
+    conceptos = list(ConceptoFactor.objects.all())
+    errores_factores, factores_rechazados, conflicto = {}, False, None
+    # Versiones que el usuario tenía en pantalla (campos ocultos): se guarda sólo si siguen vigentes
+    leidas = {'evento': evento.version, 'calificacion': calificacion.version}
 
     if request.method == 'POST':
+        for clave in leidas:
+            valor = request.POST.get(f'version_{clave}', '')
+            if valor.isdigit():
+                leidas[clave] = int(valor)
         form_evento = EventoForm(request.POST, instance=evento)
         form_calificacion = CalificacionForm(request.POST, instance=calificacion)
 
         if form_evento.is_valid() and form_calificacion.is_valid():
             try:
-                with transaction.atomic():
-                    # --- 1. VALIDACIÓN DE NEGOCIO (Suma de Créditos 8-19) ---
-                    suma_creditos = 0
-                    for concepto in conceptos:
-                        if 8 <= concepto.columna_dj <= 19:
-                            valor_raw = request.POST.get(f'factor_{concepto.pk}')
-                            if valor_raw and valor_raw.strip():
-                                try:
-                                    suma_creditos += float(valor_raw)
-                                except ValueError:
-                                    pass 
-                    
-                    if suma_creditos > 1.000001:
-                        raise ValueError(f"La suma de los factores 8 al 19 es {suma_creditos:.4f}. No puede exceder 1.")
+                # --- 1. VALIDACIÓN DE NEGOCIO (motor común) ---
+                factores, errores_factores, mensajes = _validar_factores_post(request, conceptos)
+                if mensajes:
+                    factores_rechazados = True
+                    raise ValueError(" ".join(mensajes))
 
-                    # --- 2. Guardado de Forms ---
+                with transaction.atomic():
+                    # --- 2. Guardado de Forms (UPDATE ... WHERE version = la leída) ---
+                    evento.version, calificacion.version = leidas['evento'], leidas['calificacion']
                     form_evento.save()
                     
                     calif = form_calificacion.save(commit=False)
                     calif.modificado_por = request.user
                     calif.save()
 
-                    # --- 3. Guardado de Factores ---
-                    for concepto in conceptos:
-                        valor_raw = request.POST.get(f'factor_{concepto.pk}')
-                        
-                        if valor_raw and valor_raw.strip() != '':
-                            try:
-                                valor_float = float(valor_raw)
-                                if valor_float < 0:
-                                    raise ValueError(f"El factor {concepto.columna_dj} no puede ser negativo.")
-                                
-                                DetalleFactor.objects.update_or_create(
-                                    calificacion=calificacion,
-                                    concepto=concepto,
-                                    defaults={'valor': valor_float}
-                                )
-                            except ValueError as ve:
-                                if "could not convert string" in str(ve):
-                                    raise ValueError(f"El valor para Factor {concepto.columna_dj} no es válido.")
-                                raise ve
-                        else:
-                            DetalleFactor.objects.filter(calificacion=calificacion, concepto=concepto).delete()
+                    # --- 3. Guardado de Factores por diferencias (los vacíos se eliminan) ---
+                    guardar_factores(calificacion, {c.pk: v for c, v in factores.items()}, user=request.user)
 
                 messages.success(request, "Calificación actualizada correctamente.")
                 return redirect('core:mantenedor')
 
+            except ConflictoVersion:
+                conflicto = _conflicto_edicion(evento, calificacion, leidas)
+                # Al volver a guardar se reemplaza la versión vigente, que ya se mostró
+                leidas = conflicto['versiones']
+                factores_rechazados = True
+                messages.error(request, "Otro usuario guardó esta calificación mientras usted la editaba. "
+                                        "Revise lo que cambió y vuelva a guardar para reemplazarlo.")
             except ValueError as ve:
                 messages.error(request, f"Error de validación: {ve}")
             except Exception as e:
@@ -348,13 +414,17 @@ def edit_calificacion_view(request, pk):
         form_evento = EventoForm(instance=evento)
         form_calificacion = CalificacionForm(instance=calificacion)
 
-    # Preparamos datos para la plantilla
-    factores_existentes = {d.concepto.pk: d.valor for d in calificacion.detalles.all()}
+    # Preparamos datos para la plantilla (si hubo errores, se muestra lo que el usuario envió)
+    if factores_rechazados:
+        factores_existentes = {c.pk: a_decimal(request.POST.get(f'factor_{c.pk}')) or '' for c in conceptos}
+    else:
+        factores_existentes = {d.concepto_id: d.valor for d in calificacion.detalles.all()}
     factores_para_template = []
     for concepto in conceptos:
         factores_para_template.append({
             'concepto': concepto,
-            'valor': factores_existentes.get(concepto.pk, '')
+            'valor': factores_existentes.get(concepto.pk, ''),
+            'error': errores_factores.get(f'factor_{concepto.pk}'),
         })
 
     context = {
@@ -362,16 +432,93 @@ def edit_calificacion_view(request, pk):
         'form_evento': form_evento,
         'form_calificacion': form_calificacion,
         'factores_para_template': factores_para_template,
+        'versiones': leidas,
+        'conflicto': conflicto,
     }
     
     return render(request, 'core/edit_calificacion.html', context)
 
+def _conflicto_edicion(evento, calificacion, leidas):
+    """Lo que otros guardaron en el evento y la calificación desde las versiones que se editaron."""
+    del_evento = versiones.diferencias(EventoCorporativo, evento.pk, leidas['evento'])
+    de_calificacion = versiones.diferencias(CalificacionTributaria, calificacion.pk, leidas['calificacion'])
+    cambios = [
+        (EventoCorporativo._meta.get_field(campo).verbose_name.capitalize(), valores['old'], valores['new'])
+        for campo, valores in del_evento['cambios'].items()
+    ] + [
+        (ETIQUETAS_HISTORIAL.get(campo, campo), valores['old'], valores['new'])
+        for campo, valores in de_calificacion['cambios'].items()
+    ]
+    return {
+        'cambios': cambios,
+        'factores': sorted((int(columna), v['old'], v['new']) for columna, v in de_calificacion['factores'].items()),
+        'usuarios': sorted(set(del_evento['usuarios']) | set(de_calificacion['usuarios'])),
+        'versiones': {'evento': del_evento['version'], 'calificacion': de_calificacion['version']},
+    }
+
+# Vista de Transición Masiva de Estado
+@login_required
+@group_required(['Analista Tributario'])
+def transicion_masiva_view(request):
+    if request.method != 'POST':
+        messages.error(request, "Acción no permitida.")
+        return redirect('core:mantenedor')
+
+    # Volvemos al mantenedor con los mismos filtros
+    filtros = {k: request.POST.get(k, '') for k in FILTROS_MANTENEDOR if request.POST.get(k)}
+    destino = redirect(f"{reverse('core:mantenedor')}?{urlencode(filtros)}" if filtros else 'core:mantenedor')
+
+    estado = request.POST.get('estado', '')
+    if request.POST.get('alcance') == 'filtro':
+        if not filtros:
+            messages.error(request, "Para aplicar a todos los registros filtrados, indique al menos un filtro.")
+            return destino
+        try:
+            seleccion = _filtrar_mantenedor(CalificacionTributaria.objects.all(), request.POST)
+        except ValueError as ve:
+            messages.error(request, f"Error de validación: {ve}")
+            return destino
+    else:
+        ids = [i for i in request.POST.getlist('ids') if i.isdigit()]
+        if not ids:
+            messages.error(request, "No seleccionó ninguna calificación.")
+            return destino
+        seleccion = CalificacionTributaria.objects.filter(pk__in=ids)
+
+    try:
+        resultado = transicionar(seleccion, estado, user=request.user)
+    except ValueError as ve:
+        messages.error(request, f"Error de validación: {ve}")
+        return destino
+
+    etiqueta = dict(CalificacionTributaria.ESTADO_CHOICES)[estado]
+    if resultado['actualizadas']:
+        messages.success(request, f"{resultado['actualizadas']} calificaciones pasaron a '{etiqueta}'.")
+    omitidas = dict(resultado['omitidas'])
+    if omitidas.pop(estado, 0):
+        messages.info(request, f"{resultado['omitidas'][estado]} calificaciones ya estaban en '{etiqueta}'.")
+    if omitidas.pop(ARCHIVADA, 0):
+        messages.warning(
+            request,
+            f"Se omitieron {resultado['omitidas'][ARCHIVADA]} calificaciones de ejercicios archivados (sólo lectura)."
+        )
+    if omitidas:
+        detalle = ", ".join(f"{n} en {e}" for e, n in sorted(omitidas.items()))
+        messages.warning(
+            request,
+            f"Se omitieron {sum(omitidas.values())} calificaciones cuyo estado no permite pasar a "
+            f"'{etiqueta}' ({detalle}). Permitido desde: {', '.join(origenes_permitidos(estado))}."
+        )
+    return destino
+
 # Vista de Eliminación
 @login_required
 @group_required(['Analista Tributario'])
 def delete_calificacion_view(request, pk):
     calificacion = get_object_or_404(CalificacionTributaria, pk=pk)
-    if request.method == 'POST':
+    if request.method == 'POST' and archivados([calificacion.evento.ejercicio_comercial]):
+        messages.error(request, mensaje(calificacion.evento.ejercicio_comercial))
+    elif request.method == 'POST':
         evento_info = str(calificacion.evento)
         calificacion.delete()
         messages.success(request, f"La calificación para '{evento_info}' fue eliminada correctamente.")
@@ -403,15 +550,95 @@ def create_emisor_view(request):
 @login_required
 @group_required(['Auditor Interno', 'Analista Tributario'])
 def history_calificacion_view(request, pk):
-    calificacion = get_object_or_404(CalificacionTributaria, pk=pk)
-    historical_records = calificacion.history.select_related('history_user').all()
+    calificacion = get_object_or_404(CalificacionTributaria.objects.select_related('evento__emisor'), pk=pk)
+    # Versiones anteriores a las diferencias precalculadas: se calculan una sola vez, aquí
+    if calificacion.history.filter(diferencia__isnull=True).exists():
+        procesar_historial([calificacion.pk])
+
+    diferencias = (
+        DiferenciaHistorial.objects.filter(calificacion_id=pk)
+        .select_related('usuario', 'historial')
+        .order_by('-fecha', '-id')
+    )
+    pagina = Paginator(diferencias, 20).get_page(request.GET.get('page'))
+    for diferencia in pagina:
+        diferencia.lista_cambios = [
+            (ETIQUETAS_HISTORIAL.get(campo, campo), valores['old'], valores['new'])
+            for campo, valores in diferencia.cambios.items()
+        ]
+        diferencia.lista_factores = sorted(
+            (int(columna), valores['old'], valores['new']) for columna, valores in diferencia.factores.items()
+        )
 
     context = {
         'calificacion': calificacion,
-        'historical_records': historical_records,
+        'pagina': pagina,
     }
     return render(request, 'core/history_calificacion.html', context)
 
+# Reporte de totales por emisor / ejercicio (lee sólo las tablas de resumen)
+@login_required
+@group_required(['Analista Tributario', 'Auditor Interno', 'Administrador'])
+def reporte_resumen_view(request):
+    ejercicios = list(ResumenEmisor.objects.order_by('-ejercicio').values_list('ejercicio', flat=True).distinct())
+    filtro_ejercicio = request.GET.get('ejercicio', '')
+    if not filtro_ejercicio.isdigit():
+        filtro_ejercicio = str(ejercicios[0]) if ejercicios else ''
+    filtro_mercado = request.GET.get('mercado', '')
+
+    resumenes = ResumenEmisor.objects.select_related('emisor').order_by('emisor__nemonico', 'mercado')
+    if filtro_ejercicio: resumenes = resumenes.filter(ejercicio=filtro_ejercicio)
+    if filtro_mercado: resumenes = resumenes.filter(mercado=filtro_mercado)
+
+    context = {
+        'resumenes': resumenes,
+        'totales': resumenes.aggregate(eventos=Sum('eventos'), monto_total=Sum('monto_total')),
+        'columnas': por_columna(resumenes),
+        'ejercicios': ejercicios,
+        'mercados': EventoCorporativo.MERCADO_CHOICES,
+        'filtro_ejercicio': filtro_ejercicio,
+        'filtro_mercado': filtro_mercado,
+    }
+    return render(request, 'core/reporte_resumen.html', context)
+
+# Anomalías de factores: lanzar el análisis de un ejercicio y revisar lo encontrado
+@login_required
+@group_required(['Auditor Interno', 'Analista Tributario'])
+def anomalias_view(request):
+    if request.method == 'POST':
+        ejercicio = request.POST.get('ejercicio', '')
+        if not ejercicio.isdigit():
+            messages.error(request, "Indique el ejercicio a analizar.")
+            return redirect('core:anomalias')
+        resultado = analizar_anomalias([int(ejercicio)])
+        messages.success(request, f"Análisis del ejercicio {ejercicio}: {resultado.get(int(ejercicio), 0)} anomalías.")
+        return redirect(f"{reverse('core:anomalias')}?ejercicio={ejercicio}")
+
+    ejercicios = list(
+        EventoCorporativo.objects.order_by('-ejercicio_comercial').values_list('ejercicio_comercial', flat=True).distinct()
+    )
+    filtro_ejercicio = request.GET.get('ejercicio', '')
+    if not filtro_ejercicio.isdigit():
+        filtro_ejercicio = str(ejercicios[0]) if ejercicios else ''
+    filtro_codigo = request.GET.get('codigo', '')
+
+    anomalias = AnomaliaCalificacion.objects.filter(ejercicio=filtro_ejercicio or 0)
+    por_codigo = dict(anomalias.order_by().values_list('codigo').annotate(n=Count('id')))
+    if filtro_codigo: anomalias = anomalias.filter(codigo=filtro_codigo)
+    pagina = Paginator(
+        anomalias.select_related('calificacion__evento__emisor').order_by('calificacion__evento__emisor__nemonico', 'calificacion', 'columna_dj'),
+        50,
+    ).get_page(request.GET.get('page'))
+
+    context = {
+        'pagina': pagina,
+        'ejercicios': ejercicios,
+        'filtro_ejercicio': filtro_ejercicio,
+        'filtro_codigo': filtro_codigo,
+        'codigos': [(codigo, nombre, por_codigo.get(codigo, 0)) for codigo, nombre in AnomaliaCalificacion.CODIGO_CHOICES],
+    }
+    return render(request, 'core/anomalias.html', context)
+
 # log de auditoria
 @method_decorator(group_required(['Auditor Interno', 'Administrador']), name='dispatch')
 class AuditLogListView(LoginRequiredMixin, FilterView):
@@ -452,6 +679,9 @@ def setup_2fa_view(request):
     
     # Creamos la imagen QR en memoria
     # Usamos SvgPathImage que dibuja vectores más limpios y compatibles
+    # qrcode se importa sólo aquí: la configuración de 2FA es poco frecuente
+    import qrcode
+    import qrcode.image.svg
     img = qrcode.make(otp_url, image_factory=qrcode.image.svg.SvgPathImage)
     stream = BytesIO()
     img.save(stream)